@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# Copyright 2016 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the
+#    License. You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,
+#    software distributed under the License is distributed on an "AS
+#    IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+#    express or implied. See the License for the specific language
+#    governing permissions and limitations under the License.
+
+"""
+Benchmark the Github API usage of a run against a fake Github API.
+
+``GithubExtension.activate()``, the ``pre_step()`` and ``post_step()``
+hooks for a configurable number of steps, and ``finalize()`` are
+driven exactly as ``timid`` drives them, against the in-process
+server in ``fake_github.py``.  The clone and merge steps are not run,
+so no git commands are made.  For each run, the wall time of each
+phase and the requests made, by endpoint, are recorded.  PyGithub's
+own client-side throttle is disabled unless ``--client-throttle`` is
+given, so that the timings are those of the extension.  Results are
+written as JSON to standard output.
+
+Usage::
+
+    python benchmarks/bench_api.py --commits 250 --steps 20 \\
+        --latency 0.05 --repeat 5
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from timid import context  # noqa
+import timid  # noqa
+import timid_github  # noqa
+
+import fake_github  # noqa
+
+
+class FakeStep(object):
+    """
+    A stand-in for ``timid.Step`` carrying only the attributes the
+    hooks consult.
+    """
+
+    action = None
+
+    def __init__(self, name):
+        self.name = name
+
+
+def run(server, base, steps, extra_args, throttle=False):
+    """
+    Drive a single run of the extension.
+
+    :param server: The ``FakeGithub`` to run against.
+    :param str base: The directory to run in.
+    :param int steps: The number of steps in the run.
+    :param list extra_args: Extra arguments for the extension.
+    :param bool throttle: If ``True``, leave PyGithub's client-side
+                          throttle in place.
+
+    :returns: A dictionary describing the run.
+    """
+
+    parser = argparse.ArgumentParser()
+    timid_github.GithubExtension.prepare(parser)
+    args = parser.parse_args([
+        '--github-api', server.url,
+        '--github-user', 'bench',
+        '--github-pass', 'secret',
+        '--github-pull', '%s/%s#%d' % (server.owner, server.repo,
+                                       server.number),
+        '--github-cache-dir', os.path.join(base, 'cache'),
+    ] + extra_args)
+    ctxt = context.Context(verbose=0, cwd=base)
+
+    server.reset()
+    timings = {}
+
+    with fake_github.unthrottled(not throttle):
+        start = time.time()
+        ext = timid_github.GithubExtension.activate(ctxt, args)
+        timings['activate'] = time.time() - start
+
+    start = time.time()
+    for idx in range(steps):
+        step = FakeStep('Step %d' % idx)
+        ext.pre_step(ctxt, step, idx)
+        ext.post_step(ctxt, step, idx,
+                      timid.StepResult(state=timid.SUCCESS))
+    timings['steps'] = time.time() - start
+
+    start = time.time()
+    ext.finalize(ctxt, None)
+    timings['finalize'] = time.time() - start
+
+    timings['total'] = sum(timings.values())
+
+    return {
+        'timings': timings,
+        'requests': dict(server.counts),
+        'statuses': len(server.statuses),
+    }
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--commits', type=int, default=1,
+                        help='Number of commits in the pull request.')
+    parser.add_argument('--page-size', type=int, default=30,
+                        help='Number of items per page of a list.')
+    parser.add_argument('--steps', type=int, default=10,
+                        help='Number of test steps per run.')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Latency of each request, in seconds.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of timed runs.')
+    parser.add_argument('--client-throttle', action='store_true',
+                        help="Leave PyGithub's client-side throttle in "
+                        'place.')
+    parser.add_argument('extra', nargs=argparse.REMAINDER,
+                        help='Extra arguments for the extension, after '
+                        '"--".')
+    args = parser.parse_args()
+    extra = [arg for arg in args.extra if arg != '--']
+
+    server = fake_github.FakeGithub(
+        commits=args.commits, page_size=args.page_size,
+        latency=args.latency)
+    server.start()
+    base = tempfile.mkdtemp(prefix='timid-github-bench-')
+    try:
+        runs = [run(server, base, args.steps, extra,
+                    args.client_throttle)
+                for _idx in range(args.repeat)]
+    finally:
+        shutil.rmtree(base)
+        server.stop()
+
+    summary = {
+        'commits': args.commits,
+        'page_size': args.page_size,
+        'steps': args.steps,
+        'latency': args.latency,
+        'repeat': args.repeat,
+        'client_throttle': args.client_throttle,
+        'extra_args': extra,
+        'timings': dict(
+            (key, median([r['timings'][key] for r in runs]))
+            for key in runs[0]['timings']),
+        'requests': runs[-1]['requests'],
+        'requests_total': sum(runs[-1]['requests'].values()),
+        'statuses': runs[-1]['statuses'],
+    }
+    json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
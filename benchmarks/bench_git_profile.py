@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# Copyright 2016 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the
+#    License. You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,
+#    software distributed under the License is distributed on an "AS
+#    IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+#    express or implied. See the License for the specific language
+#    governing permissions and limitations under the License.
+
+"""
+Benchmark the git configuration profiles in ``timid_github.GIT_PROFILES``.
+
+A local source repository with a configurable number of files is
+generated, then cloned, checked out, and inspected with "git status"
+once for each profile, using ``timid_github._git()`` exactly as
+``CloneAction`` does.  Results are written as JSON to standard output.
+
+Usage::
+
+    python benchmarks/bench_git_profile.py --files 5000 --repeat 5
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from timid import context  # noqa
+import timid_github  # noqa
+
+
+class FakeExtension(object):
+    """
+    A stand-in for ``timid_github.GithubExtension`` carrying only the
+    attributes ``_git()`` consults.
+    """
+
+    recorder = None
+
+    def __init__(self, git_config):
+        self.git_config = git_config
+
+
+def make_source(base, files, size):
+    """
+    Generate a source repository.
+
+    :param base: The directory in which to create the repository.
+    :param files: The number of files to create.
+    :param size: The size of each file, in bytes.
+
+    :returns: The ``file://`` URL of the repository.
+    """
+
+    src = os.path.join(base, 'source')
+    subprocess.check_call(['git', 'init', '-q', src])
+    for i in range(files):
+        subdir = os.path.join(src, 'd%03d' % (i % 100))
+        if not os.path.isdir(subdir):
+            os.makedirs(subdir)
+        with open(os.path.join(subdir, 'f%06d.txt' % i), 'wb') as f:
+            f.write(os.urandom(size))
+    subprocess.check_call(['git', 'add', '-A'], cwd=src)
+    subprocess.check_call(['git', '-c', 'user.name=bench',
+                           '-c', 'user.email=bench@example.com',
+                           'commit', '-q', '-m', 'initial'], cwd=src)
+
+    return 'file://%s' % src
+
+
+def run_profile(base, url, profile, idx):
+    """
+    Time a clone and two status checks of the source repository under a
+    profile.
+
+    :returns: A dictionary of timings, in seconds.
+    """
+
+    ghe = FakeExtension(timid_github.GIT_PROFILES[profile])
+    ctxt = context.Context(verbose=0, cwd=base)
+    target = os.path.join(base, '%s-%d' % (profile, idx))
+
+    start = time.time()
+    timid_github._git(ctxt, 'clone', url, target, ghe=ghe)
+    clone = time.time() - start
+
+    # The second status benefits from the untracked cache, if enabled
+    ctxt.environment.cwd = target
+    timings = {'clone': clone}
+    for key in ('status_cold', 'status_warm'):
+        start = time.time()
+        timid_github._git(ctxt, 'status', '--porcelain', ghe=ghe)
+        timings[key] = time.time() - start
+
+    shutil.rmtree(target)
+
+    return timings
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--files', type=int, default=2000,
+                        help='Number of files in the repository.')
+    parser.add_argument('--size', type=int, default=4096,
+                        help='Size of each file, in bytes.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of timed runs per profile.')
+    args = parser.parse_args()
+
+    base = tempfile.mkdtemp(prefix='timid-github-bench-')
+    try:
+        url = make_source(base, args.files, args.size)
+
+        results = {}
+        for idx in range(args.repeat):
+            # Alternate profiles to spread out cache effects
+            for profile in sorted(timid_github.GIT_PROFILES):
+                timing = run_profile(base, url, profile, idx)
+                for key, value in timing.items():
+                    results.setdefault(profile, {}).setdefault(
+                        key, []).append(value)
+    finally:
+        shutil.rmtree(base)
+
+    summary = {
+        'files': args.files,
+        'size': args.size,
+        'repeat': args.repeat,
+        'profiles': dict(
+            (profile, dict((key, median(values))
+                           for key, values in timings.items()))
+            for profile, timings in results.items()),
+    }
+    json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
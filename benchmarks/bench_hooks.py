@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# Copyright 2016 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the
+#    License. You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,
+#    software distributed under the License is distributed on an "AS
+#    IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+#    express or implied. See the License for the specific language
+#    governing permissions and limitations under the License.
+
+"""
+Measure the per-step overhead of the ``pre_step()`` and
+``post_step()`` hooks.
+
+A long list of empty steps is driven through the hooks of a
+``GithubExtension``, as ``timid`` drives them, with a null status
+backend: posting a status does nothing, or sleeps for ``--latency``
+seconds to stand in for the Github API.  Each of the status modes is
+timed: "sync" posts every status from the step loop, "throttled"
+limits pending statuses with ``status_interval``, "async" posts them
+from a background thread, and "throttled-async" does both.  The time
+of the same loop without the hooks is subtracted, and the overhead
+per step is reported in microseconds.  Results are written as JSON to
+standard output.
+
+Usage::
+
+    python benchmarks/bench_hooks.py --steps 10000 --latency 0.001
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from timid import context  # noqa
+import timid  # noqa
+import timid_github  # noqa
+
+MODES = {
+    'sync': {},
+    'throttled': {'status_interval': 5.0},
+    'async': {'status_async': True},
+    'throttled-async': {'status_interval': 5.0, 'status_async': True},
+}
+
+
+class NullCommit(object):
+    """
+    A stand-in for ``github.Commit.Commit`` whose ``create_status()``
+    does nothing but wait.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.statuses = 0
+
+    def create_status(self, *args, **kwargs):
+        self.statuses += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeStep(object):
+    """
+    A stand-in for ``timid.Step`` carrying only the attributes the
+    hooks consult.
+    """
+
+    action = None
+
+    def __init__(self, name):
+        self.name = name
+
+
+def loop(ctxt, steps, result, pre_step=None, post_step=None):
+    """
+    The step loop of ``timid``, reduced to the hook calls.
+
+    :returns: The elapsed time, in seconds.
+    """
+
+    start = timeit.default_timer()
+    for idx, step in enumerate(steps):
+        if pre_step is not None:
+            pre_step(ctxt, step, idx)
+        if post_step is not None:
+            post_step(ctxt, step, idx, result)
+    return timeit.default_timer() - start
+
+
+def run(mode, count, latency):
+    """
+    Time the hooks for a run of ``count`` steps.
+
+    :returns: A dictionary describing the run.
+    """
+
+    ctxt = context.Context(verbose=0, cwd='.')
+    steps = [FakeStep('Step %d' % idx) for idx in range(count)]
+    result = timid.StepResult(state=timid.SUCCESS)
+    commit = NullCommit(latency)
+    ext = timid_github.GithubExtension(
+        None, None, commit, None,
+        {'status': 'success', 'text': 'passed', 'url': None},
+        'repo', None, 'master', None, 'feature', **MODES[mode])
+
+    baseline = loop(ctxt, steps, result)
+    elapsed = loop(ctxt, steps, result, ext.pre_step, ext.post_step)
+
+    start = timeit.default_timer()
+    ext.finalize(ctxt, None)
+    finalize = timeit.default_timer() - start
+
+    return {
+        'per_step_us': max(elapsed - baseline, 0.0) / count * 1e6,
+        'finalize': finalize,
+        'statuses': commit.statuses,
+    }
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--steps', type=int, default=10000,
+                        help='Number of steps per run.')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Time taken to post a status, in seconds.')
+    parser.add_argument('--mode', action='append', choices=sorted(MODES),
+                        help='Status mode to time; may be repeated.  '
+                        'Default: all modes.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of timed runs per mode.')
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.mode or sorted(MODES):
+        runs = [run(mode, args.steps, args.latency)
+                for _idx in range(args.repeat)]
+        results[mode] = dict((key, median([r[key] for r in runs]))
+                             for key in runs[0])
+
+    summary = {
+        'steps': args.steps,
+        'latency': args.latency,
+        'repeat': args.repeat,
+        'modes': results,
+    }
+    json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# Copyright 2016 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the
+#    License. You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,
+#    software distributed under the License is distributed on an "AS
+#    IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+#    express or implied. See the License for the specific language
+#    governing permissions and limitations under the License.
+
+"""
+Benchmark the cost of the extension when no pull request is given.
+
+``timid`` loads every extension on every invocation.  Each scenario
+is timed in a fresh interpreter, after ``timid`` itself has been
+imported: "extension" imports ``timid_github``, adds its options to a
+parser and calls ``GithubExtension.activate()`` without
+``--github-pull``, as ``timid`` does; "eager" does the same but also
+imports ``github`` and ``keyring``, which is what the extension cost
+when they were imported at the top of the module.  Results are
+written as JSON to standard output.
+
+Usage::
+
+    python benchmarks/bench_import.py --repeat 20
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in the child interpreter; prints the elapsed time and the
+# modules which ended up imported
+CHILD = """
+import json, sys, time
+import timid
+start = time.time()
+if %(eager)r:
+    import github, keyring
+import argparse
+import timid_github
+parser = argparse.ArgumentParser()
+timid_github.GithubExtension.prepare(parser)
+result = timid_github.GithubExtension.activate(None, parser.parse_args([]))
+elapsed = time.time() - start
+assert result is None
+print(json.dumps({
+    'elapsed': elapsed,
+    'github': 'github' in sys.modules,
+    'keyring': 'keyring' in sys.modules,
+}))
+"""
+
+
+def run_child(eager):
+    """
+    Time one scenario in a fresh interpreter.
+
+    :param eager: If ``True``, import ``github`` and ``keyring`` up
+                  front.
+
+    :returns: A dictionary describing the run.
+    """
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    output = subprocess.check_output(
+        [sys.executable, '-c', CHILD % {'eager': eager}], env=env)
+
+    return json.loads(output.decode('utf-8'))
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='Number of timed runs per scenario.')
+    args = parser.parse_args()
+
+    results = {}
+    for _idx in range(args.repeat):
+        # Alternate scenarios to spread out cache effects
+        for scenario, eager in (('extension', False), ('eager', True)):
+            results.setdefault(scenario, []).append(run_child(eager))
+
+    summary = {
+        'repeat': args.repeat,
+        'scenarios': dict(
+            (scenario, {
+                'elapsed': median([run['elapsed'] for run in runs]),
+                'imports_github': any(run['github'] for run in runs),
+                'imports_keyring': any(run['keyring'] for run in runs),
+            })
+            for scenario, runs in results.items()),
+    }
+    json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
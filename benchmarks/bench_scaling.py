@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# Copyright 2016 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the
+#    License. You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,
+#    software distributed under the License is distributed on an "AS
+#    IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+#    express or implied. See the License for the specific language
+#    governing permissions and limitations under the License.
+
+"""
+Check that the Github API calls of a run do not grow with its size.
+
+A run is driven, as in ``bench_api.py``, for every combination of a
+number of commits in the pull request and a number of steps, against
+the fake Github API.  The number of requests of each run is compared
+with that of the smallest run; if any run makes more than
+``--slack`` additional requests, the combinations exceeding it are
+reported and the exit status is non-zero.  Results are written as
+JSON to standard output.
+
+Runs are made with ``--github-status-interval 5`` unless the extra
+arguments override it; as the steps do nothing, every run finishes
+well within the interval, so pending status updates are limited by
+the duration of a run, not by its step count, and a run whose steps
+take longer makes up to one more per interval.  Without an interval,
+every step updates the status.  The git commands of
+the clone and merge steps are bounded by the unit tests.
+
+Usage::
+
+    python benchmarks/bench_scaling.py --commits 1 100 300 \\
+        --steps 1 100 1000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bench_api  # noqa
+import fake_github  # noqa
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--commits', type=int, nargs='+',
+                        default=[1, 100, 300],
+                        help='Numbers of commits in the pull request.')
+    parser.add_argument('--steps', type=int, nargs='+',
+                        default=[1, 100, 1000],
+                        help='Numbers of test steps per run.')
+    parser.add_argument('--slack', type=int, default=0,
+                        help='Number of requests a run may make beyond '
+                        'those of the smallest run.')
+    parser.add_argument('extra', nargs=argparse.REMAINDER,
+                        help='Extra arguments for the extension, after '
+                        '"--".')
+    args = parser.parse_args()
+    extra = ['--github-status-interval', '5'] + [
+        arg for arg in args.extra if arg != '--']
+
+    runs = []
+    base = tempfile.mkdtemp(prefix='timid-github-bench-')
+    try:
+        for commits in sorted(args.commits):
+            server = fake_github.FakeGithub(commits=commits)
+            server.start()
+            try:
+                for steps in sorted(args.steps):
+                    result = bench_api.run(server, base, steps, extra)
+                    result.update(commits=commits, steps=steps,
+                                  requests_total=sum(
+                                      result['requests'].values()))
+                    runs.append(result)
+            finally:
+                server.stop()
+    finally:
+        shutil.rmtree(base)
+
+    bound = runs[0]['requests_total'] + args.slack
+    exceeded = [(run['commits'], run['steps']) for run in runs
+                if run['requests_total'] > bound]
+
+    json.dump({
+        'bound': bound,
+        'runs': runs,
+        'exceeded': exceeded,
+    }, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+    return 1 if exceeded else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# Copyright 2016 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the
+#    License. You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,
+#    software distributed under the License is distributed on an "AS
+#    IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+#    express or implied. See the License for the specific language
+#    governing permissions and limitations under the License.
+
+"""
+Benchmark the cost and reaction time of ``PullWatcher``.
+
+A ``PullWatcher`` polls the fake Github API in ``fake_github.py`` at
+a fixed interval.  Part way through, a commit is pushed to the pull
+request; the time until the watcher reports the new head is the
+reaction time.  The requests made, the number answered "304 Not
+Modified", and the rate limit consumed are reported.  Results are
+written as JSON to standard output.
+
+Usage::
+
+    python benchmarks/bench_watch.py --polls 50 --interval 0.1
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from timid import context  # noqa
+import timid_github  # noqa
+
+import fake_github  # noqa
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--polls', type=int, default=50,
+                        help='Number of polls.')
+    parser.add_argument('--interval', type=float, default=0.1,
+                        help='Seconds between polls.')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Latency of each request, in seconds.')
+    args = parser.parse_args()
+
+    server = fake_github.FakeGithub(latency=args.latency)
+    server.start()
+    base = tempfile.mkdtemp(prefix='timid-github-bench-')
+    try:
+        ctxt = context.Context(verbose=0, cwd=base)
+        watcher = timid_github.PullWatcher(
+            server.url, ['%s/%s' % (server.owner, server.repo)],
+            os.path.join(base, 'watch.json'))
+
+        # The first poll records the existing pull request
+        watcher.poll(ctxt)
+        server.reset()
+        watcher.requests = watcher.not_modified = 0
+
+        pushed = None
+        reaction = None
+        for idx in range(args.polls):
+            if idx == args.polls // 2:
+                server.push()
+                pushed = time.time()
+            updates = watcher.poll(ctxt)
+            if updates and pushed is not None and reaction is None:
+                reaction = time.time() - pushed
+            time.sleep(args.interval)
+    finally:
+        shutil.rmtree(base)
+        server.stop()
+
+    summary = {
+        'polls': args.polls,
+        'interval': args.interval,
+        'latency': args.latency,
+        'requests': watcher.requests,
+        'not_modified': watcher.not_modified,
+        'rate_limit_used': server.rate_limit - server.remaining,
+        'reaction': reaction,
+    }
+    json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# Copyright 2016 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the
+#    License. You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,
+#    software distributed under the License is distributed on an "AS
+#    IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+#    express or implied. See the License for the specific language
+#    governing permissions and limitations under the License.
+
+"""
+Benchmark the clone, update and merge paths of the workspace.
+
+A bare base repository of configurable size is generated locally,
+with a pull request branch which has diverged from the base branch.
+For each workspace strategy, ``CloneAction`` is timed cloning into an
+empty directory ("cold") and updating the resulting workspace
+("warm"), and ``MergeAction`` is timed merging the pull request
+branch.  The strategies combine each profile in
+``timid_github.GIT_PROFILES`` with and without a mirror; the time to
+create the mirror is reported separately as "mirror".  All
+repositories are accessed through ``file://`` URLs, so no network is
+needed.  Results are written as JSON to standard output.
+
+Usage::
+
+    python benchmarks/bench_workspace.py --files 2000 --commits 200 \\
+        --divergence 10 --repeat 3
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from timid import context  # noqa
+import timid_github  # noqa
+
+BRANCH = 'master'
+PR_BRANCH = 'feature'
+IDENTITY = {
+    'GIT_AUTHOR_NAME': 'bench',
+    'GIT_AUTHOR_EMAIL': 'bench@example.com',
+    'GIT_COMMITTER_NAME': 'bench',
+    'GIT_COMMITTER_EMAIL': 'bench@example.com',
+}
+
+
+class FakeUser(object):
+    login = 'bench'
+
+
+class FakePull(object):
+    """
+    A stand-in for ``github.PullRequest.PullRequest`` carrying only the
+    attributes ``MergeAction`` consults.
+    """
+
+    user = FakeUser()
+
+
+def git(cwd, *args):
+    """
+    Run a git command while generating the repositories.
+    """
+
+    env = dict(os.environ)
+    env.update(IDENTITY)
+    subprocess.check_call(('git',) + args, cwd=cwd, env=env)
+
+
+def write_file(path, size):
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+
+
+def make_source(base, files, size, commits, divergence):
+    """
+    Generate a bare base repository.  The base branch has an initial
+    commit adding ``files`` files, followed by ``commits`` commits
+    each rewriting one of them.  The pull request branch forks from
+    that point and adds ``divergence`` commits of new files, while the
+    base branch gains ``divergence`` more commits, so the merge is not
+    a fast-forward.
+
+    :returns: The ``file://`` URL of the repository.
+    """
+
+    work = os.path.join(base, 'work')
+    git(base, 'init', '-q', work)
+    git(work, 'symbolic-ref', 'HEAD', 'refs/heads/%s' % BRANCH)
+
+    def path(i):
+        return os.path.join(work, 'd%03d' % (i % 100), 'f%06d.txt' % i)
+
+    for i in range(files):
+        write_file(path(i), size)
+    git(work, 'add', '-A')
+    git(work, 'commit', '-q', '-m', 'initial')
+
+    for i in range(commits):
+        write_file(path(i % files), size)
+        git(work, 'commit', '-q', '-a', '-m', 'change %d' % i)
+
+    git(work, 'checkout', '-q', '-b', PR_BRANCH)
+    for i in range(divergence):
+        write_file(os.path.join(work, 'pr', 'p%06d.txt' % i), size)
+        git(work, 'add', '-A')
+        git(work, 'commit', '-q', '-m', 'pull request change %d' % i)
+
+    git(work, 'checkout', '-q', BRANCH)
+    for i in range(divergence):
+        write_file(path((commits + i) % files), size)
+        git(work, 'commit', '-q', '-a', '-m', 'base change %d' % i)
+
+    bare = os.path.join(base, 'source.git')
+    git(base, 'clone', '-q', '--bare', work, bare)
+    shutil.rmtree(work)
+
+    return 'file://%s' % bare
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    elapsed = time.time() - start
+    if result.state != timid_github.timid.SUCCESS:
+        raise RuntimeError('Step failed: %s' % result.msg)
+    return elapsed
+
+
+def run_strategy(base, url, profile, mirrored, idx):
+    """
+    Time a cold clone, a warm update and a merge under a strategy.
+
+    :returns: A dictionary of timings, in seconds.
+    """
+
+    ctxt = context.Context(verbose=0, cwd=base)
+    ctxt.environment.update(IDENTITY)
+    timings = {}
+
+    mirror = None
+    if mirrored:
+        mirror = timid_github.Mirror(
+            os.path.join(base, 'mirror-%s-%d.git' % (profile, idx)), url)
+        start = time.time()
+        mirror.update(ctxt)
+        timings['mirror'] = time.time() - start
+
+    # Recent versions of git refuse to pull a diverged branch unless
+    # told how to reconcile it
+    git_config = timid_github.GIT_PROFILES[profile] + [
+        ('pull.rebase', 'false'),
+    ]
+    ghe = timid_github.GithubExtension(
+        None, FakePull(), None, None, None, 'repo', url, BRANCH, url,
+        PR_BRANCH, git_config=git_config, mirror=mirror)
+    work_dir = os.path.join(base, 'ws-%s-%s-%d' %
+                            (profile, 'mirror' if mirrored else 'plain', idx))
+    os.makedirs(work_dir)
+
+    ctxt.environment.cwd = work_dir
+    timings['cold'] = timed(timid_github.CloneAction(ctxt, ghe), ctxt)
+
+    ctxt.environment.cwd = work_dir
+    timings['warm'] = timed(timid_github.CloneAction(ctxt, ghe), ctxt)
+
+    timings['merge'] = timed(timid_github.MergeAction(ctxt, ghe), ctxt)
+
+    shutil.rmtree(work_dir)
+    if mirror is not None:
+        shutil.rmtree(mirror.path)
+
+    return timings
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--files', type=int, default=1000,
+                        help='Number of files in the repository.')
+    parser.add_argument('--size', type=int, default=4096,
+                        help='Size of each file, in bytes.')
+    parser.add_argument('--commits', type=int, default=100,
+                        help='Number of commits on the base branch.')
+    parser.add_argument('--divergence', type=int, default=5,
+                        help='Number of commits on each side of the fork '
+                        'between the base and pull request branches.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of timed runs per strategy.')
+    args = parser.parse_args()
+
+    base = tempfile.mkdtemp(prefix='timid-github-bench-')
+    try:
+        url = make_source(base, args.files, args.size, args.commits,
+                          args.divergence)
+
+        results = {}
+        for idx in range(args.repeat):
+            # Alternate strategies to spread out cache effects
+            for profile in sorted(timid_github.GIT_PROFILES):
+                for mirrored in (False, True):
+                    strategy = '%s-%s' % (
+                        profile, 'mirror' if mirrored else 'plain')
+                    timing = run_strategy(base, url, profile, mirrored, idx)
+                    for key, value in timing.items():
+                        results.setdefault(strategy, {}).setdefault(
+                            key, []).append(value)
+    finally:
+        shutil.rmtree(base)
+
+    summary = {
+        'files': args.files,
+        'size': args.size,
+        'commits': args.commits,
+        'divergence': args.divergence,
+        'repeat': args.repeat,
+        'strategies': dict(
+            (strategy, dict((key, median(values))
+                            for key, values in timings.items()))
+            for strategy, timings in results.items()),
+    }
+    json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+# Copyright 2016 Rackspace
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the
+#    License. You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,
+#    software distributed under the License is distributed on an "AS
+#    IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+#    express or implied. See the License for the specific language
+#    governing permissions and limitations under the License.
+
+"""
+An in-process stand-in for the parts of the Github API used by
+``timid_github``: the authenticated user, repositories, pull requests,
+pull request commits, commits and commit statuses.  Responses carry
+rate limit headers, lists are paginated with "Link" headers, and a
+fixed latency may be added to every request.  The list of open pull
+requests carries an "ETag", and a conditional request for an
+unchanged list is answered with "304 Not Modified", which, as on
+Github, does not count against the rate limit.  Every request is
+counted, so benchmarks can report how many calls a run makes.
+
+PyGithub 2.x spaces out the requests of a client on its own, by a
+quarter of a second between requests and a second between writes;
+clients created within ``unthrottled()`` do not, so a benchmark
+measures the extension rather than that throttle.
+
+Usage::
+
+    server = FakeGithub(commits=100, latency=0.05)
+    server.start()
+    try:
+        gh = github.Github('user', 'pass', server.url)
+        ...
+    finally:
+        server.stop()
+"""
+
+import contextlib
+import hashlib
+import inspect
+import json
+import re
+import threading
+import time
+
+import six
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib import parse
+
+
+@contextlib.contextmanager
+def unthrottled(active=True):
+    """
+    A context manager within which ``github.Github`` clients are
+    created with PyGithub's client-side throttle disabled.  Versions
+    of PyGithub without the throttle are left alone.
+
+    :param bool active: If ``False``, leave the throttle in place.
+    """
+
+    if not active:
+        yield
+        return
+
+    import github
+
+    original = github.Github
+    try:
+        params = inspect.signature(original.__init__).parameters
+    except AttributeError:  # pragma: no cover
+        # Python 2
+        params = inspect.getargspec(original.__init__).args
+    if 'seconds_between_requests' not in params:
+        yield
+        return
+
+    class Github(original):
+        def __init__(self, *args, **kwargs):
+            kwargs.setdefault('seconds_between_requests', 0)
+            kwargs.setdefault('seconds_between_writes', 0)
+            super(Github, self).__init__(*args, **kwargs)
+
+    github.Github = Github
+    try:
+        yield
+    finally:
+        github.Github = original
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Dispatch requests to the ``FakeGithub`` owning the server.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, data, headers = self.server.fake.handle(
+            method, self.path, body, self.headers)
+
+        payload = b'' if status == 304 else json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+class FakeGithub(object):
+    """
+    A fake Github API server, serving a single pull request.
+    """
+
+    def __init__(self, owner='bench', repo='repo', number=1, commits=1,
+                 page_size=30, latency=0.0, rate_limit=5000):
+        """
+        Initialize a ``FakeGithub`` object.
+
+        :param owner: The owner of the repository.
+        :param repo: The name of the repository.
+        :param number: The number of the pull request.
+        :param commits: The number of commits in the pull request.
+        :param page_size: The number of items per page of a list,
+                          unless the client asks for another size.
+        :param latency: The number of seconds to delay each response.
+        :param rate_limit: The rate limit reported to the client.
+        """
+
+        self.owner = owner
+        self.repo = repo
+        self.number = number
+        self.commits = ['%040x' % (i + 1) for i in range(commits)]
+        self.page_size = page_size
+        self.latency = latency
+        self.rate_limit = rate_limit
+
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.statuses = []
+        self.remaining = rate_limit
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        """
+        The base URL of the fake API.
+        """
+
+        return 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+    @property
+    def requests(self):
+        """
+        The total number of requests served.
+        """
+
+        return sum(self.counts.values())
+
+    def start(self):
+        """
+        Start serving requests in a background thread.
+        """
+
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.fake = self
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop serving requests.
+        """
+
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def reset(self):
+        """
+        Reset the request counts, statuses and rate limit.
+        """
+
+        with self.lock:
+            self.counts = {}
+            self.statuses = []
+            self.remaining = self.rate_limit
+
+    def _repo(self):
+        full_name = '%s/%s' % (self.owner, self.repo)
+        return {
+            'id': 1,
+            'name': self.repo,
+            'full_name': full_name,
+            'owner': {'login': self.owner},
+            'url': '%s/repos/%s' % (self.url, full_name),
+            'clone_url': 'https://github.invalid/%s.git' % full_name,
+            'git_url': 'git://github.invalid/%s.git' % full_name,
+            'ssh_url': 'git@github.invalid:%s.git' % full_name,
+        }
+
+    def _pull(self):
+        repo = self._repo()
+        return {
+            'id': 1,
+            'number': self.number,
+            'url': '%s/pulls/%d' % (repo['url'], self.number),
+            'user': {'login': 'contributor'},
+            'base': {'ref': 'master', 'repo': repo},
+            'head': {'ref': 'feature', 'sha': self.commits[-1],
+                     'repo': repo},
+        }
+
+    def _commit(self, sha):
+        return {
+            'sha': sha,
+            'url': '%s/commits/%s' % (self._repo()['url'], sha),
+        }
+
+    def _page(self, path, query, items):
+        """
+        Select a page of a list, computing its "Link" header.
+        """
+
+        per_page = int(query.get('per_page', [self.page_size])[0])
+        page = int(query.get('page', ['1'])[0])
+        last = max((len(items) + per_page - 1) // per_page, 1)
+
+        links = []
+        for rel, num in (('next', page + 1), ('last', last)):
+            if page < last:
+                links.append('<%s%s?per_page=%d&page=%d>; rel="%s"' %
+                             (self.url, path, per_page, num, rel))
+
+        start = (page - 1) * per_page
+        headers = {'Link': ', '.join(links)} if links else {}
+        return items[start:start + per_page], headers
+
+    def push(self):
+        """
+        Add a commit to the pull request, changing its head.
+        """
+
+        with self.lock:
+            self.commits.append('%040x' % (len(self.commits) + 1))
+
+    def _route(self, method, path, query, body, req_headers):
+        """
+        Compute the response to a request.
+
+        :returns: A tuple of the route name, the status code, the
+                  response data and any extra headers.
+        """
+
+        prefix = '/repos/%s/%s' % (self.owner, self.repo)
+        pull = '%s/pulls/%d' % (prefix, self.number)
+
+        if method == 'GET' and path == '/user':
+            return 'user', 200, {'login': self.owner}, {}
+        if method == 'GET' and path == prefix:
+            return 'repo', 200, self._repo(), {}
+        if method == 'GET' and path == pull:
+            return 'pull', 200, self._pull(), {}
+        if method == 'GET' and path == prefix + '/pulls':
+            items, headers = self._page(path, query, [self._pull()])
+            headers['ETag'] = '"%s"' % hashlib.sha1(json.dumps(
+                items, sort_keys=True).encode('utf-8')).hexdigest()
+            if req_headers.get('If-None-Match') == headers['ETag']:
+                return 'pulls_not_modified', 304, None, headers
+            return 'pulls', 200, items, headers
+        if method == 'GET' and path == pull + '/commits':
+            items, headers = self._page(
+                path, query, [self._commit(sha) for sha in self.commits])
+            return 'pull_commits', 200, items, headers
+
+        match = re.match(r'^%s/commits/([0-9a-f]+)$' % prefix, path)
+        if method == 'GET' and match:
+            return 'commit', 200, self._commit(match.group(1)), {}
+
+        match = re.match(r'^%s/statuses/([0-9a-f]+)$' % prefix, path)
+        if method == 'POST' and match:
+            status = json.loads(body.decode('utf-8'))
+            self.statuses.append((match.group(1), status))
+            return 'create_status', 201, status, {}
+
+        return 'unknown', 404, {'message': 'Not Found'}, {}
+
+    def handle(self, method, url, body, req_headers=None):
+        """
+        Handle a request.
+
+        :param method: The HTTP method.
+        :param url: The path and query string of the request.
+        :param body: The body of the request.
+        :param req_headers: The headers of the request.
+
+        :returns: A tuple of the status code, the response data and
+                  the response headers.
+        """
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        parts = parse.urlsplit(url)
+        with self.lock:
+            name, status, data, headers = self._route(
+                method, parts.path, parse.parse_qs(parts.query), body,
+                req_headers or {})
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if status != 304:
+                self.remaining = max(self.remaining - 1, 0)
+
+            headers.update({
+                'X-RateLimit-Limit': str(self.rate_limit),
+                'X-RateLimit-Remaining': str(self.remaining),
+                'X-RateLimit-Reset': str(int(time.time()) + 3600),
+            })
+
+        return status, data, dict((key, six.text_type(value))
+                                  for key, value in headers.items())
@@ -84,6 +84,12 @@ setuptools.setup(
     install_requires=readreq('requirements.txt'),
     tests_require=readreq('test-requirements.txt'),
     entry_points={
+        'console_scripts': [
+            'timid-github-history = timid_github:history_main',
+            'timid-github-maintain = timid_github:maintain_main',
+            'timid-github-watch = timid_github:watch_main',
+            'timid-github-webhook = timid_github:webhook_main',
+        ],
         'timid.extensions': [
             'timid-github = timid_github:GithubExtension',
         ],
@@ -13,15 +13,25 @@
 #    express or implied. See the License for the specific language
 #    governing permissions and limitations under the License.
 
+import datetime
 import errno
 import inspect
 import json
+import os
+import pstats
+import shutil
 import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
 import github
 import mock
+import six
 import timid
+from timid import context
 
 import timid_github
 
@@ -30,6 +40,37 @@ class TestException(Exception):
     pass
 
 
+class TestLazyModule(unittest.TestCase):
+    @mock.patch.object(timid_github.importlib, 'import_module')
+    def test_lazy(self, mock_import_module):
+        obj = timid_github._LazyModule('some.module')
+
+        self.assertFalse(mock_import_module.called)
+
+        self.assertEqual(obj.attr1, mock_import_module.return_value.attr1)
+        self.assertEqual(obj.attr2, mock_import_module.return_value.attr2)
+
+        mock_import_module.assert_called_once_with('some.module')
+
+    def test_patchable(self):
+        obj = timid_github._LazyModule('os.path')
+
+        with mock.patch.object(obj, 'join', return_value='joined'):
+            self.assertEqual(obj.join('a', 'b'), 'joined')
+
+        self.assertEqual(obj.join('a', 'b'), os.path.join('a', 'b'))
+
+    @mock.patch.object(timid_github.importlib, 'import_module')
+    def test_load(self, mock_import_module):
+        obj = timid_github._LazyModule('some.module')
+
+        self.assertEqual(obj.load(), mock_import_module.return_value)
+        self.assertEqual(obj.load(), mock_import_module.return_value)
+        self.assertEqual(obj.attr1, mock_import_module.return_value.attr1)
+
+        mock_import_module.assert_called_once_with('some.module')
+
+
 class TestGitException(unittest.TestCase):
     def test_init(self):
         obj = timid_github.GitException('test message', 'result')
@@ -89,2578 +130,8171 @@ class TestExcToResult(unittest.TestCase):
         mock_StepResult.assert_called_once_with(exc_info='exc_info')
 
 
-class TestGit(unittest.TestCase):
-    def make_child(self, stdout=b'stdout', stderr=b'stderr', returncode=0):
-        return mock.Mock(**{
-            'communicate.return_value': (stdout, stderr),
-            'returncode': returncode,
-        })
+class TestProfiled(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmpdir, 'profiles')
 
-    def make_ctxt(self, *children, **kwargs):
-        if not children:
-            children = [self.make_child(**kwargs)]
-        else:
-            children = list(children)
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
 
-        return mock.Mock(**{
-            'environment.call.side_effect': children,
-        })
+    def make_func(self, **kwargs):
+        func = mock.Mock(__name__='func', **kwargs)
+        return func, timid_github.profiled('hook')(func)
 
-    @mock.patch.object(timid_github.timid, 'StepResult')
-    @mock.patch.object(timid_github.time, 'sleep')
-    def test_base(self, mock_sleep, mock_StepResult):
-        ctxt = self.make_ctxt()
+    @mock.patch.dict(timid_github.os.environ, clear=True)
+    def test_disabled(self):
+        func, decorated = self.make_func(return_value='result')
 
-        result = timid_github._git(ctxt, 'spam', 'arg1', 'arg2')
+        result = decorated(1, a=2)
 
-        self.assertEqual(result, b'stdout')
-        ctxt.emit.assert_has_calls([
-            mock.call('Executing command "git spam arg1 arg2"', debug=True),
-            mock.call('Command result: return code 0, stdout %r, stderr %r' %
-                      (b'stdout', b'stderr'), debug=True),
-        ])
-        self.assertEqual(ctxt.emit.call_count, 2)
-        ctxt.environment.call.assert_called_once_with(
-            ['git', 'spam', 'arg1', 'arg2'], close_fds=True,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        self.assertFalse(mock_sleep.called)
-        self.assertFalse(mock_StepResult.called)
+        self.assertEqual(result, 'result')
+        func.assert_called_once_with(1, a=2)
+        self.assertFalse(os.path.exists(self.directory))
 
-    @mock.patch.object(timid_github.timid, 'StepResult')
-    @mock.patch.object(timid_github.time, 'sleep')
-    def test_base_failure(self, mock_sleep, mock_StepResult):
-        ctxt = self.make_ctxt(returncode=1)
+    def test_cprofile(self):
+        func, decorated = self.make_func(return_value='result')
 
-        try:
-            result = timid_github._git(ctxt, 'spam', 'arg1', 'arg2')
-        except timid_github.GitException as e:
-            self.assertEqual(e.result, mock_StepResult.return_value)
-        else:
-            self.fail('timid_github.GitException not raised')
-        ctxt.emit.assert_has_calls([
-            mock.call('Executing command "git spam arg1 arg2"', debug=True),
-            mock.call('Command result: return code 1, stdout %r, stderr %r' %
-                      (b'stdout', b'stderr'), debug=True),
-        ])
-        self.assertEqual(ctxt.emit.call_count, 2)
-        ctxt.environment.call.assert_called_once_with(
-            ['git', 'spam', 'arg1', 'arg2'], close_fds=True,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        self.assertFalse(mock_sleep.called)
-        mock_StepResult.assert_called_once_with(
-            state=timid.ERROR, returncode=1,
-            msg='Git command "git spam arg1 arg2" returned 1: %s' % b'stdout')
+        with mock.patch.dict(timid_github.os.environ, clear=True,
+                             TIMID_GITHUB_PROFILE_DIR=self.directory):
+            result = decorated(1, a=2)
 
-    @mock.patch.object(timid_github.timid, 'StepResult')
-    @mock.patch.object(timid_github.time, 'sleep')
-    def test_base_failure_noout(self, mock_sleep, mock_StepResult):
-        ctxt = self.make_ctxt(returncode=1, stdout=b'')
+        self.assertEqual(result, 'result')
+        func.assert_called_once_with(1, a=2)
+        files = os.listdir(self.directory)
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith('hook.%d.' % os.getpid()))
+        self.assertTrue(files[0].endswith('.prof'))
+        pstats.Stats(os.path.join(self.directory, files[0]))
+
+    @unittest.skipIf(timid_github.tracemalloc is None,
+                     'tracemalloc unavailable')
+    def test_both(self):
+        func, decorated = self.make_func(side_effect=TestException('bah'))
+
+        with mock.patch.dict(timid_github.os.environ, clear=True,
+                             TIMID_GITHUB_PROFILE_DIR=self.directory,
+                             TIMID_GITHUB_PROFILE='cProfile, tracemalloc'):
+            self.assertRaises(TestException, decorated)
+
+        files = sorted(os.listdir(self.directory))
+        self.assertEqual(len(files), 2)
+        self.assertTrue(files[0].endswith('.prof'))
+        self.assertTrue(files[1].endswith('.tracemalloc'))
+        timid_github.tracemalloc.Snapshot.load(
+            os.path.join(self.directory, files[1]))
+        self.assertFalse(timid_github.tracemalloc.is_tracing())
+
+    @mock.patch.object(timid_github.sys, 'stderr')
+    def test_unwritable(self, mock_stderr):
+        open(self.directory, 'w').close()
+        func, decorated = self.make_func(return_value='result')
+
+        with mock.patch.dict(timid_github.os.environ, clear=True,
+                             TIMID_GITHUB_PROFILE_DIR=self.directory):
+            result = decorated()
 
-        try:
-            result = timid_github._git(ctxt, 'spam', 'arg1', 'arg2')
-        except timid_github.GitException as e:
-            self.assertEqual(e.result, mock_StepResult.return_value)
-        else:
-            self.fail('timid_github.GitException not raised')
-        ctxt.emit.assert_has_calls([
-            mock.call('Executing command "git spam arg1 arg2"', debug=True),
-            mock.call('Command result: return code 1, stdout %r, stderr %r' %
-                      (b'', b'stderr'), debug=True),
+        self.assertEqual(result, 'result')
+        self.assertEqual(mock_stderr.write.call_count, 1)
+        self.assertTrue(mock_stderr.write.call_args[0][0].startswith(
+            'Unable to write profile'))
+
+
+class TestReadJson(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_base(self):
+        path = os.path.join(self.tmpdir, 'state.json')
+        with open(path, 'w') as f:
+            f.write('{"a": 1}')
+
+        result = timid_github._read_json(path)
+
+        self.assertEqual(result, {'a': 1})
+
+    def test_missing(self):
+        path = os.path.join(self.tmpdir, 'state.json')
+
+        result = timid_github._read_json(path, 'default')
+
+        self.assertEqual(result, 'default')
+
+    def test_invalid(self):
+        path = os.path.join(self.tmpdir, 'state.json')
+        with open(path, 'w') as f:
+            f.write('{"a": ')
+
+        result = timid_github._read_json(path, 'default')
+
+        self.assertEqual(result, 'default')
+
+
+class TestWriteJson(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_base(self):
+        path = os.path.join(self.tmpdir, 'sub', 'dir', 'state.json')
+
+        timid_github._write_json(path, {'a': 1})
+
+        with open(path) as f:
+            self.assertEqual(json.load(f), {'a': 1})
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['state.json'])
+
+    def test_mode(self):
+        path = os.path.join(self.tmpdir, 'state.json')
+
+        with mock.patch.object(os, 'chmod') as mock_chmod:
+            timid_github._write_json(path, {'a': 1}, 0o600)
+
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        self.assertFalse(mock_chmod.called)
+
+    def test_stale_tmp(self):
+        path = os.path.join(self.tmpdir, 'state.json')
+        tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(),
+                                     threading.current_thread().ident)
+        with open(tmp_path, 'w') as f:
+            f.write('garbage')
+
+        timid_github._write_json(path, {'a': 1})
+
+        with open(path) as f:
+            self.assertEqual(json.load(f), {'a': 1})
+        self.assertEqual(os.listdir(self.tmpdir), ['state.json'])
+
+    def test_threads(self):
+        path = os.path.join(self.tmpdir, 'state.json')
+        errors = []
+
+        def writer(i):
+            try:
+                for _ in range(50):
+                    timid_github._write_json(path, {'writer': i})
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertIn(timid_github._read_json(path)['writer'], range(4))
+        self.assertEqual(os.listdir(self.tmpdir), ['state.json'])
+
+
+class TestFileLock(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'sub', 'file.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_init(self):
+        result = timid_github.FileLock(self.path)
+
+        self.assertEqual(result.path, self.path)
+        self.assertEqual(result.fd, None)
+
+    def test_exclusive(self):
+        obj = timid_github.FileLock(self.path)
+        other = timid_github.FileLock(self.path)
+
+        with obj.exclusive():
+            self.assertTrue(os.path.exists(self.path))
+            self.assertFalse(other.acquire(blocking=False))
+            self.assertFalse(other.acquire(shared=True, blocking=False))
+
+        self.assertEqual(obj.fd, None)
+        self.assertTrue(other.acquire(blocking=False))
+        other.release()
+
+    def test_shared(self):
+        obj = timid_github.FileLock(self.path)
+        other = timid_github.FileLock(self.path)
+
+        with obj.shared():
+            self.assertTrue(other.acquire(shared=True, blocking=False))
+            other.release()
+            self.assertFalse(other.acquire(blocking=False))
+            other.release()
+
+        self.assertEqual(obj.fd, None)
+
+    def test_release_unlocked(self):
+        obj = timid_github.FileLock(self.path)
+
+        obj.release()
+
+        self.assertEqual(obj.fd, None)
+
+
+class TestRecorder(unittest.TestCase):
+    def tearDown(self):
+        logger = timid_github.logging.getLogger('github.Requester')
+        for filt in list(logger.filters):
+            logger.removeFilter(filt)
+        logger.setLevel(timid_github.logging.NOTSET)
+
+    def test_init(self):
+        result = timid_github.Recorder()
+
+        self.assertEqual(result.sinks, [])
+        self.assertEqual(result.tracer, None)
+        self.assertEqual(result._filter, None)
+
+    def test_init_tracer(self):
+        result = timid_github.Recorder(['sink'], 'tracer')
+
+        self.assertEqual(result.sinks, ['sink', 'tracer'])
+        self.assertEqual(result.tracer, 'tracer')
+
+    @mock.patch.object(timid_github.Recorder, 'add_sink')
+    def test_init_sinks(self, mock_add_sink):
+        timid_github.Recorder(['sink1', 'sink2'])
+
+        mock_add_sink.assert_has_calls([
+            mock.call('sink1'),
+            mock.call('sink2'),
         ])
-        self.assertEqual(ctxt.emit.call_count, 2)
-        ctxt.environment.call.assert_called_once_with(
-            ['git', 'spam', 'arg1', 'arg2'], close_fds=True,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        self.assertFalse(mock_sleep.called)
-        mock_StepResult.assert_called_once_with(
-            state=timid.ERROR, returncode=1,
-            msg='Git command "git spam arg1 arg2" returned 1')
 
-    @mock.patch.object(timid_github.timid, 'StepResult')
-    @mock.patch.object(timid_github.time, 'sleep')
-    def test_base_failure_noraise(self, mock_sleep, mock_StepResult):
-        ctxt = self.make_ctxt(returncode=1)
+    def test_add_sink(self):
+        obj = timid_github.Recorder()
 
-        result = timid_github._git(ctxt, 'spam', 'arg1', 'arg2',
-                                   do_raise=False)
+        obj.add_sink('sink1')
+        obj.add_sink('sink2')
 
-        self.assertEqual(result, b'stdout')
-        ctxt.emit.assert_has_calls([
-            mock.call('Executing command "git spam arg1 arg2"', debug=True),
-            mock.call('Command result: return code 1, stdout %r, stderr %r' %
-                      (b'stdout', b'stderr'), debug=True),
+        self.assertEqual(obj.sinks, ['sink1', 'sink2'])
+        self.assertEqual(obj._filter, None)
+
+    def test_observe_http(self):
+        logger = timid_github.logging.getLogger('github.Requester')
+        obj = timid_github.Recorder()
+
+        obj.observe_http()
+        filt = obj._filter
+        obj.observe_http()
+
+        self.assertEqual(logger.filters, [filt])
+        self.assertEqual(logger.level, timid_github.logging.DEBUG)
+        self.assertEqual(filt.saved_level, timid_github.logging.NOTSET)
+
+    @mock.patch.object(timid_github.time, 'time', return_value=12345.0)
+    def test_record(self, mock_time):
+        sink = mock.Mock()
+        obj = timid_github.Recorder([sink])
+
+        obj.record('git', subcommand='spam')
+        obj.record('api', start=100.0, name='get_repo')
+
+        sink.write.assert_has_calls([
+            mock.call({'type': 'git', 'start': 12345.0,
+                       'subcommand': 'spam'}),
+            mock.call({'type': 'api', 'start': 100.0, 'name': 'get_repo'}),
         ])
-        self.assertEqual(ctxt.emit.call_count, 2)
-        ctxt.environment.call.assert_called_once_with(
-            ['git', 'spam', 'arg1', 'arg2'], close_fds=True,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        self.assertFalse(mock_sleep.called)
-        self.assertFalse(mock_StepResult.called)
 
-    @mock.patch.object(timid_github.timid, 'StepResult')
-    @mock.patch.object(timid_github.time, 'sleep')
-    def test_retries_base(self, mock_sleep, mock_StepResult):
-        ctxt = self.make_ctxt(
-            self.make_child(stdout=timid_github.SSH_ERROR, returncode=1),
-            self.make_child(stderr=timid_github.SSH_ERROR, returncode=1),
-            self.make_child(stdout=b'final success'),
-        )
+    def test_record_nosinks(self):
+        obj = timid_github.Recorder()
 
-        result = timid_github._git(ctxt, 'spam', 'arg1', 'arg2',
-                                   ssh_retries=5)
+        obj.record('git', subcommand='spam')
 
-        self.assertEqual(result, b'final success')
-        ctxt.emit.assert_has_calls([
-            mock.call('Executing command "git spam arg1 arg2"', debug=True),
-            mock.call('Command result: return code 1, stdout %r, stderr %r' %
-                      (timid_github.SSH_ERROR, b'stderr'), debug=True),
-            mock.call('Retrying command after a sleep of 1 seconds',
-                      debug=True),
-            mock.call('Retry 2 of 5: retrying command "git spam arg1 arg2"',
-                      debug=True),
-            mock.call('Command result: return code 1, stdout %r, stderr %r' %
-                      (b'stdout', timid_github.SSH_ERROR), debug=True),
-            mock.call('Retrying command after a sleep of 2 seconds',
-                      debug=True),
-            mock.call('Retry 3 of 5: retrying command "git spam arg1 arg2"',
-                      debug=True),
-            mock.call('Command result: return code 0, stdout %r, stderr %r' %
-                      (b'final success', b'stderr'), debug=True),
+    def test_push_span_notracer(self):
+        sink = mock.Mock()
+        obj = timid_github.Recorder([sink])
+
+        result = obj.push_span()
+        obj.record('git', start=1.0, subcommand='spam')
+        obj.pop_span(result)
+
+        self.assertEqual(result, None)
+        sink.write.assert_called_once_with(
+            {'type': 'git', 'start': 1.0, 'subcommand': 'spam'})
+
+    def test_push_span(self):
+        tracer = mock.Mock(**{'new_span_id.side_effect': ['step', 'inner']})
+        obj = timid_github.Recorder([], tracer)
+        events = []
+        tracer.write.side_effect = lambda e: events.append(dict(e))
+
+        obj.record('api', start=1.0)
+        step = obj.push_span()
+        obj.record('git', start=2.0)
+        inner = obj.push_span()
+        obj.record('git', start=3.0, parent_id='explicit')
+        obj.pop_span(step)
+        obj.pop_span(inner)
+        obj.record('api', start=4.0)
+
+        self.assertEqual((step, inner), ('step', 'inner'))
+        self.assertEqual([e.get('parent_id') for e in events],
+                         [None, 'step', 'explicit', None])
+
+    def test_push_span_threads(self):
+        tracer = mock.Mock(**{'new_span_id.side_effect': ['main']})
+        obj = timid_github.Recorder([], tracer)
+        events = []
+        tracer.write.side_effect = lambda e: events.append(dict(e))
+
+        obj.push_span()
+        thread = timid_github.threading.Thread(
+            target=obj.record, args=('git',), kwargs={'start': 1.0})
+        thread.start()
+        thread.join()
+        obj.record('git', start=2.0)
+
+        self.assertEqual([e.get('parent_id') for e in events],
+                         [None, 'main'])
+
+    def test_close(self):
+        logger = timid_github.logging.getLogger('github.Requester')
+        sink1 = mock.Mock()
+        sink2 = mock.Mock(spec=['write'])
+        obj = timid_github.Recorder([sink1, sink2])
+        obj.observe_http()
+
+        obj.close()
+
+        self.assertEqual(obj.sinks, [])
+        self.assertEqual(obj._filter, None)
+        self.assertEqual(logger.filters, [])
+        self.assertEqual(logger.level, timid_github.logging.NOTSET)
+        sink1.close.assert_called_once_with()
+
+    def test_http_events(self):
+        logger = timid_github.logging.getLogger('github.Requester')
+        sink = mock.Mock()
+        obj = timid_github.Recorder([sink])
+        obj.observe_http()
+        handler = mock.Mock(level=timid_github.logging.NOTSET)
+        logger.addHandler(handler)
+
+        try:
+            logger.debug('%s %s://%s%s %s %s ==> %i %s %s', 'GET', 'https',
+                         'api.github.com', '/repos/some/repo', {}, None,
+                         200, {'X-RateLimit-Remaining': '4999',
+                               'X-RateLimit-Reset': '2000'},
+                         '{"id": 1}')
+            logger.warning('a warning')
+        finally:
+            logger.removeHandler(handler)
+            obj.close()
+
+        sink.write.assert_called_once_with({
+            'type': 'http',
+            'start': mock.ANY,
+            'method': 'GET',
+            'host': 'api.github.com',
+            'url': '/repos/some/repo',
+            'status': 200,
+            'bytes': 9,
+            'rate_remaining': '4999',
+            'rate_reset': '2000',
+        })
+        self.assertEqual(handler.handle.call_count, 1)
+        self.assertEqual(handler.handle.call_args[0][0].getMessage(),
+                         'a warning')
+
+
+class TestTimelineSink(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'timeline.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write(self):
+        with open(self.path, 'w') as f:
+            f.write('{"type": "old"}\n')
+        obj = timid_github.TimelineSink(self.path)
+
+        obj.write({'type': 'git', 'duration': 1.5})
+        obj.write({'type': 'api', 'name': 'get_repo'})
+        obj.close()
+
+        with open(self.path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(lines, [
+            {'type': 'old'},
+            {'type': 'git', 'duration': 1.5},
+            {'type': 'api', 'name': 'get_repo'},
         ])
-        self.assertEqual(ctxt.emit.call_count, 8)
-        ctxt.environment.call.assert_has_calls([
-            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
-                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
-                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
-                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
+        self.assertTrue(obj.stream.closed)
+
+
+class TestMetricsSink(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmpdir, 'textfile')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_labels(self):
+        result = timid_github.MetricsSink._labels(b='x"y', a='1\\2\n')
+
+        self.assertEqual(result, 'a="1\\\\2\\n",b="x\\"y"')
+
+    def test_write(self):
+        obj = timid_github.MetricsSink(self.directory)
+
+        for event in [
+                {'type': 'git', 'subcommand': 'fetch', 'outcome': 'retry',
+                 'duration': 0.3},
+                {'type': 'git', 'subcommand': 'fetch', 'outcome': 'ok',
+                 'duration': 700.0},
+                {'type': 'api', 'name': 'get_repo', 'outcome': 'ok',
+                 'duration': 0.01},
+                {'type': 'http', 'status': 200, 'rate_remaining': '4999'},
+                {'type': 'http', 'status': 304, 'rate_remaining': None},
+                {'type': 'status', 'outcome': 'sent'},
+                {'type': 'status', 'outcome': 'suppressed'},
+                {'type': 'workspace', 'path': 'clone'},
+                {'type': 'sleep', 'duration': 1.0}]:
+            obj.write(event)
+
+        fetch = 'subcommand="fetch"'
+        self.assertEqual(obj.data['timid_github_git_commands_total'], {
+            'outcome="ok",subcommand="fetch"': 1,
+            'outcome="retry",subcommand="fetch"': 1,
+        })
+        self.assertEqual(obj.data['timid_github_git_ssh_retries_total'],
+                         {fetch: 1})
+        hist = obj.data['timid_github_git_duration_seconds'][fetch]
+        self.assertEqual(hist['buckets'],
+                         [0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1])
+        self.assertEqual(hist['sum'], 700.3)
+        self.assertEqual(hist['count'], 2)
+        self.assertEqual(obj.data['timid_github_api_calls_total'], {
+            'name="get_repo",outcome="ok"': 1,
+        })
+        self.assertEqual(obj.data['timid_github_http_requests_total'], {
+            'status="200"': 1,
+            'status="304"': 1,
+        })
+        self.assertEqual(obj.data['timid_github_rate_limit_remaining'],
+                         {'': 4999})
+        self.assertEqual(obj.data['timid_github_status_posts_total'], {
+            'result="sent"': 1,
+            'result="suppressed"': 1,
+        })
+        self.assertEqual(obj.data['timid_github_workspace_total'],
+                         {'path="clone"': 1})
+
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_close(self, mock_time):
+        for i in range(2):
+            obj = timid_github.MetricsSink(self.directory)
+            obj.write({'type': 'git', 'subcommand': 'fetch', 'outcome': 'ok',
+                       'duration': 0.5})
+            obj.write({'type': 'http', 'status': 200,
+                       'rate_remaining': str(10 - i)})
+            obj.close()
+
+        self.assertEqual(obj.data, {})
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            '.timid_github.lock', 'timid_github.json', 'timid_github.prom',
         ])
-        self.assertEqual(ctxt.environment.call.call_count, 3)
-        mock_sleep.assert_has_calls([
-            mock.call(1),
-            mock.call(2),
+        with open(os.path.join(self.directory, 'timid_github.prom')) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[:5], [
+            '# HELP timid_github_git_commands_total Number of git commands '
+            'executed, by outcome.',
+            '# TYPE timid_github_git_commands_total counter',
+            'timid_github_git_commands_total'
+            '{outcome="ok",subcommand="fetch"} 2',
+            '# HELP timid_github_git_duration_seconds Duration of git '
+            'commands.',
+            '# TYPE timid_github_git_duration_seconds histogram',
         ])
-        self.assertEqual(mock_sleep.call_count, 2)
-        self.assertFalse(mock_StepResult.called)
+        self.assertIn('timid_github_git_duration_seconds_bucket'
+                      '{subcommand="fetch",le="0.25"} 0', lines)
+        self.assertIn('timid_github_git_duration_seconds_bucket'
+                      '{subcommand="fetch",le="0.5"} 2', lines)
+        self.assertIn('timid_github_git_duration_seconds_bucket'
+                      '{subcommand="fetch",le="+Inf"} 2', lines)
+        self.assertIn('timid_github_git_duration_seconds_sum'
+                      '{subcommand="fetch"} 1.0', lines)
+        self.assertIn('timid_github_git_duration_seconds_count'
+                      '{subcommand="fetch"} 2', lines)
+        self.assertIn('timid_github_rate_limit_remaining 9', lines)
+        self.assertIn('timid_github_runs_total 2', lines)
+        self.assertIn('timid_github_last_run_timestamp_seconds 1000.0',
+                      lines)
+
+
+class TestRunSummary(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_summary(self, *args, **kwargs):
+        obj = timid_github.RunSummary(*args, **kwargs)
+        for event in [
+                {'type': 'api', 'name': 'get_repo', 'duration': 0.5},
+                {'type': 'api', 'name': 'get_pull', 'duration': 0.25},
+                {'type': 'api', 'name': 'create_status', 'duration': 0.5},
+                {'type': 'http', 'duration': 10.0, 'bytes': 100},
+                {'type': 'http', 'duration': 10.0, 'bytes': 50},
+                {'type': 'step', 'phase': 'clone', 'name': 'Clone',
+                 'duration': 4.0},
+                {'type': 'step', 'phase': 'merge', 'name': 'Merge',
+                 'duration': 1.0},
+                {'type': 'step', 'phase': 'steps', 'name': 'Test',
+                 'duration': 20.0},
+                {'type': 'step', 'phase': 'steps', 'name': 'Lint',
+                 'duration': 5.0},
+                {'type': 'git', 'args': ['fetch', 'origin'],
+                 'duration': 3.0},
+                {'type': 'git', 'args': ['status'], 'duration': 0.1},
+                {'type': 'git', 'args': ['merge', 'x'], 'duration': 0.75},
+                {'type': 'sleep', 'duration': 1.0}]:
+            obj.write(event)
+        return obj
 
-    @mock.patch.object(timid_github.timid, 'StepResult')
-    @mock.patch.object(timid_github.time, 'sleep')
-    def test_retries_too_many(self, mock_sleep, mock_StepResult):
-        ctxt = self.make_ctxt(
-            self.make_child(stdout=timid_github.SSH_ERROR, returncode=1),
-            self.make_child(stderr=timid_github.SSH_ERROR, returncode=1),
-            self.make_child(stdout=b'final success'),
-        )
+    def test_init(self):
+        result = timid_github.RunSummary()
+
+        self.assertEqual(result.top, 5)
+        self.assertEqual(result.path, None)
+        self.assertEqual(result.in_status, False)
+        self.assertEqual(result.times, {
+            'activation': 0.0,
+            'clone': 0.0,
+            'merge': 0.0,
+            'status': 0.0,
+            'steps': 0.0,
+        })
+        self.assertEqual(result.steps, [])
+        self.assertEqual(result.git, [])
+        self.assertEqual(result.api_calls, 0)
+        self.assertEqual(result.http_bytes, 0)
+
+    def test_as_dict(self):
+        obj = self.make_summary(2)
+
+        result = obj.as_dict()
+
+        self.assertEqual(result, {
+            'total': mock.ANY,
+            'phases': {
+                'activation': 0.75,
+                'clone': 4.0,
+                'merge': 1.0,
+                'status': 0.5,
+                'steps': 25.0,
+            },
+            'steps': [
+                {'name': 'Clone', 'duration': 4.0},
+                {'name': 'Merge', 'duration': 1.0},
+                {'name': 'Test', 'duration': 20.0},
+                {'name': 'Lint', 'duration': 5.0},
+            ],
+            'api_calls': 3,
+            'http_bytes': 150,
+            'slowest_git': [
+                {'command': 'fetch origin', 'duration': 3.0},
+                {'command': 'merge x', 'duration': 0.75},
+            ],
+        })
+
+    def test_as_dict_notop(self):
+        obj = self.make_summary(0)
+
+        result = obj.as_dict()
+
+        self.assertEqual(result['slowest_git'], [])
+
+    def test_brief(self):
+        obj = self.make_summary()
+
+        result = obj.brief()
+
+        self.assertEqual(result, '[activation 0.8s, clone 4.0s, merge 1.0s, '
+                         'status 0.5s, steps 25.0s]')
+
+    def test_report(self):
+        path = os.path.join(self.tmpdir, 'summary.json')
+        ctxt = mock.Mock()
+        obj = self.make_summary(1, path)
+
+        obj.report(ctxt)
 
-        try:
-            result = timid_github._git(ctxt, 'spam', 'arg1', 'arg2',
-                                       ssh_retries=2)
-        except timid_github.GitException as e:
-            self.assertEqual(e.result, mock_StepResult.return_value)
-        else:
-            self.fail('timid_github.GitException not raised')
         ctxt.emit.assert_has_calls([
-            mock.call('Executing command "git spam arg1 arg2"', debug=True),
-            mock.call('Command result: return code 1, stdout %r, stderr %r' %
-                      (timid_github.SSH_ERROR, b'stderr'), debug=True),
-            mock.call('Retrying command after a sleep of 1 seconds',
-                      debug=True),
-            mock.call('Retry 2 of 2: retrying command "git spam arg1 arg2"',
-                      debug=True),
-            mock.call('Command result: return code 1, stdout %r, stderr %r' %
-                      (b'stdout', timid_github.SSH_ERROR), debug=True),
-            mock.call('Retrying command after a sleep of 2 seconds',
-                      debug=True),
-            mock.call('Too many tries, exiting instead', debug=True),
+            mock.call('  activation API calls: 0.750s', level=2),
+            mock.call('  clone/update: 4.000s', level=2),
+            mock.call('  merge: 1.000s', level=2),
+            mock.call('  status posting: 0.500s', level=2),
+            mock.call('  test steps: 25.000s', level=2),
+            mock.call('Slowest git commands:', level=2),
+            mock.call('  3.000s: git fetch origin', level=2),
         ])
+        self.assertEqual(ctxt.emit.call_count, 8)
+        with open(path) as f:
+            self.assertEqual(json.load(f)['slowest_git'], [
+                {'command': 'fetch origin', 'duration': 3.0},
+            ])
+
+    def test_report_unwritable(self):
+        path = os.path.join(self.tmpdir, 'file', 'summary.json')
+        open(os.path.join(self.tmpdir, 'file'), 'w').close()
+        ctxt = mock.Mock()
+        obj = timid_github.RunSummary(path=path)
+
+        obj.report(ctxt)
+
+        self.assertTrue(ctxt.emit.call_args[0][0].startswith(
+            'Unable to write summary file %s: ' % path))
         self.assertEqual(ctxt.emit.call_count, 7)
-        ctxt.environment.call.assert_has_calls([
-            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
-                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
-                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-        ])
-        self.assertEqual(ctxt.environment.call.call_count, 2)
-        mock_sleep.assert_called_once_with(1)
-        mock_StepResult.assert_called_once_with(
-            state=timid.ERROR, returncode=1,
-            msg='Git command "git spam arg1 arg2" returned 1: %s' % b'stdout')
 
-    @mock.patch.object(timid_github.timid, 'StepResult')
-    @mock.patch.object(timid_github.time, 'sleep')
-    def test_retries_exponential_sleep(self, mock_sleep, mock_StepResult):
-        ctxt = self.make_ctxt(
-            self.make_child(stdout=timid_github.SSH_ERROR, returncode=1),
-            self.make_child(stderr=timid_github.SSH_ERROR, returncode=1),
-            self.make_child(stdout=timid_github.SSH_ERROR, returncode=1),
-            self.make_child(stderr=timid_github.SSH_ERROR, returncode=1),
-            self.make_child(stdout=b'final success'),
-        )
 
-        result = timid_github._git(ctxt, 'spam', 'arg1', 'arg2',
-                                   ssh_retries=5)
+class TestAppendText(unittest.TestCase):
+    def test_nosuffix(self):
+        self.assertEqual(timid_github._append_text('text', ''), 'text')
 
-        self.assertEqual(result, b'final success')
-        ctxt.emit.assert_has_calls([
-            mock.call('Executing command "git spam arg1 arg2"', debug=True),
-            mock.call('Command result: return code 1, stdout %r, stderr %r' %
-                      (timid_github.SSH_ERROR, b'stderr'), debug=True),
-            mock.call('Retrying command after a sleep of 1 seconds',
-                      debug=True),
-            mock.call('Retry 2 of 5: retrying command "git spam arg1 arg2"',
-                      debug=True),
-            mock.call('Command result: return code 1, stdout %r, stderr %r' %
-                      (b'stdout', timid_github.SSH_ERROR), debug=True),
-            mock.call('Retrying command after a sleep of 2 seconds',
-                      debug=True),
-            mock.call('Retry 3 of 5: retrying command "git spam arg1 arg2"',
-                      debug=True),
-            mock.call('Command result: return code 1, stdout %r, stderr %r' %
-                      (timid_github.SSH_ERROR, b'stderr'), debug=True),
-            mock.call('Retrying command after a sleep of 4 seconds',
-                      debug=True),
-            mock.call('Retry 4 of 5: retrying command "git spam arg1 arg2"',
-                      debug=True),
-            mock.call('Command result: return code 1, stdout %r, stderr %r' %
-                      (b'stdout', timid_github.SSH_ERROR), debug=True),
-            mock.call('Retrying command after a sleep of 8 seconds',
-                      debug=True),
-            mock.call('Retry 5 of 5: retrying command "git spam arg1 arg2"',
-                      debug=True),
-            mock.call('Command result: return code 0, stdout %r, stderr %r' %
-                      (b'final success', b'stderr'), debug=True),
+    def test_base(self):
+        self.assertEqual(timid_github._append_text('text', ' [x]'),
+                         'text [x]')
+
+    def test_none(self):
+        self.assertEqual(timid_github._append_text(None, ' [x]'), ' [x]')
+
+    def test_truncate(self):
+        result = timid_github._append_text('a' * 140, ' [x]')
+
+        self.assertEqual(result, 'a' * 133 + '... [x]')
+        self.assertEqual(len(result), 140)
+
+
+class TestPullSpecs(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_single(self):
+        self.assertEqual(timid_github._pull_specs('org/repo#1'),
+                         ['org/repo#1'])
+
+    def test_json(self):
+        value = '{"number": 1, "title": "a, b"}'
+
+        self.assertEqual(timid_github._pull_specs(value), [value])
+
+    def test_list(self):
+        self.assertEqual(
+            timid_github._pull_specs('org/repo#1, org/repo#2 repo#3'),
+            ['org/repo#1', 'org/repo#2', 'repo#3'])
+
+    def test_file(self):
+        path = os.path.join(self.tmpdir, 'pulls')
+        with open(path, 'w') as f:
+            f.write('# Pull requests to test\n'
+                    'org/repo#1\n'
+                    '\n'
+                    '  org/other#2  \n')
+
+        self.assertEqual(timid_github._pull_specs('@%s' % path),
+                         ['org/repo#1', 'org/other#2'])
+
+    def test_file_missing(self):
+        self.assertRaises(IOError, timid_github._pull_specs,
+                          '@%s' % os.path.join(self.tmpdir, 'missing'))
+
+
+class TestRunHistory(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'sub', 'history.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_summary(self, total, clone):
+        return {
+            'total': total,
+            'phases': {'clone': clone, 'merge': 1.0},
+            'steps': [{'name': 'Test', 'duration': total - clone - 1.0}],
+            'api_calls': 4,
+            'http_bytes': 1000,
+            'slowest_git': [],
+        }
+
+    def test_add_series(self):
+        obj = timid_github.RunHistory(self.path)
+
+        obj.add('org/repo', 'master', 'host1', 'org/repo#1', 'success',
+                self.make_summary(10.0, 5.0))
+        obj.add('org/repo', 'master', 'host2', 'org/repo#2', 'failure',
+                self.make_summary(20.0, 6.0))
+        obj.add('org/other', 'devel', 'host1', 'org/other#3', 'success',
+                self.make_summary(30.0, 7.0))
+
+        self.assertEqual(obj.series(repo='org/repo', host='host1'), {
+            ('org/repo', 'master', 'host1', 'total'): [(1, 10.0)],
+            ('org/repo', 'master', 'host1', 'phase:clone'): [(1, 5.0)],
+            ('org/repo', 'master', 'host1', 'phase:merge'): [(1, 1.0)],
+            ('org/repo', 'master', 'host1', 'step:Test'): [(1, 4.0)],
+            ('org/repo', 'master', 'host1', 'api_calls'): [(1, 4)],
+            ('org/repo', 'master', 'host1', 'http_bytes'): [(1, 1000)],
+        })
+        series = obj.series()
+        self.assertEqual(len(series), 18)
+        self.assertEqual(series[('org/other', 'devel', 'host1', 'total')],
+                         [(3, 30.0)])
+
+
+class TestPercentile(unittest.TestCase):
+    def test_base(self):
+        values = [5.0, 1.0, 4.0, 2.0, 3.0]
+
+        self.assertEqual(timid_github._percentile(values, 0), 1.0)
+        self.assertEqual(timid_github._percentile(values, 50), 3.0)
+        self.assertEqual(timid_github._percentile(values, 90), 4.6)
+        self.assertEqual(timid_github._percentile(values, 100), 5.0)
+
+    def test_single(self):
+        self.assertEqual(timid_github._percentile([2.0], 99), 2.0)
+
+
+class TestHistoryMain(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'history.db')
+
+        history = timid_github.RunHistory(self.path)
+        for clone in [5.0, 5.5, 4.5, 5.0, 6.0, 12.0]:
+            history.add('org/repo', 'master', 'host', 'org/repo#1',
+                        'success', {
+                            'total': 20.0,
+                            'phases': {'clone': clone},
+                            'steps': [],
+                            'api_calls': 4,
+                            'http_bytes': 1000,
+                        })
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @mock.patch.object(six.moves.builtins, 'print')
+    def test_report(self, mock_print):
+        result = timid_github.history_main([self.path])
+
+        self.assertEqual(result, 0)
+        mock_print.assert_has_calls([
+            mock.call('org/repo master host phase:clone: n=6 p50=5.250 '
+                      'p90=9.000 p99=11.700'),
+            mock.call('REGRESSION: org/repo master host phase:clone: '
+                      'run 6: 12.000, baseline median 5.000 (2.4x)'),
+            mock.call('org/repo master host total: n=6 p50=20.000 '
+                      'p90=20.000 p99=20.000'),
         ])
-        self.assertEqual(ctxt.emit.call_count, 14)
-        ctxt.environment.call.assert_has_calls([
-            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
-                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
-                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
-                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
-                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
-            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
-                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
+        self.assertEqual(mock_print.call_count, 5)
+
+    @mock.patch.object(six.moves.builtins, 'print')
+    def test_check(self, mock_print):
+        result = timid_github.history_main(['--check', self.path])
+
+        self.assertEqual(result, 1)
+        mock_print.assert_called_once_with(
+            'REGRESSION: org/repo master host phase:clone: '
+            'run 6: 12.000, baseline median 5.000 (2.4x)')
+
+    @mock.patch.object(six.moves.builtins, 'print')
+    def test_check_threshold(self, mock_print):
+        result = timid_github.history_main(
+            ['--check', '--threshold', '3', self.path])
+
+        self.assertEqual(result, 0)
+        self.assertFalse(mock_print.called)
+
+    @mock.patch.object(six.moves.builtins, 'print')
+    def test_check_min_runs(self, mock_print):
+        result = timid_github.history_main(
+            ['--check', '--min-runs', '6', self.path])
+
+        self.assertEqual(result, 0)
+        self.assertFalse(mock_print.called)
+
+    @mock.patch.object(six.moves.builtins, 'print')
+    def test_check_filter(self, mock_print):
+        result = timid_github.history_main(
+            ['--check', '--repo', 'org/other', self.path])
+
+        self.assertEqual(result, 0)
+        self.assertFalse(mock_print.called)
+
+    def test_missing(self):
+        self.assertRaises(
+            SystemExit, timid_github.history_main,
+            [os.path.join(self.tmpdir, 'missing.db')])
+
+    @mock.patch.object(six.moves.builtins, 'print')
+    def test_recent(self, mock_print):
+        result = timid_github.history_main(
+            ['--check', '--recent', '2', '--min-runs', '4', self.path])
+
+        self.assertEqual(result, 1)
+        mock_print.assert_called_once_with(
+            'REGRESSION: org/repo master host phase:clone: '
+            'run 6: 12.000, baseline median 5.000 (2.4x)')
+
+    def test_recent_zero(self):
+        with mock.patch.object(sys, 'stderr'):
+            self.assertRaises(
+                SystemExit, timid_github.history_main,
+                ['--recent', '0', self.path])
+
+
+class TestParseTraceparent(unittest.TestCase):
+    trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+    span_id = '00f067aa0ba902b7'
+
+    def test_valid(self):
+        result = timid_github._parse_traceparent(
+            '00-%s-%s-01' % (self.trace_id.upper(), self.span_id))
+
+        self.assertEqual(result, (self.trace_id, self.span_id))
+
+    def test_invalid(self):
+        for value in [None, '', 'garbage',
+                      'ff-%s-%s-01' % (self.trace_id, self.span_id),
+                      '00-%s-%s-01' % (self.trace_id[1:], self.span_id),
+                      '00-%s-%s-01' % (self.trace_id, 'x' * 16),
+                      '00-%s-%s-01' % ('0' * 32, self.span_id),
+                      '00-%s-%s-01' % (self.trace_id, '0' * 16)]:
+            self.assertEqual(timid_github._parse_traceparent(value), None)
+
+
+class TestOtlpValue(unittest.TestCase):
+    def test_values(self):
+        self.assertEqual(timid_github._otlp_value(True),
+                         {'boolValue': True})
+        self.assertEqual(timid_github._otlp_value(5), {'intValue': '5'})
+        self.assertEqual(timid_github._otlp_value(1.5),
+                         {'doubleValue': 1.5})
+        self.assertEqual(timid_github._otlp_value('x'),
+                         {'stringValue': 'x'})
+        self.assertEqual(timid_github._otlp_value(['a', 1]), {
+            'arrayValue': {'values': [
+                {'stringValue': 'a'},
+                {'intValue': '1'},
+            ]},
+        })
+
+
+class TestTraceSink(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'trace.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_init(self):
+        result = timid_github.TraceSink(self.path)
+
+        self.assertEqual(len(result.trace_id), 32)
+        self.assertEqual(len(result.run_span_id), 16)
+        self.assertEqual(result.parent_span_id, None)
+        self.assertEqual(result.traceparent('span'),
+                         '00-%s-span-01' % result.trace_id)
+        self.assertEqual(len(result.new_span_id()), 16)
+
+    def test_init_traceparent(self):
+        result = timid_github.TraceSink(
+            self.path, '00-4bf92f3577b34da6a3ce929d0e0e4736-'
+            '00f067aa0ba902b7-01')
+
+        self.assertEqual(result.trace_id, '4bf92f3577b34da6a3ce929d0e0e4736')
+        self.assertEqual(result.parent_span_id, '00f067aa0ba902b7')
+
+    def test_spans(self):
+        obj = timid_github.TraceSink(self.path, '00-%s-%s-01' % (
+            'a' * 32, 'b' * 16))
+        obj.start = 100.0
+        obj.attributes['github.pull'] = 'org/repo#5'
+        for event in [
+                {'type': 'api', 'name': 'get_pull', 'start': 100.5,
+                 'duration': 0.5, 'outcome': 'ok'},
+                {'type': 'git', 'subcommand': 'clone', 'start': 102.0,
+                 'duration': 2.0, 'attempt': 1, 'outcome': 'ok',
+                 'span_id': 'c' * 16, 'parent_id': 'd' * 16},
+                {'type': 'status', 'outcome': 'sent'},
+                {'type': 'step', 'name': 'Clone', 'start': 101.0,
+                 'duration': 4.0, 'state': timid.SUCCESS,
+                 'span_id': 'd' * 16},
+                # Another pull request's command, during the step
+                {'type': 'git', 'subcommand': 'fetch', 'start': 103.0,
+                 'duration': 1.0, 'outcome': 'ok'},
+                {'type': 'step', 'name': 'Test', 'start': 106.0,
+                 'duration': 1.0, 'state': timid.FAILURE}]:
+            obj.write(event)
+
+        result = obj.spans(110.0)
+
+        self.assertEqual(len(result), 6)
+        run, api, git, clone, other, test = result
+        self.assertEqual(run['traceId'], 'a' * 32)
+        self.assertEqual(run['parentSpanId'], 'b' * 16)
+        self.assertEqual(run['name'], 'timid run')
+        self.assertEqual(run['startTimeUnixNano'], '100000000000')
+        self.assertEqual(run['endTimeUnixNano'], '110000000000')
+        self.assertEqual(run['attributes'], [
+            {'key': 'github.pull', 'value': {'stringValue': 'org/repo#5'}},
         ])
-        self.assertEqual(ctxt.environment.call.call_count, 5)
-        mock_sleep.assert_has_calls([
-            mock.call(1),
-            mock.call(2),
-            mock.call(4),
-            mock.call(8),
+        self.assertEqual(api['name'], 'github get_pull')
+        self.assertEqual(api['parentSpanId'], run['spanId'])
+        self.assertEqual(api['kind'], 3)
+        self.assertEqual(git['name'], 'git clone')
+        self.assertEqual(git['spanId'], 'c' * 16)
+        self.assertEqual(git['parentSpanId'], clone['spanId'])
+        self.assertIn({'key': 'attempt', 'value': {'intValue': '1'}},
+                      git['attributes'])
+        self.assertNotIn('parent_id',
+                         [a['key'] for a in git['attributes']])
+        self.assertIn({'key': 'github.pull',
+                       'value': {'stringValue': 'org/repo#5'}},
+                      git['attributes'])
+        self.assertEqual(clone['name'], 'step Clone')
+        self.assertEqual(clone['spanId'], 'd' * 16)
+        self.assertEqual(clone['parentSpanId'], run['spanId'])
+        self.assertEqual(other['parentSpanId'], run['spanId'])
+        self.assertEqual(clone['status'], {'code': 0})
+        self.assertEqual(test['status'], {'code': 2})
+
+    def test_close(self):
+        obj = timid_github.TraceSink(self.path)
+        obj.write({'type': 'git', 'subcommand': 'fetch', 'start': 1.0,
+                   'duration': 1.0, 'outcome': 'error'})
+
+        obj.close()
+        obj.close()
+
+        with open(self.path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 2)
+        resource = lines[0]['resourceSpans'][0]
+        self.assertEqual(resource['resource']['attributes'], [
+            {'key': 'service.name', 'value': {'stringValue': 'timid-github'}},
         ])
-        self.assertEqual(mock_sleep.call_count, 4)
-        self.assertFalse(mock_StepResult.called)
+        spans = resource['scopeSpans'][0]['spans']
+        self.assertEqual([s['name'] for s in spans],
+                         ['timid run', 'git fetch'])
+        self.assertEqual(spans[1]['status'], {'code': 2})
+        self.assertEqual(obj.events, [])
+
+
+class TestApiBudget(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'api-usage.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write(self):
+        obj = timid_github.ApiBudget()
+
+        for event in [
+                {'type': 'api', 'name': 'get_repo'},
+                {'type': 'api', 'name': 'create_status'},
+                {'type': 'api', 'name': 'create_status'},
+                {'type': 'http', 'rate_remaining': None},
+                {'type': 'http', 'rate_remaining': '4321',
+                 'rate_reset': '2000'},
+                {'type': 'git'}]:
+            obj.write(event)
+
+        self.assertEqual(obj.calls, {'get_repo': 1, 'create_status': 2})
+        self.assertEqual(obj.total, 3)
+        self.assertEqual(obj.unflushed, 3)
+        self.assertEqual(obj.rate_remaining, 4321)
+        self.assertEqual(obj.rate_reset, 2000)
+
+    def test_flush_nostate(self):
+        obj = timid_github.ApiBudget()
+        obj.unflushed = 5
+
+        obj.flush()
+
+        self.assertEqual(obj.unflushed, 5)
+        self.assertFalse(os.path.exists(self.path))
+
+    @mock.patch.object(timid_github.time, 'time', return_value=7300.0)
+    def test_flush(self, mock_time):
+        timid_github._write_json(self.path, {
+            'user@api': {'hour': 2, 'calls': 10},
+            'other@api': {'hour': 1, 'calls': 10},
+        })
+        obj = timid_github.ApiBudget(state_path=self.path, key='user@api')
+        obj.unflushed = 5
 
+        obj.flush()
 
-class TestCloneAction(unittest.TestCase):
-    @mock.patch.object(timid_github.timid.Action, '__init__',
-                       return_value=None)
-    def test_init(self, mock_init):
-        result = timid_github.CloneAction('ctxt', 'ghe')
+        self.assertEqual(obj.unflushed, 0)
+        self.assertEqual(obj.hour, 2)
+        self.assertEqual(obj.hour_calls, 15)
+        self.assertEqual(timid_github._read_json(self.path), {
+            'user@api': {'hour': 2, 'calls': 15},
+        })
 
-        self.assertEqual(result.ghe, 'ghe')
-        mock_init.assert_called_once_with('ctxt', '__clone__', None, None)
+    @mock.patch.object(timid_github.time, 'time', return_value=11000.0)
+    def test_flush_new_hour(self, mock_time):
+        timid_github._write_json(self.path, {
+            'user@api': {'hour': 2, 'calls': 10},
+        })
+        obj = timid_github.ApiBudget(state_path=self.path, key='user@api')
+        obj.unflushed = 5
 
-    @mock.patch.object(timid_github.timid, 'StepResult')
-    @mock.patch.object(timid_github.sys, 'exc_info', return_value='exc_info')
-    @mock.patch.object(timid_github.os, 'lstat',
-                       side_effect=OSError(errno.ENOENT, 'no file'))
-    @mock.patch.object(timid_github.os, 'remove')
-    @mock.patch.object(timid_github.os.path, 'isdir', return_value=False)
-    @mock.patch.object(timid_github.shutil, 'rmtree')
-    @mock.patch.object(timid_github.stat, 'S_ISDIR', return_value=False)
-    @mock.patch.object(timid_github.CloneAction, '_clone',
-                       return_value='clone success')
-    @mock.patch.object(timid_github.CloneAction, '_update',
-                       return_value='update success')
-    def test_call_base(self, mock_update, mock_clone, mock_S_ISDIR,
-                       mock_rmtree, mock_isdir, mock_remove, mock_lstat,
-                       mock_exc_info, mock_StepResult):
-        ghe = mock.Mock(repo_name='repo')
-        ctxt = mock.Mock(**{
-            'environment.cwd': '/work/dir',
+        obj.flush()
+
+        self.assertEqual(obj.hour_calls, 5)
+        self.assertEqual(timid_github._read_json(self.path), {
+            'user@api': {'hour': 3, 'calls': 5},
         })
-        obj = timid_github.CloneAction(ctxt, ghe)
 
-        result = obj(ctxt)
+    def test_low_unlimited(self):
+        obj = timid_github.ApiBudget()
+        obj.total = 10000
 
-        self.assertEqual(result, 'clone success')
-        self.assertEqual(ctxt.environment.cwd, '/work/dir')
-        mock_lstat.assert_called_once_with('/work/dir/repo')
-        self.assertFalse(mock_exc_info.called)
-        self.assertFalse(mock_StepResult.called)
-        self.assertFalse(mock_S_ISDIR.called)
-        self.assertFalse(mock_remove.called)
-        self.assertFalse(mock_isdir.called)
-        self.assertFalse(mock_rmtree.called)
-        mock_clone.assert_called_once_with('/work/dir', '/work/dir/repo', ctxt)
-        self.assertFalse(mock_update.called)
-        self.assertFalse(ctxt.emit.called)
+        self.assertEqual(obj.low(), None)
 
-    @mock.patch.object(timid_github.timid, 'StepResult')
-    @mock.patch.object(timid_github.sys, 'exc_info', return_value='exc_info')
-    @mock.patch.object(timid_github.os, 'lstat',
-                       side_effect=OSError(errno.EAGAIN, 'again'))
-    @mock.patch.object(timid_github.os, 'remove')
-    @mock.patch.object(timid_github.os.path, 'isdir', return_value=False)
-    @mock.patch.object(timid_github.shutil, 'rmtree')
-    @mock.patch.object(timid_github.stat, 'S_ISDIR', return_value=False)
-    @mock.patch.object(timid_github.CloneAction, '_clone',
-                       return_value='clone success')
-    @mock.patch.object(timid_github.CloneAction, '_update',
-                       return_value='update success')
-    def test_call_error(self, mock_update, mock_clone, mock_S_ISDIR,
-                        mock_rmtree, mock_isdir, mock_remove, mock_lstat,
-                        mock_exc_info, mock_StepResult):
-        ghe = mock.Mock(repo_name='repo')
-        ctxt = mock.Mock(**{
-            'environment.cwd': '/work/dir',
+    def test_low_per_run(self):
+        obj = timid_github.ApiBudget(per_run=10)
+
+        obj.total = 9
+        self.assertEqual(obj.low(), None)
+        obj.total = 10
+        self.assertEqual(obj.low(), 'per-run budget of 10 API calls used')
+
+    def test_low_per_hour(self):
+        timid_github._write_json(self.path, {
+            'user@api': {'hour': int(time.time() // 3600), 'calls': 95},
         })
-        obj = timid_github.CloneAction(ctxt, ghe)
+        obj = timid_github.ApiBudget(per_hour=100, state_path=self.path,
+                                     key='user@api')
+
+        obj.unflushed = 4
+        self.assertEqual(obj.low(), None)
+        obj.unflushed = 1
+        self.assertEqual(obj.low(), 'hourly budget of 100 API calls used')
+
+    @mock.patch.object(timid_github.time, 'time', return_value=7300.0)
+    def test_low_per_hour_unchanged(self, mock_time):
+        obj = timid_github.ApiBudget(per_hour=100, state_path=self.path,
+                                     key='user@api')
+
+        with mock.patch.object(obj, 'flush',
+                               wraps=obj.flush) as mock_flush:
+            for _idx in range(3):
+                self.assertEqual(obj.low(), None)
+            self.assertEqual(mock_flush.call_count, 1)
+
+            obj.unflushed = 2
+            self.assertEqual(obj.low(), None)
+            self.assertEqual(mock_flush.call_count, 2)
+
+            mock_time.return_value = 11000.0
+            self.assertEqual(obj.low(), None)
+            self.assertEqual(mock_flush.call_count, 3)
+
+    def test_low_rate(self):
+        obj = timid_github.ApiBudget(reserve=50)
+
+        obj.rate_remaining = 51
+        self.assertEqual(obj.low(), None)
+        obj.rate_remaining = 50
+        self.assertEqual(obj.low(),
+                         'only 50 API calls remain in the rate limit')
+
+    def test_report(self):
+        ctxt = mock.Mock()
+        obj = timid_github.ApiBudget(per_hour=100)
+        obj.calls = {'get_repo': 1, 'create_status': 2}
+        obj.total = 3
+        obj.hour_calls = 40
+        obj.rate_remaining = 4000
 
-        result = obj(ctxt)
+        obj.report(ctxt)
 
-        self.assertEqual(result, mock_StepResult.return_value)
-        self.assertEqual(ctxt.environment.cwd, '/work/dir')
-        mock_lstat.assert_called_once_with('/work/dir/repo')
-        mock_exc_info.assert_called_once_with()
-        mock_StepResult.assert_called_once_with(
-            msg='Unable to stat repo directory /work/dir/repo',
-            exc_info='exc_info')
-        self.assertFalse(mock_S_ISDIR.called)
-        self.assertFalse(mock_remove.called)
-        self.assertFalse(mock_isdir.called)
-        self.assertFalse(mock_rmtree.called)
-        self.assertFalse(mock_clone.called)
-        self.assertFalse(mock_update.called)
-        self.assertFalse(ctxt.emit.called)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github API calls: 3 (create_status=2, get_repo=1)',
+                      level=2),
+            mock.call('Github API rate limit remaining: 4000', level=2),
+            mock.call('Github API calls this hour: 40 of 100', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 3)
 
-    @mock.patch.object(timid_github.timid, 'StepResult')
-    @mock.patch.object(timid_github.sys, 'exc_info', return_value='exc_info')
-    @mock.patch.object(timid_github.os, 'lstat',
-                       return_value=mock.Mock(st_mode='mode'))
-    @mock.patch.object(timid_github.os, 'remove')
-    @mock.patch.object(timid_github.os.path, 'isdir', return_value=False)
-    @mock.patch.object(timid_github.shutil, 'rmtree')
-    @mock.patch.object(timid_github.stat, 'S_ISDIR', return_value=False)
-    @mock.patch.object(timid_github.CloneAction, '_clone',
-                       return_value='clone success')
-    @mock.patch.object(timid_github.CloneAction, '_update',
-                       return_value='update success')
-    def test_call_non_dir(self, mock_update, mock_clone, mock_S_ISDIR,
-                          mock_rmtree, mock_isdir, mock_remove, mock_lstat,
-                          mock_exc_info, mock_StepResult):
-        ghe = mock.Mock(repo_name='repo')
-        ctxt = mock.Mock(**{
-            'environment.cwd': '/work/dir',
+
+class TestApiCall(unittest.TestCase):
+    def test_success(self):
+        recorder = mock.Mock()
+        func = mock.Mock(return_value='result')
+
+        result = timid_github._api_call(recorder, 'name', func, 1, a=2)
+
+        self.assertEqual(result, 'result')
+        func.assert_called_once_with(1, a=2)
+        recorder.record.assert_called_once_with(
+            'api', start=mock.ANY, duration=mock.ANY, name='name',
+            outcome='ok')
+
+    def test_failure(self):
+        recorder = mock.Mock()
+        func = mock.Mock(side_effect=TestException('oops'))
+
+        self.assertRaises(TestException, timid_github._api_call,
+                          recorder, 'name', func)
+        recorder.record.assert_called_once_with(
+            'api', start=mock.ANY, duration=mock.ANY, name='name',
+            outcome='error', error='oops')
+
+
+class TestRetryDelay(unittest.TestCase):
+    def make_exc(self, status, headers=None, data=None):
+        return github.GithubException(status, data or {}, headers or {})
+
+    def test_other_exception(self):
+        self.assertEqual(
+            timid_github._retry_delay(ValueError('bad'), 1000), None)
+
+    def test_other_status(self):
+        exc = self.make_exc(404, {'Retry-After': '10'})
+
+        self.assertEqual(timid_github._retry_delay(exc, 1000), None)
+
+    def test_retry_after(self):
+        exc = self.make_exc(403, {'Retry-After': '10'})
+
+        self.assertEqual(timid_github._retry_delay(exc, 1000), 10)
+
+    def test_reset(self):
+        exc = self.make_exc(403, {
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': '1030',
         })
-        obj = timid_github.CloneAction(ctxt, ghe)
 
-        result = obj(ctxt)
+        self.assertEqual(timid_github._retry_delay(exc, 1000), 31)
 
-        self.assertEqual(result, 'clone success')
-        self.assertEqual(ctxt.environment.cwd, '/work/dir')
-        mock_lstat.assert_called_once_with('/work/dir/repo')
-        self.assertFalse(mock_exc_info.called)
-        self.assertFalse(mock_StepResult.called)
-        mock_S_ISDIR.assert_called_once_with('mode')
-        mock_remove.assert_called_once_with('/work/dir/repo')
-        self.assertFalse(mock_isdir.called)
-        self.assertFalse(mock_rmtree.called)
-        mock_clone.assert_called_once_with('/work/dir', '/work/dir/repo', ctxt)
-        self.assertFalse(mock_update.called)
-        ctxt.emit.assert_called_once_with(
-            'Deleting file shadowing repository directory /work/dir/repo',
-            level=2)
+    def test_reset_passed(self):
+        exc = self.make_exc(403, {
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': '990',
+        })
 
-    @mock.patch.object(timid_github.timid, 'StepResult')
-    @mock.patch.object(timid_github.sys, 'exc_info', return_value='exc_info')
-    @mock.patch.object(timid_github.os, 'lstat',
-                       return_value=mock.Mock(st_mode='mode'))
-    @mock.patch.object(timid_github.os, 'remove')
-    @mock.patch.object(timid_github.os.path, 'isdir', return_value=True)
-    @mock.patch.object(timid_github.shutil, 'rmtree')
-    @mock.patch.object(timid_github.stat, 'S_ISDIR', return_value=True)
-    @mock.patch.object(timid_github.CloneAction, '_clone',
-                       return_value='clone success')
-    @mock.patch.object(timid_github.CloneAction, '_update',
-                       return_value='update success')
-    def test_call_git_dir(self, mock_update, mock_clone, mock_S_ISDIR,
-                          mock_rmtree, mock_isdir, mock_remove, mock_lstat,
-                          mock_exc_info, mock_StepResult):
-        ghe = mock.Mock(repo_name='repo')
-        ctxt = mock.Mock(**{
-            'environment.cwd': '/work/dir',
+        self.assertEqual(timid_github._retry_delay(exc, 1000), 1)
+
+    def test_secondary(self):
+        exc = self.make_exc(403, {'X-RateLimit-Remaining': '10'}, {
+            'message': 'You have exceeded a secondary rate limit.',
         })
-        obj = timid_github.CloneAction(ctxt, ghe)
 
-        result = obj(ctxt)
+        self.assertEqual(timid_github._retry_delay(exc, 1000), 60)
 
-        self.assertEqual(result, 'update success')
-        self.assertEqual(ctxt.environment.cwd, '/work/dir/repo')
-        mock_lstat.assert_called_once_with('/work/dir/repo')
-        self.assertFalse(mock_exc_info.called)
-        self.assertFalse(mock_StepResult.called)
-        mock_S_ISDIR.assert_called_once_with('mode')
-        self.assertFalse(mock_remove.called)
-        mock_isdir.assert_called_once_with('/work/dir/repo/.git')
-        self.assertFalse(mock_rmtree.called)
-        self.assertFalse(mock_clone.called)
-        mock_update.assert_called_once_with(ctxt)
-        self.assertFalse(ctxt.emit.called)
+    def test_too_many_requests(self):
+        exc = self.make_exc(429)
 
-    @mock.patch.object(timid_github.timid, 'StepResult')
-    @mock.patch.object(timid_github.sys, 'exc_info', return_value='exc_info')
-    @mock.patch.object(timid_github.os, 'lstat',
-                       return_value=mock.Mock(st_mode='mode'))
-    @mock.patch.object(timid_github.os, 'remove')
-    @mock.patch.object(timid_github.os.path, 'isdir', return_value=False)
-    @mock.patch.object(timid_github.shutil, 'rmtree')
-    @mock.patch.object(timid_github.stat, 'S_ISDIR', return_value=True)
-    @mock.patch.object(timid_github.CloneAction, '_clone',
-                       return_value='clone success')
-    @mock.patch.object(timid_github.CloneAction, '_update',
-                       return_value='update success')
-    def test_call_nongit_dir(self, mock_update, mock_clone, mock_S_ISDIR,
-                             mock_rmtree, mock_isdir, mock_remove, mock_lstat,
-                             mock_exc_info, mock_StepResult):
-        ghe = mock.Mock(repo_name='repo')
-        ctxt = mock.Mock(**{
-            'environment.cwd': '/work/dir',
+        self.assertEqual(timid_github._retry_delay(exc, 1000), 60)
+
+    def test_forbidden(self):
+        exc = self.make_exc(403, {'X-RateLimit-Remaining': '10'}, {
+            'message': 'Resource not accessible by integration',
         })
-        obj = timid_github.CloneAction(ctxt, ghe)
 
-        result = obj(ctxt)
+        self.assertEqual(timid_github._retry_delay(exc, 1000), None)
 
-        self.assertEqual(result, 'clone success')
-        self.assertEqual(ctxt.environment.cwd, '/work/dir')
-        mock_lstat.assert_called_once_with('/work/dir/repo')
-        self.assertFalse(mock_exc_info.called)
-        self.assertFalse(mock_StepResult.called)
-        mock_S_ISDIR.assert_called_once_with('mode')
-        self.assertFalse(mock_remove.called)
-        mock_isdir.assert_called_once_with('/work/dir/repo/.git')
-        mock_rmtree.assert_called_once_with('/work/dir/repo')
-        mock_clone.assert_called_once_with('/work/dir', '/work/dir/repo', ctxt)
-        self.assertFalse(mock_update.called)
-        ctxt.emit.assert_called_once_with(
-            'Deleting directory tree shadowing repository directory '
-            '/work/dir/repo', level=2)
 
-    @mock.patch.object(timid_github.timid, 'StepResult')
-    @mock.patch.object(timid_github.sys, 'exc_info', return_value='exc_info')
-    @mock.patch.object(timid_github.os, 'lstat',
-                       return_value=mock.Mock(st_mode='mode'))
-    @mock.patch.object(timid_github.os, 'remove')
-    @mock.patch.object(timid_github.os.path, 'isdir', return_value=True)
-    @mock.patch.object(timid_github.shutil, 'rmtree')
-    @mock.patch.object(timid_github.stat, 'S_ISDIR', return_value=True)
-    @mock.patch.object(timid_github.CloneAction, '_clone',
-                       return_value='clone success')
-    @mock.patch.object(timid_github.CloneAction, '_update',
-                       side_effect=TestException('bah'))
-    def test_call_git_dir_failed_update(self, mock_update, mock_clone,
-                                        mock_S_ISDIR, mock_rmtree, mock_isdir,
-                                        mock_remove, mock_lstat,
-                                        mock_exc_info, mock_StepResult):
-        ghe = mock.Mock(repo_name='repo')
-        ctxt = mock.Mock(**{
-            'environment.cwd': '/work/dir',
+class TestApiScheduler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'api-schedule.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @mock.patch.object(timid_github.time, 'sleep')
+    def test_call(self, mock_sleep):
+        func = mock.Mock(return_value='result')
+        recorder = mock.Mock()
+        obj = timid_github.ApiScheduler()
+
+        result = obj.call(recorder, 'name', func, 'a', b='c')
+
+        self.assertEqual(result, 'result')
+        func.assert_called_once_with('a', b='c')
+        recorder.record.assert_called_once_with(
+            'api', start=mock.ANY, duration=mock.ANY, name='name',
+            outcome='ok')
+        self.assertFalse(mock_sleep.called)
+        self.assertFalse(os.path.exists(self.path))
+
+    @mock.patch.object(timid_github.time, 'sleep')
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_call_spacing(self, mock_time, mock_sleep):
+        func = mock.Mock(return_value='result')
+        recorder = mock.Mock()
+        timid_github._write_json(self.path, {
+            'user@api': {'not_before': 0.0, 'last': 999.5},
         })
-        obj = timid_github.CloneAction(ctxt, ghe)
+        obj = timid_github.ApiScheduler(1.0, state_path=self.path,
+                                        key='user@api')
 
-        result = obj(ctxt)
+        result = obj.call(recorder, 'name', func)
 
-        self.assertEqual(result, 'clone success')
-        self.assertEqual(ctxt.environment.cwd, '/work/dir')
-        mock_lstat.assert_called_once_with('/work/dir/repo')
-        self.assertFalse(mock_exc_info.called)
-        self.assertFalse(mock_StepResult.called)
-        mock_S_ISDIR.assert_called_once_with('mode')
-        self.assertFalse(mock_remove.called)
-        mock_isdir.assert_called_once_with('/work/dir/repo/.git')
-        mock_rmtree.assert_called_once_with('/work/dir/repo')
-        mock_clone.assert_called_once_with('/work/dir', '/work/dir/repo', ctxt)
-        mock_update.assert_called_once_with(ctxt)
-        ctxt.emit.assert_has_calls([
-            mock.call('Failed to update existing repository in directory '
-                      '/work/dir/repo; starting from scratch'),
-            mock.call('Deleting directory tree shadowing repository '
-                      'directory /work/dir/repo', level=2),
+        self.assertEqual(result, 'result')
+        mock_sleep.assert_called_once_with(0.5)
+        recorder.record.assert_has_calls([
+            mock.call('sleep', start=1000.0, duration=0.0, name='name'),
         ])
-        self.assertEqual(ctxt.emit.call_count, 2)
+        self.assertEqual(timid_github._read_json(self.path), {
+            'user@api': {'not_before': 0.0, 'last': 1000.5},
+        })
 
-    @mock.patch.object(timid_github, '_git')
-    @mock.patch.object(timid_github.CloneAction, '_update',
-                       return_value='update success')
-    def test_clone_base(self, mock_update, mock_git):
-        ghe = mock.Mock(repo_url='repo://url')
-        ctxt = mock.Mock(**{
-            'environment.cwd': '/work/dir',
+    @mock.patch.object(timid_github.time, 'sleep')
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_call_shared_reset(self, mock_time, mock_sleep):
+        func = mock.Mock(return_value='result')
+        timid_github._write_json(self.path, {
+            'user@api': {'not_before': 1010.0},
         })
-        obj = timid_github.CloneAction(ctxt, ghe)
+        obj = timid_github.ApiScheduler(state_path=self.path,
+                                        key='user@api')
 
-        result = obj._clone('/work/dir', '/work/dir/repo', ctxt)
+        obj.call(mock.Mock(), 'name', func)
 
-        self.assertEqual(result, 'update success')
-        self.assertEqual(ctxt.environment.cwd, '/work/dir/repo')
-        mock_git.assert_called_once_with(
-            ctxt, 'clone', 'repo://url', '/work/dir/repo', ssh_retries=5)
-        mock_update.assert_called_once_with(ctxt)
-        ctxt.emit.assert_called_once_with(
-            'Cloning repository from repo://url into directory /work/dir/repo')
+        mock_sleep.assert_called_once_with(10.0)
 
-    @mock.patch.object(timid_github, '_git')
-    @mock.patch.object(timid_github.CloneAction, '_update',
-                       side_effect=TestException('bah'))
-    def test_clone_error(self, mock_update, mock_git):
-        ghe = mock.Mock(repo_url='repo://url')
-        ctxt = mock.Mock(**{
-            'environment.cwd': '/work/dir',
+    @mock.patch.object(timid_github.time, 'sleep')
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_call_retry(self, mock_time, mock_sleep):
+        func = mock.Mock(side_effect=[
+            github.GithubException(429, {}, {'Retry-After': '5'}),
+            'result',
+        ])
+        obj = timid_github.ApiScheduler(state_path=self.path,
+                                        key='user@api')
+
+        result = obj.call(mock.Mock(), 'name', func)
+
+        self.assertEqual(result, 'result')
+        self.assertEqual(func.call_count, 2)
+        mock_sleep.assert_called_once_with(5.0)
+        self.assertEqual(timid_github._read_json(self.path), {
+            'user@api': {'not_before': 1005.0},
         })
-        obj = timid_github.CloneAction(ctxt, ghe)
 
-        self.assertRaises(TestException, obj._clone,
-                          '/work/dir', '/work/dir/repo', ctxt)
-        self.assertEqual(ctxt.environment.cwd, '/work/dir')
-        mock_git.assert_called_once_with(
-            ctxt, 'clone', 'repo://url', '/work/dir/repo', ssh_retries=5)
-        mock_update.assert_called_once_with(ctxt)
-        ctxt.emit.assert_called_once_with(
-            'Cloning repository from repo://url into directory /work/dir/repo')
+    @mock.patch.object(timid_github.time, 'sleep')
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_call_too_long(self, mock_time, mock_sleep):
+        func = mock.Mock(side_effect=github.GithubException(
+            429, {}, {'Retry-After': '600'}))
+        obj = timid_github.ApiScheduler()
+
+        self.assertRaises(timid_github.ApiRateLimited, obj.call,
+                          mock.Mock(), 'name', func)
+        func.assert_called_once_with()
+        self.assertFalse(mock_sleep.called)
+        self.assertEqual(obj.not_before, 1600.0)
 
-    @mock.patch.object(timid_github, '_git')
-    @mock.patch.object(timid_github.timid, 'StepResult', return_value='result')
-    def test_update(self, mock_StepResult, mock_git):
-        ghe = mock.Mock(repo_url='repo://url', repo_branch='branch')
-        ctxt = mock.Mock()
-        obj = timid_github.CloneAction(ctxt, ghe)
+    @mock.patch.object(timid_github.time, 'sleep')
+    def test_call_failure(self, mock_sleep):
+        func = mock.Mock(side_effect=github.GithubException(404, {}, {}))
+        obj = timid_github.ApiScheduler()
 
-        result = obj._update(ctxt)
+        self.assertRaises(github.GithubException, obj.call,
+                          mock.Mock(), 'name', func)
+        func.assert_called_once_with()
+        self.assertEqual(obj.not_before, 0.0)
 
-        self.assertEqual(result, 'result')
-        mock_git.assert_has_calls([
-            mock.call(ctxt, 'remote', 'set-url', 'origin', 'repo://url'),
-            mock.call(ctxt, 'rebase', '--abort', do_raise=False),
-            mock.call(ctxt, 'checkout', '-f', 'branch'),
-            mock.call(ctxt, 'reset', '--hard', 'origin/branch'),
-            mock.call(ctxt, 'clean', '-fdx'),
-            mock.call(ctxt, 'fetch', 'origin', 'branch', ssh_retries=5),
-            mock.call(ctxt, 'checkout', 'branch'),
-        ])
-        self.assertEqual(mock_git.call_count, 7)
-        mock_StepResult.assert_called_once_with(state=timid.SUCCESS)
-        ctxt.emit.assert_has_calls([
-            mock.call('Updating repository from upstream data'),
-            mock.call('Cleaning up repository...', level=2),
-            mock.call('Checking out most recent version of branch branch',
-                      level=2),
-        ])
-        self.assertEqual(ctxt.emit.call_count, 3)
+    @mock.patch.object(timid_github.time, 'sleep')
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_try_call_blocked(self, mock_time, mock_sleep):
+        func = mock.Mock()
+        obj = timid_github.ApiScheduler()
+        obj.not_before = 1010.0
+
+        self.assertRaises(timid_github.ApiRateLimited, obj.try_call,
+                          mock.Mock(), 'name', func)
+        self.assertFalse(func.called)
+        self.assertFalse(mock_sleep.called)
 
+    @mock.patch.object(timid_github.time, 'sleep')
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_try_call_limited(self, mock_time, mock_sleep):
+        func = mock.Mock(side_effect=github.GithubException(
+            403, {}, {'Retry-After': '5'}))
+        obj = timid_github.ApiScheduler()
 
-class TestMergeAction(unittest.TestCase):
-    @mock.patch.object(timid_github.timid.Action, '__init__',
-                       return_value=None)
-    def test_init(self, mock_init):
-        result = timid_github.MergeAction('ctxt', 'ghe')
+        try:
+            obj.try_call(mock.Mock(), 'name', func)
+        except timid_github.ApiRateLimited as e:
+            self.assertEqual(e.until, 1005.0)
+        else:
+            self.fail('ApiRateLimited not raised')
+        func.assert_called_once_with()
+        self.assertFalse(mock_sleep.called)
 
-        self.assertEqual(result.ghe, 'ghe')
-        mock_init.assert_called_once_with('ctxt', '__merge__', None, None)
 
-    @mock.patch.object(timid_github, '_git')
-    @mock.patch.object(timid_github.timid, 'StepResult', return_value='result')
-    def test_call(self, mock_StepResult, mock_git):
-        ghe = mock.Mock(**{
-            'pull.user.login': 'user-login',
-            'repo_branch': 'repo-branch',
-            'change_url': 'https://change/repo',
-            'change_branch': 'change-branch',
-        })
-        ctxt = mock.Mock()
-        obj = timid_github.MergeAction(ctxt, ghe)
+class TestReadTokens(unittest.TestCase):
+    def test_read(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'tokens')
+            with open(path, 'w') as f:
+                f.write('# Tokens for CI\ntoken1\n\n  token2  \n')
 
-        result = obj(ctxt)
+            result = timid_github._read_tokens(path)
+        finally:
+            shutil.rmtree(tmpdir)
 
-        self.assertEqual(result, 'result')
-        mock_git.assert_has_calls([
-            mock.call(ctxt, 'branch', '-D', 'user-login-change-branch',
-                      do_raise=False),
-            mock.call(ctxt, 'checkout', '-b', 'user-login-change-branch',
-                      'repo-branch'),
-            mock.call(ctxt, 'pull', 'https://change/repo', 'change-branch'),
-            mock.call(ctxt, 'checkout', 'repo-branch'),
-            mock.call(ctxt, 'merge', 'user-login-change-branch'),
-        ])
-        self.assertEqual(mock_git.call_count, 5)
-        mock_StepResult.assert_called_once_with(state=timid.SUCCESS)
-        ctxt.emit.assert_has_calls([
-            mock.call('Cloning pull request from user-login branch '
-                      'change-branch into local branch '
-                      'user-login-change-branch'),
-            mock.call('Merging the change into branch repo-branch'),
-        ])
-        self.assertEqual(ctxt.emit.call_count, 2)
+        self.assertEqual(result, ['token1', 'token2'])
 
 
-class TestSelectUrl(unittest.TestCase):
-    def test_from_repo(self):
-        repo = mock.Mock(**dict((v, '%s url' % k) for k, v in
-                                timid_github.URL_ATTR.items()))
+class TestTokenPool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'token-pool.json')
 
-        for url in timid_github.URL_ATTR.keys():
-            result = timid_github._select_url(url, repo)
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
 
-            self.assertEqual(result, '%s url' % url)
+    def fp(self, token):
+        return timid_github.TokenPool.fingerprint(token)
 
-    def test_verbatim(self):
-        repo = mock.Mock()
+    def test_fingerprint(self):
+        result = timid_github.TokenPool.fingerprint('token')
 
-        result = timid_github._select_url('foo://url', repo)
+        self.assertEqual(len(result), 16)
+        self.assertNotEqual(result, timid_github.TokenPool.fingerprint('x'))
 
-        self.assertEqual(result, 'foo://url')
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_select_unused(self, mock_time):
+        timid_github._write_json(self.path, {
+            self.fp('token1'): {'used': 900.0},
+        })
+        obj = timid_github.TokenPool(['token1', 'token2'], self.path)
 
+        result = obj.select()
 
-class TestGithubExtension(unittest.TestCase):
-    @mock.patch.dict(timid_github.os.environ, clear=True)
-    @mock.patch.object(timid_github.getpass, 'getuser', return_value='user')
-    def test_prepare_noenviron(self, mock_getuser):
-        parser = mock.Mock()
-        group = parser.add_argument_group.return_value
+        self.assertEqual(result, 'token2')
+        self.assertEqual(obj.token, 'token2')
+        self.assertEqual(timid_github._read_json(self.path), {
+            self.fp('token1'): {'used': 900.0},
+            self.fp('token2'): {'used': 1000.0},
+        })
 
-        timid_github.GithubExtension.prepare(parser)
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_select_quota(self, mock_time):
+        timid_github._write_json(self.path, {
+            self.fp('token1'): {'used': 900.0, 'remaining': 10,
+                                'reset': 2000},
+            self.fp('token2'): {'used': 800.0, 'remaining': 4000,
+                                'reset': 2000},
+            self.fp('token3'): {'used': 700.0, 'remaining': 20,
+                                'reset': 2000},
+        })
+        obj = timid_github.TokenPool(['token1', 'token2', 'token3'],
+                                     self.path)
 
-        parser.add_argument_group.assert_called_once_with(
-            'Github Integration', 'Options for integrating with Github.')
-        group.add_argument.assert_has_calls([
-            mock.call('--github-api', default='https://api.github.com',
-                      help=mock.ANY),
-            mock.call('--github-user', default='user', help=mock.ANY),
-            mock.call('--github-pass', default=None, help=mock.ANY),
-            mock.call('--github-keyring-set', default=False,
-                      action='store_true', help=mock.ANY),
-            mock.call('--github-pull', help=mock.ANY),
-            mock.call('--github-repo', default='git', help=mock.ANY),
-            mock.call('--github-change-repo', help=mock.ANY),
-            mock.call('--github-status-url', help=mock.ANY),
-            mock.call('--github-override', help=mock.ANY),
-            mock.call('--github-override-status',
-                      choices=['pending', 'error', 'failure'], help=mock.ANY),
-            mock.call('--github-override-text', help=mock.ANY),
-            mock.call('--github-override-url', help=mock.ANY),
-        ])
+        result = obj.select()
 
-    @mock.patch.dict(timid_github.os.environ, clear=True,
-                     TIMID_GITHUB_API='https://example.com/api',
-                     TIMID_GITHUB_USER='alt_user',
-                     TIMID_GITHUB_PASS='passwd')
-    @mock.patch.object(timid_github.getpass, 'getuser', return_value='user')
-    def test_prepare_withenviron(self, mock_getuser):
-        parser = mock.Mock()
-        group = parser.add_argument_group.return_value
+        self.assertEqual(result, 'token2')
 
-        timid_github.GithubExtension.prepare(parser)
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_select_reset(self, mock_time):
+        timid_github._write_json(self.path, {
+            self.fp('token1'): {'used': 900.0, 'remaining': 10,
+                                'reset': 950},
+            self.fp('token2'): {'used': 800.0, 'remaining': 4000,
+                                'reset': 2000},
+        })
+        obj = timid_github.TokenPool(['token1', 'token2'], self.path)
 
-        parser.add_argument_group.assert_called_once_with(
-            'Github Integration', 'Options for integrating with Github.')
-        group.add_argument.assert_has_calls([
-            mock.call('--github-api', default='https://example.com/api',
-                      help=mock.ANY),
-            mock.call('--github-user', default='alt_user', help=mock.ANY),
-            mock.call('--github-pass', default='passwd', help=mock.ANY),
-            mock.call('--github-keyring-set', default=False,
-                      action='store_true', help=mock.ANY),
-            mock.call('--github-pull', help=mock.ANY),
-            mock.call('--github-repo', default='git', help=mock.ANY),
-            mock.call('--github-change-repo', help=mock.ANY),
-            mock.call('--github-status-url', help=mock.ANY),
-            mock.call('--github-override', help=mock.ANY),
-            mock.call('--github-override-status',
-                      choices=['pending', 'error', 'failure'], help=mock.ANY),
-            mock.call('--github-override-text', help=mock.ANY),
-            mock.call('--github-override-url', help=mock.ANY),
-        ])
+        result = obj.select()
 
-    def make_pull(self, mock_Github, number=1, repo_name='repo',
-                  full_name='some/repo',
-                  repo_url='repo-url', repo_branch='branch',
-                  change_url='change-repo-url', change_branch='change-branch'):
-        # Create the pull object
-        last_commit = mock.Mock()
-        pull = mock.Mock(**{
-            'base.repo.full_name': 'some/repo',
-            'base.repo.name': repo_name,
-            'base.repo.url': repo_url,
-            'base.ref': repo_branch,
-            'head.repo.url': change_url,
-            'head.ref': change_branch,
-            'number': 5,
-            '_last_commit': last_commit,
-            'get_commits.return_value': [0, 1, 2, last_commit],
+        self.assertEqual(result, 'token1')
+
+    def test_update(self):
+        timid_github._write_json(self.path, {
+            self.fp('token1'): {'used': 900.0},
         })
+        obj = timid_github.TokenPool(['token1', 'token2'], self.path)
+        obj.token = 'token1'
 
-        # Attach it to the right places
-        obj = mock_Github.return_value
-        obj.get_repo.return_value.get_pull.return_value = pull
-        obj.create_from_raw_data.return_value = pull
+        obj.update(4321, 2000)
 
-        return pull
+        self.assertEqual(timid_github._read_json(self.path), {
+            self.fp('token1'): {'used': 900.0, 'remaining': 4321,
+                                'reset': 2000},
+        })
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_base(self, mock_init, mock_select_url, mock_set_password,
-                           mock_get_password, mock_Github, mock_getpass,
-                           mock_exit):
-        ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=None,
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
-        )
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+class TestSetenv(unittest.TestCase):
+    def test_none(self):
+        ctxt = mock.Mock(environment={'VAR': 'orig'})
 
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('some/repo')
-        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
-        self.assertFalse(gh.create_from_raw_data.called)
-        mock_select_url.assert_has_calls([
-            mock.call('https://example.com/repo', pull.base.repo),
-            mock.call('https://example.com/repo', pull.head.repo),
-        ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_keyring',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'success',
-                'github_success_text': 'Tests passed!',
-                'github_success_url': None,
-                'github_status_url': None,
-            }),
-        ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, None, {
-                'status': 'success',
-                'text': 'Tests passed!',
-                'url': None,
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
+        with timid_github._setenv(ctxt, 'VAR', None):
+            self.assertEqual(ctxt.environment, {'VAR': 'orig'})
+
+        self.assertEqual(ctxt.environment, {'VAR': 'orig'})
+
+    def test_replace(self):
+        ctxt = mock.Mock(environment={'VAR': 'orig'})
+
+        with timid_github._setenv(ctxt, 'VAR', 'new'):
+            self.assertEqual(ctxt.environment, {'VAR': 'new'})
+
+        self.assertEqual(ctxt.environment, {'VAR': 'orig'})
+
+    def test_add_exception(self):
+        ctxt = mock.Mock(environment={})
+
+        try:
+            with timid_github._setenv(ctxt, 'VAR', 'new'):
+                self.assertEqual(ctxt.environment, {'VAR': 'new'})
+                raise TestException('bah')
+        except TestException:
+            pass
+        else:
+            self.fail('TestException not raised')
+
+        self.assertEqual(ctxt.environment, {})
+
+
+class TestChdir(unittest.TestCase):
+    def test_base(self):
+        ctxt = mock.Mock(**{'environment.cwd': '/work/dir'})
+
+        with timid_github._chdir(ctxt, '/other/dir'):
+            self.assertEqual(ctxt.environment.cwd, '/other/dir')
+
+        self.assertEqual(ctxt.environment.cwd, '/work/dir')
+
+    def test_exception(self):
+        ctxt = mock.Mock(**{'environment.cwd': '/work/dir'})
+
+        try:
+            with timid_github._chdir(ctxt, '/other/dir'):
+                raise TestException('bah')
+        except TestException:
+            pass
+        else:
+            self.fail('TestException not raised')
+
+        self.assertEqual(ctxt.environment.cwd, '/work/dir')
+
+
+class TestGit(unittest.TestCase):
+    def make_child(self, stdout=b'stdout', stderr=b'stderr', returncode=0):
+        return mock.Mock(**{
+            'communicate.return_value': (stdout, stderr),
+            'returncode': returncode,
+        })
+
+    def make_ctxt(self, *children, **kwargs):
+        if not children:
+            children = [self.make_child(**kwargs)]
+        else:
+            children = list(children)
+
+        return mock.Mock(**{
+            'environment.call.side_effect': children,
+        })
+
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.time, 'sleep')
+    def test_base(self, mock_sleep, mock_StepResult):
+        ctxt = self.make_ctxt()
+
+        result = timid_github._git(ctxt, 'spam', 'arg1', 'arg2')
+
+        self.assertEqual(result, b'stdout')
         ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
+            mock.call('Executing command "git spam arg1 arg2"', debug=True),
+            mock.call('Command result: return code 0, stdout %r, stderr %r' %
+                      (b'stdout', b'stderr'), debug=True),
         ])
-        self.assertEqual(ctxt.emit.call_count, 4)
-        self.assertFalse(mock_exit.called)
+        self.assertEqual(ctxt.emit.call_count, 2)
+        ctxt.environment.call.assert_called_once_with(
+            ['git', 'spam', 'arg1', 'arg2'], close_fds=True,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertFalse(mock_sleep.called)
+        self.assertFalse(mock_StepResult.called)
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_nopull(self, mock_init, mock_select_url,
-                             mock_set_password, mock_get_password, mock_Github,
-                             mock_getpass, mock_exit):
-        ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull=None,
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=None,
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
-        )
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.time, 'sleep')
+    def test_ghe_config(self, mock_sleep, mock_StepResult):
+        ctxt = self.make_ctxt()
+        ghe = mock.Mock(git_config=[('core.fsync', 'none'),
+                                    ('protocol.version', '2')],
+                        **{'recorder.tracer': None})
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+        result = timid_github._git(ctxt, 'spam', 'arg1', ghe=ghe)
 
-        self.assertEqual(result, None)
-        self.assertFalse(mock_get_password.called)
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        self.assertFalse(mock_Github.called)
-        self.assertFalse(mock_select_url.called)
-        self.assertEqual(len(ctxt.variables.method_calls), 0)
-        self.assertFalse(mock_init.called)
-        self.assertFalse(ctxt.emit.called)
-        self.assertFalse(mock_exit.called)
+        self.assertEqual(result, b'stdout')
+        ctxt.emit.assert_has_calls([
+            mock.call('Executing command "git -c core.fsync=none '
+                      '-c protocol.version=2 spam arg1"', debug=True),
+        ])
+        ctxt.environment.call.assert_called_once_with(
+            ['git', '-c', 'core.fsync=none', '-c', 'protocol.version=2',
+             'spam', 'arg1'], close_fds=True,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_withpass(self, mock_init, mock_select_url,
-                               mock_set_password, mock_get_password,
-                               mock_Github, mock_getpass, mock_exit):
-        ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass='from_cli',
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=None,
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.time, 'sleep')
+    def test_recorder(self, mock_sleep, mock_StepResult):
+        ctxt = self.make_ctxt(
+            self.make_child(stdout=timid_github.SSH_ERROR, returncode=1),
+            self.make_child(),
         )
+        ctxt.environment.cwd = '/work/dir'
+        ghe = mock.Mock(git_config=[], **{'recorder.tracer': None})
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+        result = timid_github._git(ctxt, 'spam', 'arg1', ssh_retries=5,
+                                   ghe=ghe)
 
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        self.assertFalse(mock_get_password.called)
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_cli', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('some/repo')
-        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
-        self.assertFalse(gh.create_from_raw_data.called)
-        mock_select_url.assert_has_calls([
-            mock.call('https://example.com/repo', pull.base.repo),
-            mock.call('https://example.com/repo', pull.head.repo),
+        self.assertEqual(result, b'stdout')
+        ghe.recorder.record.assert_has_calls([
+            mock.call('git', start=mock.ANY, duration=mock.ANY,
+                      subcommand='spam', args=['spam', 'arg1'],
+                      cwd='/work/dir', attempt=1, returncode=1,
+                      stdout_bytes=len(timid_github.SSH_ERROR),
+                      stderr_bytes=6, outcome='retry', span_id=None),
+            mock.call('sleep', start=mock.ANY, duration=mock.ANY,
+                      subcommand='spam', attempt=2),
+            mock.call('git', start=mock.ANY, duration=mock.ANY,
+                      subcommand='spam', args=['spam', 'arg1'],
+                      cwd='/work/dir', attempt=2, returncode=0,
+                      stdout_bytes=6, stderr_bytes=6, outcome='ok',
+                      span_id=None),
         ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_cli',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'success',
-                'github_success_text': 'Tests passed!',
-                'github_success_url': None,
-                'github_status_url': None,
-            }),
+        self.assertEqual(ghe.recorder.record.call_count, 3)
+
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.time, 'sleep')
+    def test_recorder_failure(self, mock_sleep, mock_StepResult):
+        ctxt = self.make_ctxt(returncode=1)
+        ctxt.environment.cwd = '/work/dir'
+        ghe = mock.Mock(git_config=[], **{'recorder.tracer': None})
+
+        timid_github._git(ctxt, 'spam', do_raise=False, ghe=ghe)
+
+        ghe.recorder.record.assert_called_once_with(
+            'git', start=mock.ANY, duration=mock.ANY, subcommand='spam',
+            args=['spam'], cwd='/work/dir', attempt=1, returncode=1,
+            stdout_bytes=6, stderr_bytes=6, outcome='error', span_id=None)
+
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.time, 'sleep')
+    def test_recorder_explicit(self, mock_sleep, mock_StepResult):
+        ctxt = self.make_ctxt()
+        ctxt.environment.cwd = '/work/dir'
+        recorder = mock.Mock(tracer=None)
+
+        timid_github._git(ctxt, 'spam', recorder=recorder)
+
+        ctxt.environment.call.assert_called_once_with(
+            ['git', 'spam'], close_fds=True,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        recorder.record.assert_called_once_with(
+            'git', start=mock.ANY, duration=mock.ANY, subcommand='spam',
+            args=['spam'], cwd='/work/dir', attempt=1, returncode=0,
+            stdout_bytes=6, stderr_bytes=6, outcome='ok', span_id=None)
+
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.time, 'sleep')
+    def test_tracer(self, mock_sleep, mock_StepResult):
+        child = self.make_child()
+        seen = []
+
+        class Environment(dict):
+            cwd = '/work/dir'
+
+            def call(self, *args, **kwargs):
+                seen.append(dict(self))
+                return child
+
+        ctxt = mock.Mock(environment=Environment(TRACEPARENT='incoming'))
+        tracer = mock.Mock(**{
+            'new_span_id.return_value': 'span',
+            'traceparent.return_value': '00-trace-span-01',
+        })
+        ghe = mock.Mock(git_config=[], **{'recorder.tracer': tracer})
+
+        timid_github._git(ctxt, 'spam', ghe=ghe)
+
+        self.assertEqual(seen, [{'TRACEPARENT': '00-trace-span-01'}])
+        self.assertEqual(ctxt.environment, {'TRACEPARENT': 'incoming'})
+        tracer.traceparent.assert_called_once_with('span')
+        self.assertEqual(ghe.recorder.record.call_args[1]['span_id'], 'span')
+
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.time, 'sleep')
+    def test_base_failure(self, mock_sleep, mock_StepResult):
+        ctxt = self.make_ctxt(returncode=1)
+
+        try:
+            result = timid_github._git(ctxt, 'spam', 'arg1', 'arg2')
+        except timid_github.GitException as e:
+            self.assertEqual(e.result, mock_StepResult.return_value)
+        else:
+            self.fail('timid_github.GitException not raised')
+        ctxt.emit.assert_has_calls([
+            mock.call('Executing command "git spam arg1 arg2"', debug=True),
+            mock.call('Command result: return code 1, stdout %r, stderr %r' %
+                      (b'stdout', b'stderr'), debug=True),
         ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, None, {
-                'status': 'success',
-                'text': 'Tests passed!',
-                'url': None,
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
+        self.assertEqual(ctxt.emit.call_count, 2)
+        ctxt.environment.call.assert_called_once_with(
+            ['git', 'spam', 'arg1', 'arg2'], close_fds=True,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertFalse(mock_sleep.called)
+        mock_StepResult.assert_called_once_with(
+            state=timid.ERROR, returncode=1,
+            msg='Git command "git spam arg1 arg2" returned 1: %s' % b'stdout')
+
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.time, 'sleep')
+    def test_base_failure_noout(self, mock_sleep, mock_StepResult):
+        ctxt = self.make_ctxt(returncode=1, stdout=b'')
+
+        try:
+            result = timid_github._git(ctxt, 'spam', 'arg1', 'arg2')
+        except timid_github.GitException as e:
+            self.assertEqual(e.result, mock_StepResult.return_value)
+        else:
+            self.fail('timid_github.GitException not raised')
         ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
+            mock.call('Executing command "git spam arg1 arg2"', debug=True),
+            mock.call('Command result: return code 1, stdout %r, stderr %r' %
+                      (b'', b'stderr'), debug=True),
         ])
-        self.assertEqual(ctxt.emit.call_count, 4)
-        self.assertFalse(mock_exit.called)
+        self.assertEqual(ctxt.emit.call_count, 2)
+        ctxt.environment.call.assert_called_once_with(
+            ['git', 'spam', 'arg1', 'arg2'], close_fds=True,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertFalse(mock_sleep.called)
+        mock_StepResult.assert_called_once_with(
+            state=timid.ERROR, returncode=1,
+            msg='Git command "git spam arg1 arg2" returned 1')
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value=None)
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_nokeyring(self, mock_init, mock_select_url,
-                                mock_set_password, mock_get_password,
-                                mock_Github, mock_getpass, mock_exit):
-        ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=None,
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
-        )
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.time, 'sleep')
+    def test_base_failure_noraise(self, mock_sleep, mock_StepResult):
+        ctxt = self.make_ctxt(returncode=1)
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+        result = timid_github._git(ctxt, 'spam', 'arg1', 'arg2',
+                                   do_raise=False)
 
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        mock_getpass.assert_called_once_with(
-            '[https://api.github.com] Password for "example"> ')
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyboard', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('some/repo')
-        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
-        self.assertFalse(gh.create_from_raw_data.called)
-        mock_select_url.assert_has_calls([
-            mock.call('https://example.com/repo', pull.base.repo),
-            mock.call('https://example.com/repo', pull.head.repo),
-        ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_keyboard',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'success',
-                'github_success_text': 'Tests passed!',
-                'github_success_url': None,
-                'github_status_url': None,
-            }),
-        ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, None, {
-                'status': 'success',
-                'text': 'Tests passed!',
-                'url': None,
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
+        self.assertEqual(result, b'stdout')
         ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
+            mock.call('Executing command "git spam arg1 arg2"', debug=True),
+            mock.call('Command result: return code 1, stdout %r, stderr %r' %
+                      (b'stdout', b'stderr'), debug=True),
         ])
-        self.assertEqual(ctxt.emit.call_count, 4)
-        self.assertFalse(mock_exit.called)
+        self.assertEqual(ctxt.emit.call_count, 2)
+        ctxt.environment.call.assert_called_once_with(
+            ['git', 'spam', 'arg1', 'arg2'], close_fds=True,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertFalse(mock_sleep.called)
+        self.assertFalse(mock_StepResult.called)
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_set_keyring(self, mock_init, mock_select_url,
-                                  mock_set_password, mock_get_password,
-                                  mock_Github, mock_getpass, mock_exit):
-        ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=True,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=None,
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.time, 'sleep')
+    def test_retries_base(self, mock_sleep, mock_StepResult):
+        ctxt = self.make_ctxt(
+            self.make_child(stdout=timid_github.SSH_ERROR, returncode=1),
+            self.make_child(stderr=timid_github.SSH_ERROR, returncode=1),
+            self.make_child(stdout=b'final success'),
         )
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+        result = timid_github._git(ctxt, 'spam', 'arg1', 'arg2',
+                                   ssh_retries=5)
 
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        self.assertFalse(mock_get_password.called)
-        mock_getpass.assert_called_once_with(
-            '[https://api.github.com] Password for "example"> ')
-        mock_set_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example', 'from_keyboard')
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyboard', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('some/repo')
-        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
-        self.assertFalse(gh.create_from_raw_data.called)
-        mock_select_url.assert_has_calls([
-            mock.call('https://example.com/repo', pull.base.repo),
-            mock.call('https://example.com/repo', pull.head.repo),
-        ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_keyboard',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'success',
-                'github_success_text': 'Tests passed!',
-                'github_success_url': None,
-                'github_status_url': None,
-            }),
-        ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, None, {
-                'status': 'success',
-                'text': 'Tests passed!',
-                'url': None,
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
+        self.assertEqual(result, b'final success')
         ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Saving password in keyring as requested'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
+            mock.call('Executing command "git spam arg1 arg2"', debug=True),
+            mock.call('Command result: return code 1, stdout %r, stderr %r' %
+                      (timid_github.SSH_ERROR, b'stderr'), debug=True),
+            mock.call('Retrying command after a sleep of 1 seconds',
+                      debug=True),
+            mock.call('Retry 2 of 5: retrying command "git spam arg1 arg2"',
+                      debug=True),
+            mock.call('Command result: return code 1, stdout %r, stderr %r' %
+                      (b'stdout', timid_github.SSH_ERROR), debug=True),
+            mock.call('Retrying command after a sleep of 2 seconds',
+                      debug=True),
+            mock.call('Retry 3 of 5: retrying command "git spam arg1 arg2"',
+                      debug=True),
+            mock.call('Command result: return code 0, stdout %r, stderr %r' %
+                      (b'final success', b'stderr'), debug=True),
         ])
-        self.assertEqual(ctxt.emit.call_count, 5)
-        self.assertFalse(mock_exit.called)
-
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_empty_pull_number(self, mock_init, mock_select_url,
-                                        mock_set_password, mock_get_password,
-                                        mock_Github, mock_getpass, mock_exit):
-        ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=None,
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
-        )
-
-        self.assertRaises(TestException,
-                          timid_github.GithubExtension.activate, ctxt, args)
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        self.assertFalse(gh.get_repo.called)
-        self.assertFalse(gh.get_repo.return_value.get_pull.called)
-        self.assertFalse(gh.create_from_raw_data.called)
-        self.assertFalse(mock_select_url.called)
-        self.assertEqual(len(ctxt.variables.method_calls), 0)
-        self.assertFalse(mock_init.called)
-        ctxt.emit.assert_called_once_with('Github plugin activated')
-        mock_exit.assert_called_once_with('Invalid pull request number ""')
+        self.assertEqual(ctxt.emit.call_count, 8)
+        ctxt.environment.call.assert_has_calls([
+            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
+                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
+            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
+                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
+            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
+                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
+        ])
+        self.assertEqual(ctxt.environment.call.call_count, 3)
+        mock_sleep.assert_has_calls([
+            mock.call(1),
+            mock.call(2),
+        ])
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertFalse(mock_StepResult.called)
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_bad_pull_number(self, mock_init, mock_select_url,
-                                      mock_set_password, mock_get_password,
-                                      mock_Github, mock_getpass, mock_exit):
-        ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#x',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=None,
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.time, 'sleep')
+    def test_retries_too_many(self, mock_sleep, mock_StepResult):
+        ctxt = self.make_ctxt(
+            self.make_child(stdout=timid_github.SSH_ERROR, returncode=1),
+            self.make_child(stderr=timid_github.SSH_ERROR, returncode=1),
+            self.make_child(stdout=b'final success'),
         )
 
-        self.assertRaises(TestException,
-                          timid_github.GithubExtension.activate, ctxt, args)
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        self.assertFalse(gh.get_repo.called)
-        self.assertFalse(gh.get_repo.return_value.get_pull.called)
-        self.assertFalse(gh.create_from_raw_data.called)
-        self.assertFalse(mock_select_url.called)
-        self.assertEqual(len(ctxt.variables.method_calls), 0)
-        self.assertFalse(mock_init.called)
-        ctxt.emit.assert_called_once_with('Github plugin activated')
-        mock_exit.assert_called_once_with('Invalid pull request number "x"')
+        try:
+            result = timid_github._git(ctxt, 'spam', 'arg1', 'arg2',
+                                       ssh_retries=2)
+        except timid_github.GitException as e:
+            self.assertEqual(e.result, mock_StepResult.return_value)
+        else:
+            self.fail('timid_github.GitException not raised')
+        ctxt.emit.assert_has_calls([
+            mock.call('Executing command "git spam arg1 arg2"', debug=True),
+            mock.call('Command result: return code 1, stdout %r, stderr %r' %
+                      (timid_github.SSH_ERROR, b'stderr'), debug=True),
+            mock.call('Retrying command after a sleep of 1 seconds',
+                      debug=True),
+            mock.call('Retry 2 of 2: retrying command "git spam arg1 arg2"',
+                      debug=True),
+            mock.call('Command result: return code 1, stdout %r, stderr %r' %
+                      (b'stdout', timid_github.SSH_ERROR), debug=True),
+            mock.call('Retrying command after a sleep of 2 seconds',
+                      debug=True),
+            mock.call('Too many tries, exiting instead', debug=True),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 7)
+        ctxt.environment.call.assert_has_calls([
+            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
+                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
+            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
+                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
+        ])
+        self.assertEqual(ctxt.environment.call.call_count, 2)
+        mock_sleep.assert_called_once_with(1)
+        mock_StepResult.assert_called_once_with(
+            state=timid.ERROR, returncode=1,
+            msg='Git command "git spam arg1 arg2" returned 1: %s' % b'stdout')
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_no_pull_object(self, mock_init, mock_select_url,
-                                     mock_set_password, mock_get_password,
-                                     mock_Github, mock_getpass, mock_exit):
-        mock_Github.return_value.get_repo.side_effect = TestException()
-        ctxt = mock.Mock()
-        args = mock.Mock(
-            github_pull='some/repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=None,
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.time, 'sleep')
+    def test_retries_exponential_sleep(self, mock_sleep, mock_StepResult):
+        ctxt = self.make_ctxt(
+            self.make_child(stdout=timid_github.SSH_ERROR, returncode=1),
+            self.make_child(stderr=timid_github.SSH_ERROR, returncode=1),
+            self.make_child(stdout=timid_github.SSH_ERROR, returncode=1),
+            self.make_child(stderr=timid_github.SSH_ERROR, returncode=1),
+            self.make_child(stdout=b'final success'),
         )
 
-        self.assertRaises(TestException,
-                          timid_github.GithubExtension.activate, ctxt, args)
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('some/repo')
-        self.assertFalse(gh.get_repo.return_value.get_pull.called)
-        self.assertFalse(gh.create_from_raw_data.called)
-        self.assertFalse(mock_select_url.called)
-        self.assertEqual(len(ctxt.variables.method_calls), 0)
-        self.assertFalse(mock_init.called)
-        ctxt.emit.assert_called_once_with('Github plugin activated')
-        mock_exit.assert_called_once_with(
-            'Unable to resolve pull request "some/repo#5"')
+        result = timid_github._git(ctxt, 'spam', 'arg1', 'arg2',
+                                   ssh_retries=5)
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_unqualified_repo(self, mock_init, mock_select_url,
-                                       mock_set_password, mock_get_password,
-                                       mock_Github, mock_getpass, mock_exit):
-        ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=None,
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
-        )
-
-        result = timid_github.GithubExtension.activate(ctxt, args)
-
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('example/repo')
-        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
-        self.assertFalse(gh.create_from_raw_data.called)
-        mock_select_url.assert_has_calls([
-            mock.call('https://example.com/repo', pull.base.repo),
-            mock.call('https://example.com/repo', pull.head.repo),
+        self.assertEqual(result, b'final success')
+        ctxt.emit.assert_has_calls([
+            mock.call('Executing command "git spam arg1 arg2"', debug=True),
+            mock.call('Command result: return code 1, stdout %r, stderr %r' %
+                      (timid_github.SSH_ERROR, b'stderr'), debug=True),
+            mock.call('Retrying command after a sleep of 1 seconds',
+                      debug=True),
+            mock.call('Retry 2 of 5: retrying command "git spam arg1 arg2"',
+                      debug=True),
+            mock.call('Command result: return code 1, stdout %r, stderr %r' %
+                      (b'stdout', timid_github.SSH_ERROR), debug=True),
+            mock.call('Retrying command after a sleep of 2 seconds',
+                      debug=True),
+            mock.call('Retry 3 of 5: retrying command "git spam arg1 arg2"',
+                      debug=True),
+            mock.call('Command result: return code 1, stdout %r, stderr %r' %
+                      (timid_github.SSH_ERROR, b'stderr'), debug=True),
+            mock.call('Retrying command after a sleep of 4 seconds',
+                      debug=True),
+            mock.call('Retry 4 of 5: retrying command "git spam arg1 arg2"',
+                      debug=True),
+            mock.call('Command result: return code 1, stdout %r, stderr %r' %
+                      (b'stdout', timid_github.SSH_ERROR), debug=True),
+            mock.call('Retrying command after a sleep of 8 seconds',
+                      debug=True),
+            mock.call('Retry 5 of 5: retrying command "git spam arg1 arg2"',
+                      debug=True),
+            mock.call('Command result: return code 0, stdout %r, stderr %r' %
+                      (b'final success', b'stderr'), debug=True),
         ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_keyring',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'success',
-                'github_success_text': 'Tests passed!',
-                'github_success_url': None,
-                'github_status_url': None,
-            }),
+        self.assertEqual(ctxt.emit.call_count, 14)
+        ctxt.environment.call.assert_has_calls([
+            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
+                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
+            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
+                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
+            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
+                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
+            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
+                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
+            mock.call(['git', 'spam', 'arg1', 'arg2'], close_fds=True,
+                      stdout=subprocess.PIPE, stderr=subprocess.PIPE),
         ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, None, {
-                'status': 'success',
-                'text': 'Tests passed!',
-                'url': None,
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
-        ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
+        self.assertEqual(ctxt.environment.call.call_count, 5)
+        mock_sleep.assert_has_calls([
+            mock.call(1),
+            mock.call(2),
+            mock.call(4),
+            mock.call(8),
         ])
-        self.assertEqual(ctxt.emit.call_count, 4)
-        self.assertFalse(mock_exit.called)
+        self.assertEqual(mock_sleep.call_count, 4)
+        self.assertFalse(mock_StepResult.called)
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_json_pull(self, mock_init, mock_select_url,
-                                mock_set_password, mock_get_password,
-                                mock_Github, mock_getpass, mock_exit):
-        ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull=json.dumps({'foo': 'bar'}),
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=None,
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
-        )
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+class TestMirror(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'repo.git')
 
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        self.assertFalse(gh.get_repo.called)
-        self.assertFalse(gh.get_repo.return_value.get_pull.called)
-        gh.create_from_raw_data.assert_called_once_with(
-            github.PullRequest.PullRequest, {'foo': 'bar'})
-        mock_select_url.assert_has_calls([
-            mock.call('https://example.com/repo', pull.base.repo),
-            mock.call('https://example.com/repo', pull.head.repo),
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_packs(self, count):
+        pack_dir = os.path.join(self.path, 'objects', 'pack')
+        os.makedirs(pack_dir)
+        for i in range(count):
+            for ext in ('pack', 'idx'):
+                open(os.path.join(pack_dir, 'pack-%d.%s' % (i, ext)),
+                     'w').close()
+
+    def test_init(self):
+        result = timid_github.Mirror(self.path, 'repo://url', 100, 5,
+                                     '/timeline')
+
+        self.assertEqual(result.path, self.path)
+        self.assertEqual(result.url, 'repo://url')
+        self.assertEqual(result.interval, 100)
+        self.assertEqual(result.max_packs, 5)
+        self.assertEqual(result.timeline, '/timeline')
+        self.assertEqual(result.lock.path, '%s.lock' % self.path)
+
+    @mock.patch.object(timid_github, '_git')
+    def test_update_create(self, mock_git):
+        ctxt = mock.Mock(**{'environment.cwd': '/work/dir'})
+        obj = timid_github.Mirror(self.path, 'repo://url')
+
+        obj.update(ctxt, 'recorder')
+
+        mock_git.assert_called_once_with(
+            ctxt, 'clone', '--mirror', '--config', 'gc.auto=0',
+            '--config', 'maintenance.auto=false', 'repo://url', self.path,
+            ssh_retries=5, recorder='recorder')
+        self.assertEqual(obj.lock.fd, None)
+
+    @mock.patch.object(timid_github, '_git')
+    def test_update_existing(self, mock_git):
+        os.makedirs(self.path)
+        cwds = []
+        ctxt = mock.Mock(**{'environment.cwd': '/work/dir'})
+        mock_git.side_effect = lambda c, *a, **k: cwds.append(
+            c.environment.cwd)
+        obj = timid_github.Mirror(self.path, 'repo://url')
+
+        obj.update(ctxt, 'recorder')
+
+        mock_git.assert_has_calls([
+            mock.call(ctxt, 'remote', 'set-url', 'origin', 'repo://url',
+                      recorder='recorder'),
+            mock.call(ctxt, 'fetch', '--prune', 'origin', ssh_retries=5,
+                      recorder='recorder'),
         ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_keyring',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'success',
-                'github_success_text': 'Tests passed!',
-                'github_success_url': None,
-                'github_status_url': None,
-            }),
+        self.assertEqual(mock_git.call_count, 2)
+        self.assertEqual(cwds, [self.path, self.path])
+        self.assertEqual(ctxt.environment.cwd, '/work/dir')
+
+    def test_pack_count(self):
+        self.make_packs(3)
+        obj = timid_github.Mirror(self.path, 'repo://url')
+
+        self.assertEqual(obj.pack_count(), 3)
+
+    def test_pack_count_missing(self):
+        obj = timid_github.Mirror(self.path, 'repo://url')
+
+        self.assertEqual(obj.pack_count(), 0)
+
+    def test_needs_maintenance_missing(self):
+        obj = timid_github.Mirror(self.path, 'repo://url')
+
+        self.assertFalse(obj.needs_maintenance())
+
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_needs_maintenance_recent(self, mock_time):
+        self.make_packs(2)
+        timid_github._write_json(
+            os.path.join(self.path, 'timid-maintenance.json'),
+            {'time': 950.0})
+        obj = timid_github.Mirror(self.path, 'repo://url', 100, 2)
+
+        self.assertFalse(obj.needs_maintenance())
+
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_needs_maintenance_interval(self, mock_time):
+        self.make_packs(2)
+        timid_github._write_json(
+            os.path.join(self.path, 'timid-maintenance.json'),
+            {'time': 900.0})
+        obj = timid_github.Mirror(self.path, 'repo://url', 100, 2)
+
+        self.assertTrue(obj.needs_maintenance())
+
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_needs_maintenance_packs(self, mock_time):
+        self.make_packs(3)
+        timid_github._write_json(
+            os.path.join(self.path, 'timid-maintenance.json'),
+            {'time': 950.0})
+        obj = timid_github.Mirror(self.path, 'repo://url', 100, 2)
+
+        self.assertTrue(obj.needs_maintenance())
+
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    @mock.patch.object(timid_github, '_git')
+    def test_maintain_base(self, mock_git, mock_time):
+        self.make_packs(2)
+        ctxt = mock.Mock(**{'environment.cwd': '/work/dir'})
+        obj = timid_github.Mirror(self.path, 'repo://url', 100, 2)
+
+        result = obj.maintain(ctxt)
+
+        self.assertTrue(result)
+        mock_git.assert_has_calls([
+            mock.call(ctxt, 'fetch', '--prune', 'origin', ssh_retries=5,
+                      recorder=None),
+            mock.call(ctxt, 'multi-pack-index', 'write', recorder=None),
+            mock.call(ctxt, 'commit-graph', 'write', '--reachable',
+                      recorder=None),
         ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, None, {
-                'status': 'success',
-                'text': 'Tests passed!',
-                'url': None,
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
-        ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
+        self.assertEqual(mock_git.call_count, 3)
+        self.assertEqual(ctxt.environment.cwd, '/work/dir')
+        self.assertEqual(timid_github._read_json(
+            os.path.join(self.path, 'timid-maintenance.json')),
+            {'time': 1000.0})
+        self.assertEqual(obj.lock.fd, None)
+
+    @mock.patch.object(timid_github, '_git')
+    def test_maintain_repack(self, mock_git):
+        self.make_packs(3)
+        ctxt = mock.Mock(**{'environment.cwd': '/work/dir'})
+        obj = timid_github.Mirror(self.path, 'repo://url', 100, 2)
+
+        result = obj.maintain(ctxt, 'recorder')
+
+        self.assertTrue(result)
+        mock_git.assert_has_calls([
+            mock.call(ctxt, 'fetch', '--prune', 'origin', ssh_retries=5,
+                      recorder='recorder'),
+            mock.call(ctxt, 'repack', '-a', '-d', '-b',
+                      recorder='recorder'),
+            mock.call(ctxt, 'multi-pack-index', 'write',
+                      recorder='recorder'),
+            mock.call(ctxt, 'commit-graph', 'write', '--reachable',
+                      recorder='recorder'),
         ])
-        self.assertEqual(ctxt.emit.call_count, 4)
-        self.assertFalse(mock_exit.called)
+        self.assertEqual(mock_git.call_count, 4)
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_alternate_change_repo(self, mock_init, mock_select_url,
-                                            mock_set_password,
-                                            mock_get_password, mock_Github,
-                                            mock_getpass, mock_exit):
-        ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='ssh',
-            github_change_repo='https',
-            github_status_url=None,
-            github_override=None,
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
-        )
+    @mock.patch.object(timid_github, '_git')
+    def test_maintain_busy(self, mock_git):
+        os.makedirs(self.path)
+        ctxt = mock.Mock(**{'environment.cwd': '/work/dir'})
+        obj = timid_github.Mirror(self.path, 'repo://url')
+        other = timid_github.FileLock(obj.lock.path)
+        other.acquire(shared=True)
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+        try:
+            result = obj.maintain(ctxt)
+        finally:
+            other.release()
 
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('some/repo')
-        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
-        self.assertFalse(gh.create_from_raw_data.called)
-        mock_select_url.assert_has_calls([
-            mock.call('ssh', pull.base.repo),
-            mock.call('https', pull.head.repo),
-        ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_keyring',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'success',
-                'github_success_text': 'Tests passed!',
-                'github_success_url': None,
-                'github_status_url': None,
-            }),
-        ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, None, {
-                'status': 'success',
-                'text': 'Tests passed!',
-                'url': None,
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
-        ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
-        ])
-        self.assertEqual(ctxt.emit.call_count, 4)
-        self.assertFalse(mock_exit.called)
+        self.assertFalse(result)
+        self.assertFalse(mock_git.called)
+        ctxt.emit.assert_called_once_with(
+            'Mirror %s is busy; skipping maintenance' % self.path)
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_override_compat(self, mock_init, mock_select_url,
-                                      mock_set_password, mock_get_password,
-                                      mock_Github, mock_getpass, mock_exit):
+    def test_spawn_maintenance(self):
         ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=json.dumps({
-                'status': 'override',
-                'text': 'some text',
-                'url': 'some url',
-                'other': 'skipped',
-            }),
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
-        )
+        obj = timid_github.Mirror(self.path, 'repo://url', 100, 2)
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+        obj.spawn_maintenance(ctxt)
 
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('some/repo')
-        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
-        self.assertFalse(gh.create_from_raw_data.called)
-        mock_select_url.assert_has_calls([
-            mock.call('https://example.com/repo', pull.base.repo),
-            mock.call('https://example.com/repo', pull.head.repo),
-        ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_keyring',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'override',
-                'github_success_text': 'some text',
-                'github_success_url': 'some url',
-                'github_status_url': None,
-            }),
-        ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, None, {
-                'status': 'override',
-                'text': 'some text',
-                'url': 'some url',
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
-        ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
-        ])
-        self.assertEqual(ctxt.emit.call_count, 4)
-        self.assertFalse(mock_exit.called)
+        ctxt.environment.call.assert_called_once_with(
+            [timid_github.sys.executable, '-c', mock.ANY,
+             '--interval', '100', '--packs', '2', self.path],
+            close_fds=True, stdin=mock.ANY, stdout=mock.ANY, stderr=mock.ANY,
+            preexec_fn=os.setsid)
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_override_compat_missing_key(self, mock_init,
-                                                  mock_select_url,
-                                                  mock_set_password,
-                                                  mock_get_password,
-                                                  mock_Github, mock_getpass,
-                                                  mock_exit):
+    def test_spawn_maintenance_timeline(self):
         ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=json.dumps({
-                'status': 'override',
-                'url': 'some url',
-                'other': 'skipped',
-            }),
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
-        )
+        obj = timid_github.Mirror(self.path, 'repo://url', 100, 2,
+                                  '/timeline')
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+        obj.spawn_maintenance(ctxt)
 
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('some/repo')
-        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
-        self.assertFalse(gh.create_from_raw_data.called)
-        mock_select_url.assert_has_calls([
-            mock.call('https://example.com/repo', pull.base.repo),
-            mock.call('https://example.com/repo', pull.head.repo),
-        ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_keyring',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'override',
-                'github_success_text': 'Tests passed!',
-                'github_success_url': 'some url',
-                'github_status_url': None,
-            }),
-        ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, None, {
-                'status': 'override',
-                'text': 'Tests passed!',
-                'url': 'some url',
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
-        ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
-        ])
-        self.assertEqual(ctxt.emit.call_count, 4)
-        self.assertFalse(mock_exit.called)
+        ctxt.environment.call.assert_called_once_with(
+            [timid_github.sys.executable, '-c', mock.ANY,
+             '--interval', '100', '--packs', '2', '--timeline', '/timeline',
+             self.path],
+            close_fds=True, stdin=mock.ANY, stdout=mock.ANY, stderr=mock.ANY,
+            preexec_fn=os.setsid)
+
+
+class TestMaintainMain(unittest.TestCase):
+    @mock.patch.object(timid_github.Mirror, 'maintain')
+    @mock.patch.object(timid_github.Mirror, 'needs_maintenance',
+                       side_effect=[True, False])
+    def test_base(self, mock_needs_maintenance, mock_maintain):
+        result = timid_github.maintain_main(
+            ['--interval', '100', '--packs', '2', '/m/one', '/m/two'])
+
+        self.assertEqual(result, 0)
+        self.assertEqual(mock_needs_maintenance.call_count, 2)
+        self.assertEqual(mock_maintain.call_count, 1)
+
+    @mock.patch.object(timid_github.Mirror, 'maintain',
+                       side_effect=timid_github.GitException('failed'))
+    @mock.patch.object(timid_github.Mirror, 'needs_maintenance',
+                       return_value=False)
+    def test_force_failure(self, mock_needs_maintenance, mock_maintain):
+        result = timid_github.maintain_main(['--force', '/m/one'])
+
+        self.assertEqual(result, 1)
+        self.assertFalse(mock_needs_maintenance.called)
+        self.assertEqual(mock_maintain.call_count, 1)
+
+    @mock.patch.object(timid_github, 'Recorder')
+    @mock.patch.object(timid_github, 'TimelineSink')
+    @mock.patch.object(timid_github.Mirror, 'maintain')
+    def test_timeline(self, mock_maintain, mock_TimelineSink,
+                      mock_Recorder):
+        result = timid_github.maintain_main(
+            ['--force', '--timeline', '/timeline', '/m/one'])
+
+        self.assertEqual(result, 0)
+        mock_TimelineSink.assert_called_once_with('/timeline')
+        mock_Recorder.assert_called_once_with(
+            [mock_TimelineSink.return_value])
+        mock_maintain.assert_called_once_with(
+            mock.ANY, mock_Recorder.return_value)
+        mock_Recorder.return_value.close.assert_called_once_with()
+
+
+class TestParseSize(unittest.TestCase):
+    def test_base(self):
+        self.assertEqual(timid_github._parse_size('1024'), 1024)
+        self.assertEqual(timid_github._parse_size('2k'), 2048)
+        self.assertEqual(timid_github._parse_size('1.5M'), 3 << 19)
+        self.assertEqual(timid_github._parse_size('10GB'), 10 << 30)
+        self.assertEqual(timid_github._parse_size('1T'), 1 << 40)
+
+    def test_invalid(self):
+        self.assertRaises(timid_github.argparse.ArgumentTypeError,
+                          timid_github._parse_size, 'lots')
+
+
+class TestDiskUsage(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_base(self):
+        os.makedirs(os.path.join(self.tmpdir, 'sub'))
+        with open(os.path.join(self.tmpdir, 'a'), 'w') as f:
+            f.write('x' * 100)
+        with open(os.path.join(self.tmpdir, 'sub', 'b'), 'w') as f:
+            f.write('x' * 50)
+        os.link(os.path.join(self.tmpdir, 'a'),
+                os.path.join(self.tmpdir, 'sub', 'c'))
+        dir_size = os.lstat(os.path.join(self.tmpdir, 'sub')).st_size
+
+        result = timid_github._disk_usage(self.tmpdir)
+
+        self.assertEqual(result, 150 + dir_size)
+
+
+class TestWorkspaceRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_entry(self, name, size, last_used, kind='workspace'):
+        path = os.path.join(self.tmpdir, name)
+        os.makedirs(path)
+        obj = timid_github.WorkspaceRegistry(self.cache_dir)
+        entries = timid_github._read_json(obj.path, {})
+        entries[path] = {
+            'kind': kind,
+            'size': size,
+            'last_used': last_used,
+            'lock': obj.lock_path(path),
+        }
+        timid_github._write_json(obj.path, entries)
+        return path
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
+    def test_init(self):
+        result = timid_github.WorkspaceRegistry(self.cache_dir, 100, 50)
+
+        self.assertEqual(result.cache_dir, self.cache_dir)
+        self.assertEqual(result.path,
+                         os.path.join(self.cache_dir, 'workspaces.json'))
+        self.assertEqual(result.budget, 100)
+        self.assertEqual(result.min_free, 50)
+        self.assertEqual(result.held, {})
+
+    def test_lock_path(self):
+        obj = timid_github.WorkspaceRegistry(self.cache_dir)
+
+        result = obj.lock_path('/work/dir/repo')
+
+        self.assertEqual(os.path.dirname(result),
+                         os.path.join(self.cache_dir, 'locks'))
+        self.assertNotEqual(result, obj.lock_path('/work/dir/other'))
+
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_acquire_release(self, mock_time):
+        obj = timid_github.WorkspaceRegistry(self.cache_dir)
+
+        obj.acquire('/work/dir/repo')
+        obj.acquire('/mirror.git', 'mirror')
+
+        self.assertEqual(sorted(obj.held), ['/mirror.git', '/work/dir/repo'])
+        self.assertEqual(timid_github._read_json(obj.path), {
+            '/work/dir/repo': {
+                'kind': 'workspace',
+                'size': 0,
+                'last_used': 1000.0,
+                'lock': obj.lock_path('/work/dir/repo'),
+            },
+            '/mirror.git': {
+                'kind': 'mirror',
+                'size': 0,
+                'last_used': 1000.0,
+                'lock': obj.lock_path('/mirror.git'),
+            },
+        })
+        other = timid_github.FileLock(obj.lock_path('/work/dir/repo'))
+        self.assertFalse(other.acquire(blocking=False))
+
+        obj.release()
+
+        self.assertEqual(obj.held, {})
+        self.assertTrue(other.acquire(blocking=False))
+        other.release()
+
+    def test_acquire_lock_file_removed(self):
+        obj = timid_github.WorkspaceRegistry(self.cache_dir)
+        real_acquire = timid_github.FileLock.acquire
+        calls = []
+
+        def fake_acquire(lock, *args, **kwargs):
+            result = real_acquire(lock, *args, **kwargs)
+            if not calls:
+                # Evicted while we waited for the lock
+                os.unlink(lock.path)
+            calls.append(lock.path)
+            return result
+
+        with mock.patch.object(timid_github.FileLock, 'acquire',
+                               autospec=True, side_effect=fake_acquire):
+            obj.acquire('/work/dir/repo')
+
+        lock_path = obj.lock_path('/work/dir/repo')
+        self.assertEqual(calls[:2], [lock_path, lock_path])
+        self.assertTrue(os.path.exists(lock_path))
+        other = timid_github.FileLock(obj.lock_path('/work/dir/repo'))
+        self.assertFalse(other.acquire(blocking=False))
+        obj.release()
+
+    @mock.patch.object(timid_github, '_disk_usage', return_value=1234)
+    def test_update_sizes(self, mock_disk_usage):
+        obj = timid_github.WorkspaceRegistry(self.cache_dir)
+        obj.acquire('/work/dir/repo')
+
+        obj.update_sizes()
+
+        self.assertEqual(
+            timid_github._read_json(obj.path)['/work/dir/repo']['size'],
+            1234)
+        mock_disk_usage.assert_called_once_with('/work/dir/repo')
+        obj.release()
+
+    def test_evict_disabled(self):
+        path = self.make_entry('old', 100, 10.0)
+        obj = timid_github.WorkspaceRegistry(self.cache_dir)
+
+        result = obj.evict(mock.Mock())
+
+        self.assertEqual(result, [])
+        self.assertTrue(os.path.isdir(path))
+
+    def test_evict_budget(self):
+        oldest = self.make_entry('oldest', 100, 10.0)
+        old = self.make_entry('old', 100, 20.0, 'mirror')
+        new = self.make_entry('new', 100, 30.0)
+        obj = timid_github.WorkspaceRegistry(self.cache_dir, budget=150)
+
+        result = obj.evict(mock.Mock())
+
+        self.assertEqual(result, [oldest, old])
+        self.assertFalse(os.path.exists(oldest))
+        self.assertFalse(os.path.exists(old))
+        self.assertFalse(os.path.exists(obj.lock_path(oldest)))
+        self.assertFalse(os.path.exists(obj.lock_path(old)))
+        self.assertTrue(os.path.isdir(new))
+        self.assertEqual(list(timid_github._read_json(obj.path)), [new])
+
+    def test_evict_skips_locked_and_held(self):
+        locked = self.make_entry('locked', 100, 10.0)
+        held = self.make_entry('held', 100, 20.0)
+        old = self.make_entry('old', 100, 30.0)
+        new = self.make_entry('new', 100, 40.0)
+        obj = timid_github.WorkspaceRegistry(self.cache_dir, budget=150)
+        other = timid_github.FileLock(obj.lock_path(locked))
+        other.acquire(shared=True)
+        obj.acquire(held)
+
+        try:
+            result = obj.evict(mock.Mock())
+        finally:
+            other.release()
+            obj.release()
+
+        self.assertEqual(result, [old, new])
+        self.assertTrue(os.path.isdir(locked))
+        self.assertTrue(os.path.isdir(held))
+
+    def test_evict_mirror_being_updated(self):
+        updating = self.make_entry('updating.git', 100, 10.0, 'mirror')
+        old = self.make_entry('old.git', 100, 20.0, 'mirror')
+        obj = timid_github.WorkspaceRegistry(self.cache_dir, budget=50)
+        fetch_lock = timid_github.Mirror(updating, None).lock
+        fetch_lock.acquire()
+
+        try:
+            result = obj.evict(mock.Mock())
+        finally:
+            fetch_lock.release()
+
+        self.assertEqual(result, [old])
+        self.assertTrue(os.path.isdir(updating))
+        old_lock = timid_github.Mirror(old, None).lock
+        self.assertTrue(old_lock.acquire(blocking=False))
+        old_lock.release()
+
+    def test_evict_forgets_missing(self):
+        gone = self.make_entry('gone', 100, 10.0)
+        shutil.rmtree(gone)
+        present = self.make_entry('present', 100, 20.0)
+        obj = timid_github.WorkspaceRegistry(self.cache_dir, budget=1000)
+
+        result = obj.evict(mock.Mock())
+
+        self.assertEqual(result, [])
+        self.assertEqual(list(timid_github._read_json(obj.path)), [present])
+
+    @mock.patch.object(timid_github.WorkspaceRegistry, '_free_space',
+                       return_value=50)
+    def test_evict_min_free(self, mock_free_space):
+        oldest = self.make_entry('oldest', 100, 10.0)
+        new = self.make_entry('new', 100, 30.0)
+        obj = timid_github.WorkspaceRegistry(self.cache_dir, min_free=120)
+
+        result = obj.evict(mock.Mock(), '/work/dir')
+
+        self.assertEqual(result, [oldest])
+        self.assertTrue(os.path.isdir(new))
+        mock_free_space.assert_called_once_with('/work/dir')
+
+
+class TestCloneAction(unittest.TestCase):
+    @mock.patch.object(timid_github.timid.Action, '__init__',
                        return_value=None)
-    def test_activate_override_compat_invalid(self, mock_init, mock_select_url,
-                                              mock_set_password,
-                                              mock_get_password, mock_Github,
-                                              mock_getpass, mock_exit):
-        ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override='invalid',
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
-        )
+    def test_init(self, mock_init):
+        result = timid_github.CloneAction('ctxt', 'ghe')
+
+        self.assertEqual(result.ghe, 'ghe')
+        mock_init.assert_called_once_with('ctxt', '__clone__', None, None)
+
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.sys, 'exc_info', return_value='exc_info')
+    @mock.patch.object(timid_github.os, 'lstat',
+                       side_effect=OSError(errno.ENOENT, 'no file'))
+    @mock.patch.object(timid_github.os, 'remove')
+    @mock.patch.object(timid_github.os.path, 'isdir', return_value=False)
+    @mock.patch.object(timid_github.shutil, 'rmtree')
+    @mock.patch.object(timid_github.stat, 'S_ISDIR', return_value=False)
+    @mock.patch.object(timid_github.CloneAction, '_clone',
+                       return_value='clone success')
+    @mock.patch.object(timid_github.CloneAction, '_update',
+                       return_value='update success')
+    def test_call_base(self, mock_update, mock_clone, mock_S_ISDIR,
+                       mock_rmtree, mock_isdir, mock_remove, mock_lstat,
+                       mock_exc_info, mock_StepResult):
+        ghe = mock.Mock(repo_name='repo', mirror=None, workspaces=None)
+        ctxt = mock.Mock(**{
+            'environment.cwd': '/work/dir',
+        })
+        obj = timid_github.CloneAction(ctxt, ghe)
+
+        result = obj(ctxt)
+
+        self.assertEqual(result, 'clone success')
+        self.assertEqual(ctxt.environment.cwd, '/work/dir')
+        mock_lstat.assert_called_once_with('/work/dir/repo')
+        self.assertFalse(mock_exc_info.called)
+        self.assertFalse(mock_StepResult.called)
+        self.assertFalse(mock_S_ISDIR.called)
+        self.assertFalse(mock_remove.called)
+        self.assertFalse(mock_isdir.called)
+        self.assertFalse(mock_rmtree.called)
+        mock_clone.assert_called_once_with('/work/dir', '/work/dir/repo', ctxt)
+        self.assertFalse(mock_update.called)
+        self.assertFalse(ctxt.emit.called)
+
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.sys, 'exc_info', return_value='exc_info')
+    @mock.patch.object(timid_github.os, 'lstat',
+                       side_effect=OSError(errno.EAGAIN, 'again'))
+    @mock.patch.object(timid_github.os, 'remove')
+    @mock.patch.object(timid_github.os.path, 'isdir', return_value=False)
+    @mock.patch.object(timid_github.shutil, 'rmtree')
+    @mock.patch.object(timid_github.stat, 'S_ISDIR', return_value=False)
+    @mock.patch.object(timid_github.CloneAction, '_clone',
+                       return_value='clone success')
+    @mock.patch.object(timid_github.CloneAction, '_update',
+                       return_value='update success')
+    def test_call_error(self, mock_update, mock_clone, mock_S_ISDIR,
+                        mock_rmtree, mock_isdir, mock_remove, mock_lstat,
+                        mock_exc_info, mock_StepResult):
+        ghe = mock.Mock(repo_name='repo', mirror=None, workspaces=None)
+        ctxt = mock.Mock(**{
+            'environment.cwd': '/work/dir',
+        })
+        obj = timid_github.CloneAction(ctxt, ghe)
+
+        result = obj(ctxt)
+
+        self.assertEqual(result, mock_StepResult.return_value)
+        self.assertEqual(ctxt.environment.cwd, '/work/dir')
+        mock_lstat.assert_called_once_with('/work/dir/repo')
+        mock_exc_info.assert_called_once_with()
+        mock_StepResult.assert_called_once_with(
+            msg='Unable to stat repo directory /work/dir/repo',
+            exc_info='exc_info')
+        self.assertFalse(mock_S_ISDIR.called)
+        self.assertFalse(mock_remove.called)
+        self.assertFalse(mock_isdir.called)
+        self.assertFalse(mock_rmtree.called)
+        self.assertFalse(mock_clone.called)
+        self.assertFalse(mock_update.called)
+        self.assertFalse(ctxt.emit.called)
+
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.sys, 'exc_info', return_value='exc_info')
+    @mock.patch.object(timid_github.os, 'lstat',
+                       return_value=mock.Mock(st_mode='mode'))
+    @mock.patch.object(timid_github.os, 'remove')
+    @mock.patch.object(timid_github.os.path, 'isdir', return_value=False)
+    @mock.patch.object(timid_github.shutil, 'rmtree')
+    @mock.patch.object(timid_github.stat, 'S_ISDIR', return_value=False)
+    @mock.patch.object(timid_github.CloneAction, '_clone',
+                       return_value='clone success')
+    @mock.patch.object(timid_github.CloneAction, '_update',
+                       return_value='update success')
+    def test_call_non_dir(self, mock_update, mock_clone, mock_S_ISDIR,
+                          mock_rmtree, mock_isdir, mock_remove, mock_lstat,
+                          mock_exc_info, mock_StepResult):
+        ghe = mock.Mock(repo_name='repo', mirror=None, workspaces=None)
+        ctxt = mock.Mock(**{
+            'environment.cwd': '/work/dir',
+        })
+        obj = timid_github.CloneAction(ctxt, ghe)
+
+        result = obj(ctxt)
+
+        self.assertEqual(result, 'clone success')
+        self.assertEqual(ctxt.environment.cwd, '/work/dir')
+        mock_lstat.assert_called_once_with('/work/dir/repo')
+        self.assertFalse(mock_exc_info.called)
+        self.assertFalse(mock_StepResult.called)
+        mock_S_ISDIR.assert_called_once_with('mode')
+        mock_remove.assert_called_once_with('/work/dir/repo')
+        self.assertFalse(mock_isdir.called)
+        self.assertFalse(mock_rmtree.called)
+        mock_clone.assert_called_once_with('/work/dir', '/work/dir/repo', ctxt)
+        self.assertFalse(mock_update.called)
+        ctxt.emit.assert_called_once_with(
+            'Deleting file shadowing repository directory /work/dir/repo',
+            level=2)
+
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.sys, 'exc_info', return_value='exc_info')
+    @mock.patch.object(timid_github.os, 'lstat',
+                       return_value=mock.Mock(st_mode='mode'))
+    @mock.patch.object(timid_github.os, 'remove')
+    @mock.patch.object(timid_github.os.path, 'isdir', return_value=True)
+    @mock.patch.object(timid_github.shutil, 'rmtree')
+    @mock.patch.object(timid_github.stat, 'S_ISDIR', return_value=True)
+    @mock.patch.object(timid_github.CloneAction, '_clone',
+                       return_value='clone success')
+    @mock.patch.object(timid_github.CloneAction, '_update',
+                       return_value='update success')
+    def test_call_git_dir(self, mock_update, mock_clone, mock_S_ISDIR,
+                          mock_rmtree, mock_isdir, mock_remove, mock_lstat,
+                          mock_exc_info, mock_StepResult):
+        ghe = mock.Mock(repo_name='repo', mirror=None, workspaces=None)
+        ctxt = mock.Mock(**{
+            'environment.cwd': '/work/dir',
+        })
+        obj = timid_github.CloneAction(ctxt, ghe)
+
+        result = obj(ctxt)
+
+        self.assertEqual(result, 'update success')
+        self.assertEqual(ctxt.environment.cwd, '/work/dir/repo')
+        mock_lstat.assert_called_once_with('/work/dir/repo')
+        self.assertFalse(mock_exc_info.called)
+        self.assertFalse(mock_StepResult.called)
+        mock_S_ISDIR.assert_called_once_with('mode')
+        self.assertFalse(mock_remove.called)
+        mock_isdir.assert_called_once_with('/work/dir/repo/.git')
+        self.assertFalse(mock_rmtree.called)
+        self.assertFalse(mock_clone.called)
+        mock_update.assert_called_once_with(ctxt)
+        self.assertFalse(ctxt.emit.called)
+        ghe.recorder.record.assert_called_once_with('workspace',
+                                                    path='update')
+
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.sys, 'exc_info', return_value='exc_info')
+    @mock.patch.object(timid_github.os, 'lstat',
+                       return_value=mock.Mock(st_mode='mode'))
+    @mock.patch.object(timid_github.os, 'remove')
+    @mock.patch.object(timid_github.os.path, 'isdir', return_value=False)
+    @mock.patch.object(timid_github.shutil, 'rmtree')
+    @mock.patch.object(timid_github.stat, 'S_ISDIR', return_value=True)
+    @mock.patch.object(timid_github.CloneAction, '_clone',
+                       return_value='clone success')
+    @mock.patch.object(timid_github.CloneAction, '_update',
+                       return_value='update success')
+    def test_call_nongit_dir(self, mock_update, mock_clone, mock_S_ISDIR,
+                             mock_rmtree, mock_isdir, mock_remove, mock_lstat,
+                             mock_exc_info, mock_StepResult):
+        ghe = mock.Mock(repo_name='repo', mirror=None, workspaces=None)
+        ctxt = mock.Mock(**{
+            'environment.cwd': '/work/dir',
+        })
+        obj = timid_github.CloneAction(ctxt, ghe)
+
+        result = obj(ctxt)
+
+        self.assertEqual(result, 'clone success')
+        self.assertEqual(ctxt.environment.cwd, '/work/dir')
+        mock_lstat.assert_called_once_with('/work/dir/repo')
+        self.assertFalse(mock_exc_info.called)
+        self.assertFalse(mock_StepResult.called)
+        mock_S_ISDIR.assert_called_once_with('mode')
+        self.assertFalse(mock_remove.called)
+        mock_isdir.assert_called_once_with('/work/dir/repo/.git')
+        mock_rmtree.assert_called_once_with('/work/dir/repo')
+        mock_clone.assert_called_once_with('/work/dir', '/work/dir/repo', ctxt)
+        self.assertFalse(mock_update.called)
+        ctxt.emit.assert_called_once_with(
+            'Deleting directory tree shadowing repository directory '
+            '/work/dir/repo', level=2)
+
+    @mock.patch.object(timid_github.timid, 'StepResult')
+    @mock.patch.object(timid_github.sys, 'exc_info', return_value='exc_info')
+    @mock.patch.object(timid_github.os, 'lstat',
+                       return_value=mock.Mock(st_mode='mode'))
+    @mock.patch.object(timid_github.os, 'remove')
+    @mock.patch.object(timid_github.os.path, 'isdir', return_value=True)
+    @mock.patch.object(timid_github.shutil, 'rmtree')
+    @mock.patch.object(timid_github.stat, 'S_ISDIR', return_value=True)
+    @mock.patch.object(timid_github.CloneAction, '_clone',
+                       return_value='clone success')
+    @mock.patch.object(timid_github.CloneAction, '_update',
+                       side_effect=TestException('bah'))
+    def test_call_git_dir_failed_update(self, mock_update, mock_clone,
+                                        mock_S_ISDIR, mock_rmtree, mock_isdir,
+                                        mock_remove, mock_lstat,
+                                        mock_exc_info, mock_StepResult):
+        ghe = mock.Mock(repo_name='repo', mirror=None, workspaces=None)
+        ctxt = mock.Mock(**{
+            'environment.cwd': '/work/dir',
+        })
+        obj = timid_github.CloneAction(ctxt, ghe)
+
+        result = obj(ctxt)
+
+        self.assertEqual(result, 'clone success')
+        self.assertEqual(ctxt.environment.cwd, '/work/dir')
+        mock_lstat.assert_called_once_with('/work/dir/repo')
+        self.assertFalse(mock_exc_info.called)
+        self.assertFalse(mock_StepResult.called)
+        mock_S_ISDIR.assert_called_once_with('mode')
+        self.assertFalse(mock_remove.called)
+        mock_isdir.assert_called_once_with('/work/dir/repo/.git')
+        mock_rmtree.assert_called_once_with('/work/dir/repo')
+        mock_clone.assert_called_once_with('/work/dir', '/work/dir/repo', ctxt)
+        mock_update.assert_called_once_with(ctxt)
+        ctxt.emit.assert_has_calls([
+            mock.call('Failed to update existing repository in directory '
+                      '/work/dir/repo; starting from scratch'),
+            mock.call('Deleting directory tree shadowing repository '
+                      'directory /work/dir/repo', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 2)
+
+    @mock.patch.object(timid_github.CloneAction, '_workspace',
+                       return_value='workspace')
+    def test_call_mirror(self, mock_workspace):
+        mirror = mock.MagicMock()
+        ghe = mock.Mock(mirror=mirror, workspaces=None)
+        ctxt = mock.Mock()
+        obj = timid_github.CloneAction(ctxt, ghe)
+
+        result = obj(ctxt)
+
+        self.assertEqual(result, 'workspace')
+        mirror.update.assert_called_once_with(ctxt, ghe.recorder)
+        mirror.lock.shared.assert_called_once_with()
+        mock_workspace.assert_called_once_with(ctxt)
+
+    @mock.patch.object(timid_github.CloneAction, '_workspace',
+                       return_value='workspace')
+    def test_call_mirror_registry(self, mock_workspace):
+        mirror = mock.MagicMock(**{
+            'path': '/mirror.git',
+            'lock.path': '/mirror.git.lock',
+        })
+        ghe = mock.Mock(mirror=mirror)
+        ctxt = mock.Mock()
+        obj = timid_github.CloneAction(ctxt, ghe)
+
+        result = obj(ctxt)
+
+        self.assertEqual(result, 'workspace')
+        ghe.workspaces.acquire.assert_called_once_with(
+            '/mirror.git', 'mirror')
+
+    @mock.patch.object(timid_github.CloneAction, '_workspace',
+                       return_value='workspace')
+    def test_call_mirror_no_profile(self, mock_workspace):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        child = mock.Mock(returncode=0, **{
+            'communicate.return_value': (b'', b''),
+        })
+        ctxt = mock.Mock(**{
+            'environment.cwd': tmpdir,
+            'environment.call.return_value': child,
+        })
+        ghe = mock.Mock(
+            mirror=timid_github.Mirror(os.path.join(tmpdir, 'mirror.git'),
+                                       'repo://url'),
+            workspaces=None,
+            git_config=timid_github.GIT_PROFILES['ephemeral'],
+            **{'recorder.tracer': None})
+        obj = timid_github.CloneAction(ctxt, ghe)
+
+        # Create the mirror, then update it
+        obj(ctxt)
+        os.makedirs(ghe.mirror.path)
+        obj(ctxt)
+
+        commands = [c[0][0] for c in ctxt.environment.call.call_args_list]
+        self.assertEqual([cmd[1] for cmd in commands],
+                         ['clone', 'remote', 'fetch'])
+        for cmd in commands:
+            self.assertNotIn('-c', cmd)
+        self.assertEqual(ghe.recorder.record.call_count, 3)
+
+    @mock.patch.object(timid_github, '_git')
+    @mock.patch.object(timid_github.CloneAction, '_workspace',
+                       return_value='workspace')
+    def test_call_mirror_shared(self, mock_workspace, mock_git):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        cache_dir = os.path.join(tmpdir, 'cache')
+        path = os.path.join(tmpdir, 'mirror.git')
+        os.makedirs(path)
+        ctxt = mock.MagicMock()
+        runs = []
+        for _idx in range(2):
+            ghe = mock.Mock(
+                mirror=timid_github.Mirror(path, 'repo://url'),
+                workspaces=timid_github.WorkspaceRegistry(
+                    cache_dir, budget=1))
+            runs.append((ghe, timid_github.CloneAction(ctxt, ghe)))
+
+        try:
+            for ghe, obj in runs:
+                # The other run's registration must not keep this one
+                # from fetching into the mirror
+                fetch_lock = timid_github.FileLock(ghe.mirror.lock.path)
+                self.assertTrue(fetch_lock.acquire(blocking=False))
+                fetch_lock.release()
+
+                self.assertEqual(obj(ctxt), 'workspace')
+        finally:
+            for ghe, _obj in runs:
+                ghe.workspaces.release()
+
+        fetches = [c for c in mock_git.call_args_list
+                   if c[0][1] == 'fetch']
+        self.assertEqual(len(fetches), 2)
+
+    @mock.patch.object(timid_github.os, 'lstat',
+                       side_effect=OSError(errno.ENOENT, 'no such file'))
+    @mock.patch.object(timid_github.CloneAction, '_clone',
+                       return_value='clone success')
+    def test_call_registry(self, mock_clone, mock_lstat):
+        ghe = mock.Mock(repo_name='repo', mirror=None)
+        ctxt = mock.Mock(**{
+            'environment.cwd': '/work/dir',
+        })
+        obj = timid_github.CloneAction(ctxt, ghe)
+
+        result = obj(ctxt)
+
+        self.assertEqual(result, 'clone success')
+        ghe.workspaces.acquire.assert_called_once_with('/work/dir/repo')
+
+    def test_origin(self):
+        ghe = mock.Mock(repo_url='repo://url', mirror=None)
+        obj = timid_github.CloneAction('ctxt', ghe)
+
+        self.assertEqual(obj._origin(), 'repo://url')
+
+    def test_origin_mirror(self):
+        ghe = mock.Mock(repo_url='repo://url', **{'mirror.path': '/mirror'})
+        obj = timid_github.CloneAction('ctxt', ghe)
+
+        self.assertEqual(obj._origin(), '/mirror')
+
+    @mock.patch.object(timid_github, '_git')
+    @mock.patch.object(timid_github.CloneAction, '_update',
+                       return_value='update success')
+    def test_clone_base(self, mock_update, mock_git):
+        ghe = mock.Mock(repo_url='repo://url', mirror=None)
+        ctxt = mock.Mock(**{
+            'environment.cwd': '/work/dir',
+        })
+        obj = timid_github.CloneAction(ctxt, ghe)
+
+        result = obj._clone('/work/dir', '/work/dir/repo', ctxt)
+
+        self.assertEqual(result, 'update success')
+        self.assertEqual(ctxt.environment.cwd, '/work/dir/repo')
+        mock_git.assert_called_once_with(
+            ctxt, 'clone', 'repo://url', '/work/dir/repo', ssh_retries=5,
+            ghe=ghe)
+        mock_update.assert_called_once_with(ctxt)
+        ghe.recorder.record.assert_called_once_with('workspace',
+                                                    path='clone')
+        ctxt.emit.assert_called_once_with(
+            'Cloning repository from repo://url into directory /work/dir/repo')
+
+    @mock.patch.object(timid_github, '_git')
+    @mock.patch.object(timid_github.CloneAction, '_update',
+                       side_effect=TestException('bah'))
+    def test_clone_error(self, mock_update, mock_git):
+        ghe = mock.Mock(repo_url='repo://url', mirror=None)
+        ctxt = mock.Mock(**{
+            'environment.cwd': '/work/dir',
+        })
+        obj = timid_github.CloneAction(ctxt, ghe)
+
+        self.assertRaises(TestException, obj._clone,
+                          '/work/dir', '/work/dir/repo', ctxt)
+        self.assertEqual(ctxt.environment.cwd, '/work/dir')
+        mock_git.assert_called_once_with(
+            ctxt, 'clone', 'repo://url', '/work/dir/repo', ssh_retries=5,
+            ghe=ghe)
+        mock_update.assert_called_once_with(ctxt)
+        ctxt.emit.assert_called_once_with(
+            'Cloning repository from repo://url into directory /work/dir/repo')
+
+    @mock.patch.object(timid_github, '_git')
+    @mock.patch.object(timid_github.timid, 'StepResult', return_value='result')
+    def test_update(self, mock_StepResult, mock_git):
+        ghe = mock.Mock(repo_url='repo://url', repo_branch='branch',
+                        mirror=None)
+        ctxt = mock.Mock()
+        obj = timid_github.CloneAction(ctxt, ghe)
+
+        result = obj._update(ctxt)
+
+        self.assertEqual(result, 'result')
+        mock_git.assert_has_calls([
+            mock.call(ctxt, 'remote', 'set-url', 'origin', 'repo://url',
+                      ghe=ghe),
+            mock.call(ctxt, 'rebase', '--abort', do_raise=False, ghe=ghe),
+            mock.call(ctxt, 'checkout', '-f', 'branch', ghe=ghe),
+            mock.call(ctxt, 'reset', '--hard', 'origin/branch', ghe=ghe),
+            mock.call(ctxt, 'clean', '-fdx', ghe=ghe),
+            mock.call(ctxt, 'fetch', 'origin', 'branch', ssh_retries=5,
+                      ghe=ghe),
+            mock.call(ctxt, 'checkout', 'branch', ghe=ghe),
+        ])
+        self.assertEqual(mock_git.call_count, 7)
+        mock_StepResult.assert_called_once_with(state=timid.SUCCESS)
+        ctxt.emit.assert_has_calls([
+            mock.call('Updating repository from upstream data'),
+            mock.call('Cleaning up repository...', level=2),
+            mock.call('Checking out most recent version of branch branch',
+                      level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 3)
+
+
+class TestMergeAction(unittest.TestCase):
+    @mock.patch.object(timid_github.timid.Action, '__init__',
+                       return_value=None)
+    def test_init(self, mock_init):
+        result = timid_github.MergeAction('ctxt', 'ghe')
+
+        self.assertEqual(result.ghe, 'ghe')
+        self.assertEqual(result.pulls, ['ghe'])
+        mock_init.assert_called_once_with('ctxt', '__merge__', None, None)
+
+    @mock.patch.object(timid_github.timid.Action, '__init__',
+                       return_value=None)
+    def test_init_pulls(self, mock_init):
+        result = timid_github.MergeAction('ctxt', 'ghe', ['ghe1', 'ghe2'])
+
+        self.assertEqual(result.ghe, 'ghe')
+        self.assertEqual(result.pulls, ['ghe1', 'ghe2'])
+
+    @mock.patch.object(timid_github, '_git')
+    @mock.patch.object(timid_github.timid, 'StepResult', return_value='result')
+    def test_call(self, mock_StepResult, mock_git):
+        ghe = mock.Mock(**{
+            'pull.user.login': 'user-login',
+            'repo_branch': 'repo-branch',
+            'change_url': 'https://change/repo',
+            'change_branch': 'change-branch',
+        })
+        ctxt = mock.Mock()
+        obj = timid_github.MergeAction(ctxt, ghe)
+
+        result = obj(ctxt)
+
+        self.assertEqual(result, 'result')
+        self.assertEqual(mock_git.call_args_list, [
+            mock.call(ctxt, 'branch', '-D', 'user-login-change-branch',
+                      do_raise=False, ghe=ghe),
+            mock.call(ctxt, 'checkout', '-b', 'user-login-change-branch',
+                      'repo-branch', ghe=ghe),
+            mock.call(ctxt, 'pull', '--no-rebase', 'https://change/repo',
+                      'change-branch', ghe=ghe),
+            mock.call(ctxt, 'checkout', 'repo-branch', ghe=ghe),
+            mock.call(ctxt, 'merge', 'user-login-change-branch', ghe=ghe),
+        ])
+        mock_StepResult.assert_called_once_with(state=timid.SUCCESS)
+        ctxt.emit.assert_has_calls([
+            mock.call('Cloning pull request from user-login branch '
+                      'change-branch into local branch '
+                      'user-login-change-branch'),
+            mock.call('Merging the change into branch repo-branch'),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 2)
+
+    @mock.patch.object(timid_github, '_git')
+    @mock.patch.object(timid_github.timid, 'StepResult', return_value='result')
+    def test_call_pulls(self, mock_StepResult, mock_git):
+        ghe = mock.Mock(repo_branch='repo-branch')
+        pulls = [
+            mock.Mock(**{
+                'pull.user.login': 'user%d' % idx,
+                'change_url': 'https://change/repo%d' % idx,
+                'change_branch': 'change-branch',
+            })
+            for idx in range(2)
+        ]
+        ctxt = mock.Mock()
+        obj = timid_github.MergeAction(ctxt, ghe, pulls)
+
+        result = obj(ctxt)
+
+        self.assertEqual(result, 'result')
+        self.assertEqual(mock_git.call_args_list, [
+            mock.call(ctxt, 'branch', '-D', 'user0-change-branch',
+                      do_raise=False, ghe=ghe),
+            mock.call(ctxt, 'checkout', '-b', 'user0-change-branch',
+                      'repo-branch', ghe=ghe),
+            mock.call(ctxt, 'pull', '--no-rebase', 'https://change/repo0',
+                      'change-branch', ghe=ghe),
+            mock.call(ctxt, 'checkout', 'repo-branch', ghe=ghe),
+            mock.call(ctxt, 'merge', 'user0-change-branch', ghe=ghe),
+            mock.call(ctxt, 'branch', '-D', 'user1-change-branch',
+                      do_raise=False, ghe=ghe),
+            mock.call(ctxt, 'checkout', '-b', 'user1-change-branch',
+                      'repo-branch', ghe=ghe),
+            mock.call(ctxt, 'pull', '--no-rebase', 'https://change/repo1',
+                      'change-branch', ghe=ghe),
+            mock.call(ctxt, 'checkout', 'repo-branch', ghe=ghe),
+            mock.call(ctxt, 'merge', 'user1-change-branch', ghe=ghe),
+        ])
+        mock_StepResult.assert_called_once_with(state=timid.SUCCESS)
+
+
+class TestSelectUrl(unittest.TestCase):
+    def test_from_repo(self):
+        repo = mock.Mock(**dict((v, '%s url' % k) for k, v in
+                                timid_github.URL_ATTR.items()))
+
+        for url in timid_github.URL_ATTR.keys():
+            result = timid_github._select_url(url, repo)
+
+            self.assertEqual(result, '%s url' % url)
+
+    def test_verbatim(self):
+        repo = mock.Mock()
+
+        result = timid_github._select_url('foo://url', repo)
+
+        self.assertEqual(result, 'foo://url')
+
+
+class TestProbeUrl(unittest.TestCase):
+    @mock.patch.object(timid_github.time, 'time', side_effect=[10.0, 12.5])
+    def test_success(self, mock_time):
+        child = mock.Mock(returncode=0, **{
+            'communicate.return_value': (b'sha\tHEAD\n', b''),
+        })
+        ctxt = mock.Mock(**{'environment.call.return_value': child})
+        children = []
+
+        result = timid_github._probe_url(ctxt, 'git://repo', children)
+
+        self.assertEqual(result, 2.5)
+        self.assertEqual(children, [child])
+        ctxt.environment.call.assert_called_once_with(
+            ['git', 'ls-remote', 'git://repo', 'HEAD'], close_fds=True,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        child.communicate.assert_called_once_with()
+
+    @mock.patch.object(timid_github.time, 'time', side_effect=[10.0, 12.5])
+    def test_success_recorded(self, mock_time):
+        child = mock.Mock(returncode=0, **{
+            'communicate.return_value': (b'sha\tHEAD\n', b''),
+        })
+        ctxt = mock.Mock(**{
+            'environment.call.return_value': child,
+            'environment.cwd': '/work/dir',
+        })
+        recorder = mock.Mock()
+
+        result = timid_github._probe_url(ctxt, 'git://repo', [], recorder)
+
+        self.assertEqual(result, 2.5)
+        recorder.record.assert_called_once_with(
+            'git', start=10.0, duration=2.5, subcommand='ls-remote',
+            args=['ls-remote', 'git://repo', 'HEAD'], cwd='/work/dir',
+            attempt=1, returncode=0, stdout_bytes=9, stderr_bytes=0,
+            outcome='ok')
+
+    @mock.patch.object(timid_github.time, 'time', side_effect=[10.0, 12.5])
+    def test_failure(self, mock_time):
+        child = mock.Mock(returncode=128, **{
+            'communicate.return_value': (b'', b'fatal: no\n'),
+        })
+        ctxt = mock.Mock(**{'environment.call.return_value': child})
+        children = []
+        recorder = mock.Mock()
+
+        result = timid_github._probe_url(ctxt, 'git://repo', children,
+                                         recorder)
+
+        self.assertEqual(result, None)
+        self.assertEqual(children, [child])
+        self.assertEqual(recorder.record.call_args[1]['outcome'], 'error')
+
+    @mock.patch.object(timid_github.time, 'time', side_effect=[10.0, 12.5])
+    def test_spawn_failure(self, mock_time):
+        ctxt = mock.Mock(**{'environment.call.side_effect': OSError()})
+        children = []
+
+        result = timid_github._probe_url(ctxt, 'git://repo', children)
+
+        self.assertEqual(result, None)
+        self.assertEqual(children, [])
+
+
+class TestAutoProtocol(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmpdir, 'protocols.json')
+        self.repo = mock.Mock(
+            ssh_url='git@github.com:org/repo.git',
+            git_url='git://github.com/org/repo.git',
+            clone_url='https://github.com/org/repo.git',
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @mock.patch.object(timid_github, '_probe_url')
+    def test_cached(self, mock_probe_url):
+        timid_github._write_json(self.cache_file, {
+            'github.com': {'protocol': 'ssh', 'time': 1000.0},
+        })
+        ctxt = mock.Mock()
+
+        with mock.patch.object(timid_github.time, 'time',
+                               return_value=1100.0):
+            result = timid_github._auto_protocol(
+                ctxt, self.repo, self.tmpdir, 3600, 10.0)
+
+        self.assertEqual(result, 'ssh')
+        self.assertFalse(mock_probe_url.called)
+
+    @mock.patch.object(timid_github, '_probe_url',
+                       side_effect=lambda c, u, ch, r:
+                       {'git@github.com:org/repo.git': 0.5,
+                        'git://github.com/org/repo.git': None,
+                        'https://github.com/org/repo.git': 0.25}[u])
+    def test_probe_expired(self, mock_probe_url):
+        timid_github._write_json(self.cache_file, {
+            'github.com': {'protocol': 'ssh', 'time': 1000.0},
+            'example.com': {'protocol': 'git', 'time': 1000.0},
+        })
+        ctxt = mock.Mock()
+
+        with mock.patch.object(timid_github.time, 'time',
+                               return_value=5000.0):
+            result = timid_github._auto_protocol(
+                ctxt, self.repo, self.tmpdir, 3600, 10.0, 'recorder')
+
+        self.assertEqual(result, 'https')
+        self.assertEqual(mock_probe_url.call_count, 3)
+        mock_probe_url.assert_any_call(
+            ctxt, 'git@github.com:org/repo.git', mock.ANY, 'recorder')
+        self.assertEqual(timid_github._read_json(self.cache_file), {
+            'github.com': {'protocol': 'https', 'time': 5000.0},
+            'example.com': {'protocol': 'git', 'time': 1000.0},
+        })
+
+    @mock.patch.object(timid_github, '_probe_url', return_value=None)
+    def test_probe_unreachable(self, mock_probe_url):
+        ctxt = mock.Mock()
+
+        result = timid_github._auto_protocol(
+            ctxt, self.repo, self.tmpdir, 3600, 10.0)
+
+        self.assertEqual(result, 'https')
+        self.assertEqual(mock_probe_url.call_count, 3)
+        self.assertFalse(os.path.exists(self.cache_file))
+        ctxt.emit.assert_any_call(
+            'No access method reachable for host github.com; using "https"')
+
+    def test_probe_kills_stragglers(self):
+        child = mock.Mock(returncode=None)
+
+        def probe(ctxt, url, children, recorder):
+            children.append(child)
+            return None
+
+        ctxt = mock.Mock()
+
+        with mock.patch.object(timid_github, '_probe_url',
+                               side_effect=probe):
+            timid_github._auto_protocol(
+                ctxt, self.repo, self.tmpdir, 3600, 10.0)
+
+        self.assertEqual(child.kill.call_count, 3)
+
+
+class TestAppToken(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmpdir, 'app-tokens.json')
+        self.key_file = os.path.join(self.tmpdir, 'app.pem')
+        with open(self.key_file, 'w') as f:
+            f.write('private key')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    @mock.patch.object(timid_github.github, 'GithubIntegration')
+    def test_cached(self, mock_GithubIntegration, mock_time):
+        timid_github._write_json(self.cache_file, {
+            '12/34@api': {'token': 'cached', 'expires': 1601},
+        })
+        ctxt = mock.Mock()
+
+        result = timid_github._app_token(
+            ctxt, self.cache_file, 12, self.key_file, 34, 'api')
+
+        self.assertEqual(result, 'cached')
+        self.assertFalse(mock_GithubIntegration.called)
+        ctxt.emit.assert_called_once_with(
+            'Using cached installation token for Github App 12', debug=True)
+
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    @mock.patch.object(timid_github.github, 'GithubIntegration', **{
+        'return_value.get_access_token.return_value.token': 'new',
+        'return_value.get_access_token.return_value.expires_at':
+        datetime.datetime(2020, 1, 1, 1, 0, 0),
+    })
+    def test_expiring(self, mock_GithubIntegration, mock_time):
+        timid_github._write_json(self.cache_file, {
+            '12/34@api': {'token': 'cached', 'expires': 1600},
+            '12/56@api': {'token': 'other', 'expires': 5000},
+        })
+        ctxt = mock.Mock()
+
+        result = timid_github._app_token(
+            ctxt, self.cache_file, 12, self.key_file, 34, 'api')
+
+        self.assertEqual(result, 'new')
+        mock_GithubIntegration.assert_called_once_with(
+            12, 'private key', base_url='api')
+        integration = mock_GithubIntegration.return_value
+        integration.get_access_token.assert_called_once_with(34)
+        ctxt.emit.assert_called_once_with(
+            'Requesting installation token for Github App 12', level=2)
+        self.assertEqual(timid_github._read_json(self.cache_file), {
+            '12/34@api': {'token': 'new', 'expires': 1577840400},
+            '12/56@api': {'token': 'other', 'expires': 5000},
+        })
+        self.assertEqual(os.stat(self.cache_file).st_mode & 0o777, 0o600)
+
+    @mock.patch.object(timid_github, '_write_json',
+                       side_effect=OSError('denied'))
+    @mock.patch.object(timid_github.github, 'GithubIntegration', **{
+        'return_value.get_access_token.return_value.token': 'new',
+        'return_value.get_access_token.return_value.expires_at':
+        datetime.datetime(2020, 1, 1, 1, 0, 0),
+    })
+    def test_write_failure(self, mock_GithubIntegration, mock_write_json):
+        ctxt = mock.Mock()
+
+        result = timid_github._app_token(
+            ctxt, self.cache_file, 12, self.key_file, 34, 'api')
+
+        self.assertEqual(result, 'new')
+        ctxt.emit.assert_has_calls([
+            mock.call('Unable to update token cache %s: denied' %
+                      self.cache_file, debug=True),
+        ])
+
+
+class TestStatusPoster(unittest.TestCase):
+    def test_init(self):
+        result = timid_github.StatusPoster('post')
+
+        self.assertEqual(result.post, 'post')
+        self.assertEqual(result.waiting, None)
+        self.assertFalse(result.busy)
+        self.assertFalse(result.stopped)
+        self.assertEqual(result.thread, None)
+
+    def test_submit(self):
+        posted = []
+        obj = timid_github.StatusPoster(
+            lambda *args: posted.append(args))
+
+        obj.submit('ctxt', 'pending', 'Step 1')
+        obj.flush()
+        obj.submit('ctxt', 'pending', 'Step 2')
+        obj.stop()
+
+        self.assertEqual(posted, [
+            ('ctxt', 'pending', 'Step 1'),
+            ('ctxt', 'pending', 'Step 2'),
+        ])
+        self.assertEqual(obj.thread, None)
+
+    def test_submit_coalesced(self):
+        posted = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def post(*args):
+            posted.append(args)
+            started.set()
+            release.wait()
+
+        obj = timid_github.StatusPoster(post)
+
+        obj.submit('Step 1')
+        started.wait()
+        obj.submit('Step 2')
+        obj.submit('Step 3')
+        release.set()
+        obj.stop()
+
+        self.assertEqual(posted, [('Step 1',), ('Step 3',)])
+
+    @mock.patch.object(timid_github.sys, 'stderr')
+    def test_submit_failure(self, mock_stderr):
+        obj = timid_github.StatusPoster(
+            mock.Mock(side_effect=TestException('oops')))
+
+        obj.submit('Step 1')
+        obj.stop()
+
+        mock_stderr.write.assert_called_once_with(
+            'Unable to post status: oops\n')
+
+    def test_stop_unstarted(self):
+        obj = timid_github.StatusPoster('post')
+
+        obj.stop()
+
+        self.assertTrue(obj.stopped)
+        self.assertEqual(obj.thread, None)
+
+
+class TestGithubExtension(unittest.TestCase):
+    @mock.patch.dict(timid_github.os.environ, clear=True)
+    @mock.patch.object(timid_github.getpass, 'getuser', return_value='user')
+    def test_prepare_noenviron(self, mock_getuser):
+        parser = mock.Mock()
+        group = parser.add_argument_group.return_value
+
+        timid_github.GithubExtension.prepare(parser)
+
+        parser.add_argument_group.assert_called_once_with(
+            'Github Integration', 'Options for integrating with Github.')
+        group.add_argument.assert_has_calls([
+            mock.call('--github-api', default='https://api.github.com',
+                      help=mock.ANY),
+            mock.call('--github-user', default='user', help=mock.ANY),
+            mock.call('--github-pass', default=None, help=mock.ANY),
+            mock.call('--github-keyring-set', default=False,
+                      action='store_true', help=mock.ANY),
+            mock.call('--github-token-pool', default=None, help=mock.ANY),
+            mock.call('--github-app-id', default=None, help=mock.ANY),
+            mock.call('--github-app-key', default=None, help=mock.ANY),
+            mock.call('--github-app-installation', type=int, default=None,
+                      help=mock.ANY),
+            mock.call('--github-pull', help=mock.ANY),
+            mock.call('--github-batch-jobs', type=int, default=1,
+                      help=mock.ANY),
+            mock.call('--github-merge-queue', action='store_true',
+                      default=False, help=mock.ANY),
+            mock.call('--github-repo', default='git', help=mock.ANY),
+            mock.call('--github-change-repo', help=mock.ANY),
+            mock.call('--github-cache-dir', default='~/.cache/timid-github',
+                      help=mock.ANY),
+            mock.call('--github-auto-ttl', default=3600, type=int,
+                      help=mock.ANY),
+            mock.call('--github-auto-timeout', default=10.0, type=float,
+                      help=mock.ANY),
+            mock.call('--github-git-profile', default='default',
+                      choices=['default', 'ephemeral'], help=mock.ANY),
+            mock.call('--github-mirror', default=False, action='store_true',
+                      help=mock.ANY),
+            mock.call('--github-maintenance-interval', default=86400,
+                      type=int, help=mock.ANY),
+            mock.call('--github-maintenance-packs', default=20, type=int,
+                      help=mock.ANY),
+            mock.call('--github-disk-budget',
+                      type=timid_github._parse_size, help=mock.ANY),
+            mock.call('--github-min-free', type=timid_github._parse_size,
+                      help=mock.ANY),
+            mock.call('--github-api-budget', type=int, help=mock.ANY),
+            mock.call('--github-api-hourly-budget', type=int,
+                      help=mock.ANY),
+            mock.call('--github-api-reserve', type=int, default=50,
+                      help=mock.ANY),
+            mock.call('--github-api-spacing', type=float, default=0.0,
+                      help=mock.ANY),
+            mock.call('--github-api-max-wait', type=int, default=300,
+                      help=mock.ANY),
+            mock.call('--github-summary-top', type=int, default=5,
+                      help=mock.ANY),
+            mock.call('--github-summary-file', help=mock.ANY),
+            mock.call('--github-summary-status', action='store_true',
+                      default=False, help=mock.ANY),
+            mock.call('--github-metrics-dir', default=None, help=mock.ANY),
+            mock.call('--github-history', help=mock.ANY),
+            mock.call('--github-trace', help=mock.ANY),
+            mock.call('--github-timeline', help=mock.ANY),
+            mock.call('--github-status-url', help=mock.ANY),
+            mock.call('--github-status-interval', type=float, default=0.0,
+                      help=mock.ANY),
+            mock.call('--github-status-async', action='store_true',
+                      default=False, help=mock.ANY),
+            mock.call('--github-queue', default=None, help=mock.ANY),
+            mock.call('--github-override', help=mock.ANY),
+            mock.call('--github-override-status',
+                      choices=['pending', 'error', 'failure'], help=mock.ANY),
+            mock.call('--github-override-text', help=mock.ANY),
+            mock.call('--github-override-url', help=mock.ANY),
+        ])
+
+    @mock.patch.dict(timid_github.os.environ, clear=True,
+                     TIMID_GITHUB_API='https://example.com/api',
+                     TIMID_GITHUB_USER='alt_user',
+                     TIMID_GITHUB_PASS='passwd',
+                     TIMID_GITHUB_CACHE='/var/cache/timid',
+                     TIMID_GITHUB_METRICS_DIR='/var/lib/metrics',
+                     TIMID_GITHUB_QUEUE='/var/cache/queue.json',
+                     TIMID_GITHUB_TOKEN_POOL='/etc/tokens',
+                     TIMID_GITHUB_APP_ID='1234',
+                     TIMID_GITHUB_APP_KEY='/etc/app.pem',
+                     TIMID_GITHUB_APP_INSTALLATION='5678')
+    @mock.patch.object(timid_github.getpass, 'getuser', return_value='user')
+    def test_prepare_withenviron(self, mock_getuser):
+        parser = mock.Mock()
+        group = parser.add_argument_group.return_value
+
+        timid_github.GithubExtension.prepare(parser)
+
+        parser.add_argument_group.assert_called_once_with(
+            'Github Integration', 'Options for integrating with Github.')
+        group.add_argument.assert_has_calls([
+            mock.call('--github-api', default='https://example.com/api',
+                      help=mock.ANY),
+            mock.call('--github-user', default='alt_user', help=mock.ANY),
+            mock.call('--github-pass', default='passwd', help=mock.ANY),
+            mock.call('--github-keyring-set', default=False,
+                      action='store_true', help=mock.ANY),
+            mock.call('--github-token-pool', default='/etc/tokens',
+                      help=mock.ANY),
+            mock.call('--github-app-id', default='1234', help=mock.ANY),
+            mock.call('--github-app-key', default='/etc/app.pem',
+                      help=mock.ANY),
+            mock.call('--github-app-installation', type=int, default='5678',
+                      help=mock.ANY),
+            mock.call('--github-pull', help=mock.ANY),
+            mock.call('--github-batch-jobs', type=int, default=1,
+                      help=mock.ANY),
+            mock.call('--github-merge-queue', action='store_true',
+                      default=False, help=mock.ANY),
+            mock.call('--github-repo', default='git', help=mock.ANY),
+            mock.call('--github-change-repo', help=mock.ANY),
+            mock.call('--github-cache-dir', default='/var/cache/timid',
+                      help=mock.ANY),
+            mock.call('--github-auto-ttl', default=3600, type=int,
+                      help=mock.ANY),
+            mock.call('--github-auto-timeout', default=10.0, type=float,
+                      help=mock.ANY),
+            mock.call('--github-git-profile', default='default',
+                      choices=['default', 'ephemeral'], help=mock.ANY),
+            mock.call('--github-mirror', default=False, action='store_true',
+                      help=mock.ANY),
+            mock.call('--github-maintenance-interval', default=86400,
+                      type=int, help=mock.ANY),
+            mock.call('--github-maintenance-packs', default=20, type=int,
+                      help=mock.ANY),
+            mock.call('--github-disk-budget',
+                      type=timid_github._parse_size, help=mock.ANY),
+            mock.call('--github-min-free', type=timid_github._parse_size,
+                      help=mock.ANY),
+            mock.call('--github-api-budget', type=int, help=mock.ANY),
+            mock.call('--github-api-hourly-budget', type=int,
+                      help=mock.ANY),
+            mock.call('--github-api-reserve', type=int, default=50,
+                      help=mock.ANY),
+            mock.call('--github-api-spacing', type=float, default=0.0,
+                      help=mock.ANY),
+            mock.call('--github-api-max-wait', type=int, default=300,
+                      help=mock.ANY),
+            mock.call('--github-summary-top', type=int, default=5,
+                      help=mock.ANY),
+            mock.call('--github-summary-file', help=mock.ANY),
+            mock.call('--github-summary-status', action='store_true',
+                      default=False, help=mock.ANY),
+            mock.call('--github-metrics-dir', default='/var/lib/metrics',
+                      help=mock.ANY),
+            mock.call('--github-history', help=mock.ANY),
+            mock.call('--github-trace', help=mock.ANY),
+            mock.call('--github-timeline', help=mock.ANY),
+            mock.call('--github-status-url', help=mock.ANY),
+            mock.call('--github-status-interval', type=float, default=0.0,
+                      help=mock.ANY),
+            mock.call('--github-status-async', action='store_true',
+                      default=False, help=mock.ANY),
+            mock.call('--github-queue', default='/var/cache/queue.json',
+                      help=mock.ANY),
+            mock.call('--github-override', help=mock.ANY),
+            mock.call('--github-override-status',
+                      choices=['pending', 'error', 'failure'], help=mock.ANY),
+            mock.call('--github-override-text', help=mock.ANY),
+            mock.call('--github-override-url', help=mock.ANY),
+        ])
+
+    def make_args(self, **kwargs):
+        defaults = {
+            'github_cache_dir': '~/cache',
+            'github_auto_ttl': 3600,
+            'github_auto_timeout': 10.0,
+            'github_git_profile': 'default',
+            'github_mirror': False,
+            'github_maintenance_interval': 86400,
+            'github_maintenance_packs': 20,
+            'github_disk_budget': None,
+            'github_min_free': None,
+            'github_api_budget': None,
+            'github_api_hourly_budget': None,
+            'github_api_reserve': 50,
+            'github_api_spacing': 0.0,
+            'github_status_interval': 5.0,
+            'github_status_async': False,
+            'github_queue': None,
+            'github_batch_jobs': 1,
+            'github_merge_queue': False,
+            'check': False,
+            'github_token_pool': None,
+            'github_app_id': None,
+            'github_app_key': None,
+            'github_app_installation': None,
+            'github_api_max_wait': 300,
+            'github_summary_top': 5,
+            'github_summary_file': None,
+            'github_summary_status': False,
+            'github_metrics_dir': None,
+            'github_history': None,
+            'github_trace': None,
+            'github_timeline': None,
+        }
+        defaults.update(kwargs)
+        return mock.Mock(**defaults)
+
+    def make_pull(self, mock_Github, number=1, repo_name='repo',
+                  full_name='some/repo',
+                  repo_url='repo-url', repo_branch='branch',
+                  change_url='change-repo-url', change_branch='change-branch'):
+        # Create the pull object
+        last_commit = mock.Mock()
+        pull = mock.Mock(**{
+            'base.repo.full_name': 'some/repo',
+            'base.repo.name': repo_name,
+            'base.repo.url': repo_url,
+            'base.ref': repo_branch,
+            'head.repo.url': change_url,
+            'head.ref': change_branch,
+            'number': 5,
+            'head.sha': 'head-sha',
+            '_last_commit': last_commit,
+            'base.repo.get_commit.return_value': last_commit,
+        })
+
+        # Attach it to the right places
+        obj = mock_Github.return_value
+        obj.get_repo.return_value.get_pull.return_value = pull
+        obj.create_from_raw_data.return_value = pull
+
+        return pull
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_base(self, mock_init, mock_select_url, mock_set_password,
+                           mock_get_password, mock_Github, mock_getpass,
+                           mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_select_url.assert_has_calls([
+            mock.call('https://example.com/repo', pull.base.repo),
+            mock.call('https://example.com/repo', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyring',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'success',
+                'github_success_text': 'Tests passed!',
+                'github_success_url': None,
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': None,
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_auto_protocol', return_value='ssh')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_auto_repo(self, mock_init, mock_select_url,
+                                mock_auto_protocol, mock_set_password,
+                                mock_get_password, mock_Github, mock_getpass,
+                                mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='auto',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        cache_dir = os.path.expanduser('~/cache')
+        mock_auto_protocol.assert_has_calls([
+            mock.call(ctxt, pull.base.repo, cache_dir, 3600, 10.0,
+                      mock.ANY),
+            mock.call(ctxt, pull.head.repo, cache_dir, 3600, 10.0,
+                      mock.ANY),
+        ])
+        self.assertEqual(mock_auto_protocol.call_count, 2)
+        mock_select_url.assert_has_calls([
+            mock.call('ssh', pull.base.repo),
+            mock.call('ssh', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyring',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'success',
+                'github_success_text': 'Tests passed!',
+                'github_success_url': None,
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': None,
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, 'ApiBudget')
+    @mock.patch.object(timid_github, 'TraceSink')
+    @mock.patch.object(timid_github, 'MetricsSink')
+    @mock.patch.object(timid_github, 'RunHistory')
+    @mock.patch.object(timid_github, 'RunSummary')
+    @mock.patch.object(timid_github, 'Recorder')
+    @mock.patch.object(timid_github, 'TimelineSink')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_perf(self, mock_init, mock_select_url,
+                           mock_TimelineSink, mock_Recorder, mock_RunSummary,
+                           mock_RunHistory, mock_MetricsSink,
+                           mock_TraceSink, mock_ApiBudget,
+                           mock_set_password, mock_get_password,
+                           mock_Github, mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+            github_timeline='/tmp/timeline.jsonl',
+            github_history='/tmp/history.db',
+            github_metrics_dir='/tmp/metrics',
+            github_trace='/tmp/trace.jsonl',
+            github_api_budget=100,
+            github_api_hourly_budget=1000,
+        )
+        recorder = mock_Recorder.return_value
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_RunSummary.assert_called_once_with(5, None, False)
+        mock_TraceSink.assert_called_once_with(
+            '/tmp/trace.jsonl', ctxt.environment.get.return_value)
+        ctxt.environment.get.assert_called_once_with('TRACEPARENT')
+        tracer = mock_TraceSink.return_value
+        tracer.attributes.update.assert_called_once_with({
+            'github.pull': 'some/repo#5',
+            'github.repo': 'some/repo',
+            'github.base_branch': 'branch',
+            'github.commit_sha': pull._last_commit.sha,
+        })
+        mock_ApiBudget.assert_called_once_with(
+            100, 1000, 50,
+            os.path.join(os.path.expanduser('~/cache'), 'api-usage.json'),
+            'example@https://api.github.com')
+        mock_Recorder.assert_called_once_with(
+            [mock_RunSummary.return_value, mock_ApiBudget.return_value],
+            mock_TraceSink.return_value)
+        mock_TimelineSink.assert_called_once_with('/tmp/timeline.jsonl')
+        recorder.add_sink.assert_has_calls([
+            mock.call(mock_TimelineSink.return_value),
+            mock.call(mock_MetricsSink.return_value),
+        ])
+        self.assertEqual(recorder.add_sink.call_count, 2)
+        mock_MetricsSink.assert_called_once_with('/tmp/metrics')
+        mock_RunHistory.assert_called_once_with('/tmp/history.db')
+        recorder.observe_http.assert_called_once_with()
+        recorder.record.assert_has_calls([
+            mock.call('api', start=mock.ANY, duration=mock.ANY,
+                      name='get_user', outcome='ok'),
+            mock.call('api', start=mock.ANY, duration=mock.ANY,
+                      name='get_user.login', outcome='ok'),
+            mock.call('api', start=mock.ANY, duration=mock.ANY,
+                      name='get_repo', outcome='ok'),
+            mock.call('api', start=mock.ANY, duration=mock.ANY,
+                      name='get_pull', outcome='ok'),
+            mock.call('api', start=mock.ANY, duration=mock.ANY,
+                      name='get_commit', outcome='ok'),
+        ])
+        self.assertEqual(recorder.record.call_count, 5)
+        mock_init.assert_called_once_with(
+            mock_Github.return_value, pull, pull._last_commit, None, {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': None,
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=recorder,
+            summary=mock_RunSummary.return_value,
+            history=mock_RunHistory.return_value,
+            budget=mock_ApiBudget.return_value, scheduler=mock.ANY,
+            pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, 'Mirror')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_mirror(self, mock_init, mock_select_url, mock_Mirror,
+                             mock_set_password, mock_get_password,
+                             mock_Github, mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        pull.base.repo.clone_url = 'https://github.com/some/repo.git'
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_mirror=True,
+            github_maintenance_interval=100,
+            github_maintenance_packs=5,
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_Mirror.assert_called_once_with(
+            os.path.join(os.path.expanduser('~/cache'), 'mirrors',
+                         'github.com', 'some/repo.git'),
+            'repo-url', 100, 5, None)
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyring',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'success',
+                'github_success_text': 'Tests passed!',
+                'github_success_url': None,
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': None,
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[],
+            mirror=mock_Mirror.return_value, workspaces=None,
+            recorder=mock.ANY, summary=mock.ANY,
+            history=None, budget=mock.ANY,
+            scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+            mock.call('Using mirror %s' % mock_Mirror.return_value.path,
+                      level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 5)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_nopull(self, mock_init, mock_select_url,
+                             mock_set_password, mock_get_password, mock_Github,
+                             mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull=None,
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertEqual(result, None)
+        self.assertFalse(mock_get_password.called)
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        self.assertFalse(mock_Github.called)
+        self.assertFalse(mock_select_url.called)
+        self.assertEqual(len(ctxt.variables.method_calls), 0)
+        self.assertFalse(mock_init.called)
+        self.assertFalse(ctxt.emit.called)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_withpass(self, mock_init, mock_select_url,
+                               mock_set_password, mock_get_password,
+                               mock_Github, mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass='from_cli',
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        self.assertFalse(mock_get_password.called)
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_cli', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_select_url.assert_has_calls([
+            mock.call('https://example.com/repo', pull.base.repo),
+            mock.call('https://example.com/repo', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_cli',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'success',
+                'github_success_text': 'Tests passed!',
+                'github_success_url': None,
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': None,
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass')
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github.keyring, 'get_password')
+    @mock.patch.object(timid_github, '_app_token', return_value='token')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_app(self, mock_init, mock_select_url, mock_app_token,
+                          mock_get_password, mock_Github, mock_getpass,
+                          mock_exit):
+        ctxt = mock.Mock()
+        self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_app_id='12',
+            github_app_key='~/app.pem',
+            github_app_installation=34,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_app_token.assert_called_once_with(
+            ctxt,
+            os.path.join(os.path.expanduser('~/cache'), 'app-tokens.json'),
+            '12', os.path.expanduser('~/app.pem'), 34,
+            'https://api.github.com')
+        self.assertFalse(mock_get_password.called)
+        self.assertFalse(mock_getpass.called)
+        mock_Github.assert_called_once_with(
+            'token', None, base_url='https://api.github.com')
+        variables = ctxt.variables.update.call_args[0][0]
+        self.assertEqual(variables['github_api_username'], 'x-access-token')
+        self.assertEqual(variables['github_api_password'], 'token')
+        self.assertEqual(mock_init.call_args[1]['scheduler'].key,
+                         'app-12-34@https://api.github.com')
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github, '_app_token')
+    def test_activate_app_with_pool(self, mock_app_token, mock_Github,
+                                    mock_exit):
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_app_id='12',
+            github_app_key='/app.pem',
+            github_app_installation=34,
+            github_token_pool='/tokens',
+        )
+
+        self.assertRaises(TestException, timid_github.GithubExtension.activate,
+                          mock.Mock(), args)
+        mock_exit.assert_called_once_with(
+            'A Github App and a token pool may not both be used')
+        self.assertFalse(mock_app_token.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github, '_app_token')
+    def test_activate_app_incomplete(self, mock_app_token, mock_Github,
+                                     mock_exit):
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_app_id='12',
+            github_app_key='/app.pem',
+        )
+
+        self.assertRaises(TestException, timid_github.GithubExtension.activate,
+                          mock.Mock(), args)
+        mock_exit.assert_called_once_with(
+            'A Github App requires a private key and an installation ID')
+        self.assertFalse(mock_app_token.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github, '_app_token',
+                       side_effect=IOError('no such file'))
+    def test_activate_app_failure(self, mock_app_token, mock_Github,
+                                  mock_exit):
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_app_id='12',
+            github_app_key='/app.pem',
+            github_app_installation=34,
+        )
+
+        self.assertRaises(TestException, timid_github.GithubExtension.activate,
+                          mock.Mock(), args)
+        mock_exit.assert_called_once_with(
+            'Unable to obtain a token for Github App 12: no such file')
+        self.assertFalse(mock_Github.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass')
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github.keyring, 'get_password')
+    @mock.patch.object(timid_github, '_read_tokens',
+                       return_value=['token1', 'token2'])
+    @mock.patch.object(timid_github, 'TokenPool', **{
+        'return_value.select.return_value': 'token2',
+        'return_value.fingerprint.return_value': 'fp2',
+    })
+    @mock.patch.object(timid_github, 'ApiBudget')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_token_pool(self, mock_init, mock_select_url,
+                                 mock_ApiBudget, mock_TokenPool,
+                                 mock_read_tokens,
+                                 mock_get_password, mock_Github,
+                                 mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_token_pool='~/tokens',
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+        pool = mock_TokenPool.return_value
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_read_tokens.assert_called_once_with(
+            os.path.expanduser('~/tokens'))
+        mock_TokenPool.assert_called_once_with(
+            ['token1', 'token2'],
+            os.path.join(os.path.expanduser('~/cache'), 'token-pool.json'))
+        pool.select.assert_called_once_with()
+        self.assertFalse(mock_get_password.called)
+        self.assertFalse(mock_getpass.called)
+        mock_Github.assert_called_once_with(
+            'token2', None, base_url='https://api.github.com')
+        mock_ApiBudget.assert_called_once_with(
+            None, None, 50, None, 'token-fp2@https://api.github.com')
+        ctxt.emit.assert_has_calls([
+            mock.call('Using token fp2 from the pool', level=2),
+        ])
+        self.assertEqual(
+            ctxt.variables.update.call_args[0][0]['github_api_password'],
+            'token2')
+        mock_init.assert_called_once_with(
+            mock_Github.return_value, pull, pull._last_commit, None,
+            mock.ANY, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY, summary=mock.ANY,
+            history=None, budget=mock_ApiBudget.return_value,
+            scheduler=mock.ANY, pool=pool,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        self.assertEqual(mock_init.call_args[1]['scheduler'].key,
+                         'token-fp2@https://api.github.com')
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_queue(self, mock_init, mock_select_url,
+                            mock_get_password, mock_Github, mock_exit):
+        self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+            github_queue='/var/cache/queue.json',
+        )
+
+        timid_github.GithubExtension.activate(mock.Mock(), args)
+
+        queue = mock_init.call_args[1]['queue']
+        self.assertTrue(isinstance(queue, timid_github.RunQueue))
+        self.assertEqual(queue.path, '/var/cache/queue.json')
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    @mock.patch.object(timid_github, '_github_passwords', {})
+    @mock.patch.object(timid_github, '_github_clients', {})
+    def test_activate_client_reused(self, mock_init, mock_select_url,
+                                    mock_get_password, mock_Github,
+                                    mock_exit):
+        self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        timid_github.GithubExtension.activate(mock.Mock(), args)
+        timid_github.GithubExtension.activate(mock.Mock(), args)
+
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertEqual(timid_github._github_clients, {
+            'example@https://api.github.com': (
+                mock_Github.return_value,
+                timid_github.TokenPool.fingerprint('from_keyring')),
+        })
+        self.assertEqual(timid_github._github_passwords, {
+            ('https://api.github.com', 'example'): 'from_keyring',
+        })
+        self.assertEqual(mock_Github.return_value.get_repo.call_count, 2)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github, '_app_token',
+                       side_effect=['token1', 'token1', 'token2'])
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    @mock.patch.object(timid_github, '_github_clients', {})
+    def test_activate_client_token_renewed(self, mock_init, mock_select_url,
+                                           mock_app_token, mock_Github,
+                                           mock_exit):
+        self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user=None,
+            github_pass=None,
+            github_keyring_set=False,
+            github_app_id=12,
+            github_app_key='/app.pem',
+            github_app_installation=34,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        for _idx in range(3):
+            timid_github.GithubExtension.activate(mock.Mock(), args)
+
+        self.assertEqual(mock_Github.call_args_list, [
+            mock.call('token1', None, base_url='https://api.github.com'),
+            mock.call('token2', None, base_url='https://api.github.com'),
+        ])
+        self.assertEqual(list(timid_github._github_clients),
+                         ['app-12-34@https://api.github.com'])
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_batch(self, mock_init, mock_select_url,
+                            mock_get_password, mock_Github, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5, some/repo#6',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+            github_batch_jobs=4,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.BatchExtension))
+        self.assertEqual(result.jobs, 4)
+        self.assertFalse(result.check)
+        self.assertEqual(len(result.pulls), 2)
+        for ext, variables in result.pulls:
+            self.assertTrue(isinstance(ext, timid_github.GithubExtension))
+            self.assertEqual(variables['github_pull'], 'some/repo#5')
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        self.assertEqual(gh.get_repo.call_args_list, [
+            mock.call('some/repo'),
+            mock.call('some/repo'),
+        ])
+        self.assertEqual(gh.get_repo.return_value.get_pull.call_args_list,
+                         [mock.call(5), mock.call(6)])
+        self.assertEqual(mock_init.call_count, 2)
+        self.assertEqual(mock_init.call_args_list[0][1]['recorder'],
+                         mock_init.call_args_list[1][1]['recorder'])
+        self.assertEqual(mock_init.call_args_list[0][1]['scheduler'],
+                         mock_init.call_args_list[1][1]['scheduler'])
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 1)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    def test_activate_merge_queue(self, mock_select_url, mock_get_password,
+                                  mock_Github, mock_exit):
+        self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5, some/repo#6',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+            github_batch_jobs=4,
+            github_merge_queue=True,
+            check=True,
+        )
+
+        result = timid_github.GithubExtension.activate(mock.Mock(), args)
+
+        self.assertTrue(isinstance(result,
+                                   timid_github.MergeQueueExtension))
+        self.assertEqual(len(result.pulls), 2)
+        self.assertEqual(result.jobs, 1)
+        self.assertTrue(result.check)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    def test_activate_merge_queue_bases(self, mock_select_url,
+                                        mock_get_password, mock_Github,
+                                        mock_exit):
+        pulls = [self.make_pull(mock_Github),
+                 self.make_pull(mock_Github, repo_branch='other')]
+        gh = mock_Github.return_value
+        gh.get_repo.return_value.get_pull.side_effect = pulls
+        args = self.make_args(
+            github_pull='some/repo#5, some/repo#6',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+            github_merge_queue=True,
+        )
+
+        self.assertRaises(TestException, timid_github.GithubExtension.activate,
+                          mock.Mock(), args)
+        mock_exit.assert_called_once_with(
+            'Pull requests in a merge queue must share a base repository '
+            'and branch')
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github, '_pull_specs',
+                       side_effect=IOError('no such file'))
+    def test_activate_pull_file_unreadable(self, mock_pull_specs,
+                                           mock_Github, mock_exit):
+        ctxt = mock.Mock()
+        args = self.make_args(github_pull='@/pulls')
+
+        self.assertRaises(TestException, timid_github.GithubExtension.activate,
+                          ctxt, args)
+        mock_exit.assert_called_once_with(
+            'Unable to read pull requests from /pulls: no such file')
+        self.assertFalse(mock_Github.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github, '_pull_specs', return_value=[])
+    def test_activate_pull_file_empty(self, mock_pull_specs, mock_Github,
+                                      mock_exit):
+        ctxt = mock.Mock()
+        args = self.make_args(github_pull='@/pulls')
+
+        self.assertRaises(TestException, timid_github.GithubExtension.activate,
+                          ctxt, args)
+        mock_exit.assert_called_once_with(
+            'No pull requests found in "@/pulls"')
+        self.assertFalse(mock_Github.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github, '_read_tokens',
+                       side_effect=IOError('no such file'))
+    def test_activate_token_pool_unreadable(self, mock_read_tokens,
+                                            mock_Github, mock_exit):
+        ctxt = mock.Mock()
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_token_pool='/tokens',
+        )
+
+        self.assertRaises(TestException, timid_github.GithubExtension.activate,
+                          ctxt, args)
+        mock_exit.assert_called_once_with(
+            'Unable to read tokens from /tokens: no such file')
+        self.assertFalse(mock_Github.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.github, 'Github')
+    @mock.patch.object(timid_github, '_read_tokens', return_value=[])
+    def test_activate_token_pool_empty(self, mock_read_tokens,
+                                       mock_Github, mock_exit):
+        ctxt = mock.Mock()
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_token_pool='/tokens',
+        )
+
+        self.assertRaises(TestException, timid_github.GithubExtension.activate,
+                          ctxt, args)
+        mock_exit.assert_called_once_with('No tokens found in /tokens')
+        self.assertFalse(mock_Github.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value=None)
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_nokeyring(self, mock_init, mock_select_url,
+                                mock_set_password, mock_get_password,
+                                mock_Github, mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        mock_getpass.assert_called_once_with(
+            '[https://api.github.com] Password for "example"> ')
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyboard', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_select_url.assert_has_calls([
+            mock.call('https://example.com/repo', pull.base.repo),
+            mock.call('https://example.com/repo', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyboard',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'success',
+                'github_success_text': 'Tests passed!',
+                'github_success_url': None,
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': None,
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_set_keyring(self, mock_init, mock_select_url,
+                                  mock_set_password, mock_get_password,
+                                  mock_Github, mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=True,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        self.assertFalse(mock_get_password.called)
+        mock_getpass.assert_called_once_with(
+            '[https://api.github.com] Password for "example"> ')
+        mock_set_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example', 'from_keyboard')
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyboard', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_select_url.assert_has_calls([
+            mock.call('https://example.com/repo', pull.base.repo),
+            mock.call('https://example.com/repo', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyboard',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'success',
+                'github_success_text': 'Tests passed!',
+                'github_success_url': None,
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': None,
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Saving password in keyring as requested'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 5)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_empty_pull_number(self, mock_init, mock_select_url,
+                                        mock_set_password, mock_get_password,
+                                        mock_Github, mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        self.assertRaises(TestException,
+                          timid_github.GithubExtension.activate, ctxt, args)
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        self.assertFalse(gh.get_repo.called)
+        self.assertFalse(gh.get_repo.return_value.get_pull.called)
+        self.assertFalse(gh.create_from_raw_data.called)
+        self.assertFalse(mock_select_url.called)
+        self.assertEqual(len(ctxt.variables.method_calls), 0)
+        self.assertFalse(mock_init.called)
+        ctxt.emit.assert_called_once_with('Github plugin activated')
+        mock_exit.assert_called_once_with('Invalid pull request number ""')
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_bad_pull_number(self, mock_init, mock_select_url,
+                                      mock_set_password, mock_get_password,
+                                      mock_Github, mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#x',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        self.assertRaises(TestException,
+                          timid_github.GithubExtension.activate, ctxt, args)
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        self.assertFalse(gh.get_repo.called)
+        self.assertFalse(gh.get_repo.return_value.get_pull.called)
+        self.assertFalse(gh.create_from_raw_data.called)
+        self.assertFalse(mock_select_url.called)
+        self.assertEqual(len(ctxt.variables.method_calls), 0)
+        self.assertFalse(mock_init.called)
+        ctxt.emit.assert_called_once_with('Github plugin activated')
+        mock_exit.assert_called_once_with('Invalid pull request number "x"')
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_no_pull_object(self, mock_init, mock_select_url,
+                                     mock_set_password, mock_get_password,
+                                     mock_Github, mock_getpass, mock_exit):
+        mock_Github.return_value.get_repo.side_effect = TestException()
+        ctxt = mock.Mock()
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        self.assertRaises(TestException,
+                          timid_github.GithubExtension.activate, ctxt, args)
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        self.assertFalse(gh.get_repo.return_value.get_pull.called)
+        self.assertFalse(gh.create_from_raw_data.called)
+        self.assertFalse(mock_select_url.called)
+        self.assertEqual(len(ctxt.variables.method_calls), 0)
+        self.assertFalse(mock_init.called)
+        ctxt.emit.assert_called_once_with('Github plugin activated')
+        mock_exit.assert_called_once_with(
+            'Unable to resolve pull request "some/repo#5"')
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_unqualified_repo(self, mock_init, mock_select_url,
+                                       mock_set_password, mock_get_password,
+                                       mock_Github, mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('example/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_select_url.assert_has_calls([
+            mock.call('https://example.com/repo', pull.base.repo),
+            mock.call('https://example.com/repo', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyring',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'success',
+                'github_success_text': 'Tests passed!',
+                'github_success_url': None,
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': None,
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_json_pull(self, mock_init, mock_select_url,
+                                mock_set_password, mock_get_password,
+                                mock_Github, mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull=json.dumps({'foo': 'bar'}),
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        self.assertFalse(gh.get_repo.called)
+        self.assertFalse(gh.get_repo.return_value.get_pull.called)
+        gh.create_from_raw_data.assert_called_once_with(
+            github.PullRequest.PullRequest, {'foo': 'bar'})
+        mock_select_url.assert_has_calls([
+            mock.call('https://example.com/repo', pull.base.repo),
+            mock.call('https://example.com/repo', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyring',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'success',
+                'github_success_text': 'Tests passed!',
+                'github_success_url': None,
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': None,
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_alternate_change_repo(self, mock_init, mock_select_url,
+                                            mock_set_password,
+                                            mock_get_password, mock_Github,
+                                            mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='ssh',
+            github_change_repo='https',
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_select_url.assert_has_calls([
+            mock.call('ssh', pull.base.repo),
+            mock.call('https', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyring',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'success',
+                'github_success_text': 'Tests passed!',
+                'github_success_url': None,
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': None,
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_override_compat(self, mock_init, mock_select_url,
+                                      mock_set_password, mock_get_password,
+                                      mock_Github, mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=json.dumps({
+                'status': 'override',
+                'text': 'some text',
+                'url': 'some url',
+                'other': 'skipped',
+            }),
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_select_url.assert_has_calls([
+            mock.call('https://example.com/repo', pull.base.repo),
+            mock.call('https://example.com/repo', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyring',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'override',
+                'github_success_text': 'some text',
+                'github_success_url': 'some url',
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'override',
+                'text': 'some text',
+                'url': 'some url',
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_override_compat_missing_key(self, mock_init,
+                                                  mock_select_url,
+                                                  mock_set_password,
+                                                  mock_get_password,
+                                                  mock_Github, mock_getpass,
+                                                  mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=json.dumps({
+                'status': 'override',
+                'url': 'some url',
+                'other': 'skipped',
+            }),
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_select_url.assert_has_calls([
+            mock.call('https://example.com/repo', pull.base.repo),
+            mock.call('https://example.com/repo', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyring',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'override',
+                'github_success_text': 'Tests passed!',
+                'github_success_url': 'some url',
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'override',
+                'text': 'Tests passed!',
+                'url': 'some url',
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_override_compat_invalid(self, mock_init, mock_select_url,
+                                              mock_set_password,
+                                              mock_get_password, mock_Github,
+                                              mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override='invalid',
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_select_url.assert_has_calls([
+            mock.call('https://example.com/repo', pull.base.repo),
+            mock.call('https://example.com/repo', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyring',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'success',
+                'github_success_text': 'Tests passed!',
+                'github_success_url': None,
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': None,
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_override_status(self, mock_init, mock_select_url,
+                                      mock_set_password, mock_get_password,
+                                      mock_Github, mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status='status',
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_select_url.assert_has_calls([
+            mock.call('https://example.com/repo', pull.base.repo),
+            mock.call('https://example.com/repo', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyring',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'status',
+                'github_success_text': 'Tests passed!',
+                'github_success_url': None,
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'status',
+                'text': 'Tests passed!',
+                'url': None,
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_override_text(self, mock_init, mock_select_url,
+                                    mock_set_password, mock_get_password,
+                                    mock_Github, mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text='text',
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_select_url.assert_has_calls([
+            mock.call('https://example.com/repo', pull.base.repo),
+            mock.call('https://example.com/repo', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyring',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'success',
+                'github_success_text': 'text',
+                'github_success_url': None,
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'success',
+                'text': 'text',
+                'url': None,
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_override_url(self, mock_init, mock_select_url,
+                                   mock_set_password, mock_get_password,
+                                   mock_Github, mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url='url',
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_select_url.assert_has_calls([
+            mock.call('https://example.com/repo', pull.base.repo),
+            mock.call('https://example.com/repo', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyring',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'success',
+                'github_success_text': 'Tests passed!',
+                'github_success_url': 'url',
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': 'url',
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_override_compat_precedence(self, mock_init,
+                                                 mock_select_url,
+                                                 mock_set_password,
+                                                 mock_get_password,
+                                                 mock_Github, mock_getpass,
+                                                 mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url=None,
+            github_override=json.dumps({
+                'status': 'override',
+                'text': 'some text',
+                'url': 'some url',
+                'other': 'skipped',
+            }),
+            github_override_status='status',
+            github_override_text='text',
+            github_override_url='url',
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_select_url.assert_has_calls([
+            mock.call('https://example.com/repo', pull.base.repo),
+            mock.call('https://example.com/repo', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyring',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'status',
+                'github_success_text': 'text',
+                'github_success_url': 'url',
+                'github_status_url': None,
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, None, {
+                'status': 'status',
+                'text': 'text',
+                'url': 'url',
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    @mock.patch.object(timid_github.sys, 'exit',
+                       side_effect=TestException('exit'))
+    @mock.patch.object(timid_github.getpass, 'getpass',
+                       return_value='from_keyboard')
+    @mock.patch.object(timid_github.github, 'Github', **{
+        'return_value.get_user.return_value.login': 'example',
+    })
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='from_keyring')
+    @mock.patch.object(timid_github.keyring, 'set_password')
+    @mock.patch.object(timid_github, '_select_url',
+                       side_effect=lambda x, y: y.url)
+    @mock.patch.object(timid_github.GithubExtension, '__init__',
+                       return_value=None)
+    def test_activate_status_url(self, mock_init, mock_select_url,
+                                 mock_set_password, mock_get_password,
+                                 mock_Github, mock_getpass, mock_exit):
+        ctxt = mock.Mock()
+        pull = self.make_pull(mock_Github)
+        args = self.make_args(
+            github_pull='some/repo#5',
+            github_api='https://api.github.com',
+            github_user='example',
+            github_pass=None,
+            github_keyring_set=False,
+            github_repo='https://example.com/repo',
+            github_change_repo=None,
+            github_status_url='https://status.example.com/',
+            github_override=None,
+            github_override_status=None,
+            github_override_text=None,
+            github_override_url=None,
+        )
+
+        result = timid_github.GithubExtension.activate(ctxt, args)
+
+        self.assertTrue(isinstance(result, timid_github.GithubExtension))
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api.github.com', 'example')
+        self.assertFalse(mock_getpass.called)
+        self.assertFalse(mock_set_password.called)
+        mock_Github.assert_called_once_with(
+            'example', 'from_keyring', base_url='https://api.github.com')
+        gh = mock_Github.return_value
+        gh.get_repo.assert_called_once_with('some/repo')
+        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
+        self.assertFalse(gh.create_from_raw_data.called)
+        mock_select_url.assert_has_calls([
+            mock.call('https://example.com/repo', pull.base.repo),
+            mock.call('https://example.com/repo', pull.head.repo),
+        ])
+        self.assertEqual(mock_select_url.call_count, 2)
+        ctxt.variables.assert_has_calls([
+            mock.call.declare_sensitive('github_api_password'),
+            mock.call.update({
+                'github_api': 'https://api.github.com',
+                'github_api_username': 'example',
+                'github_api_password': 'from_keyring',
+                'github_repo_name': 'repo',
+                'github_pull': 'some/repo#5',
+                'github_base_repo': 'repo-url',
+                'github_base_branch': 'branch',
+                'github_change_repo': 'change-repo-url',
+                'github_change_branch': 'change-branch',
+                'github_success_status': 'success',
+                'github_success_text': 'Tests passed!',
+                'github_success_url': 'https://status.example.com/',
+                'github_status_url': 'https://status.example.com/',
+            }),
+        ])
+        self.assertEqual(len(ctxt.variables.method_calls), 2)
+        mock_init.assert_called_once_with(
+            gh, pull, pull._last_commit, 'https://status.example.com/', {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': 'https://status.example.com/',
+            }, 'repo', 'repo-url', 'branch',
+            'change-repo-url', 'change-branch', git_config=[], mirror=None,
+            workspaces=None, recorder=mock.ANY,
+            summary=mock.ANY, history=None,
+            budget=mock.ANY, scheduler=mock.ANY, pool=None,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt.emit.assert_has_calls([
+            mock.call('Github plugin activated'),
+            mock.call('Testing pull request some/repo#5'),
+            mock.call('Base repository repo-url', level=2),
+            mock.call('PR repository change-repo-url', level=2),
+        ])
+        self.assertEqual(ctxt.emit.call_count, 4)
+        self.assertFalse(mock_exit.called)
+
+    def test_init(self):
+        result = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        self.assertEqual(result.gh, 'gh')
+        self.assertEqual(result.pull, 'pull')
+        self.assertEqual(result.last_commit, 'last_commit')
+        self.assertEqual(result.status_url, 'status_url')
+        self.assertEqual(result.final_status, 'final_status')
+        self.assertEqual(result.repo_name, 'repo_name')
+        self.assertEqual(result.repo_url, 'repo_url')
+        self.assertEqual(result.repo_branch, 'repo_branch')
+        self.assertEqual(result.change_url, 'change_url')
+        self.assertEqual(result.change_branch, 'change_branch')
+        self.assertEqual(result.git_config, [])
+        self.assertEqual(result.last_status, None)
+        self.assertEqual(result.queue, None)
+        self.assertEqual(result.superseded, None)
+
+    def test_init_git_config(self):
+        result = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', git_config=[('a', 'b')])
+
+        self.assertEqual(result.git_config, [('a', 'b')])
+
+    @mock.patch.object(timid_github, 'Recorder')
+    def test_init_recorder(self, mock_Recorder):
+        result = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        self.assertEqual(result.recorder, mock_Recorder.return_value)
+
+    def test_init_recorder_given(self):
+        result = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', recorder='recorder')
+
+        self.assertEqual(result.recorder, 'recorder')
+
+    def test_set_status_recorder(self):
+        last_commit = mock.Mock()
+        recorder = mock.Mock()
+        ctxt = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', last_commit, 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', recorder=recorder)
+
+        obj._set_status(ctxt, 'pending')
+
+        recorder.record.assert_has_calls([
+            mock.call('api', start=mock.ANY, duration=mock.ANY,
+                      name='create_status', outcome='ok'),
+            mock.call('status', state='pending', outcome='sent'),
+        ])
+        self.assertEqual(recorder.record.call_count, 2)
+
+    def test_set_status_unchanged(self):
+        last_commit = mock.Mock()
+        recorder = mock.Mock()
+        ctxt = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', last_commit, 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', recorder=recorder)
+        obj.last_status = {
+            'status': 'pending',
+            'text': 'Step',
+            'url': 'url',
+        }
+
+        obj._set_status(ctxt, 'pending', 'Step', 'url')
+
+        self.assertFalse(last_commit.create_status.called)
+        recorder.record.assert_called_once_with(
+            'status', state='pending', outcome='suppressed')
+        ctxt.emit.assert_called_once_with(
+            'Status unchanged; not updating', debug=True)
+
+    def test_set_status_queued(self):
+        last_commit = mock.Mock()
+        scheduler = mock.Mock(**{
+            'try_call.side_effect': timid_github.ApiRateLimited(1000.0),
+        })
+        recorder = mock.Mock()
+        ctxt = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', last_commit, 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', recorder=recorder,
+            scheduler=scheduler)
+
+        obj._set_status(ctxt, 'pending', 'Step', 'url')
+
+        scheduler.try_call.assert_called_once_with(
+            recorder, 'create_status', last_commit.create_status,
+            'pending', 'url', 'Step')
+        self.assertFalse(scheduler.call.called)
+        self.assertEqual(obj.last_status, None)
+        self.assertEqual(obj.queued_status, {
+            'status': 'pending',
+            'text': 'Step',
+            'url': 'url',
+        })
+        ctxt.emit.assert_called_once_with(
+            'Queueing status "pending": %s' %
+            scheduler.try_call.side_effect, debug=True)
+        recorder.record.assert_called_once_with(
+            'status', state='pending', outcome='queued')
+
+    def test_set_status_wait(self):
+        last_commit = mock.Mock()
+        scheduler = mock.Mock()
+        recorder = mock.Mock()
+        ctxt = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', last_commit, 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', recorder=recorder,
+            scheduler=scheduler)
+        obj.queued_status = {
+            'status': 'pending',
+            'text': 'Step',
+            'url': 'url',
+        }
+
+        obj._set_status(ctxt, 'success', 'Passed', 'url', wait=True)
+
+        scheduler.call.assert_called_once_with(
+            recorder, 'create_status', last_commit.create_status,
+            'success', 'url', 'Passed')
+        self.assertFalse(scheduler.try_call.called)
+        self.assertEqual(obj.last_status, {
+            'status': 'success',
+            'text': 'Passed',
+            'url': 'url',
+        })
+        self.assertEqual(obj.queued_status, None)
+
+    def test_set_status_wait_limited(self):
+        last_commit = mock.Mock()
+        scheduler = mock.Mock(**{
+            'call.side_effect': timid_github.ApiRateLimited(1000.0),
+        })
+        ctxt = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', last_commit, 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', scheduler=scheduler)
+
+        obj._set_status(ctxt, 'success', 'Passed', 'url', wait=True)
+
+        ctxt.emit.assert_called_once_with(
+            'Unable to change status to "success": %s' %
+            scheduler.call.side_effect)
+        self.assertEqual(obj.queued_status, {
+            'status': 'success',
+            'text': 'Passed',
+            'url': 'url',
+        })
+
+    def test_set_status_base(self):
+        last_commit = mock.Mock()
+        ctxt = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', last_commit, 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        obj._set_status(ctxt, 'pending')
+
+        self.assertEqual(obj.last_status, {
+            'status': 'pending',
+            'text': None,
+            'url': None,
+        })
+        last_commit.create_status.assert_called_once_with(
+            'pending', github.GithubObject.NotSet,
+            github.GithubObject.NotSet)
+        ctxt.emit.assert_called_once_with(
+            'Changing status to "pending" (text "None")',
+            debug=True)
+
+    def test_set_status_alt(self):
+        last_commit = mock.Mock()
+        ctxt = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', last_commit, 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        obj._set_status(ctxt, 'pending', 'text', 'url')
+
+        self.assertEqual(obj.last_status, {
+            'status': 'pending',
+            'text': 'text',
+            'url': 'url',
+        })
+        last_commit.create_status.assert_called_once_with(
+            'pending', 'url', 'text')
+        ctxt.emit.assert_called_once_with(
+            'Changing status to "pending" (text "text", url url)',
+            debug=True)
+
+    @mock.patch.object(timid_github, 'CloneAction', return_value='clone')
+    @mock.patch.object(timid_github, 'MergeAction', return_value='merge')
+    @mock.patch.object(timid_github.timid, 'Step',
+                       side_effect=lambda addr, action, name, description:
+                       "%s#%s" % (addr, action))
+    @mock.patch.object(timid_github.timid, 'StepAddress',
+                       side_effect=lambda x, y: '%s:%s' % (x, y))
+    def test_read_steps(self, mock_StepAddress, mock_Step, mock_MergeAction,
+                        mock_CloneAction):
+        fname = inspect.getsourcefile(timid_github.GithubExtension)
+        ctxt = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+        steps = ['step0', 'step1', 'step2']
+
+        obj.read_steps(ctxt, steps)
+
+        self.assertEqual(steps, [
+            '%s:0#clone' % fname, '%s:1#merge' % fname,
+            'step0', 'step1', 'step2',
+        ])
+        ctxt.emit.assert_called_once_with(
+            'Prepending clone and merge steps', debug=True)
+        mock_CloneAction.assert_called_once_with(ctxt, obj)
+        mock_MergeAction.assert_called_once_with(ctxt, obj)
+        mock_StepAddress.assert_has_calls([
+            mock.call(fname, 0),
+            mock.call(fname, 1),
+        ])
+        self.assertEqual(mock_StepAddress.call_count, 2)
+        mock_Step.assert_has_calls([
+            mock.call('%s:0' % fname, 'clone', name='Cloning repository',
+                      description='Clone the Github repository'),
+            mock.call('%s:1' % fname, 'merge', name='Merging pull request',
+                      description='Merge the Github pull request'),
+        ])
+        self.assertEqual(mock_Step.call_count, 2)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_pre_step(self, mock_set_status):
+        step = mock.Mock()
+        step.name = 'Step'
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        result = obj.pre_step('ctxt', step, 5)
+
+        self.assertEqual(result, None)
+        mock_set_status.assert_called_once_with(
+            'ctxt', 'pending', 'Step', 'status_url')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_pre_step_budget_low(self, mock_set_status):
+        step = mock.Mock()
+        step.name = 'Step'
+        gh = mock.Mock(spec=[])
+        budget = mock.Mock(**{'low.return_value': 'too many calls'})
+        recorder = mock.Mock()
+        ctxt = mock.Mock()
+        obj = timid_github.GithubExtension(
+            gh, 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', recorder=recorder, budget=budget)
+
+        obj.pre_step(ctxt, step, 5)
+        obj.pre_step(ctxt, step, 6)
+
+        self.assertFalse(mock_set_status.called)
+        self.assertTrue(obj.degraded)
+        ctxt.emit.assert_called_once_with(
+            'Skipping pending status updates: too many calls')
+        recorder.record.assert_called_with(
+            'status', state='pending', outcome='suppressed')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_pre_step_budget_ok(self, mock_set_status):
+        step = mock.Mock()
+        step.name = 'Step'
+        gh = mock.Mock(spec=[])
+        budget = mock.Mock(**{'low.return_value': None})
+        obj = timid_github.GithubExtension(
+            gh, 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', budget=budget)
+
+        obj.pre_step('ctxt', step, 5)
+
+        mock_set_status.assert_called_once_with(
+            'ctxt', 'pending', 'Step', 'status_url')
+        self.assertFalse(obj.degraded)
+
+    @mock.patch.object(timid_github.time, 'time', return_value=12.0)
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_pre_step_throttled(self, mock_set_status, mock_time):
+        step = mock.Mock()
+        step.name = 'Step'
+        recorder = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', recorder=recorder,
+            status_interval=5.0,
+            status_async=False,
+            queue=None)
+        obj.last_post = 10.0
+
+        obj.pre_step('ctxt', step, 5)
+
+        self.assertFalse(mock_set_status.called)
+        self.assertEqual(obj.queued_status, {
+            'status': 'pending',
+            'text': 'Step',
+            'url': 'status_url',
+        })
+        recorder.record.assert_called_once_with(
+            'status', state='pending', outcome='throttled')
+
+    @mock.patch.object(timid_github.time, 'time', return_value=15.0)
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_pre_step_interval_elapsed(self, mock_set_status, mock_time):
+        step = mock.Mock()
+        step.name = 'Step'
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', status_interval=5.0,
+            status_async=False,
+            queue=None)
+        obj.last_post = 10.0
+
+        obj.pre_step('ctxt', step, 5)
+
+        mock_set_status.assert_called_once_with(
+            'ctxt', 'pending', 'Step', 'status_url')
+        self.assertEqual(obj.queued_status, None)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_pre_step_async(self, mock_set_status):
+        step = mock.Mock()
+        step.name = 'Step'
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', status_async=True)
+        obj.poster = mock.Mock()
+
+        obj.pre_step('ctxt', step, 5)
+
+        self.assertFalse(mock_set_status.called)
+        obj.poster.submit.assert_called_once_with(
+            'ctxt', 'pending', 'Step', 'status_url')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_pre_step_current(self, mock_set_status):
+        step = mock.Mock()
+        step.name = 'Step'
+        pull = mock.Mock(number=5, **{'base.repo.full_name': 'org/repo'})
+        queue = mock.Mock(**{'superseded.return_value': None})
+        obj = timid_github.GithubExtension(
+            'gh', pull, mock.Mock(sha='abc'), 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', queue=queue)
+
+        result = obj.pre_step('ctxt', step, 5)
+
+        self.assertEqual(result, None)
+        queue.superseded.assert_called_once_with('org/repo#5', 'abc')
+        mock_set_status.assert_called_once_with(
+            'ctxt', 'pending', 'Step', 'status_url')
+        self.assertEqual(obj.superseded, None)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_pre_step_superseded(self, mock_set_status):
+        ctxt = mock.Mock()
+        step = mock.Mock()
+        step.name = 'Step'
+        pull = mock.Mock(number=5, **{'base.repo.full_name': 'org/repo'})
+        queue = mock.Mock(**{'superseded.return_value': '0123456789abcdef'})
+        obj = timid_github.GithubExtension(
+            'gh', pull, mock.Mock(sha='abc'), 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', status_async=True, queue=queue)
+        obj.poster = mock.Mock()
+
+        result = obj.pre_step(ctxt, step, 5)
+
+        self.assertTrue(result)
+        self.assertEqual(obj.superseded, '0123456789abcdef')
+        ctxt.emit.assert_called_once_with(
+            'Superseded by 0123456789abcdef; skipping remaining steps')
+        obj.poster.flush.assert_called_once_with()
+        self.assertFalse(obj.poster.submit.called)
+        mock_set_status.assert_called_once_with(
+            ctxt, 'error', 'Superseded by 0123456', 'status_url')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_pre_step_already_superseded(self, mock_set_status):
+        queue = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', queue=queue)
+        obj.superseded = 'def'
+
+        result = obj.pre_step('ctxt', mock.Mock(), 5)
+
+        self.assertTrue(result)
+        self.assertFalse(queue.superseded.called)
+        self.assertFalse(mock_set_status.called)
+
+    @mock.patch.object(timid_github.time, 'time',
+                       side_effect=[9.0, 10.0, 12.5])
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_step_timing(self, mock_set_status, mock_time):
+        recorder = mock.Mock(**{'push_span.return_value': 'span'})
+        step = mock.Mock(action=mock.Mock(spec=timid_github.CloneAction))
+        step.name = 'Step'
+        result = timid.StepResult(state=timid.SUCCESS)
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', recorder=recorder)
+
+        obj.pre_step('ctxt', step, 0)
+        obj.post_step('ctxt', step, 0, result)
+
+        recorder.record.assert_called_once_with(
+            'step', start=10.0, duration=2.5, name='Step', index=0,
+            phase='clone', state=timid.SUCCESS, span_id='span')
+        recorder.pop_span.assert_called_once_with('span')
+        self.assertEqual(obj.step_start, None)
+        self.assertEqual(obj.step_span, None)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_step_span_not_closed(self, mock_set_status):
+        recorder = mock.Mock(**{'push_span.side_effect': ['span1', 'span2']})
+        step = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', recorder=recorder)
+
+        # The first step is skipped by another extension
+        obj.pre_step('ctxt', step, 0)
+        obj.pre_step('ctxt', step, 1)
+
+        recorder.pop_span.assert_called_once_with('span1')
+        self.assertEqual(obj.step_span, 'span2')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_step_timing_phases(self, mock_set_status):
+        recorder = mock.Mock()
+        result = timid.StepResult(state=timid.SUCCESS)
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', recorder=recorder)
+
+        for action in (mock.Mock(spec=timid_github.MergeAction),
+                       mock.Mock()):
+            obj.pre_step('ctxt', mock.Mock(action=action), 1)
+            obj.post_step('ctxt', mock.Mock(action=action), 1, result)
+
+        self.assertEqual(
+            [c[1]['phase'] for c in recorder.record.call_args_list],
+            ['merge', 'steps'])
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_post_step_skipped(self, mock_set_status):
+        step = mock.Mock()
+        step.name = 'Step'
+        result = timid.StepResult(state=timid.SKIPPED)
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        obj.post_step('ctxt', step, 5, result)
+
+        self.assertFalse(mock_set_status.called)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_post_step_success(self, mock_set_status):
+        step = mock.Mock()
+        step.name = 'Step'
+        result = timid.StepResult(state=timid.SUCCESS)
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        obj.post_step('ctxt', step, 5, result)
+
+        self.assertFalse(mock_set_status.called)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_post_step_failure_nomsg(self, mock_set_status):
+        step = mock.Mock()
+        step.name = 'Step'
+        result = timid.StepResult(state=timid.FAILURE)
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        obj.post_step('ctxt', step, 5, result)
+
+        mock_set_status.assert_called_once_with(
+            'ctxt', 'failure', 'Failed: Step', 'status_url')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_post_step_failure_withmsg(self, mock_set_status):
+        step = mock.Mock()
+        step.name = 'Step'
+        result = timid.StepResult(state=timid.FAILURE, msg='message')
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        obj.post_step('ctxt', step, 5, result)
+
+        mock_set_status.assert_called_once_with(
+            'ctxt', 'failure', 'message', 'status_url')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_post_step_failure_async(self, mock_set_status):
+        step = mock.Mock()
+        step.name = 'Step'
+        result = timid.StepResult(state=timid.FAILURE, msg='message')
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', status_async=True)
+        obj.poster = mock.Mock()
+        manager = mock.Mock()
+        manager.attach_mock(obj.poster.flush, 'flush')
+        manager.attach_mock(mock_set_status, 'set_status')
+
+        obj.post_step('ctxt', step, 5, result)
+
+        self.assertEqual(manager.mock_calls, [
+            mock.call.flush(),
+            mock.call.set_status('ctxt', 'failure', 'message', 'status_url'),
+        ])
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_post_step_error_nomsg(self, mock_set_status):
+        step = mock.Mock()
+        step.name = 'Step'
+        result = timid.StepResult(state=timid.ERROR)
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        obj.post_step('ctxt', step, 5, result)
+
+        mock_set_status.assert_called_once_with(
+            'ctxt', 'error', 'Error: Step', 'status_url')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_post_step_error_withmsg(self, mock_set_status):
+        step = mock.Mock()
+        step.name = 'Step'
+        result = timid.StepResult(state=timid.ERROR, msg='message')
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        obj.post_step('ctxt', step, 5, result)
+
+        mock_set_status.assert_called_once_with(
+            'ctxt', 'error', 'message', 'status_url')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_post_step_other_nomsg(self, mock_set_status):
+        step = mock.Mock()
+        step.name = 'Step'
+        result = timid.StepResult(state=5)
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        obj.post_step('ctxt', step, 5, result)
+
+        mock_set_status.assert_called_once_with(
+            'ctxt', 'error', 'Unknown timid state "5" during step: Step',
+            'status_url')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_post_step_other_withmsg(self, mock_set_status):
+        step = mock.Mock()
+        step.name = 'Step'
+        result = timid.StepResult(state='other', msg='message')
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        obj.post_step('ctxt', step, 5, result)
+
+        mock_set_status.assert_called_once_with(
+            'ctxt', 'error', 'message', 'status_url')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_none(self, mock_set_status):
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': 'https://example.com',
+            }, 'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        result = obj.finalize('ctxt', None)
+
+        self.assertEqual(result, None)
+        mock_set_status.assert_called_once_with(
+            'ctxt', status='success', text='Tests passed!',
+            url='https://example.com', wait=True)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_async(self, mock_set_status):
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': 'https://example.com',
+            }, 'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', status_async=True)
+        obj.poster = mock.Mock()
+        manager = mock.Mock()
+        manager.attach_mock(obj.poster.stop, 'stop')
+        manager.attach_mock(mock_set_status, 'set_status')
+
+        obj.finalize('ctxt', None)
+
+        self.assertEqual(manager.mock_calls, [
+            mock.call.stop(),
+            mock.call.set_status(
+                'ctxt', status='success', text='Tests passed!',
+                url='https://example.com', wait=True),
+        ])
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_superseded(self, mock_set_status):
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': 'https://example.com',
+            }, 'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+        obj.superseded = 'def'
+
+        result = obj.finalize('ctxt', None)
+
+        self.assertEqual(result, None)
+        self.assertFalse(mock_set_status.called)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_superseded_queued(self, mock_set_status):
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+        obj.superseded = 'def'
+        obj.queued_status = {
+            'status': 'error',
+            'text': 'Superseded by def',
+            'url': 'status_url',
+        }
+
+        obj.finalize('ctxt', 'Test step failure')
+
+        mock_set_status.assert_called_once_with(
+            'ctxt', status='error', text='Superseded by def',
+            url='status_url', wait=True)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_exception(self, mock_set_status):
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': 'https://example.com',
+            }, 'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+        exc = TestException('some failure')
+
+        result = obj.finalize('ctxt', exc)
+
+        self.assertEqual(result, exc)
+        mock_set_status.assert_called_once_with(
+            'ctxt', 'error', 'Exception while running timid: some failure',
+            'status_url', wait=True)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_string_no_last_status(self, mock_set_status):
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': 'https://example.com',
+            }, 'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+
+        result = obj.finalize('ctxt', 'text')
+
+        self.assertEqual(result, 'text')
+        self.assertFalse(mock_set_status.called)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_string_with_last_status_other(self, mock_set_status):
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': 'https://example.com',
+            }, 'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+        obj.last_status = {
+            'status': 'other',
+        }
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+        result = obj.finalize('ctxt', 'text')
 
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('some/repo')
-        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
-        self.assertFalse(gh.create_from_raw_data.called)
-        mock_select_url.assert_has_calls([
-            mock.call('https://example.com/repo', pull.base.repo),
-            mock.call('https://example.com/repo', pull.head.repo),
-        ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_keyring',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'success',
-                'github_success_text': 'Tests passed!',
-                'github_success_url': None,
-                'github_status_url': None,
-            }),
-        ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, None, {
+        self.assertEqual(result, 'text')
+        self.assertFalse(mock_set_status.called)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_string_with_last_status_pending(self, mock_set_status):
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', {
                 'status': 'success',
                 'text': 'Tests passed!',
-                'url': None,
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
-        ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
-        ])
-        self.assertEqual(ctxt.emit.call_count, 4)
-        self.assertFalse(mock_exit.called)
+                'url': 'https://example.com',
+            }, 'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+        obj.last_status = {
+            'status': 'pending',
+        }
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_override_status(self, mock_init, mock_select_url,
-                                      mock_set_password, mock_get_password,
-                                      mock_Github, mock_getpass, mock_exit):
+        result = obj.finalize('ctxt', 'text')
+
+        self.assertEqual(result, 'text')
+        mock_set_status.assert_called_once_with(
+            'ctxt', 'failure', 'Testing failed: text', 'status_url',
+            wait=True)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_string_degraded(self, mock_set_status):
+        budget = mock.Mock()
         ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=None,
-            github_override_status='status',
-            github_override_text=None,
-            github_override_url=None,
-        )
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', budget=budget)
+        obj.degraded = True
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+        result = obj.finalize(ctxt, 'failed')
 
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('some/repo')
-        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
-        self.assertFalse(gh.create_from_raw_data.called)
-        mock_select_url.assert_has_calls([
-            mock.call('https://example.com/repo', pull.base.repo),
-            mock.call('https://example.com/repo', pull.head.repo),
-        ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_keyring',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'status',
-                'github_success_text': 'Tests passed!',
-                'github_success_url': None,
-                'github_status_url': None,
-            }),
-        ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, None, {
-                'status': 'status',
-                'text': 'Tests passed!',
-                'url': None,
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
-        ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
+        self.assertEqual(result, 'failed')
+        mock_set_status.assert_called_once_with(
+            ctxt, 'failure', 'Testing failed: failed', 'status_url',
+            wait=True)
+        budget.flush.assert_called_once_with()
+        budget.report.assert_called_once_with(ctxt)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_budget_flush_failure(self, mock_set_status):
+        budget = mock.Mock(state_path='/usage.json', **{
+            'flush.side_effect': OSError('denied'),
+        })
+        ctxt = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', budget=budget)
+
+        obj.finalize(ctxt, 'failed')
+
+        ctxt.emit.assert_called_once_with(
+            'Unable to record API usage in /usage.json: denied')
+        budget.report.assert_called_once_with(ctxt)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_string_queued_pending(self, mock_set_status):
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+        obj.last_status = {'status': 'success'}
+        obj.queued_status = {'status': 'pending'}
+
+        result = obj.finalize('ctxt', 'failed')
+
+        self.assertEqual(result, 'failed')
+        mock_set_status.assert_has_calls([
+            mock.call('ctxt', 'failure', 'Testing failed: failed',
+                      'status_url', wait=True),
+            mock.call('ctxt', wait=True, status='pending'),
         ])
-        self.assertEqual(ctxt.emit.call_count, 4)
-        self.assertFalse(mock_exit.called)
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_override_text(self, mock_init, mock_select_url,
-                                    mock_set_password, mock_get_password,
-                                    mock_Github, mock_getpass, mock_exit):
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_string_queued(self, mock_set_status):
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch')
+        obj.queued_status = {'status': 'error', 'text': 'text', 'url': 'url'}
+
+        obj.finalize('ctxt', 'failed')
+
+        mock_set_status.assert_called_once_with(
+            'ctxt', wait=True, status='error', text='text', url='url')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_pool(self, mock_set_status):
+        gh = mock.Mock(spec=[])
+        pool = mock.Mock()
+        budget = mock.Mock(rate_remaining=4321, rate_reset=2000)
         ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=None,
-            github_override_status=None,
-            github_override_text='text',
-            github_override_url=None,
-        )
+        obj = timid_github.GithubExtension(
+            gh, 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', budget=budget, pool=pool)
+
+        obj.finalize(ctxt, 'failed')
+
+        pool.update.assert_called_once_with(4321, 2000)
+        self.assertFalse(ctxt.emit.called)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_pool_unknown(self, mock_set_status):
+        gh = mock.Mock(spec=[])
+        pool = mock.Mock()
+        budget = mock.Mock(rate_remaining=None, rate_reset=None)
+        ctxt = mock.Mock()
+        obj = timid_github.GithubExtension(
+            gh, 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', budget=budget, pool=pool)
+
+        obj.finalize(ctxt, 'failed')
+
+        self.assertFalse(pool.update.called)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_pool_failure(self, mock_set_status):
+        pool = mock.Mock(state_path='/pool.json', **{
+            'update.side_effect': OSError('denied'),
+        })
+        budget = mock.Mock(rate_remaining=4321, rate_reset=2000)
+        ctxt = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', budget=budget, pool=pool)
+
+        obj.finalize(ctxt, 'failed')
+
+        ctxt.emit.assert_called_once_with(
+            'Unable to record token usage in /pool.json: denied')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_mirror_due(self, mock_set_status):
+        mirror = mock.Mock(**{'needs_maintenance.return_value': True})
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': 'https://example.com',
+            }, 'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', mirror=mirror)
+
+        result = obj.finalize('ctxt', None)
+
+        self.assertEqual(result, None)
+        mirror.spawn_maintenance.assert_called_once_with('ctxt')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_mirror_not_due(self, mock_set_status):
+        mirror = mock.Mock(**{'needs_maintenance.return_value': False})
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': 'https://example.com',
+            }, 'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', mirror=mirror)
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+        result = obj.finalize('ctxt', None)
 
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('some/repo')
-        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
-        self.assertFalse(gh.create_from_raw_data.called)
-        mock_select_url.assert_has_calls([
-            mock.call('https://example.com/repo', pull.base.repo),
-            mock.call('https://example.com/repo', pull.head.repo),
-        ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_keyring',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'success',
-                'github_success_text': 'text',
-                'github_success_url': None,
-                'github_status_url': None,
-            }),
-        ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, None, {
+        self.assertEqual(result, None)
+        self.assertFalse(mirror.spawn_maintenance.called)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_summary(self, mock_set_status):
+        summary = mock.Mock(in_status=False)
+        ctxt = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', {
                 'status': 'success',
-                'text': 'text',
-                'url': None,
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
-        ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
-        ])
-        self.assertEqual(ctxt.emit.call_count, 4)
-        self.assertFalse(mock_exit.called)
+                'text': 'Tests passed!',
+                'url': 'https://example.com',
+            }, 'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', summary=summary)
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_override_url(self, mock_init, mock_select_url,
-                                   mock_set_password, mock_get_password,
-                                   mock_Github, mock_getpass, mock_exit):
+        obj.finalize(ctxt, None)
+
+        summary.report.assert_called_once_with(ctxt)
+        self.assertFalse(summary.brief.called)
+        mock_set_status.assert_called_once_with(
+            ctxt, status='success', text='Tests passed!',
+            url='https://example.com', wait=True)
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_summary_status(self, mock_set_status):
+        summary = mock.Mock(in_status=True, **{
+            'brief.return_value': '[clone 1.0s]',
+        })
+        final_status = {
+            'status': 'success',
+            'text': 'Tests passed!',
+            'url': 'https://example.com',
+        }
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', final_status,
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', summary=summary)
+
+        obj.finalize('ctxt', None)
+
+        mock_set_status.assert_called_once_with(
+            'ctxt', status='success', text='Tests passed! [clone 1.0s]',
+            url='https://example.com', wait=True)
+        self.assertEqual(final_status['text'], 'Tests passed!')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_summary_status_failure(self, mock_set_status):
+        summary = mock.Mock(in_status=True, **{
+            'brief.return_value': '[clone 1.0s]',
+        })
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', summary=summary)
+        obj.last_status = {'status': 'pending'}
+
+        obj.finalize('ctxt', 'failed')
+
+        mock_set_status.assert_called_once_with(
+            'ctxt', 'failure', 'Testing failed: failed [clone 1.0s]',
+            'status_url', wait=True)
+
+    @mock.patch.object(timid_github.socket, 'gethostname',
+                       return_value='host')
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_history(self, mock_set_status, mock_gethostname):
+        pull = mock.Mock(number=5, **{'base.repo.full_name': 'org/repo'})
+        summary = mock.Mock(in_status=False)
+        history = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', pull, 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', summary=summary, history=history)
+        exc = TestException('oops')
+
+        obj.finalize('ctxt', exc)
+
+        history.add.assert_called_once_with(
+            'org/repo', 'repo_branch', 'host', 'org/repo#5', 'error',
+            summary.as_dict.return_value)
+
+    @mock.patch.object(timid_github.socket, 'gethostname',
+                       return_value='host')
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_history_failure(self, mock_set_status,
+                                      mock_gethostname):
+        pull = mock.Mock(number=5, **{'base.repo.full_name': 'org/repo'})
+        summary = mock.Mock(in_status=False)
+        history = mock.Mock(path='/history.db', **{
+            'add.side_effect': timid_github.sqlite3.OperationalError('bad'),
+        })
         ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=None,
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url='url',
-        )
+        obj = timid_github.GithubExtension(
+            'gh', pull, 'last_commit', 'status_url', 'final_status',
+            'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', summary=summary, history=history)
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+        obj.finalize(ctxt, 'failed')
 
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('some/repo')
-        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
-        self.assertFalse(gh.create_from_raw_data.called)
-        mock_select_url.assert_has_calls([
-            mock.call('https://example.com/repo', pull.base.repo),
-            mock.call('https://example.com/repo', pull.head.repo),
-        ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_keyring',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'success',
-                'github_success_text': 'Tests passed!',
-                'github_success_url': 'url',
-                'github_status_url': None,
-            }),
-        ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, None, {
+        history.add.assert_called_once_with(
+            'org/repo', 'repo_branch', 'host', 'org/repo#5', 'failure',
+            summary.as_dict.return_value)
+        ctxt.emit.assert_called_once_with(
+            'Unable to record run history in /history.db: bad')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_recorder(self, mock_set_status):
+        recorder = mock.Mock()
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', {
                 'status': 'success',
                 'text': 'Tests passed!',
-                'url': 'url',
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
-        ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
-        ])
-        self.assertEqual(ctxt.emit.call_count, 4)
-        self.assertFalse(mock_exit.called)
+                'url': 'https://example.com',
+            }, 'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', recorder=recorder)
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
-                       return_value=None)
-    def test_activate_override_compat_precedence(self, mock_init,
-                                                 mock_select_url,
-                                                 mock_set_password,
-                                                 mock_get_password,
-                                                 mock_Github, mock_getpass,
-                                                 mock_exit):
+        result = obj.finalize('ctxt', None)
+
+        self.assertEqual(result, None)
+        recorder.close.assert_called_once_with()
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_recorder_failure(self, mock_set_status):
+        recorder = mock.Mock(**{
+            'close.side_effect': OSError('denied'),
+        })
         ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url=None,
-            github_override=json.dumps({
-                'status': 'override',
-                'text': 'some text',
-                'url': 'some url',
-                'other': 'skipped',
-            }),
-            github_override_status='status',
-            github_override_text='text',
-            github_override_url='url',
-        )
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': 'https://example.com',
+            }, 'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', recorder=recorder)
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+        result = obj.finalize(ctxt, None)
 
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('some/repo')
-        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
-        self.assertFalse(gh.create_from_raw_data.called)
-        mock_select_url.assert_has_calls([
-            mock.call('https://example.com/repo', pull.base.repo),
-            mock.call('https://example.com/repo', pull.head.repo),
+        self.assertEqual(result, None)
+        ctxt.emit.assert_called_once_with(
+            'Unable to write performance data: denied')
+
+    @mock.patch.object(timid_github.GithubExtension, '_set_status')
+    def test_finalize_workspaces(self, mock_set_status):
+        workspaces = mock.Mock()
+        ctxt = mock.Mock(**{'environment.cwd': '/work/dir/repo'})
+        obj = timid_github.GithubExtension(
+            'gh', 'pull', 'last_commit', 'status_url', {
+                'status': 'success',
+                'text': 'Tests passed!',
+                'url': 'https://example.com',
+            }, 'repo_name', 'repo_url', 'repo_branch',
+            'change_url', 'change_branch', workspaces=workspaces)
+
+        result = obj.finalize(ctxt, None)
+
+        self.assertEqual(result, None)
+        workspaces.assert_has_calls([
+            mock.call.update_sizes(),
+            mock.call.evict(ctxt, '/work/dir/repo'),
+            mock.call.release(),
         ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_keyring',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'status',
-                'github_success_text': 'text',
-                'github_success_url': 'url',
-                'github_status_url': None,
-            }),
+
+
+class TestBatchExtension(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_pulls(self, *names):
+        return [(mock.Mock(), {'github_pull': name}) for name in names]
+
+    def make_step(self, name, state=timid.SUCCESS, msg=None):
+        step = mock.Mock(return_value=timid.StepResult(state=state, msg=msg))
+        step.name = name
+        return step
+
+    def test_init(self):
+        result = timid_github.BatchExtension('pulls', 4, True)
+
+        self.assertEqual(result.pulls, 'pulls')
+        self.assertEqual(result.jobs, 4)
+        self.assertTrue(result.check)
+        self.assertEqual(result.steps, [])
+
+    def test_read_steps(self):
+        steps = ['step1', 'step2']
+        obj = timid_github.BatchExtension([])
+
+        obj.read_steps('ctxt', steps)
+
+        self.assertEqual(steps, [])
+        self.assertEqual(obj.steps, ['step1', 'step2'])
+
+    def test_context(self):
+        ctxt = context.Context(0, False, self.tmpdir)
+        ctxt.environment['SECRET'] = 'value'
+        ctxt.environment.declare_sensitive('SECRET')
+        ctxt.variables['var'] = 'value'
+        ext = mock.Mock(**{'pull.base.repo.full_name': 'org/repo',
+                           'pull.number': 5})
+        obj = timid_github.BatchExtension([])
+
+        result = obj._context(ctxt, ext, {'github_pull': 'org/repo#5'})
+
+        work_dir = os.path.join(self.tmpdir, 'org-repo-5')
+        self.assertTrue(os.path.isdir(work_dir))
+        self.assertEqual(result.environment.cwd, work_dir)
+        self.assertEqual(result.environment['SECRET'], 'value')
+        self.assertTrue('SECRET' in result.environment.sensitive)
+        self.assertEqual(dict(result.variables), {
+            'var': 'value',
+            'github_pull': 'org/repo#5',
+        })
+        self.assertEqual(dict(ctxt.variables), {'var': 'value'})
+        self.assertEqual(ctxt.environment.cwd, self.tmpdir)
+
+    @mock.patch.object(timid_github.BatchExtension, '_context')
+    def test_run_pull(self, mock_context):
+        pull_ctxt = mock_context.return_value
+        steps = [self.make_step('Step 1'), self.make_step('Step 2')]
+        ext = mock.Mock(**{'pre_step.return_value': None})
+        obj = timid_github.BatchExtension([])
+        obj.steps = steps
+
+        result = obj._run_pull('ctxt', ext, {'github_pull': 'org/repo#5'})
+
+        self.assertEqual(result, None)
+        mock_context.assert_called_once_with(
+            'ctxt', ext, {'github_pull': 'org/repo#5'})
+        ext.read_steps.assert_called_once_with(pull_ctxt, steps)
+        for idx, step in enumerate(steps):
+            step.assert_called_once_with(pull_ctxt)
+            ext.pre_step.assert_any_call(pull_ctxt, step, idx)
+            ext.post_step.assert_any_call(
+                pull_ctxt, step, idx, step.return_value)
+        pull_ctxt.emit.assert_has_calls([
+            mock.call('[org/repo#5] [Step 0]: Step 1 . . .'),
+            mock.call('[org/repo#5] [Step 0]: `- Step SUCCESS'),
+            mock.call('[org/repo#5] [Step 1]: Step 2 . . .'),
+            mock.call('[org/repo#5] [Step 1]: `- Step SUCCESS'),
         ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, None, {
-                'status': 'status',
-                'text': 'text',
-                'url': 'url',
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
-        ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
+        ext._finish_status.assert_called_once_with(pull_ctxt, None)
+        ext._release_workspace.assert_called_once_with(pull_ctxt)
+
+    @mock.patch.object(timid_github.BatchExtension, '_context')
+    def test_run_pull_skipped(self, mock_context):
+        pull_ctxt = mock_context.return_value
+        step = self.make_step('Step 1')
+        ext = mock.Mock(**{'pre_step.return_value': True})
+        obj = timid_github.BatchExtension([])
+        obj.steps = [step]
+
+        result = obj._run_pull('ctxt', ext, {'github_pull': 'org/repo#5'})
+
+        self.assertEqual(result, None)
+        self.assertFalse(step.called)
+        self.assertFalse(ext.post_step.called)
+        pull_ctxt.emit.assert_called_with(
+            '[org/repo#5] [Step 0]: `- Step SKIPPED')
+
+    @mock.patch.object(timid_github.BatchExtension, '_context')
+    def test_run_pull_failure(self, mock_context):
+        pull_ctxt = mock_context.return_value
+        steps = [self.make_step('Step 1', timid.FAILURE, 'oops'),
+                 self.make_step('Step 2')]
+        ext = mock.Mock(**{'pre_step.return_value': None})
+        obj = timid_github.BatchExtension([])
+        obj.steps = steps
+
+        result = obj._run_pull('ctxt', ext, {'github_pull': 'org/repo#5'})
+
+        self.assertEqual(result, 'Test step failure: oops')
+        self.assertFalse(steps[1].called)
+        ext._finish_status.assert_called_once_with(
+            pull_ctxt, 'Test step failure: oops')
+
+    @mock.patch.object(timid_github.BatchExtension, '_context',
+                       side_effect=OSError('read-only'))
+    def test_run_pull_exception(self, mock_context):
+        ext = mock.Mock()
+        obj = timid_github.BatchExtension([])
+
+        result = obj._run_pull('ctxt', ext, {'github_pull': 'org/repo#5'})
+
+        self.assertTrue(isinstance(result, OSError))
+        ext._finish_status.assert_called_once_with('ctxt', result)
+        ext._release_workspace.assert_called_once_with('ctxt')
+
+    def test_run_steps_no_ext(self):
+        ctxt = mock.Mock()
+        steps = [self.make_step('Step 1'),
+                 self.make_step('Step 2', timid.FAILURE, 'oops'),
+                 self.make_step('Step 3')]
+        obj = timid_github.BatchExtension([])
+
+        result = obj._run_steps(ctxt, 'merge queue', steps)
+
+        self.assertEqual(result, ('Test step failure: oops', 1))
+        steps[0].assert_called_once_with(ctxt)
+        steps[1].assert_called_once_with(ctxt)
+        self.assertFalse(steps[2].called)
+        ctxt.emit.assert_called_with(
+            '[merge queue] [Step 1]: `- Step FAILURE')
+
+    @mock.patch.object(timid_github.BatchExtension, '_run_pull',
+                       side_effect=[None, 'Test step failure'])
+    def test_finalize(self, mock_run_pull):
+        pulls = self.make_pulls('org/repo#1', 'org/repo#2')
+        lead = pulls[0][0]
+        obj = timid_github.BatchExtension(pulls)
+
+        result = obj.finalize('ctxt', None)
+
+        self.assertEqual(result, 'Testing failed for 1 of 2 pull requests: '
+                         'org/repo#2')
+        mock_run_pull.assert_has_calls([
+            mock.call('ctxt', pulls[0][0], pulls[0][1]),
+            mock.call('ctxt', pulls[1][0], pulls[1][1]),
         ])
-        self.assertEqual(ctxt.emit.call_count, 4)
-        self.assertFalse(mock_exit.called)
+        lead._report_run.assert_called_once_with(
+            'ctxt', result, 'org/repo#1, org/repo#2')
+        lead._release_api.assert_called_once_with('ctxt')
+        lead.recorder.close.assert_called_once_with()
+        for ext, _variables in pulls:
+            self.assertFalse(ext._finish_status.called)
+
+    @mock.patch.object(timid_github.BatchExtension, '_run_pull',
+                       return_value=None)
+    def test_finalize_parallel(self, mock_run_pull):
+        pulls = self.make_pulls('org/repo#1', 'org/repo#2', 'org/repo#3')
+        obj = timid_github.BatchExtension(pulls, jobs=2)
 
-    @mock.patch.object(timid_github.sys, 'exit',
-                       side_effect=TestException('exit'))
-    @mock.patch.object(timid_github.getpass, 'getpass',
-                       return_value='from_keyboard')
-    @mock.patch.object(timid_github.github, 'Github', **{
-        'return_value.get_user.return_value.login': 'example',
-    })
-    @mock.patch.object(timid_github.keyring, 'get_password',
-                       return_value='from_keyring')
-    @mock.patch.object(timid_github.keyring, 'set_password')
-    @mock.patch.object(timid_github, '_select_url',
-                       side_effect=lambda x, y: y.url)
-    @mock.patch.object(timid_github.GithubExtension, '__init__',
+        result = obj.finalize('ctxt', None)
+
+        self.assertEqual(result, None)
+        self.assertEqual(mock_run_pull.call_count, 3)
+        for ext, variables in pulls:
+            mock_run_pull.assert_any_call('ctxt', ext, variables)
+
+    @mock.patch.object(timid_github.BatchExtension, '_run_pull')
+    def test_finalize_failed(self, mock_run_pull):
+        pulls = self.make_pulls('org/repo#1', 'org/repo#2')
+        obj = timid_github.BatchExtension(pulls)
+        exc = TestException('broken')
+
+        result = obj.finalize('ctxt', exc)
+
+        self.assertEqual(result, exc)
+        self.assertFalse(mock_run_pull.called)
+        for ext, _variables in pulls:
+            ext._finish_status.assert_called_once_with('ctxt', exc)
+            ext._release_workspace.assert_called_once_with('ctxt')
+        pulls[0][0]._report_run.assert_called_once_with(
+            'ctxt', exc, 'org/repo#1, org/repo#2')
+
+    @mock.patch.object(timid_github.BatchExtension, '_run_pull')
+    def test_finalize_check(self, mock_run_pull):
+        pulls = self.make_pulls('org/repo#1', 'org/repo#2')
+        obj = timid_github.BatchExtension(pulls, check=True)
+
+        result = obj.finalize('ctxt', None)
+
+        self.assertEqual(result, None)
+        self.assertFalse(mock_run_pull.called)
+        for ext, _variables in pulls:
+            ext._finish_status.assert_called_once_with('ctxt', None)
+
+    @mock.patch.object(timid_github.BatchExtension, '_run_pull',
                        return_value=None)
-    def test_activate_status_url(self, mock_init, mock_select_url,
-                                 mock_set_password, mock_get_password,
-                                 mock_Github, mock_getpass, mock_exit):
+    def test_finalize_recorder_failure(self, mock_run_pull):
+        pulls = self.make_pulls('org/repo#1', 'org/repo#2')
+        pulls[0][0].recorder.close.side_effect = IOError('disk full')
         ctxt = mock.Mock()
-        pull = self.make_pull(mock_Github)
-        args = mock.Mock(
-            github_pull='some/repo#5',
-            github_api='https://api.github.com',
-            github_user='example',
-            github_pass=None,
-            github_keyring_set=False,
-            github_repo='https://example.com/repo',
-            github_change_repo=None,
-            github_status_url='https://status.example.com/',
-            github_override=None,
-            github_override_status=None,
-            github_override_text=None,
-            github_override_url=None,
-        )
+        obj = timid_github.BatchExtension(pulls)
 
-        result = timid_github.GithubExtension.activate(ctxt, args)
+        result = obj.finalize(ctxt, None)
 
-        self.assertTrue(isinstance(result, timid_github.GithubExtension))
-        mock_get_password.assert_called_once_with(
-            'timid-github!https://api.github.com', 'example')
-        self.assertFalse(mock_getpass.called)
-        self.assertFalse(mock_set_password.called)
-        mock_Github.assert_called_once_with(
-            'example', 'from_keyring', 'https://api.github.com')
-        gh = mock_Github.return_value
-        gh.get_repo.assert_called_once_with('some/repo')
-        gh.get_repo.return_value.get_pull.assert_called_once_with(5)
-        self.assertFalse(gh.create_from_raw_data.called)
-        mock_select_url.assert_has_calls([
-            mock.call('https://example.com/repo', pull.base.repo),
-            mock.call('https://example.com/repo', pull.head.repo),
-        ])
-        self.assertEqual(mock_select_url.call_count, 2)
-        ctxt.variables.assert_has_calls([
-            mock.call.declare_sensitive('github_api_password'),
-            mock.call.update({
-                'github_api': 'https://api.github.com',
-                'github_api_username': 'example',
-                'github_api_password': 'from_keyring',
-                'github_repo_name': 'repo',
-                'github_pull': 'some/repo#5',
-                'github_base_repo': 'repo-url',
-                'github_base_branch': 'branch',
-                'github_change_repo': 'change-repo-url',
-                'github_change_branch': 'change-branch',
-                'github_success_status': 'success',
-                'github_success_text': 'Tests passed!',
-                'github_success_url': 'https://status.example.com/',
-                'github_status_url': 'https://status.example.com/',
-            }),
+        self.assertEqual(result, None)
+        ctxt.emit.assert_called_once_with(
+            'Unable to write performance data: disk full')
+
+
+class TestMergeQueueExtension(unittest.TestCase):
+    def make_pulls(self, count):
+        return [(mock.Mock(status_url='status_url'),
+                 {'github_pull': 'org/repo#%d' % idx})
+                for idx in range(count)]
+
+    def make_run_group(self, culprits, culprit=True):
+        def run_group(ctxt, group, base):
+            if set(base + group) & set(culprits):
+                return 'Test step failure', culprit
+            return None, False
+        return run_group
+
+    def test_init(self):
+        result = timid_github.MergeQueueExtension('pulls', True)
+
+        self.assertEqual(result.pulls, 'pulls')
+        self.assertEqual(result.jobs, 1)
+        self.assertTrue(result.check)
+        self.assertEqual(result.runs, 0)
+
+    @mock.patch.object(timid_github.timid, 'Step',
+                       side_effect=lambda addr, action, **kw: action)
+    @mock.patch.object(timid_github, 'MergeAction')
+    @mock.patch.object(timid_github, 'CloneAction')
+    @mock.patch.object(timid_github.MergeQueueExtension, '_run_steps',
+                       return_value=(None, None))
+    @mock.patch.object(timid_github.MergeQueueExtension, '_context')
+    def test_run_group(self, mock_context, mock_run_steps, mock_CloneAction,
+                       mock_MergeAction, mock_Step):
+        ctxt = mock.Mock()
+        group_ctxt = mock_context.return_value
+        pulls = self.make_pulls(3)
+        pulls[0][0].pull.base.repo.full_name = 'org/repo'
+        obj = timid_github.MergeQueueExtension(pulls)
+        obj.steps = ['step']
+
+        result = obj._run_group(ctxt, [2], [0])
+
+        self.assertEqual(result, (None, False))
+        ctxt.emit.assert_called_once_with(
+            'Testing 2 pull requests together: org/repo#0, org/repo#2')
+        pulls[2][0]._set_status.assert_called_once_with(
+            ctxt, 'pending', 'Testing in a batch of 2', 'status_url')
+        self.assertFalse(pulls[0][0]._set_status.called)
+        self.assertFalse(pulls[1][0]._set_status.called)
+        mock_context.assert_called_once_with(
+            ctxt, pulls[0][0], {'github_pull': 'org/repo#0, org/repo#2'},
+            'org-repo-merge-queue')
+        mock_CloneAction.assert_called_once_with(group_ctxt, pulls[0][0])
+        mock_MergeAction.assert_called_once_with(
+            group_ctxt, pulls[0][0], [pulls[0][0], pulls[2][0]])
+        mock_run_steps.assert_called_once_with(
+            group_ctxt, 'merge queue', [
+                mock_CloneAction.return_value,
+                mock_MergeAction.return_value,
+                'step',
+            ])
+        pulls[0][0]._release_workspace.assert_called_once_with(group_ctxt)
+
+    @mock.patch.object(timid_github.timid, 'Step')
+    @mock.patch.object(timid_github, 'MergeAction')
+    @mock.patch.object(timid_github, 'CloneAction')
+    @mock.patch.object(timid_github.MergeQueueExtension, '_run_steps',
+                       return_value=('Test step failure', 2))
+    @mock.patch.object(timid_github.MergeQueueExtension, '_context')
+    def test_run_group_failure(self, mock_context, mock_run_steps,
+                               mock_CloneAction, mock_MergeAction,
+                               mock_Step):
+        obj = timid_github.MergeQueueExtension(self.make_pulls(2))
+
+        result = obj._run_group(mock.Mock(), [0, 1], [])
+
+        self.assertEqual(result, ('Test step failure', True))
+
+    @mock.patch.object(timid_github.timid, 'Step')
+    @mock.patch.object(timid_github, 'MergeAction')
+    @mock.patch.object(timid_github, 'CloneAction')
+    @mock.patch.object(timid_github.MergeQueueExtension, '_run_steps',
+                       return_value=('Test step failure', 0))
+    @mock.patch.object(timid_github.MergeQueueExtension, '_context')
+    def test_run_group_clone_failure(self, mock_context, mock_run_steps,
+                                     mock_CloneAction, mock_MergeAction,
+                                     mock_Step):
+        obj = timid_github.MergeQueueExtension(self.make_pulls(2))
+
+        result = obj._run_group(mock.Mock(), [0, 1], [])
+
+        self.assertEqual(result, ('Test step failure', False))
+
+    @mock.patch.object(timid_github.MergeQueueExtension, '_context',
+                       side_effect=OSError('read-only'))
+    def test_run_group_exception(self, mock_context):
+        ctxt = mock.Mock()
+        pulls = self.make_pulls(2)
+        obj = timid_github.MergeQueueExtension(pulls)
+
+        result, culprit = obj._run_group(ctxt, [1], [0])
+
+        self.assertTrue(isinstance(result, OSError))
+        self.assertFalse(culprit)
+        pulls[0][0]._release_workspace.assert_called_once_with(ctxt)
+
+    def test_test_passed(self):
+        pulls = self.make_pulls(4)
+        obj = timid_github.MergeQueueExtension(pulls)
+        obj._run_group = mock.Mock(side_effect=self.make_run_group([]))
+        ctxt = mock.Mock()
+
+        result = obj._test(ctxt)
+
+        self.assertEqual(result, [None] * 4)
+        obj._run_group.assert_called_once_with(ctxt, [0, 1, 2, 3], [])
+        for ext, _variables in pulls:
+            ext._finish_status.assert_called_once_with(ctxt, None)
+        ctxt.emit.assert_called_once_with('Tested 4 pull requests in 1 runs')
+
+    def test_test_bisect(self):
+        pulls = self.make_pulls(4)
+        obj = timid_github.MergeQueueExtension(pulls)
+        obj._run_group = mock.Mock(side_effect=self.make_run_group([2]))
+        ctxt = mock.Mock()
+
+        result = obj._test(ctxt)
+
+        self.assertEqual(result, [None, None, 'Test step failure', None])
+        self.assertEqual(obj._run_group.call_args_list, [
+            mock.call(ctxt, [0, 1, 2, 3], []),
+            mock.call(ctxt, [0, 1], []),
+            mock.call(ctxt, [2, 3], [0, 1]),
+            mock.call(ctxt, [2], [0, 1]),
+            mock.call(ctxt, [3], [0, 1]),
         ])
-        self.assertEqual(len(ctxt.variables.method_calls), 2)
-        mock_init.assert_called_once_with(
-            gh, pull, pull._last_commit, 'https://status.example.com/', {
-                'status': 'success',
-                'text': 'Tests passed!',
-                'url': 'https://status.example.com/',
-            }, 'repo', 'repo-url', 'branch',
-            'change-repo-url', 'change-branch')
+        self.assertEqual(obj.runs, 5)
+        for idx, (ext, _variables) in enumerate(pulls):
+            ext._finish_status.assert_called_once_with(ctxt, result[idx])
         ctxt.emit.assert_has_calls([
-            mock.call('Github plugin activated'),
-            mock.call('Testing pull request some/repo#5'),
-            mock.call('Base repository repo-url', level=2),
-            mock.call('PR repository change-repo-url', level=2),
+            mock.call('Testing of 4 pull requests failed; bisecting'),
+            mock.call('Testing of 2 pull requests failed; bisecting'),
         ])
-        self.assertEqual(ctxt.emit.call_count, 4)
-        self.assertFalse(mock_exit.called)
 
-    def test_init(self):
-        result = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
-            'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
+    def test_test_not_culprit(self):
+        pulls = self.make_pulls(3)
+        obj = timid_github.MergeQueueExtension(pulls)
+        obj._run_group = mock.Mock(
+            side_effect=self.make_run_group([1], culprit=False))
+        ctxt = mock.Mock()
 
-        self.assertEqual(result.gh, 'gh')
-        self.assertEqual(result.pull, 'pull')
-        self.assertEqual(result.last_commit, 'last_commit')
-        self.assertEqual(result.status_url, 'status_url')
-        self.assertEqual(result.final_status, 'final_status')
-        self.assertEqual(result.repo_name, 'repo_name')
-        self.assertEqual(result.repo_url, 'repo_url')
-        self.assertEqual(result.repo_branch, 'repo_branch')
-        self.assertEqual(result.change_url, 'change_url')
-        self.assertEqual(result.change_branch, 'change_branch')
-        self.assertEqual(result.last_status, None)
+        result = obj._test(ctxt)
 
-    def test_set_status_base(self):
+        self.assertEqual(result, ['Test step failure'] * 3)
+        obj._run_group.assert_called_once_with(ctxt, [0, 1, 2], [])
+        for ext, _variables in pulls:
+            ext._finish_status.assert_called_once_with(
+                ctxt, 'Test step failure')
+
+    def test_finalize(self):
+        pulls = self.make_pulls(3)
+        obj = timid_github.MergeQueueExtension(pulls)
+        obj._run_group = mock.Mock(side_effect=self.make_run_group([0]))
+
+        result = obj.finalize(mock.Mock(), None)
+
+        self.assertEqual(result, 'Testing failed for 1 of 3 pull requests: '
+                         'org/repo#0')
+        self.assertEqual(obj._run_group.call_count, 3)
+
+
+class TestScaling(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.now = 1000.0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_pull(self, commits):
+        return mock.Mock(**{
+            'number': 5,
+            'commits': commits,
+            'get_commits.return_value': [mock.Mock()
+                                         for _idx in range(commits)],
+            'base.repo.full_name': 'org/repo',
+            'base.repo.name': 'repo',
+            'base.repo.clone_url': 'https://github.com/org/repo.git',
+            'base.ref': 'master',
+            'head.repo.clone_url': 'https://github.com/user/repo.git',
+            'head.ref': 'feature',
+            'head.sha': 'head-sha',
+            'user.login': 'user',
+        })
+
+    def run_pull(self, commits, steps, *extra):
+        pull = self.make_pull(commits)
+        child = mock.Mock(returncode=0, **{
+            'communicate.return_value': (b'', b''),
+        })
+        ctxt = mock.Mock(**{
+            'environment.cwd': self.tmpdir,
+            'environment.call.return_value': child,
+        })
+        parser = timid_github.argparse.ArgumentParser()
+        timid_github.GithubExtension.prepare(parser)
+        args = parser.parse_args([
+            '--github-pull', 'org/repo#5',
+            '--github-user', 'user',
+            '--github-pass', 'pass',
+            '--github-repo', 'https',
+            '--github-cache-dir', os.path.join(self.tmpdir, 'cache'),
+        ] + list(extra))
+
+        with mock.patch.object(timid_github.github, 'Github') as mock_Github:
+            gh = mock_Github.return_value
+            gh.get_repo.return_value.get_pull.return_value = pull
+            ext = timid_github.GithubExtension.activate(ctxt, args)
+            step_list = [mock.Mock(**{
+                'action': None,
+                'return_value': timid.StepResult(state=timid.SUCCESS),
+            }) for _idx in range(steps)]
+            ext.read_steps(ctxt, step_list)
+            for idx, step in enumerate(step_list):
+                ext.pre_step(ctxt, step, idx)
+                result = step(ctxt)
+                self.assertTrue(result, result.msg)
+                ext.post_step(ctxt, step, idx, result)
+            ext.finalize(ctxt, None)
+
+        self.assertFalse(pull.get_commits.called)
+        statuses = pull.base.repo.get_commit.return_value.create_status
+        return (ctxt.environment.call.call_count,
+                len(mock_Github.mock_calls), statuses.call_count)
+
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_clone_merge_constant_in_commits_and_steps(self, mock_time):
+        # Steps finishing within the status interval
+        results = dict(((commits, steps),
+                        self.run_pull(commits, steps,
+                                      '--github-status-interval', '5'))
+                       for commits in (1, 100, 300)
+                       for steps in (1, 100, 1000))
+
+        # Cloning and merging spawn a fixed number of git processes,
+        # and neither they nor the Github calls depend on the size of
+        # the pull request or the number of steps
+        spawns, requests, statuses = results[1, 1]
+        self.assertTrue(spawns <= 13, spawns)
+        self.assertTrue(requests <= 6, requests)
+        self.assertEqual(statuses, 2)
+        for key, result in results.items():
+            self.assertEqual(result, (spawns, requests, statuses), key)
+
+    @mock.patch.object(timid_github.time, 'time', return_value=1000.0)
+    def test_status_every_step_by_default(self, mock_time):
+        # Without --github-status-interval, every step updates the
+        # status
+        one = self.run_pull(1, 1)[2]
+        ten = self.run_pull(1, 10)[2]
+
+        self.assertEqual(ten - one, 9)
+
+    def run_steps(self, count, duration=0.0):
         last_commit = mock.Mock()
-        ctxt = mock.Mock()
         obj = timid_github.GithubExtension(
-            'gh', 'pull', last_commit, 'status_url', 'final_status',
+            mock.Mock(), 'pull', last_commit, 'status_url',
+            {'status': 'success', 'text': 'passed', 'url': None},
             'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
+            'change_url', 'change_branch', status_interval=5.0,
+            status_async=False,
+            queue=None)
+        ctxt = mock.Mock()
 
-        obj._set_status(ctxt, 'pending')
+        for idx in range(count):
+            step = mock.Mock(action=None)
+            step.name = 'Step %d' % idx
+            obj.pre_step(ctxt, step, idx)
+            self.now += duration
+            obj.post_step(ctxt, step, idx,
+                          timid.StepResult(state=timid.SUCCESS))
+        obj.finalize(ctxt, None)
+
+        return last_commit.create_status.call_count
+
+    @mock.patch.object(timid_github.time, 'time')
+    def test_status_calls_bounded_by_duration(self, mock_time):
+        # Pending updates are limited by the time the run takes, not
+        # by its step count: at most one per status interval, plus
+        # the final status
+        mock_time.side_effect = lambda: self.now
+        for count in (1, 100, 1000):
+            start = self.now
+            result = self.run_steps(count, 1.0)
+            self.assertTrue(
+                result <= (self.now - start) // 5.0 + 2, (count, result))
+
+
+class TestNextLink(unittest.TestCase):
+    def test_none(self):
+        self.assertEqual(timid_github._next_link(None), None)
+
+    def test_last_page(self):
+        self.assertEqual(timid_github._next_link(
+            '<https://api/x?page=1>; rel="first", '
+            '<https://api/x?page=2>; rel="prev"'), None)
+
+    def test_next(self):
+        self.assertEqual(timid_github._next_link(
+            '<https://api/x?page=3>; rel="next", '
+            '<https://api/x?page=5>; rel="last"'), 'https://api/x?page=3')
+
+
+class TestPullWatcher(unittest.TestCase):
+    url = 'https://api/repos/org/repo/pulls?state=open&per_page=100'
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'watch.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_resp(self, pulls, etag='"etag"', link=None):
+        headers = {'ETag': etag, 'Link': link}
+        return mock.Mock(**{
+            'read.return_value': json.dumps([
+                {'number': number, 'head': {'sha': sha}}
+                for number, sha in pulls]).encode('utf-8'),
+            'info.return_value.get.side_effect': headers.get,
+        })
 
-        self.assertEqual(obj.last_status, {
-            'status': 'pending',
-            'text': None,
-            'url': None,
+    def not_modified(self):
+        return six.moves.urllib.error.HTTPError(
+            self.url, 304, 'Not Modified', {}, None)
+
+    def test_init(self):
+        timid_github._write_json(self.path, {
+            'pages': 'pages',
+            'heads': 'heads',
         })
-        last_commit.create_status.assert_called_once_with(
-            'pending', github.GithubObject.NotSet,
-            github.GithubObject.NotSet)
+
+        result = timid_github.PullWatcher(
+            'https://api/', ['org/repo'], self.path, 'token t')
+
+        self.assertEqual(result.api, 'https://api')
+        self.assertEqual(result.repos, ['org/repo'])
+        self.assertEqual(result.auth, 'token t')
+        self.assertEqual(result.pages, 'pages')
+        self.assertEqual(result.heads, 'heads')
+
+    def test_init_nostate(self):
+        result = timid_github.PullWatcher('https://api', [], self.path)
+
+        self.assertEqual(result.pages, {})
+        self.assertEqual(result.heads, {})
+
+    @mock.patch.object(six.moves.urllib.request, 'urlopen')
+    def test_page(self, mock_urlopen):
+        mock_urlopen.return_value = self.make_resp(
+            [(1, 'sha1')], link='<https://api/next>; rel="next"')
+        obj = timid_github.PullWatcher(
+            'https://api', ['org/repo'], self.path, 'token t')
+
+        result = obj._page(self.url)
+
+        self.assertEqual(result, ([[1, 'sha1']], 'https://api/next'))
+        req = mock_urlopen.call_args[0][0]
+        self.assertEqual(req.get_full_url(), self.url)
+        self.assertEqual(req.get_header('Authorization'), 'token t')
+        self.assertEqual(req.get_header('If-none-match'), None)
+        self.assertEqual(obj.pages, {self.url: {
+            'etag': '"etag"',
+            'pulls': [[1, 'sha1']],
+            'next': 'https://api/next',
+        }})
+        self.assertEqual(obj.requests, 1)
+        self.assertEqual(obj.not_modified, 0)
+        mock_urlopen.return_value.close.assert_called_once_with()
+
+    @mock.patch.object(six.moves.urllib.request, 'urlopen')
+    def test_page_not_modified(self, mock_urlopen):
+        mock_urlopen.side_effect = self.not_modified()
+        obj = timid_github.PullWatcher('https://api', [], self.path)
+        obj.pages[self.url] = {
+            'etag': '"etag"',
+            'pulls': [[1, 'sha1']],
+            'next': None,
+        }
+
+        result = obj._page(self.url)
+
+        self.assertEqual(result, ([[1, 'sha1']], None))
+        req = mock_urlopen.call_args[0][0]
+        self.assertEqual(req.get_header('If-none-match'), '"etag"')
+        self.assertEqual(obj.requests, 1)
+        self.assertEqual(obj.not_modified, 1)
+
+    @mock.patch.object(six.moves.urllib.request, 'urlopen')
+    def test_page_error(self, mock_urlopen):
+        mock_urlopen.side_effect = six.moves.urllib.error.HTTPError(
+            self.url, 404, 'Not Found', {}, None)
+        obj = timid_github.PullWatcher('https://api', [], self.path)
+
+        self.assertRaises(six.moves.urllib.error.HTTPError, obj._page,
+                          self.url)
+
+    @mock.patch.object(six.moves.urllib.request, 'urlopen')
+    def test_page_noetag(self, mock_urlopen):
+        mock_urlopen.return_value = self.make_resp([(1, 'sha1')], etag=None)
+        obj = timid_github.PullWatcher('https://api', [], self.path)
+        obj.pages[self.url] = {'etag': '"old"', 'pulls': [], 'next': None}
+
+        result = obj._page(self.url)
+
+        self.assertEqual(result, ([[1, 'sha1']], None))
+        self.assertEqual(obj.pages, {})
+
+    @mock.patch.object(timid_github.PullWatcher, '_page')
+    def test_poll(self, mock_page):
+        pages = {
+            self.url: ([[1, 'new1'], [2, 'same2']], 'https://api/page2'),
+            'https://api/page2': ([[3, 'new3']], None),
+        }
+        mock_page.side_effect = lambda url: pages[url]
+        ctxt = mock.Mock()
+        obj = timid_github.PullWatcher('https://api', ['org/repo'],
+                                       self.path)
+        obj.heads = {
+            'org/repo#1': 'old1',
+            'org/repo#2': 'same2',
+            'org/repo#4': 'closed4',
+            'org/other#1': 'other1',
+        }
+
+        result = obj.poll(ctxt)
+
+        self.assertEqual(result, [
+            ('org/repo#1', 'new1'),
+            ('org/repo#3', 'new3'),
+        ])
+        self.assertEqual(obj.heads, {
+            'org/repo#1': 'new1',
+            'org/repo#2': 'same2',
+            'org/repo#3': 'new3',
+            'org/other#1': 'other1',
+        })
+        self.assertEqual(timid_github._read_json(self.path), {
+            'pages': {},
+            'heads': obj.heads,
+        })
+        self.assertFalse(ctxt.emit.called)
+
+    @mock.patch.object(timid_github.PullWatcher, '_page',
+                       side_effect=IOError('connection refused'))
+    def test_poll_failure(self, mock_page):
+        ctxt = mock.Mock()
+        obj = timid_github.PullWatcher('https://api', ['org/repo'],
+                                       self.path)
+        obj.heads = {'org/repo#1': 'sha1'}
+
+        result = obj.poll(ctxt)
+
+        self.assertEqual(result, [])
+        self.assertEqual(obj.heads, {'org/repo#1': 'sha1'})
         ctxt.emit.assert_called_once_with(
-            'Changing status to "pending" (text "None")',
-            debug=True)
+            'Unable to list pull requests of org/repo: connection refused')
 
-    def test_set_status_alt(self):
-        last_commit = mock.Mock()
+    @mock.patch.object(timid_github, '_write_json',
+                       side_effect=OSError('read-only'))
+    @mock.patch.object(timid_github.PullWatcher, '_page',
+                       return_value=([], None))
+    def test_poll_save_failure(self, mock_page, mock_write_json):
+        ctxt = mock.Mock()
+        obj = timid_github.PullWatcher('https://api', ['org/repo'],
+                                       self.path)
+
+        result = obj.poll(ctxt)
+
+        self.assertEqual(result, [])
+        ctxt.emit.assert_called_once_with(
+            'Unable to save watch state in %s: read-only' % self.path)
+
+
+class TestAuthHeader(unittest.TestCase):
+    def test_none(self):
+        self.assertEqual(timid_github._auth_header('user', None), None)
+
+    def test_token(self):
+        self.assertEqual(timid_github._auth_header(None, 'abc'),
+                         'token abc')
+
+    def test_basic(self):
+        self.assertEqual(timid_github._auth_header('user', 'pass'),
+                         'Basic dXNlcjpwYXNz')
+
+
+class TestStartCommand(unittest.TestCase):
+    @mock.patch.object(timid_github.subprocess, 'Popen')
+    def test_base(self, mock_Popen):
         ctxt = mock.Mock()
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', last_commit, 'status_url', 'final_status',
-            'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
 
-        obj._set_status(ctxt, 'pending', 'text', 'url')
+        result = timid_github._start_command(
+            ctxt, ['timid', '--github-pull', '{pull}', '--sha={sha}'],
+            'org/repo#1', 'abc', {'VAR': 'value'})
 
-        self.assertEqual(obj.last_status, {
-            'status': 'pending',
-            'text': 'text',
-            'url': 'url',
-        })
-        last_commit.create_status.assert_called_once_with(
-            'pending', 'url', 'text')
-        ctxt.emit.assert_called_once_with(
-            'Changing status to "pending" (text "text", url url)',
-            debug=True)
+        self.assertEqual(result, mock_Popen.return_value)
+        mock_Popen.assert_called_once_with(
+            ['timid', '--github-pull', 'org/repo#1', '--sha=abc'],
+            env={'VAR': 'value'})
+        ctxt.emit.assert_called_once_with('Testing org/repo#1 at abc')
 
-    @mock.patch.object(timid_github, 'CloneAction', return_value='clone')
-    @mock.patch.object(timid_github, 'MergeAction', return_value='merge')
-    @mock.patch.object(timid_github.timid, 'Step',
-                       side_effect=lambda addr, action, name, description:
-                       "%s#%s" % (addr, action))
-    @mock.patch.object(timid_github.timid, 'StepAddress',
-                       side_effect=lambda x, y: '%s:%s' % (x, y))
-    def test_read_steps(self, mock_StepAddress, mock_Step, mock_MergeAction,
-                        mock_CloneAction):
-        fname = inspect.getsourcefile(timid_github.GithubExtension)
+    @mock.patch.object(timid_github.subprocess, 'Popen',
+                       side_effect=OSError('not found'))
+    def test_missing(self, mock_Popen):
         ctxt = mock.Mock()
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
-            'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
-        steps = ['step0', 'step1', 'step2']
 
-        obj.read_steps(ctxt, steps)
+        result = timid_github._start_command(ctxt, ['timid'], 'org/repo#1',
+                                             'abc')
 
-        self.assertEqual(steps, [
-            '%s:0#clone' % fname, '%s:1#merge' % fname,
-            'step0', 'step1', 'step2',
+        self.assertEqual(result, None)
+        ctxt.emit.assert_called_with('Unable to run "timid": not found')
+
+
+class TestQueueUpdates(unittest.TestCase):
+    def test_base(self):
+        ctxt = mock.Mock()
+        queue = mock.Mock(**{'push.side_effect': [[], ['a', 'b']]})
+
+        timid_github._queue_updates(ctxt, queue, [
+            ('org/repo#1', 'c', None),
+            ('org/repo#2', 'd', '{}'),
         ])
-        ctxt.emit.assert_called_once_with(
-            'Prepending clone and merge steps', debug=True)
-        mock_CloneAction.assert_called_once_with(ctxt, obj)
-        mock_MergeAction.assert_called_once_with(ctxt, obj)
-        mock_StepAddress.assert_has_calls([
-            mock.call(fname, 0),
-            mock.call(fname, 1),
+
+        queue.push.assert_has_calls([
+            mock.call('org/repo#1', 'c', None),
+            mock.call('org/repo#2', 'd', '{}'),
         ])
-        self.assertEqual(mock_StepAddress.call_count, 2)
-        mock_Step.assert_has_calls([
-            mock.call('%s:0' % fname, 'clone', name='Cloning repository',
-                      description='Clone the Github repository'),
-            mock.call('%s:1' % fname, 'merge', name='Merging pull request',
-                      description='Merge the Github pull request'),
+        ctxt.emit.assert_has_calls([
+            mock.call('Dropping superseded run of org/repo#2 at a'),
+            mock.call('Dropping superseded run of org/repo#2 at b'),
         ])
-        self.assertEqual(mock_Step.call_count, 2)
+        self.assertEqual(ctxt.emit.call_count, 2)
 
-    @mock.patch.object(timid_github.GithubExtension, '_set_status')
-    def test_pre_step(self, mock_set_status):
-        step = mock.Mock()
-        step.name = 'Step'
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
-            'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
 
-        result = obj.pre_step('ctxt', step, 5)
+class TestRunQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'queue.json')
 
-        self.assertEqual(result, None)
-        mock_set_status.assert_called_once_with(
-            'ctxt', 'pending', 'Step', 'status_url')
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
 
-    @mock.patch.object(timid_github.GithubExtension, '_set_status')
-    def test_post_step_skipped(self, mock_set_status):
-        step = mock.Mock()
-        step.name = 'Step'
-        result = timid.StepResult(state=timid.SKIPPED)
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
-            'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
+    def test_init(self):
+        result = timid_github.RunQueue(self.path)
+
+        self.assertEqual(result.path, self.path)
+        self.assertEqual(result.lock_path, self.path + '.lock')
+        self.assertEqual(result._mtime, None)
+        self.assertEqual(result._heads, {})
+
+    def test_push_pop(self):
+        obj = timid_github.RunQueue(self.path)
+
+        self.assertEqual(obj.push('org/repo#1', 'a'), [])
+        self.assertEqual(obj.push('org/repo#2', 'b', '{}'), [])
+        self.assertEqual(len(obj), 2)
+        self.assertEqual(obj.pop(), ('org/repo#1', 'a', None))
+        self.assertEqual(obj.pop(), ('org/repo#2', 'b', '{}'))
+        self.assertEqual(obj.pop(), None)
+        self.assertEqual(len(obj), 0)
+
+    def test_push_supersedes(self):
+        obj = timid_github.RunQueue(self.path)
+        obj.push('org/repo#1', 'a')
+        obj.push('org/repo#2', 'b')
+
+        result = obj.push('org/repo#1', 'c')
+
+        self.assertEqual(result, ['a'])
+        self.assertEqual(obj.pop(), ('org/repo#2', 'b', None))
+        self.assertEqual(obj.pop(), ('org/repo#1', 'c', None))
+        self.assertEqual(timid_github._read_json(self.path)['heads'], {
+            'org/repo#1': 'c',
+            'org/repo#2': 'b',
+        })
 
-        obj.post_step('ctxt', step, 5, result)
+    def test_len_missing(self):
+        obj = timid_github.RunQueue(self.path)
 
-        self.assertFalse(mock_set_status.called)
+        self.assertEqual(len(obj), 0)
 
-    @mock.patch.object(timid_github.GithubExtension, '_set_status')
-    def test_post_step_success(self, mock_set_status):
-        step = mock.Mock()
-        step.name = 'Step'
-        result = timid.StepResult(state=timid.SUCCESS)
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
-            'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
+    def test_done(self):
+        obj = timid_github.RunQueue(self.path)
+        obj.push('org/repo#1', 'a')
+        obj.push('org/repo#2', 'b')
+        obj.pop()
+        obj.push('org/repo#1', 'c')
 
-        obj.post_step('ctxt', step, 5, result)
+        obj.done('org/repo#1', 'a')
+        obj.done('org/repo#2', 'b')
 
-        self.assertFalse(mock_set_status.called)
+        self.assertEqual(timid_github._read_json(self.path)['heads'], {
+            'org/repo#1': 'c',
+        })
 
-    @mock.patch.object(timid_github.GithubExtension, '_set_status')
-    def test_post_step_failure_nomsg(self, mock_set_status):
-        step = mock.Mock()
-        step.name = 'Step'
-        result = timid.StepResult(state=timid.FAILURE)
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
-            'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
+    def test_superseded(self):
+        obj = timid_github.RunQueue(self.path)
+        other = timid_github.RunQueue(self.path)
+        other.push('org/repo#1', 'a')
 
-        obj.post_step('ctxt', step, 5, result)
+        self.assertEqual(obj.superseded('org/repo#1', 'a'), None)
+        self.assertEqual(obj.superseded('org/repo#2', 'b'), None)
 
-        mock_set_status.assert_called_once_with(
-            'ctxt', 'failure', 'Failed: Step', 'status_url')
+        other.push('org/repo#1', 'c')
+        os.utime(self.path, (0, 12345))
 
-    @mock.patch.object(timid_github.GithubExtension, '_set_status')
-    def test_post_step_failure_withmsg(self, mock_set_status):
-        step = mock.Mock()
-        step.name = 'Step'
-        result = timid.StepResult(state=timid.FAILURE, msg='message')
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
-            'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
+        self.assertEqual(obj.superseded('org/repo#1', 'a'), 'c')
+        self.assertEqual(obj.superseded('org/repo#1', 'c'), None)
 
-        obj.post_step('ctxt', step, 5, result)
+    def test_superseded_missing(self):
+        obj = timid_github.RunQueue(self.path)
 
-        mock_set_status.assert_called_once_with(
-            'ctxt', 'failure', 'message', 'status_url')
+        self.assertEqual(obj.superseded('org/repo#1', 'a'), None)
 
-    @mock.patch.object(timid_github.GithubExtension, '_set_status')
-    def test_post_step_error_nomsg(self, mock_set_status):
-        step = mock.Mock()
-        step.name = 'Step'
-        result = timid.StepResult(state=timid.ERROR)
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
-            'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
+    @mock.patch.object(timid_github, '_read_json',
+                       return_value={'heads': {'org/repo#1': 'c'}})
+    def test_superseded_cached(self, mock_read_json):
+        with open(self.path, 'w') as f:
+            f.write('{}')
+        obj = timid_github.RunQueue(self.path)
 
-        obj.post_step('ctxt', step, 5, result)
+        for _idx in range(3):
+            self.assertEqual(obj.superseded('org/repo#1', 'a'), 'c')
 
-        mock_set_status.assert_called_once_with(
-            'ctxt', 'error', 'Error: Step', 'status_url')
+        mock_read_json.assert_called_once_with(self.path)
 
-    @mock.patch.object(timid_github.GithubExtension, '_set_status')
-    def test_post_step_error_withmsg(self, mock_set_status):
-        step = mock.Mock()
-        step.name = 'Step'
-        result = timid.StepResult(state=timid.ERROR, msg='message')
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
-            'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
+    def test_cancel(self):
+        obj = timid_github.RunQueue(self.path)
+        obj.push('org/repo#1', 'a')
+        obj.push('org/repo#2', 'b')
 
-        obj.post_step('ctxt', step, 5, result)
+        result = obj.cancel('org/repo#1')
 
-        mock_set_status.assert_called_once_with(
-            'ctxt', 'error', 'message', 'status_url')
+        self.assertEqual(result, ['a'])
+        self.assertEqual(obj.cancel('org/repo#3'), [])
+        self.assertEqual(timid_github._read_json(self.path), {
+            'pending': [['org/repo#2', 'b', None]],
+            'heads': {'org/repo#2': 'b'},
+        })
 
-    @mock.patch.object(timid_github.GithubExtension, '_set_status')
-    def test_post_step_other_nomsg(self, mock_set_status):
-        step = mock.Mock()
-        step.name = 'Step'
-        result = timid.StepResult(state=5)
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
-            'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
 
-        obj.post_step('ctxt', step, 5, result)
+class TestWatchMain(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'watch.json')
+        self.queue_path = os.path.join(self.tmpdir, 'queue.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @mock.patch.object(timid_github, '_start_command')
+    @mock.patch.object(timid_github, 'PullWatcher')
+    def test_once(self, mock_PullWatcher, mock_start_command):
+        mock_start_command.side_effect = [
+            mock.Mock(**{'wait.return_value': 0}),
+            mock.Mock(**{'wait.return_value': 1}),
+            None,
+        ]
+        watcher = mock_PullWatcher.return_value
+        watcher.poll.return_value = [('org/repo#1', 'a'), ('org/repo#2', 'b'),
+                                     ('org/repo#3', 'c')]
+
+        result = timid_github.watch_main([
+            'org/repo', '--api', 'https://api', '--token', 'abc',
+            '--state', self.path, '--queue', self.queue_path, '--once',
+            '--', 'timid', '{pull}',
+        ])
 
-        mock_set_status.assert_called_once_with(
-            'ctxt', 'error', 'Unknown timid state "5" during step: Step',
-            'status_url')
+        self.assertEqual(result, 1)
+        mock_PullWatcher.assert_called_once_with(
+            'https://api', ['org/repo'], self.path, 'token abc')
+        mock_start_command.assert_has_calls([
+            mock.call(mock.ANY, ['timid', '{pull}'], 'org/repo#1', 'a',
+                      mock.ANY),
+            mock.call(mock.ANY, ['timid', '{pull}'], 'org/repo#2', 'b',
+                      mock.ANY),
+            mock.call(mock.ANY, ['timid', '{pull}'], 'org/repo#3', 'c',
+                      mock.ANY),
+        ])
+        env = mock_start_command.call_args[0][4]
+        self.assertEqual(env['TIMID_GITHUB_QUEUE'], self.queue_path)
+        self.assertEqual(timid_github._read_json(self.queue_path),
+                         {'pending': [], 'heads': {}})
 
-    @mock.patch.object(timid_github.GithubExtension, '_set_status')
-    def test_post_step_other_withmsg(self, mock_set_status):
-        step = mock.Mock()
-        step.name = 'Step'
-        result = timid.StepResult(state='other', msg='message')
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', 'final_status',
-            'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
+    @mock.patch.object(timid_github.keyring, 'get_password',
+                       return_value='pass')
+    @mock.patch.object(timid_github, '_start_command')
+    @mock.patch.object(timid_github, 'PullWatcher')
+    def test_ignore_existing(self, mock_PullWatcher, mock_start_command,
+                             mock_get_password):
+        watcher = mock_PullWatcher.return_value
+        watcher.poll.return_value = [('org/repo#1', 'a')]
+
+        result = timid_github.watch_main([
+            'org/repo', '--api', 'https://api', '--user', 'user',
+            '--token', '', '--state', self.path, '--queue', self.queue_path,
+            '--ignore-existing', '--once', '--', 'timid',
+        ])
 
-        obj.post_step('ctxt', step, 5, result)
+        self.assertEqual(result, 0)
+        mock_get_password.assert_called_once_with(
+            'timid-github!https://api', 'user')
+        mock_PullWatcher.assert_called_once_with(
+            'https://api', ['org/repo'], self.path, 'Basic dXNlcjpwYXNz')
+        self.assertFalse(mock_start_command.called)
+
+    @mock.patch.object(timid_github.time, 'sleep',
+                       side_effect=[None, None, TestException('stop')])
+    @mock.patch.object(timid_github, '_start_command')
+    @mock.patch.object(timid_github, 'PullWatcher')
+    def test_loop(self, mock_PullWatcher, mock_start_command, mock_sleep):
+        procs = [
+            mock.Mock(**{'poll.side_effect': [None, 0]}),
+            mock.Mock(**{'poll.return_value': None}),
+        ]
+        mock_start_command.side_effect = procs
+        watcher = mock_PullWatcher.return_value
+        watcher.poll.side_effect = [
+            [], [('org/repo#1', 'a')], [('org/repo#1', 'b')],
+        ]
+
+        self.assertRaises(TestException, timid_github.watch_main, [
+            'org/repo', '--token', 'abc', '--state', self.path,
+            '--queue', self.queue_path, '--interval', '5', '--', 'timid',
+        ])
 
-        mock_set_status.assert_called_once_with(
-            'ctxt', 'error', 'message', 'status_url')
+        self.assertEqual(watcher.poll.call_count, 3)
+        self.assertEqual(mock_start_command.call_args_list, [
+            mock.call(mock.ANY, ['timid'], 'org/repo#1', 'a', mock.ANY),
+            mock.call(mock.ANY, ['timid'], 'org/repo#1', 'b', mock.ANY),
+        ])
+        self.assertEqual(procs[0].poll.call_count, 2)
+        self.assertFalse(procs[0].wait.called)
+        mock_sleep.assert_has_calls([mock.call(5.0)] * 3)
+        self.assertEqual(timid_github._read_json(self.queue_path),
+                         {'pending': [], 'heads': {'org/repo#1': 'b'}})
+
+    @mock.patch.object(timid_github.time, 'sleep',
+                       side_effect=[None, TestException('stop')])
+    @mock.patch.object(timid_github, '_start_command')
+    @mock.patch.object(timid_github, 'PullWatcher')
+    def test_loop_superseded(self, mock_PullWatcher, mock_start_command,
+                             mock_sleep):
+        proc = mock.Mock(**{'poll.return_value': None})
+        mock_start_command.return_value = proc
+        watcher = mock_PullWatcher.return_value
+        watcher.poll.side_effect = [
+            [('org/repo#1', 'a'), ('org/repo#2', 'b')],
+            [('org/repo#2', 'c')],
+        ]
+
+        self.assertRaises(TestException, timid_github.watch_main, [
+            'org/repo', '--token', 'abc', '--state', self.path,
+            '--queue', self.queue_path, '--', 'timid',
+        ])
 
-    @mock.patch.object(timid_github.GithubExtension, '_set_status')
-    def test_finalize_none(self, mock_set_status):
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', {
-                'status': 'success',
-                'text': 'Tests passed!',
-                'url': 'https://example.com',
-            }, 'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
+        mock_start_command.assert_called_once_with(
+            mock.ANY, ['timid'], 'org/repo#1', 'a', mock.ANY)
+        self.assertEqual(timid_github._read_json(self.queue_path), {
+            'pending': [['org/repo#2', 'c', None]],
+            'heads': {'org/repo#1': 'a', 'org/repo#2': 'c'},
+        })
 
-        result = obj.finalize('ctxt', None)
+    @mock.patch.object(timid_github, 'PullWatcher')
+    def test_nocommand(self, mock_PullWatcher):
+        with mock.patch.object(sys, 'stderr'):
+            self.assertRaises(SystemExit, timid_github.watch_main,
+                              ['org/repo', '--once'])
+
+        self.assertFalse(mock_PullWatcher.called)
+
+
+class TestVerifySignature(unittest.TestCase):
+    def sign(self, body):
+        return 'sha256=%s' % timid_github.hmac.new(
+            b'secret', body, timid_github.hashlib.sha256).hexdigest()
+
+    def test_valid(self):
+        self.assertTrue(timid_github._verify_signature(
+            b'secret', b'body', self.sign(b'body')))
+
+    def test_invalid(self):
+        self.assertFalse(timid_github._verify_signature(
+            b'secret', b'body', self.sign(b'other')))
+
+    def test_missing(self):
+        self.assertFalse(timid_github._verify_signature(
+            b'secret', b'body', None))
+
+    def test_sha1(self):
+        self.assertFalse(timid_github._verify_signature(
+            b'secret', b'body', 'sha1=0123456789abcdef'))
+
+
+class TestWebhookServer(unittest.TestCase):
+    def setUp(self):
+        self.jobs = six.moves.queue.Queue()
+        self.ctxt = mock.Mock()
+        self.queue = mock.Mock(**{'push.return_value': ['old']})
+        self.server = timid_github.WebhookServer(
+            ('127.0.0.1', 0), b'secret', self.jobs, self.ctxt, self.queue)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def post(self, payload, event='pull_request', signature=None):
+        body = json.dumps(payload).encode('utf-8')
+        if signature is None:
+            signature = 'sha256=%s' % timid_github.hmac.new(
+                b'secret', body, timid_github.hashlib.sha256).hexdigest()
+
+        conn = six.moves.http_client.HTTPConnection(
+            '127.0.0.1', self.server.server_address[1])
+        try:
+            conn.request('POST', '/', body, {
+                'Content-Type': 'application/json',
+                'X-GitHub-Event': event,
+                'X-Hub-Signature-256': signature,
+            })
+            resp = conn.getresponse()
+            return resp.status, resp.read().decode('utf-8').strip()
+        finally:
+            conn.close()
+
+    def make_payload(self, action='synchronize'):
+        return {
+            'action': action,
+            'pull_request': {
+                'number': 5,
+                'base': {'repo': {'full_name': 'org/repo'}},
+                'head': {'sha': 'abc'},
+            },
+        }
 
-        self.assertEqual(result, None)
-        mock_set_status.assert_called_once_with(
-            'ctxt', status='success', text='Tests passed!',
-            url='https://example.com')
+    def test_dispatch(self):
+        payload = self.make_payload()
 
-    @mock.patch.object(timid_github.GithubExtension, '_set_status')
-    def test_finalize_exception(self, mock_set_status):
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', {
-                'status': 'success',
-                'text': 'Tests passed!',
-                'url': 'https://example.com',
-            }, 'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
-        exc = TestException('some failure')
+        result = self.post(payload)
 
-        result = obj.finalize('ctxt', exc)
+        self.assertEqual(result, (202, 'Queued org/repo#5 at abc'))
+        self.assertEqual(self.jobs.get_nowait(), True)
+        self.queue.push.assert_called_once_with('org/repo#5', 'abc', mock.ANY)
+        raw = self.queue.push.call_args[0][2]
+        self.assertEqual(json.loads(raw), payload['pull_request'])
+        self.ctxt.emit.assert_has_calls([
+            mock.call('Queueing org/repo#5 at abc'),
+            mock.call('Dropping superseded run of org/repo#5 at old'),
+        ])
 
-        self.assertEqual(result, exc)
-        mock_set_status.assert_called_once_with(
-            'ctxt', 'error', 'Exception while running timid: some failure',
-            'status_url')
+    def test_bad_signature(self):
+        result = self.post(self.make_payload(), signature='sha256=00')
 
-    @mock.patch.object(timid_github.GithubExtension, '_set_status')
-    def test_finalize_string_no_last_status(self, mock_set_status):
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', {
-                'status': 'success',
-                'text': 'Tests passed!',
-                'url': 'https://example.com',
-            }, 'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
+        self.assertEqual(result, (401, 'Invalid signature'))
+        self.assertTrue(self.jobs.empty())
 
-        result = obj.finalize('ctxt', 'text')
+    def test_ping(self):
+        result = self.post({'zen': 'Keep it simple.'}, event='ping')
 
-        self.assertEqual(result, 'text')
-        self.assertFalse(mock_set_status.called)
+        self.assertEqual(result, (200, 'pong'))
 
-    @mock.patch.object(timid_github.GithubExtension, '_set_status')
-    def test_finalize_string_with_last_status_other(self, mock_set_status):
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', {
-                'status': 'success',
-                'text': 'Tests passed!',
-                'url': 'https://example.com',
-            }, 'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
-        obj.last_status = {
-            'status': 'other',
-        }
+    def test_other_event(self):
+        result = self.post({}, event='push')
 
-        result = obj.finalize('ctxt', 'text')
+        self.assertEqual(result, (200, 'Ignored event "push"'))
+        self.assertTrue(self.jobs.empty())
 
-        self.assertEqual(result, 'text')
-        self.assertFalse(mock_set_status.called)
+    def test_ignored_action(self):
+        result = self.post(self.make_payload('edited'))
 
-    @mock.patch.object(timid_github.GithubExtension, '_set_status')
-    def test_finalize_string_with_last_status_pending(self, mock_set_status):
-        obj = timid_github.GithubExtension(
-            'gh', 'pull', 'last_commit', 'status_url', {
-                'status': 'success',
-                'text': 'Tests passed!',
-                'url': 'https://example.com',
-            }, 'repo_name', 'repo_url', 'repo_branch',
-            'change_url', 'change_branch')
-        obj.last_status = {
-            'status': 'pending',
-        }
+        self.assertEqual(result, (200, 'Ignored action "edited"'))
+        self.assertTrue(self.jobs.empty())
+        self.assertFalse(self.queue.cancel.called)
 
-        result = obj.finalize('ctxt', 'text')
+    def test_closed(self):
+        self.queue.cancel.return_value = ['old']
 
-        self.assertEqual(result, 'text')
-        mock_set_status.assert_called_once_with(
-            'ctxt', 'failure', 'Testing failed: text', 'status_url')
+        result = self.post(self.make_payload('closed'))
+
+        self.assertEqual(result, (200, 'Cancelled org/repo#5'))
+        self.assertTrue(self.jobs.empty())
+        self.queue.cancel.assert_called_once_with('org/repo#5')
+        self.assertFalse(self.queue.push.called)
+        self.ctxt.emit.assert_any_call(
+            'Dropping run of closed org/repo#5 at old')
+
+    def test_bad_payload(self):
+        result = self.post({'action': 'opened'})
+
+        self.assertEqual(result[0], 400)
+        self.assertTrue(self.jobs.empty())
+
+    def post_length(self, length):
+        conn = six.moves.http_client.HTTPConnection(
+            '127.0.0.1', self.server.server_address[1])
+        try:
+            conn.putrequest('POST', '/')
+            conn.putheader('Content-Length', length)
+            conn.endheaders()
+            resp = conn.getresponse()
+            return resp.status, resp.read().decode('utf-8').strip()
+        finally:
+            conn.close()
+
+    def test_bad_length(self):
+        for length in ('abc', '-1'):
+            result = self.post_length(length)
+
+            self.assertEqual(result, (400, 'Invalid Content-Length'))
+        self.assertTrue(self.jobs.empty())
+
+    def test_too_large(self):
+        result = self.post_length(str(timid_github.WEBHOOK_MAX_BODY + 1))
+
+        self.assertEqual(result, (413, 'Payload too large'))
+
+
+class TestWebhookWorker(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.queue_path = os.path.join(self.tmpdir, 'queue.json')
+
+    def tearDown(self):
+        timid_github._github_clients = None
+        timid_github._github_passwords = None
+        shutil.rmtree(self.tmpdir)
+
+    @mock.patch.dict(timid_github.os.environ)
+    @mock.patch.object(timid_github.sys, 'stderr')
+    @mock.patch('timid.main.timid')
+    def test_base(self, mock_timid, mock_stderr):
+        mock_timid.console.side_effect = [None, 'Test step failure',
+                                          SystemExit('exited')]
+        queue = timid_github.RunQueue(self.queue_path)
+        jobs = six.moves.queue.Queue()
+        for pull, sha, raw in (('org/repo#1', 'a', '{"number": 1}'),
+                               ('org/repo#2', 'x', '{"number": 2}'),
+                               ('org/repo#2', 'b', '{"number": 2}'),
+                               ('org/repo#3', 'c', '{"number": 3}')):
+            queue.push(pull, sha, raw)
+            jobs.put(True)
+        jobs.put(None)
+
+        timid_github._webhook_worker(jobs, ['test.yaml', '/work/{sha}'],
+                                     self.queue_path)
+
+        mock_timid.console.assert_has_calls([
+            mock.call(argv=['--github-pull', '{"number": 1}',
+                            'test.yaml', '/work/a']),
+            mock.call(argv=['--github-pull', '{"number": 2}',
+                            'test.yaml', '/work/b']),
+            mock.call(argv=['--github-pull', '{"number": 3}',
+                            'test.yaml', '/work/c']),
+        ])
+        mock_stderr.write.assert_has_calls([
+            mock.call('Testing org/repo#2 at b failed: Test step failure\n'),
+            mock.call('Testing org/repo#3 at c failed: exited\n'),
+        ])
+        self.assertEqual(mock_stderr.write.call_count, 2)
+        self.assertEqual(timid_github._github_clients, {})
+        self.assertEqual(timid_github._github_passwords, {})
+        self.assertEqual(timid_github.os.environ['TIMID_GITHUB_QUEUE'],
+                         self.queue_path)
+        self.assertEqual(timid_github._read_json(self.queue_path),
+                         {'pending': [], 'heads': {}})
+
+
+class TestWebhookMain(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.queue_path = os.path.join(self.tmpdir, 'queue.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @mock.patch.object(timid_github, 'WebhookServer', **{
+        'return_value.server_address': ('127.0.0.1', 8080),
+        'return_value.serve_forever.side_effect': KeyboardInterrupt(),
+    })
+    @mock.patch('multiprocessing.Process')
+    @mock.patch('multiprocessing.Queue')
+    def test_base(self, mock_Queue, mock_Process, mock_WebhookServer):
+        jobs = mock_Queue.return_value
+        timid_github.RunQueue(self.queue_path).push('org/repo#1', 'a')
+
+        result = timid_github.webhook_main([
+            '--secret', 'secret', '--workers', '3', '--queue',
+            self.queue_path, '--', 'test.yaml',
+        ])
+
+        self.assertEqual(result, 0)
+        self.assertEqual(mock_Process.call_count, 3)
+        mock_Process.assert_called_with(
+            target=timid_github._webhook_worker,
+            args=(jobs, ['test.yaml'], self.queue_path))
+        self.assertEqual(mock_Process.return_value.start.call_count, 3)
+        self.assertEqual(mock_Process.return_value.join.call_count, 3)
+        mock_WebhookServer.assert_called_once_with(
+            ('127.0.0.1', 8080), b'secret', jobs, mock.ANY, mock.ANY)
+        queue = mock_WebhookServer.call_args[0][4]
+        self.assertEqual(queue.path, self.queue_path)
+        mock_WebhookServer.return_value.server_close.assert_called_once_with()
+        self.assertEqual(jobs.put.call_args_list,
+                         [mock.call(True)] + [mock.call(None)] * 3)
+
+    @mock.patch('multiprocessing.Process')
+    def test_nosecret(self, mock_Process):
+        with mock.patch.object(sys, 'stderr'):
+            with mock.patch.dict(os.environ):
+                os.environ.pop('TIMID_GITHUB_WEBHOOK_SECRET', None)
+                self.assertRaises(SystemExit, timid_github.webhook_main,
+                                  ['--', 'test.yaml'])
+
+        self.assertFalse(mock_Process.called)
+
+    @mock.patch('multiprocessing.Process')
+    def test_noargs(self, mock_Process):
+        with mock.patch.object(sys, 'stderr'):
+            self.assertRaises(SystemExit, timid_github.webhook_main,
+                              ['--secret', 'secret'])
+
+        self.assertFalse(mock_Process.called)
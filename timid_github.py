@@ -13,21 +13,93 @@
 #    express or implied. See the License for the specific language
 #    governing permissions and limitations under the License.
 
+from __future__ import print_function
+
+import argparse
+import binascii
+import calendar
+import contextlib
+import cProfile
 import errno
 import getpass
+import hashlib
+import heapq
+import hmac
+import importlib
 import inspect
+import itertools
 import json
+import logging
 import os
 import shutil
+import socket
+import sqlite3
 import stat
 import subprocess
 import sys
+import threading
 import time
 
-import github
-import keyring
 import six
 import timid
+from timid import context
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+
+class _LazyModule(object):
+    """
+    A stand-in for a module which is not imported until one of its
+    attributes is first used.  ``timid`` loads every extension on
+    every invocation, so the slow imports of ``github`` and
+    ``keyring`` are deferred until the extension is actually
+    activated.
+    """
+
+    def __init__(self, name):
+        """
+        Initialize a ``_LazyModule`` object.
+
+        :param name: The name of the module.
+        """
+
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        """
+        Retrieve an attribute of the module, importing it if
+        necessary.
+
+        :param attr: The name of the attribute.
+
+        :returns: The value of the attribute.
+        """
+
+        return getattr(self.load(), attr)
+
+    def load(self):
+        """
+        Import the module now, if it has not already been imported.
+
+        :returns: The module.
+        """
+
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+
+github = _LazyModule('github')
+keyring = _LazyModule('keyring')
 
 
 SSH_ERROR = b'ssh_exchange_identification: Connection closed by remote host'
@@ -77,814 +149,5663 @@ def exc_to_result(func):
     return wrapper
 
 
-def _git(ctxt, *args, **kwargs):
-    """
-    Invoke a "git" subcommand.
+# Environment variables controlling profiling of the extension hooks
+PROFILE_DIR_ENV = 'TIMID_GITHUB_PROFILE_DIR'
+PROFILE_ENV = 'TIMID_GITHUB_PROFILE'
 
-    :param ctxt: The context object.
-    :param args: Positional arguments, specified as strings; the first
-                 must be a "git" subcommand, and remaining arguments
-                 will be passed to that subcommand.
-    :param ssh_retries: A keyword-only parameter specifying the number
-                        of retries to attempt.  If the command fails
-                        due to an SSH error, the command will be
-                        retried up to this many times.  This does not
-                        impact failures due to other connection
-                        errors.  Defaults to ``1``.
-    :param do_raise: A keyword-only parameter specifying whether to
-                     raise exceptions in the event of command
-                     failures.  If ``False``, no exception will be
-                     raised.  Defaults to ``True``.
+# A sequence number, to keep the names of profile dumps unique
+_profile_seq = itertools.count()
 
-    :returns: The contents of standard output.
+
+def profiled(name):
+    """
+    A decorator to profile a hook of the extension.  Profiling is
+    enabled by setting the "TIMID_GITHUB_PROFILE_DIR" environment
+    variable to the name of a directory, into which a dump is written
+    for each call.  The "TIMID_GITHUB_PROFILE" environment variable
+    selects the profilers, as a comma-separated list of "cprofile",
+    which writes a ``pstats`` file with the extension ".prof", and
+    "tracemalloc", which writes a ``tracemalloc.Snapshot`` with the
+    extension ".tracemalloc".  The default is "cprofile".
+
+    :param name: The name of the hook, used to name the dumps.
+
+    :returns: A decorator.
     """
 
-    # Extract keyword-only parameters
-    ssh_retries = kwargs.get('ssh_retries', 1)
-    do_raise = kwargs.get('do_raise', True)
+    def decorator(func):
+        @six.wraps(func)
+        def wrapper(*args, **kwargs):
+            directory = os.environ.get(PROFILE_DIR_ENV)
+            if not directory:
+                return func(*args, **kwargs)
+
+            kinds = set(kind.strip().lower() for kind in
+                        os.environ.get(PROFILE_ENV, 'cprofile').split(','))
+            base = os.path.join(directory, '%s.%d.%d' % (
+                name, os.getpid(), next(_profile_seq)))
+
+            # Start the requested profilers
+            profiler = None
+            if 'cprofile' in kinds:
+                profiler = cProfile.Profile()
+            tracing = False
+            if 'tracemalloc' in kinds and tracemalloc is not None:
+                tracing = not tracemalloc.is_tracing()
+                if tracing:
+                    tracemalloc.start(25)
+
+            if profiler is not None:
+                profiler.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                snapshot = None
+                if 'tracemalloc' in kinds and tracemalloc is not None:
+                    snapshot = tracemalloc.take_snapshot()
+                    if tracing:
+                        tracemalloc.stop()
+
+                # Write the dumps
+                try:
+                    if not os.path.isdir(directory):
+                        os.makedirs(directory)
+                    if profiler is not None:
+                        profiler.dump_stats(base + '.prof')
+                    if snapshot is not None:
+                        snapshot.dump(base + '.tracemalloc')
+                except (IOError, OSError) as e:
+                    sys.stderr.write('Unable to write profile %s: %s\n' %
+                                     (base, e))
+
+        return wrapper
+
+    return decorator
+
+
+def _read_json(path, default=None):
+    """
+    Read a JSON state file.
 
-    # Construct the full command
-    cmd = ['git']
-    cmd.extend(args)
+    :param path: The name of the file to read.
+    :param default: The value to return if the file does not exist
+                    or cannot be parsed.
 
-    # Construct the command text for debugging and error output
-    cmd_text = ' '.join(six.moves.shlex_quote(c) for c in cmd)
+    :returns: The decoded contents of the file, or ``default``.
+    """
 
-    # Loop the requisite number of times, with appropriate sleeps
-    sleep_time = 1
-    num_tries = 0
-    while num_tries < ssh_retries:
-        num_tries += 1
-        if num_tries > 1:
-            # Second or subsequent try; sleep with exponential backoff
-            time.sleep(sleep_time)
-            sleep_time <<= 1
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return default
 
-            ctxt.emit('Retry %d of %d: retrying command "%s"' %
-                      (num_tries, ssh_retries, cmd_text), debug=True)
-        else:
-            ctxt.emit('Executing command "%s"' % cmd_text, debug=True)
 
-        # Run the command
-        child = ctxt.environment.call(
-            cmd, close_fds=True, stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
-        stdout, stderr = child.communicate()
-        ctxt.emit('Command result: return code %d, stdout %r, stderr %r' %
-                  (child.returncode, stdout, stderr), debug=True)
+def _open_tmp(path, mode=None):
+    """
+    Create a temporary file next to a file which is to be atomically
+    replaced.  The name of the temporary file is unique to the calling
+    thread, and the file is created with its final mode, so its
+    contents are never visible with looser permissions.
 
-        # Do we need to retry?
-        if child.returncode and (SSH_ERROR in stdout or SSH_ERROR in stderr):
-            ctxt.emit('Retrying command after a sleep of %d seconds' %
-                      sleep_time, debug=True)
-            continue
+    :param path: The name of the file to be replaced.
+    :param mode: An optional file mode for the file.  If not given,
+                 the process umask applies.
 
-        # We have executed it!
-        break
-    else:
-        ctxt.emit('Too many tries, exiting instead', debug=True)
+    :returns: A tuple of the name of the temporary file and the file
+              object, open for writing.
+    """
 
-    if do_raise and child.returncode:
-        # Include stdout
-        text = stdout.strip()
-        if text:
-            msg = ('Git command "%s" returned %d: %s' %
-                   (cmd_text, child.returncode, text))
-        else:
-            msg = ('Git command "%s" returned %d' %
-                   (cmd_text, child.returncode))
+    tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(),
+                                 threading.current_thread().ident)
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL
+    mode = 0o666 if mode is None else mode
+    try:
+        fd = os.open(tmp_path, flags, mode)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
 
-        # Raise the exception
-        result = timid.StepResult(state=timid.ERROR, msg=msg,
-                                  returncode=child.returncode)
-        raise GitException(msg, result)
+        # Left over by a dead process which had the same process and
+        # thread IDs
+        os.unlink(tmp_path)
+        fd = os.open(tmp_path, flags, mode)
 
-    # Return the standard output
-    return stdout
+    return tmp_path, os.fdopen(fd, 'w')
 
 
-class CloneAction(timid.Action):
+def _write_json(path, data, mode=None):
     """
-    A Timid action that will clone the target repository.  The
-    repository will be cloned into the working directory.  This action
-    cannot appear in the test description, as it is implicitly added
-    by the ``GithubExtension`` extension.
+    Atomically write a JSON state file.  The data is written to a
+    temporary file in the same directory, which is then renamed over
+    the target, so concurrent readers never observe a partially
+    written file.  Any missing parent directories are created.
+
+    :param path: The name of the file to write.
+    :param data: The data to encode and write.
+    :param mode: An optional file mode for the file.
     """
 
-    schema = None
-
-    def __init__(self, ctxt, ghe):
-        """
-        Initialize a ``CloneAction`` instance.
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError as e:
+            # Another process may have created it
+            if e.errno != errno.EEXIST:
+                raise
 
-        :param ghe: An instance of ``GithubExtension``.
-        """
+    tmp_path, f = _open_tmp(path, mode)
+    with f:
+        json.dump(data, f)
+    os.rename(tmp_path, path)
 
-        # Initialize the superclass
-        super(CloneAction, self).__init__(ctxt, '__clone__', None, None)
 
-        # Store the github extension instance
-        self.ghe = ghe
+class FileLock(object):
+    """
+    An advisory lock on a file, used to coordinate access to state
+    shared between concurrent runs.  On platforms without ``fcntl``,
+    locking is a no-op.
+    """
 
-    def validate_conf(self, name, config, step_addr):
+    def __init__(self, path):
         """
-        Validate configuration.  This action does not take a
-        configuration, so the ``validate_conf()`` method is overridden
-        to inhibit validation.
+        Initialize a ``FileLock`` object.
 
-        :param name: The name of the action or modifier.
-        :param config: The actual configuration.
-        :param step_addr: The address of the step in the test
-                          configuration.
+        :param path: The name of the lock file.  It will be created,
+                     along with any missing parent directories, when
+                     the lock is first acquired.
         """
 
-        pass  # pragma: no cover
+        self.path = path
+        self.fd = None
 
-    @exc_to_result
-    def __call__(self, ctxt):
+    def acquire(self, shared=False, blocking=True):
         """
-        Invoke the action.  This method will clone the repository into the
-        correct directory, then switch to that directory.
+        Acquire the lock.
 
-        :param ctxt: The context object.
+        :param shared: If ``True``, acquire a shared lock; otherwise,
+                       an exclusive lock is acquired.
+        :param blocking: If ``False``, do not wait for the lock if it
+                         is held by another process.
 
-        :returns: A ``StepResult`` object.
+        :returns: ``True`` if the lock was acquired, ``False``
+                  otherwise.
         """
 
-        # First step, see if the repository exists
-        work_dir = ctxt.environment.cwd
-        repo_dir = os.path.join(work_dir, self.ghe.repo_name)
-        try:
-            dir_data = os.lstat(repo_dir)
-        except OSError as e:
-            # Re-raise the error if it's not ENOENT
-            if e.errno != errno.ENOENT:
-                msg = 'Unable to stat repo directory %s' % repo_dir
-                return timid.StepResult(msg=msg, exc_info=sys.exc_info())
+        if self.fd is None:
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.isdir(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
 
-            # OK, safe to clone from scratch
-            return self._clone(work_dir, repo_dir, ctxt)
+        if fcntl is None:  # pragma: no cover
+            return True
 
-        # Hmmm, the file exists; is it a directory?
-        if not stat.S_ISDIR(dir_data.st_mode):
-            # OK, we control the workdir, so delete the extraneous
-            # file and clone from scratch
-            ctxt.emit('Deleting file shadowing repository directory %s' %
-                      repo_dir, level=2)
-            os.remove(repo_dir)
-            return self._clone(work_dir, repo_dir, ctxt)
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
 
-        # It's a directory; is it a repository?
-        if os.path.isdir(os.path.join(repo_dir, '.git')):
-            # Try updating the base branch
-            try:
-                ctxt.environment.cwd = repo_dir
-                return self._update(ctxt)
-            except Exception:
-                # Failed to update, so back out of the directory
-                # temporarily
-                ctxt.emit('Failed to update existing repository in '
-                          'directory %s; starting from scratch' % repo_dir)
-                ctxt.environment.cwd = work_dir
+        try:
+            fcntl.flock(self.fd, flags)
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return False
 
-        # Not a repository, or couldn't update; blow it away and try
-        # cloning from scratch
-        ctxt.emit('Deleting directory tree shadowing repository directory %s' %
-                  repo_dir, level=2)
-        shutil.rmtree(repo_dir)
-        return self._clone(work_dir, repo_dir, ctxt)
+        return True
 
-    def _clone(self, work_dir, target_dir, ctxt):
+    def release(self):
+        """
+        Release the lock.
         """
-        Clones the base repository into the specified target directory.
 
-        :param work_dir: The current working directory.  This is used
-                         to restore the environment working directory
-                         in the event that the later call to
-                         ``self._update()`` fails.
-        :param target_dir: The directory into which the repository
-                           should be checked out.
-        :param ctxt: The context object.
+        fd, self.fd = self.fd, None
+        if fd is not None:
+            # Closing the file releases the lock
+            os.close(fd)
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """
+        A context manager which holds the lock exclusively.
         """
 
-        # Begin by cloning the repository
-        ctxt.emit('Cloning repository from %s into directory %s' %
-                  (self.ghe.repo_url, target_dir))
-        _git(ctxt, 'clone', self.ghe.repo_url, target_dir, ssh_retries=5)
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
 
-        # Change to the target directory and fetch any changes
+    @contextlib.contextmanager
+    def shared(self):
+        """
+        A context manager which holds the lock in shared mode.
+        """
+
+        self.acquire(shared=True)
         try:
-            ctxt.environment.cwd = target_dir
-            return self._update(ctxt)
-        except Exception:
-            exc_info = sys.exc_info()
+            yield
+        finally:
+            self.release()
 
-            # Reset the directory
-            ctxt.environment.cwd = work_dir
 
-            # Re-raise the exception
-            six.reraise(*exc_info)
+class Recorder(object):
+    """
+    Record structured performance events, such as git commands and
+    Github API calls, and dispatch them to a set of sinks.  A sink is
+    any object with a ``write()`` method accepting an event
+    dictionary, and optionally a ``close()`` method.  Events are
+    discarded if there are no sinks.  When tracing, each thread keeps
+    a stack of open spans, such as that of the step being run, and
+    each event records the innermost as its "parent_id".
+    """
 
-    def _update(self, ctxt):
-        """
-        Updates the repository, assumed to be the current working
-        directory, from the specified base repository.
+    # The logger PyGithub uses to report each HTTP request it makes
+    api_logger = 'github.Requester'
 
-        :param ctxt: The context object.
+    def __init__(self, sinks=None, tracer=None):
+        """
+        Initialize a ``Recorder`` object.
 
-        :returns: A ``timid.StepResult`` object.
+        :param sinks: An optional list of sinks to which events should
+                      be dispatched.
+        :param tracer: An optional ``TraceSink``.  It is added to the
+                       sinks, and is used to propagate the trace
+                       context to child processes.
         """
 
-        ctxt.emit('Updating repository from upstream data')
+        self.sinks = []
+        self.lock = threading.Lock()
+        self.tracer = tracer
+        self._filter = None
+        self._local = threading.local()
 
-        # Ensure the remote is set properly
-        _git(ctxt, 'remote', 'set-url', 'origin', self.ghe.repo_url)
+        for sink in sinks or []:
+            self.add_sink(sink)
+        if tracer is not None:
+            self.add_sink(tracer)
 
-        # Do some initial resets
-        ctxt.emit('Cleaning up repository...', level=2)
-        _git(ctxt, 'rebase', '--abort', do_raise=False)
-        _git(ctxt, 'checkout', '-f', self.ghe.repo_branch)
-        _git(ctxt, 'reset', '--hard', 'origin/%s' % self.ghe.repo_branch)
-        _git(ctxt, 'clean', '-fdx')
+    def add_sink(self, sink):
+        """
+        Add a sink to which events should be dispatched.
 
-        # And check out the designated branch
-        ctxt.emit('Checking out most recent version of branch %s' %
-                  self.ghe.repo_branch, level=2)
-        _git(ctxt, 'fetch', 'origin', self.ghe.repo_branch, ssh_retries=5)
-        _git(ctxt, 'checkout', self.ghe.repo_branch)
+        :param sink: The sink to add.
+        """
 
-        return timid.StepResult(state=timid.SUCCESS)
+        self.sinks.append(sink)
 
+    def _spans(self):
+        """
+        Retrieve the stack of spans open in the calling thread.
 
-class MergeAction(timid.Action):
-    """
-    A Timid action that will prepare a repository by creating and
-    checking out a topic branch and merging the pull request into that
-    branch.  This action cannot appear in the test description, as it
-    is implicitly added by the ``GithubExtension`` extension.
-    """
+        :returns: A list of span IDs, the innermost last.
+        """
 
-    schema = None
+        try:
+            return self._local.spans
+        except AttributeError:
+            self._local.spans = []
+            return self._local.spans
 
-    def __init__(self, ctxt, ghe):
+    def push_span(self):
         """
-        Initialize a ``MergeAction`` instance.
+        Open a span in the calling thread.  Until it is closed, it is
+        the parent of the events the thread records.
 
-        :param ghe: An instance of ``GithubExtension``.
+        :returns: The span ID, or ``None`` if not tracing.
         """
 
-        # Initialize the superclass
-        super(MergeAction, self).__init__(ctxt, '__merge__', None, None)
+        if self.tracer is None:
+            return None
 
-        # Store the github extension instance
-        self.ghe = ghe
+        span_id = self.tracer.new_span_id()
+        self._spans().append(span_id)
+        return span_id
 
-    def validate_conf(self, name, config, step_addr):
+    def pop_span(self, span_id):
         """
-        Validate configuration.  This action does not take a
-        configuration, so the ``validate_conf()`` method is overridden
-        to inhibit validation.
+        Close a span opened by ``push_span()``, along with any spans
+        opened within it which were not closed.
 
-        :param name: The name of the action or modifier.
-        :param config: The actual configuration.
-        :param step_addr: The address of the step in the test
-                          configuration.
+        :param span_id: The span ID.
         """
 
-        pass  # pragma: no cover
+        spans = self._spans()
+        if span_id in spans:
+            del spans[spans.index(span_id):]
 
-    @exc_to_result
-    def __call__(self, ctxt):
+    def observe_http(self):
+        """
+        Begin recording the individual HTTP requests made by PyGithub
+        as "http" events.  Observation ends when the recorder is
+        closed.
         """
-        Invoke the action.  This method will create the appropriate branch
-        and merge the pull request into it.
 
-        :param ctxt: The context object.
+        if self._filter is None:
+            logger = logging.getLogger(self.api_logger)
+            self._filter = _ApiLogFilter(self, logger)
+            logger.addFilter(self._filter)
+            logger.setLevel(logging.DEBUG)
 
-        :returns: A ``StepResult`` object.
+    def record(self, kind, **fields):
         """
+        Record an event.
 
-        # Compute a branch name
-        local_branch = ('%s-%s' %
-                        (self.ghe.pull.user.login, self.ghe.change_branch))
+        :param kind: The kind of event, e.g., "git" or "api".
+        :param fields: Additional fields describing the event.  If
+                       "start" is not given, the current time is used.
+        """
 
-        ctxt.emit('Cloning pull request from %s branch %s '
-                  'into local branch %s' %
-                  (self.ghe.pull.user.login, self.ghe.change_branch,
-                   local_branch))
+        if not self.sinks:
+            return
 
-        # Make sure the branch doesn't already exist
-        _git(ctxt, 'branch', '-D', local_branch, do_raise=False)
+        fields['type'] = kind
+        fields.setdefault('start', time.time())
+        if self.tracer is not None:
+            spans = self._spans()
+            if spans:
+                fields.setdefault('parent_id', spans[-1])
 
-        # Create the branch
-        _git(ctxt, 'checkout', '-b', local_branch, self.ghe.repo_branch)
-        _git(ctxt, 'pull', self.ghe.change_url, self.ghe.change_branch)
-
-        # Merge the change
-        ctxt.emit('Merging the change into branch %s' % self.ghe.repo_branch)
-        _git(ctxt, 'checkout', self.ghe.repo_branch)
-        _git(ctxt, 'merge', local_branch)
+        with self.lock:
+            for sink in self.sinks:
+                sink.write(fields)
 
-        return timid.StepResult(state=timid.SUCCESS)
+    def close(self):
+        """
+        Stop observing HTTP requests and close all the sinks.
+        """
 
+        if self._filter is not None:
+            logger = logging.getLogger(self.api_logger)
+            logger.removeFilter(self._filter)
+            logger.setLevel(self._filter.saved_level)
+            self._filter = None
 
-# A mapping of URL string to the attribute of the repository object
-# containing the desired URL.
-URL_ATTR = {
-    'ssh': 'ssh_url',
-    'git': 'git_url',
-    'https': 'clone_url',
-}
+        with self.lock:
+            for sink in self.sinks:
+                if hasattr(sink, 'close'):
+                    sink.close()
+            self.sinks = []
 
 
-def _select_url(repo_url, repo_obj):
+class _ApiLogFilter(logging.Filter):
+    """
+    A logging filter which observes the debugging messages PyGithub
+    logs for each HTTP request, and records them as "http" events.
+    The debugging messages are then suppressed, so that enabling them
+    does not alter what the application logs.
     """
-    Select the appropriate repository URL.
 
-    :param repo_url: The URL to select.  May be "ssh", "git", or
-                     "https" to select the appropriate URL from the
-                     ``repo_obj``, or may be a verbatim repository
-                     URL.
-    :param repo_obj: An instance of ``github.Repository.Repository``.
+    # The format of the message logged by PyGithub
+    api_format = '%s %s://%s%s %s %s ==> %i %s %s'
 
-    :returns: The appropriate repository URL.
+    def __init__(self, recorder, logger):
+        """
+        Initialize an ``_ApiLogFilter`` object.
+
+        :param recorder: The ``Recorder`` to record events with.
+        :param logger: The logger being observed.  Its current level
+                       is saved, so that messages below it may be
+                       suppressed.
+        """
+
+        super(_ApiLogFilter, self).__init__()
+
+        self.recorder = recorder
+        self.saved_level = logger.level
+        self.threshold = logger.getEffectiveLevel()
+
+    def filter(self, record):
+        """
+        Observe a log record.
+
+        :param record: The ``logging.LogRecord`` to observe.
+
+        :returns: A true value if the record should be logged.
+        """
+
+        if record.msg == self.api_format and len(record.args) == 9:
+            (verb, _scheme, host, url, _req_headers, _input, status,
+             headers, output) = record.args
+            headers = dict((k.lower(), v) for k, v in (headers or {}).items())
+            self.recorder.record(
+                'http', method=verb, host=host, url=url, status=status,
+                bytes=len(output or ''),
+                rate_remaining=headers.get('x-ratelimit-remaining'),
+                rate_reset=headers.get('x-ratelimit-reset'),
+            )
+
+        return record.levelno >= self.threshold
+
+
+class TimelineSink(object):
+    """
+    A ``Recorder`` sink which appends each event to a file as a line
+    of JSON.
     """
 
-    # If it's one of the defined ones, return the appropriate
-    # attribute
-    if repo_url in URL_ATTR:
-        return getattr(repo_obj, URL_ATTR[repo_url])
+    def __init__(self, path):
+        """
+        Initialize a ``TimelineSink`` object.
 
-    # Verbatim URL; return it unchanged
-    return repo_url
+        :param path: The name of the file to append events to.
+        """
 
+        self.path = path
+        self.stream = open(path, 'a')
 
-class GithubExtension(timid.Extension):
+    def write(self, event):
+        """
+        Write an event to the timeline.
+
+        :param event: A dictionary describing the event.
+        """
+
+        self.stream.write(json.dumps(event, sort_keys=True, default=str))
+        self.stream.write('\n')
+        self.stream.flush()
+
+    def close(self):
+        """
+        Close the timeline file.
+        """
+
+        self.stream.close()
+
+
+class MetricsSink(object):
     """
-    A Timid extension that provides integration with Github.  This
-    will allow a pull request to be tested directly by Timid.  Testing
-    includes making status updates to the pull request for each step
-    in the testing procedure, with a final "success" or "failure"
-    status at the conclusion of testing, with an optional override for
-    "success" status.
+    A ``Recorder`` sink which maintains Prometheus metrics describing
+    runs, in the text format read by the node exporter's textfile
+    collector.  The metrics are cumulative across runs; their state is
+    kept in a JSON file alongside the metrics file.
     """
 
-    priority = 50
+    prom_file = 'timid_github.prom'
+    state_file = 'timid_github.json'
+
+    # The upper bounds of the histogram buckets, in seconds
+    buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+
+    # The metrics maintained, with their types and help text
+    metrics = {
+        'timid_github_runs_total': (
+            'counter', 'Number of runs completed.'),
+        'timid_github_last_run_timestamp_seconds': (
+            'gauge', 'Time at which the last run completed.'),
+        'timid_github_git_commands_total': (
+            'counter', 'Number of git commands executed, by outcome.'),
+        'timid_github_git_ssh_retries_total': (
+            'counter', 'Number of git commands retried due to SSH errors.'),
+        'timid_github_git_duration_seconds': (
+            'histogram', 'Duration of git commands.'),
+        'timid_github_api_calls_total': (
+            'counter', 'Number of Github API calls, by outcome.'),
+        'timid_github_api_duration_seconds': (
+            'histogram', 'Duration of Github API calls.'),
+        'timid_github_http_requests_total': (
+            'counter', 'Number of HTTP requests made to the Github API.'),
+        'timid_github_rate_limit_remaining': (
+            'gauge', 'Github API requests remaining in the rate limit.'),
+        'timid_github_status_posts_total': (
+            'counter', 'Number of status updates sent or suppressed.'),
+        'timid_github_workspace_total': (
+            'counter', 'Number of workspaces prepared, by clone or update.'),
+    }
+
+    def __init__(self, directory):
+        """
+        Initialize a ``MetricsSink`` object.
 
-    @classmethod
-    def prepare(cls, parser):
+        :param directory: The textfile collector directory to which
+                          the metrics file should be written.
         """
-        Called to prepare the extension.  The extension is prepared during
-        argument parser preparation.  An extension implementing this
-        method is able to add command line arguments specific for that
-        extension.  Note that this is a class method; the extension
-        will not be instantiated prior to calling this method, nor
-        should this method attempt to initialize the extension.
 
-        :param parser: The argument parser, an instance of
-                       ``argparse.ArgumentParser``.
+        self.directory = directory
+        self.lock = FileLock(os.path.join(directory, '.timid_github.lock'))
+        self.data = {}
+
+    @staticmethod
+    def _labels(**labels):
         """
+        Format a set of metric labels.
 
-        # Begin by grouping the extension arguments
-        group = parser.add_argument_group(
-            'Github Integration', 'Options for integrating with Github.',
-        )
+        :param labels: The labels and their values.
 
-        # Authentication options
-        group.add_argument(
-            '--github-api',
-            default=os.environ.get('TIMID_GITHUB_API',
-                                   'https://api.github.com'),
-            help='Designate the Github API for the instance of Github to '
-            'search for the pull request.  Default is drawn from the '
-            '"TIMID_GITHUB_API" environment variable.  Default: %(default)s',
-        )
-        group.add_argument(
-            '--github-user',
-            default=os.environ.get('TIMID_GITHUB_USER', getpass.getuser()),
-            help='Designate the username to use to authenticate to the '
-            'Github API.  Default is drawn from the "TIMID_GITHUB_USER" '
-            'environment variable.  Default: %(default)s',
-        )
-        group.add_argument(
-            '--github-pass',
-            default=os.environ.get('TIMID_GITHUB_PASS'),
-            help='Designate the password to use to authenticate to the '
-            'Github API.  If not provided, and not available from the '
-            'keyring, will be prompted for.',
-        )
-        group.add_argument(
-            '--github-keyring-set',
-            default=False,
-            action='store_true',
-            help='Enable setting the password in the keyring.  The entry '
-            'will be keyed by the Github API URL and by the username.',
-        )
+        :returns: The labels, formatted for inclusion in a metric
+                  name.
+        """
 
-        # The pull request to test
-        group.add_argument(
-            '--github-pull',
-            help='Designate the pull request to test.  This may be the '
-            'repository name and pull request number (e.g., "repo#1" or '
-            '"org/repo#1"), or a JSON object describing the pull request '
-            '(deprecated usage).  This is the only option that enables the '
-            'Github extension.',
+        return ','.join(
+            '%s="%s"' % (key, six.text_type(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+            for key, value in sorted(labels.items())
         )
 
-        # The repository to pull from
-        group.add_argument(
-            '--github-repo',
-            default='git',
-            help='Designate the repository URL to clone from.  This may '
-            'be the full URL to the repository, or it may be one of the '
-            'tokens "ssh", "git", or "https", designating to use the '
-            'specified access method from the repository specified in the '
-            'Github pull request.  Default: %(default)s.',
-        )
+    def _inc(self, name, labels, value=1):
+        """
+        Increment a counter.
 
-        # The repository to pull from
-        group.add_argument(
-            '--github-change-repo',
-            help='Designate the repository URL to merge the pull request '
-            'from.  This may be the full URL to the repository, or it may '
-            'be one of the tokens "ssh", "git", or "https", designating to '
-            'use the specified access method from the repository specified '
-            'in the Github pull request.  Defaults to the same method as '
-            'selected for --github-repo.',
-        )
+        :param name: The name of the metric.
+        :param labels: The formatted labels.
+        :param value: The amount to increment by.
+        """
 
-        # Some control options
-        group.add_argument(
-            '--github-status-url',
-            help='A URL to include in status updates made on the pull '
-            'request.  Optional.',
-        )
+        series = self.data.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + value
 
-        # Override options
-        group.add_argument(
-            '--github-override',
-            help='DEPRECATED.  Accepts a JSON object describing the status '
-            'to use in place of a successful status resulting from the test. '
-            'The JSON object should be a dictionary containing the "status" '
-            'key designating the final status (replaced by '
-            '"--github-override-status").  Optionally, the "text" key '
-            '(replaced by "--github-override-text") designates the status '
-            'text, and the "url" key (replaced by "--github-override-url") '
-            'designates the status URL.',
-        )
-        group.add_argument(
-            '--github-override-status',
-            choices=['pending', 'error', 'failure'],
-            help='Specifies an alternate status to use if tests complete '
-            'successfully.  Must be "pending", "error", or "failure".  If '
-            'used with "--github-override", this option takes precedence.',
-        )
-        group.add_argument(
-            '--github-override-text',
-            help='Specifies status text to include with the override '
-            'status specified by "--github-override-status".  If used with '
-            '"--github-override", this option takes precedence.',
-        )
-        group.add_argument(
-            '--github-override-url',
-            help='Specifies a status URL to include with the override '
-            'status specified by "--github-override-status".  If used with '
-            '"--github-override", this option takes precedence.',
+    def _set(self, name, labels, value):
+        """
+        Set a gauge.
+
+        :param name: The name of the metric.
+        :param labels: The formatted labels.
+        :param value: The value of the gauge.
+        """
+
+        self.data.setdefault(name, {})[labels] = value
+
+    def _observe(self, name, labels, value):
+        """
+        Add an observation to a histogram.
+
+        :param name: The name of the metric.
+        :param labels: The formatted labels.
+        :param value: The observed value.
+        """
+
+        hist = self.data.setdefault(name, {}).setdefault(labels, {
+            'buckets': [0] * (len(self.buckets) + 1),
+            'sum': 0.0,
+            'count': 0,
+        })
+        idx = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                idx = i
+                break
+        hist['buckets'][idx] += 1
+        hist['sum'] += value
+        hist['count'] += 1
+
+    def write(self, event):
+        """
+        Accumulate an event.
+
+        :param event: A dictionary describing the event.
+        """
+
+        kind = event['type']
+        if kind == 'git':
+            labels = self._labels(subcommand=event['subcommand'])
+            self._inc('timid_github_git_commands_total', self._labels(
+                subcommand=event['subcommand'], outcome=event['outcome']))
+            if event['outcome'] == 'retry':
+                self._inc('timid_github_git_ssh_retries_total', labels)
+            self._observe('timid_github_git_duration_seconds', labels,
+                          event['duration'])
+        elif kind == 'api':
+            self._inc('timid_github_api_calls_total', self._labels(
+                name=event['name'], outcome=event['outcome']))
+            self._observe('timid_github_api_duration_seconds',
+                          self._labels(name=event['name']),
+                          event['duration'])
+        elif kind == 'http':
+            self._inc('timid_github_http_requests_total',
+                      self._labels(status=event['status']))
+            if event.get('rate_remaining') is not None:
+                self._set('timid_github_rate_limit_remaining', '',
+                          int(event['rate_remaining']))
+        elif kind == 'status':
+            self._inc('timid_github_status_posts_total',
+                      self._labels(result=event['outcome']))
+        elif kind == 'workspace':
+            self._inc('timid_github_workspace_total',
+                      self._labels(path=event['path']))
+
+    def _merge(self, state):
+        """
+        Merge the metrics of this run into the cumulative state.
+
+        :param state: The cumulative state, as read from the state
+                      file.  It is updated in place.
+        """
+
+        for name, series in self.data.items():
+            kind = self.metrics[name][0]
+            dest = state.setdefault(name, {})
+            for labels, value in series.items():
+                if kind == 'gauge' or labels not in dest:
+                    dest[labels] = value
+                elif kind == 'counter':
+                    dest[labels] += value
+                else:
+                    hist = dest[labels]
+                    hist['buckets'] = [
+                        a + b for a, b in zip(hist['buckets'],
+                                              value['buckets'])
+                    ]
+                    hist['sum'] += value['sum']
+                    hist['count'] += value['count']
+
+    def _render(self, state):
+        """
+        Render the cumulative state in the Prometheus text format.
+
+        :param state: The cumulative state.
+
+        :returns: The text of the metrics file.
+        """
+
+        lines = []
+        for name in sorted(state):
+            kind, help_text = self.metrics[name]
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in sorted(state[name].items()):
+                if kind != 'histogram':
+                    lines.append('%s%s %s' % (
+                        name, '{%s}' % labels if labels else '', value))
+                    continue
+
+                prefix = '%s,' % labels if labels else ''
+                total = 0
+                bounds = [repr(float(b)) for b in self.buckets] + ['+Inf']
+                for bound, count in zip(bounds, value['buckets']):
+                    total += count
+                    lines.append('%s_bucket{%sle="%s"} %d' %
+                                 (name, prefix, bound, total))
+                suffix = '{%s}' % labels if labels else ''
+                lines.append('%s_sum%s %r' % (name, suffix, value['sum']))
+                lines.append('%s_count%s %d' %
+                             (name, suffix, value['count']))
+
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        """
+        Fold the metrics of this run into the cumulative state, and
+        atomically rewrite the metrics file.
+        """
+
+        self._inc('timid_github_runs_total', '')
+        self._set('timid_github_last_run_timestamp_seconds', '',
+                  time.time())
+
+        with self.lock.exclusive():
+            state_path = os.path.join(self.directory, self.state_file)
+            state = _read_json(state_path, {})
+            self._merge(state)
+            _write_json(state_path, state)
+
+            # Write the metrics file atomically, so the collector
+            # never sees a partial file
+            prom_path = os.path.join(self.directory, self.prom_file)
+            tmp_path, f = _open_tmp(prom_path)
+            with f:
+                f.write(self._render(state))
+            os.rename(tmp_path, prom_path)
+
+        self.data = {}
+
+
+class RunSummary(object):
+    """
+    A ``Recorder`` sink which accumulates the wall time spent in each
+    phase of a run, along with the slowest git commands, so that a
+    breakdown may be reported when the run completes.
+    """
+
+    # The phases, in the order they are reported, and their labels
+    phases = [
+        ('activation', 'activation API calls'),
+        ('clone', 'clone/update'),
+        ('merge', 'merge'),
+        ('status', 'status posting'),
+        ('steps', 'test steps'),
+    ]
+
+    def __init__(self, top=5, path=None, in_status=False):
+        """
+        Initialize a ``RunSummary`` object.
+
+        :param top: The number of slowest git commands to report.
+        :param path: An optional name of a file to which the summary
+                     should be written, as JSON.
+        :param in_status: If ``True``, a brief summary is appended to
+                          the final status description.
+        """
+
+        self.top = top
+        self.path = path
+        self.in_status = in_status
+
+        self.start = time.time()
+        self.times = dict((phase, 0.0) for phase, _label in self.phases)
+        self.steps = []
+        self.git = []
+        self.api_calls = 0
+        self.http_bytes = 0
+
+    def write(self, event):
+        """
+        Accumulate an event.
+
+        :param event: A dictionary describing the event.
+        """
+
+        if event['type'] == 'api':
+            phase = ('status' if event['name'] == 'create_status' else
+                     'activation')
+            self.times[phase] += event['duration']
+            self.api_calls += 1
+        elif event['type'] == 'http':
+            self.http_bytes += event['bytes']
+        elif event['type'] == 'step':
+            self.times[event['phase']] += event['duration']
+            self.steps.append((event['name'], event['duration']))
+        elif event['type'] == 'git' and self.top > 0:
+            item = (event['duration'], ' '.join(event['args']))
+            if len(self.git) < self.top:
+                heapq.heappush(self.git, item)
+            else:
+                heapq.heappushpop(self.git, item)
+
+    def as_dict(self):
+        """
+        Describe the summary.
+
+        :returns: A dictionary containing the total wall time of the
+                  run under the key "total", the time spent in each
+                  phase under the key "phases", the duration of each
+                  step, as a list of "name" and "duration"
+                  dictionaries, under the key "steps", the number of
+                  API calls and the size of the API responses under
+                  the keys "api_calls" and "http_bytes", and a list of
+                  the slowest git commands, each a dictionary of
+                  "command" and "duration", under the key
+                  "slowest_git".
+        """
+
+        return {
+            'total': time.time() - self.start,
+            'phases': dict(self.times),
+            'steps': [
+                {'name': name, 'duration': duration}
+                for name, duration in self.steps
+            ],
+            'api_calls': self.api_calls,
+            'http_bytes': self.http_bytes,
+            'slowest_git': [
+                {'command': cmd, 'duration': duration}
+                for duration, cmd in sorted(self.git, reverse=True)
+            ],
+        }
+
+    def brief(self):
+        """
+        Describe the summary in a form suitable for inclusion in a
+        status description.
+
+        :returns: A brief textual summary of the phase times.
+        """
+
+        return '[%s]' % ', '.join(
+            '%s %.1fs' % (phase, self.times[phase])
+            for phase, _label in self.phases
         )
 
-    @classmethod
-    def activate(cls, ctxt, args):
+    def report(self, ctxt):
         """
-        Called to determine whether to activate the extension.  This call
-        is made after processing command line arguments, and must
-        return either ``None`` or an initialized instance of the
-        extension.  Note that this is a class method.
+        Report the summary.  The summary is emitted at verbosity level
+        2, and written to the summary file, if one was requested.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        """
+
+        summary = self.as_dict()
+
+        ctxt.emit('Run took %.3fs:' % summary['total'], level=2)
+        for phase, label in self.phases:
+            ctxt.emit('  %s: %.3fs' % (label, summary['phases'][phase]),
+                      level=2)
+        if summary['slowest_git']:
+            ctxt.emit('Slowest git commands:', level=2)
+            for item in summary['slowest_git']:
+                ctxt.emit('  %.3fs: git %s' %
+                          (item['duration'], item['command']), level=2)
+
+        if self.path:
+            try:
+                _write_json(self.path, summary)
+            except (IOError, OSError) as e:
+                ctxt.emit('Unable to write summary file %s: %s' %
+                          (self.path, e))
+
+
+class RunHistory(object):
+    """
+    A local SQLite database recording the timings of each run, keyed
+    by repository, base branch, and the host running the tests.  The
+    "timid-github-history" command reports on the contents.
+    """
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            time REAL NOT NULL,
+            repo TEXT NOT NULL,
+            branch TEXT NOT NULL,
+            host TEXT NOT NULL,
+            pull TEXT,
+            outcome TEXT,
+            api_calls INTEGER,
+            http_bytes INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS timings (
+            run_id INTEGER NOT NULL REFERENCES runs (id),
+            name TEXT NOT NULL,
+            duration REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS runs_key ON runs (repo, branch, host);
+        CREATE INDEX IF NOT EXISTS timings_run ON timings (run_id);
+    '''
+
+    def __init__(self, path):
+        """
+        Initialize a ``RunHistory`` object.
+
+        :param path: The name of the SQLite database file.
+        """
+
+        self.path = path
+
+    def _connect(self):
+        """
+        Connect to the database, creating it if necessary.
+
+        :returns: A ``sqlite3.Connection`` object.
+        """
+
+        parent = os.path.dirname(self.path)
+        if parent and not os.path.isdir(parent):
+            os.makedirs(parent)
+
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.executescript(self.schema)
+        return conn
+
+    def add(self, repo, branch, host, pull, outcome, summary):
+        """
+        Record a run.
+
+        :param repo: The full name of the base repository.
+        :param branch: The base branch.
+        :param host: The name of the host which ran the tests.
+        :param pull: The pull request designation, e.g.,
+                     "org/repo#5".
+        :param outcome: The outcome of the run, e.g., "success".
+        :param summary: The dictionary returned by
+                        ``RunSummary.as_dict()``.
+        """
+
+        timings = [('total', summary['total'])]
+        timings.extend(('phase:%s' % phase, duration)
+                       for phase, duration in
+                       sorted(summary['phases'].items()))
+        timings.extend(('step:%s' % step['name'], step['duration'])
+                       for step in summary['steps'])
+
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    'INSERT INTO runs (time, repo, branch, host, pull, '
+                    'outcome, api_calls, http_bytes) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (time.time(), repo, branch, host, pull, outcome,
+                     summary['api_calls'], summary['http_bytes']))
+                conn.executemany(
+                    'INSERT INTO timings (run_id, name, duration) '
+                    'VALUES (?, ?, ?)',
+                    [(cursor.lastrowid, name, duration)
+                     for name, duration in timings])
+        finally:
+            conn.close()
+
+    def series(self, repo=None, branch=None, host=None):
+        """
+        Retrieve the recorded timings.
+
+        :param repo: If given, only include runs of this repository.
+        :param branch: If given, only include runs against this base
+                       branch.
+        :param host: If given, only include runs on this host.
+
+        :returns: A dictionary mapping a tuple of repository, branch,
+                  host, and timing name to a list of tuples of run ID
+                  and duration, in the order in which the runs were
+                  recorded.  The number of API calls and the API
+                  response size are included under the timing names
+                  "api_calls" and "http_bytes".
+        """
+
+        where = []
+        params = []
+        for column, value in (('repo', repo), ('branch', branch),
+                              ('host', host)):
+            if value is not None:
+                where.append('runs.%s = ?' % column)
+                params.append(value)
+        where = (' WHERE %s' % ' AND '.join(where)) if where else ''
+
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT runs.id, repo, branch, host, name, duration '
+                'FROM runs JOIN timings ON timings.run_id = runs.id%s '
+                'UNION ALL '
+                'SELECT id, repo, branch, host, \'api_calls\', api_calls '
+                'FROM runs%s '
+                'UNION ALL '
+                'SELECT id, repo, branch, host, \'http_bytes\', http_bytes '
+                'FROM runs%s '
+                'ORDER BY 1' % (where, where, where), params * 3).fetchall()
+        finally:
+            conn.close()
+
+        result = {}
+        for run_id, repo, branch, host, name, value in rows:
+            result.setdefault((repo, branch, host, name), []).append(
+                (run_id, value))
+
+        return result
+
+
+def _percentile(values, pct):
+    """
+    Compute a percentile of a list of values, interpolating between
+    the closest ranks.
+
+    :param values: A non-empty list of values.
+    :param pct: The desired percentile, from 0 to 100.
+
+    :returns: The percentile.
+    """
+
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def history_main(argv=None):
+    """
+    Entry point for the "timid-github-history" command, which reports
+    percentiles of the timings recorded in a run history database,
+    and flags timings of the most recent runs which have regressed
+    relative to a rolling baseline of the runs preceding them.
+
+    :param argv: The command line arguments.  Defaults to
+                 ``sys.argv[1:]``.
+
+    :returns: The exit code.  With ``--check``, this is 1 if any
+              regressions were found.
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Report on a timid-github run history database.',
+    )
+    parser.add_argument(
+        'database',
+        help='The run history database, as given to "--github-history".',
+    )
+    parser.add_argument(
+        '--repo',
+        help='Only report on runs of this repository, e.g., "org/repo".',
+    )
+    parser.add_argument(
+        '--branch',
+        help='Only report on runs against this base branch.',
+    )
+    parser.add_argument(
+        '--host',
+        help='Only report on runs on this host.',
+    )
+    parser.add_argument(
+        '--window',
+        default=20,
+        type=int,
+        help='The number of runs to use as the rolling baseline.  '
+        'Default: %(default)s',
+    )
+    parser.add_argument(
+        '--recent',
+        default=1,
+        type=int,
+        help='The number of most recent runs to compare against the '
+        'baseline.  Default: %(default)s',
+    )
+    parser.add_argument(
+        '--min-runs',
+        default=5,
+        type=int,
+        help='The minimum number of runs in the baseline for a '
+        'regression to be flagged.  Default: %(default)s',
+    )
+    parser.add_argument(
+        '--threshold',
+        default=1.5,
+        type=float,
+        help='The ratio of a timing to the median of the baseline above '
+        'which it is flagged as a regression.  Default: %(default)s',
+    )
+    parser.add_argument(
+        '--check',
+        default=False,
+        action='store_true',
+        help='Only report regressions, exiting with a non-zero status if '
+        'any are found.',
+    )
+    args = parser.parse_args(argv)
+
+    if args.recent < 1:
+        parser.error('--recent must be at least 1')
+    if not os.path.exists(args.database):
+        parser.error('No such database "%s"' % args.database)
+
+    series = RunHistory(args.database).series(
+        args.repo, args.branch, args.host)
+
+    regressions = 0
+    for key in sorted(series):
+        repo, branch, host, name = key
+        values = [value for _run_id, value in series[key]]
+
+        if not args.check:
+            print('%s %s %s %s: n=%d p50=%.3f p90=%.3f p99=%.3f' %
+                  (repo, branch, host, name, len(values),
+                   _percentile(values, 50), _percentile(values, 90),
+                   _percentile(values, 99)))
+
+        # Compare the most recent runs against the baseline
+        recent = series[key][-args.recent:]
+        baseline = values[:-args.recent][-args.window:]
+        if len(baseline) < args.min_runs:
+            continue
+        median = _percentile(baseline, 50)
+        for run_id, value in recent:
+            if median > 0 and value > median * args.threshold:
+                regressions += 1
+                print('REGRESSION: %s %s %s %s: run %d: %.3f, '
+                      'baseline median %.3f (%.1fx)' %
+                      (repo, branch, host, name, run_id, value, median,
+                       value / median))
+
+    return 1 if args.check and regressions else 0
+
+
+def _new_id(size):
+    """
+    Generate a random trace or span ID.
+
+    :param size: The size of the ID, in bytes.
+
+    :returns: The ID, as a string of hexadecimal digits.
+    """
+
+    return binascii.hexlify(os.urandom(size)).decode('ascii')
+
+
+def _parse_traceparent(value):
+    """
+    Parse a W3C "traceparent" header value.
+
+    :param value: The value to parse.  May be ``None``.
+
+    :returns: A tuple of the trace ID and the parent span ID, or
+              ``None`` if the value is missing or invalid.
+    """
+
+    parts = (value or '').strip().lower().split('-')
+    if len(parts) < 4 or parts[0] == 'ff':
+        return None
+
+    version, trace_id, span_id = parts[:3]
+    if (len(version) != 2 or len(trace_id) != 32 or len(span_id) != 16 or
+            not all(c in '0123456789abcdef'
+                    for c in version + trace_id + span_id) or
+            trace_id == '0' * 32 or span_id == '0' * 16):
+        return None
+
+    return trace_id, span_id
+
+
+def _otlp_value(value):
+    """
+    Encode a value as an OTLP ``AnyValue``.
+
+    :param value: The value to encode.
+
+    :returns: A dictionary describing the value.
+    """
+
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    elif isinstance(value, six.integer_types):
+        return {'intValue': str(value)}
+    elif isinstance(value, float):
+        return {'doubleValue': value}
+    elif isinstance(value, (list, tuple)):
+        return {'arrayValue': {'values': [_otlp_value(v) for v in value]}}
+    return {'stringValue': six.text_type(value)}
+
+
+class TraceSink(object):
+    """
+    A ``Recorder`` sink which assembles events into trace spans: a
+    span for the run, containing a span for each step, containing
+    spans for the git commands and Github API calls made during the
+    step.  When closed, the spans are appended to a file as a line of
+    OTLP JSON, as written by the OpenTelemetry file exporter.
+    """
+
+    # Span kinds and status codes, as defined by OTLP
+    SPAN_KIND_INTERNAL = 1
+    SPAN_KIND_CLIENT = 3
+    STATUS_CODE_UNSET = 0
+    STATUS_CODE_ERROR = 2
+
+    def __init__(self, path, traceparent=None):
+        """
+        Initialize a ``TraceSink`` object.
+
+        :param path: The name of the file to append spans to.
+        :param traceparent: An optional W3C "traceparent" value
+                            identifying the span of the process which
+                            invoked ``timid``.  If valid, the run span
+                            becomes its child.
+        """
+
+        self.path = path
+        self.start = time.time()
+        self.attributes = {}
+        self.events = []
+
+        parent = _parse_traceparent(traceparent)
+        if parent:
+            self.trace_id, self.parent_span_id = parent
+        else:
+            self.trace_id, self.parent_span_id = _new_id(16), None
+        self.run_span_id = _new_id(8)
+
+    def new_span_id(self):
+        """
+        Allocate a span ID for an event which is about to occur, so
+        that it may be passed to child processes.
+
+        :returns: The span ID.
+        """
+
+        return _new_id(8)
+
+    def traceparent(self, span_id):
+        """
+        Compute the W3C "traceparent" value identifying a span.
+
+        :param span_id: The span ID.
+
+        :returns: The "traceparent" value.
+        """
+
+        return '00-%s-%s-01' % (self.trace_id, span_id)
+
+    def write(self, event):
+        """
+        Accumulate an event.
+
+        :param event: A dictionary describing the event.
+        """
+
+        if 'duration' in event:
+            self.events.append(event)
+
+    def _span(self, span_id, parent_id, name, kind, start, end, attrs,
+              error=False):
+        """
+        Construct an OTLP span.
+
+        :param span_id: The span ID.
+        :param parent_id: The parent span ID, or ``None``.
+        :param name: The name of the span.
+        :param kind: The span kind.
+        :param start: The start time of the span.
+        :param end: The end time of the span.
+        :param attrs: A dictionary of attributes of the span.
+        :param error: If ``True``, the span's status is an error.
+
+        :returns: A dictionary describing the span.
+        """
+
+        span = {
+            'traceId': self.trace_id,
+            'spanId': span_id,
+            'name': name,
+            'kind': kind,
+            'startTimeUnixNano': str(int(start * 1e9)),
+            'endTimeUnixNano': str(int(end * 1e9)),
+            'attributes': [
+                {'key': key, 'value': _otlp_value(value)}
+                for key, value in sorted(attrs.items())
+                if value is not None
+            ],
+            'status': {
+                'code': (self.STATUS_CODE_ERROR if error else
+                         self.STATUS_CODE_UNSET),
+            },
+        }
+        if parent_id:
+            span['parentSpanId'] = parent_id
+        return span
+
+    def spans(self, end=None):
+        """
+        Assemble the accumulated events into spans.  The parent of each
+        event is the span recorded as its "parent_id", such as the
+        step during which it occurred, or the run if it has none.
+
+        :param end: The end time of the run.  Defaults to the current
+                    time.
+
+        :returns: A list of dictionaries describing the spans.
+        """
+
+        spans = [self._span(
+            self.run_span_id, self.parent_span_id, 'timid run',
+            self.SPAN_KIND_INTERNAL, self.start, end or time.time(),
+            self.attributes)]
+
+        for event in self.events:
+            event = dict(event)
+            kind = event.pop('type')
+            span_id = event.pop('span_id', None) or _new_id(8)
+            parent_id = event.pop('parent_id', None) or self.run_span_id
+            start = event.pop('start')
+            end = start + event.pop('duration')
+
+            if kind == 'step':
+                name = 'step %s' % event['name']
+                span_kind = self.SPAN_KIND_INTERNAL
+                error = event.get('state') not in (timid.SUCCESS,
+                                                   timid.SKIPPED)
+            elif kind == 'git':
+                name = 'git %s' % event['subcommand']
+                span_kind = self.SPAN_KIND_CLIENT
+                error = event.get('outcome') == 'error'
+            elif kind == 'api':
+                name = 'github %s' % event['name']
+                span_kind = self.SPAN_KIND_CLIENT
+                error = event.get('outcome') == 'error'
+            else:
+                name = kind
+                span_kind = self.SPAN_KIND_INTERNAL
+                error = False
+
+            attrs = dict(self.attributes)
+            attrs.update(event)
+            spans.append(self._span(span_id, parent_id, name, span_kind,
+                                    start, end, attrs, error))
+
+        return spans
+
+    def close(self):
+        """
+        Assemble the spans and append them to the trace file.
+        """
+
+        request = {
+            'resourceSpans': [{
+                'resource': {
+                    'attributes': [
+                        {'key': 'service.name',
+                         'value': {'stringValue': 'timid-github'}},
+                    ],
+                },
+                'scopeSpans': [{
+                    'scope': {'name': 'timid_github'},
+                    'spans': self.spans(),
+                }],
+            }],
+        }
+
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(request, sort_keys=True) + '\n')
+
+        self.events = []
+
+
+class ApiBudget(object):
+    """
+    A ``Recorder`` sink which counts the Github API calls made by a
+    run, by endpoint, and tracks the remaining rate limit.  Optional
+    per-run and per-hour budgets allow non-essential calls to be
+    skipped once the budget runs low.  The per-hour budget is shared
+    by all runs on the host using the same credentials, through a
+    state file.
+    """
+
+    def __init__(self, per_run=None, per_hour=None, reserve=0,
+                 state_path=None, key=None):
+        """
+        Initialize an ``ApiBudget`` object.
+
+        :param per_run: The maximum number of API calls a run should
+                        make before non-essential calls are skipped.
+        :param per_hour: The maximum number of API calls all runs
+                         should make in a clock hour before
+                         non-essential calls are skipped.  Requires
+                         ``state_path``.
+        :param reserve: The number of calls remaining in the Github
+                        rate limit below which non-essential calls
+                        are skipped.
+        :param state_path: The name of the file in which hourly usage
+                           is recorded.
+        :param key: The key identifying the credentials in the state
+                    file.
+        """
+
+        self.per_run = per_run
+        self.per_hour = per_hour
+        self.reserve = reserve
+        self.state_path = state_path
+        self.key = key
+        self.lock = FileLock(state_path + '.lock') if state_path else None
+
+        self.calls = {}
+        self.total = 0
+        self.unflushed = 0
+        self.hour = None
+        self.hour_calls = 0
+        self.rate_remaining = None
+        self.rate_reset = None
+
+    def write(self, event):
+        """
+        Accumulate an event.
+
+        :param event: A dictionary describing the event.
+        """
+
+        if event['type'] == 'api':
+            self.calls[event['name']] = self.calls.get(event['name'], 0) + 1
+            self.total += 1
+            self.unflushed += 1
+        elif event['type'] == 'http' and event.get('rate_remaining'):
+            self.rate_remaining = int(event['rate_remaining'])
+            if event.get('rate_reset'):
+                self.rate_reset = int(event['rate_reset'])
+
+    def flush(self):
+        """
+        Add the calls made since the last flush to the hourly usage in
+        the state file.
+        """
+
+        if self.state_path is None:
+            return
+
+        hour = int(time.time() // 3600)
+        with self.lock.exclusive():
+            state = _read_json(self.state_path, {})
+            entry = state.get(self.key)
+            if not entry or entry['hour'] != hour:
+                entry = {'hour': hour, 'calls': 0}
+            entry['calls'] += self.unflushed
+            state[self.key] = entry
+
+            # Discard the usage of earlier hours
+            for key in list(state):
+                if state[key]['hour'] != hour:
+                    del state[key]
+
+            _write_json(self.state_path, state)
+
+        self.unflushed = 0
+        self.hour = hour
+        self.hour_calls = entry['calls']
+
+    def low(self):
+        """
+        Determine whether the budget is running low.
+
+        :returns: A description of why the budget is low, or ``None``
+                  if it is not.
+        """
+
+        if self.per_run is not None and self.total >= self.per_run:
+            return 'per-run budget of %d API calls used' % self.per_run
+
+        if self.per_hour is not None:
+            # Only rewrite the state file if there is something new to
+            # add, or if the hour has turned over
+            if (self.unflushed or
+                    self.hour != int(time.time() // 3600)):
+                self.flush()
+            if self.hour_calls >= self.per_hour:
+                return 'hourly budget of %d API calls used' % self.per_hour
+
+        if (self.rate_remaining is not None and
+                self.rate_remaining <= self.reserve):
+            return ('only %d API calls remain in the rate limit' %
+                    self.rate_remaining)
+
+        return None
+
+    def report(self, ctxt):
+        """
+        Report the API usage of the run.  The report is emitted at
+        verbosity level 2.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        """
+
+        calls = ', '.join('%s=%d' % item
+                          for item in sorted(self.calls.items()))
+        ctxt.emit('Github API calls: %d (%s)' % (self.total, calls),
+                  level=2)
+        if self.rate_remaining is not None:
+            ctxt.emit('Github API rate limit remaining: %d' %
+                      self.rate_remaining, level=2)
+        if self.per_hour is not None:
+            ctxt.emit('Github API calls this hour: %d of %d' %
+                      (self.hour_calls, self.per_hour), level=2)
+
+
+def _api_call(recorder, name, func, *args, **kwargs):
+    """
+    Make a Github API call, recording it as an "api" event.
+
+    :param recorder: A ``Recorder`` with which to record the call.
+    :param name: A name for the call, e.g., "get_repo".
+    :param func: The callable making the call.
+    :param args: Positional arguments for ``func``.
+    :param kwargs: Keyword arguments for ``func``.
+
+    :returns: The return value of ``func``.
+    """
+
+    start = time.time()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        recorder.record('api', start=start, duration=time.time() - start,
+                        name=name, outcome='error', error=str(e))
+        raise
+
+    recorder.record('api', start=start, duration=time.time() - start,
+                    name=name, outcome='ok')
+    return result
+
+
+class ApiRateLimited(Exception):
+    """
+    An exception raised when a Github API call cannot be made because
+    the API is rate limiting the client.
+    """
+
+    def __init__(self, until):
+        """
+        Initialize an ``ApiRateLimited`` exception.
+
+        :param until: The time, in seconds since the epoch, before
+                      which no further calls should be made.
+        """
+
+        super(ApiRateLimited, self).__init__(
+            'Github API rate limited until %s' %
+            time.strftime('%H:%M:%S', time.localtime(until)))
+        self.until = until
+
+
+def _retry_delay(exc, now):
+    """
+    Determine how long to wait before retrying a Github API call which
+    failed due to rate limiting.
+
+    :param exc: The exception raised by the call.
+    :param now: The current time, in seconds since the epoch.
+
+    :returns: The number of seconds to wait, or ``None`` if the
+              exception does not indicate rate limiting.
+    """
+
+    if (not isinstance(exc, github.GithubException) or
+            exc.status not in (403, 429)):
+        return None
+
+    headers = dict((key.lower(), value)
+                   for key, value in (exc.headers or {}).items())
+
+    # The Retry-After header is authoritative
+    if headers.get('retry-after', '').isdigit():
+        return int(headers['retry-after'])
+
+    # Primary rate limit exhausted; wait for the reset
+    if (headers.get('x-ratelimit-remaining') == '0' and
+            headers.get('x-ratelimit-reset', '').isdigit()):
+        return max(int(headers['x-ratelimit-reset']) - now, 0) + 1
+
+    # Secondary rate limits don't always say how long to wait
+    if (exc.status == 429 or
+            'secondary rate limit' in str(exc.data).lower()):
+        return ApiScheduler.SECONDARY_DELAY
+
+    # An ordinary permission failure
+    return None
+
+
+class ApiScheduler(object):
+    """
+    Schedule Github API calls.  Calls are spaced at least ``spacing``
+    seconds apart, and calls which are rate limited are retried once
+    the rate limit resets.  The schedule is kept in a state file shared
+    by all runs using the same credentials, so that parallel runs
+    share a single quota.
+    """
+
+    # The delay to use when a secondary rate limit does not specify
+    # how long to wait
+    SECONDARY_DELAY = 60
+
+    def __init__(self, spacing=0.0, max_wait=300, state_path=None,
+                 key=None):
+        """
+        Initialize an ``ApiScheduler`` object.
+
+        :param spacing: The minimum number of seconds between calls.
+        :param max_wait: The maximum number of seconds to wait for a
+                         rate limit to reset before giving up.
+        :param state_path: The name of the file in which the schedule
+                           is shared with other runs.
+        :param key: The key identifying the credentials in the state
+                    file.
+        """
+
+        self.spacing = spacing
+        self.max_wait = max_wait
+        self.state_path = state_path
+        self.key = key
+        self.lock = FileLock(state_path + '.lock') if state_path else None
+
+        self.not_before = 0.0
+        self.last = None
+
+    def _reserve(self, wait):
+        """
+        Reserve a time slot for a call.
+
+        :param wait: If ``False``, raise ``ApiRateLimited`` rather than
+                     reserving a slot beyond the reset of a rate
+                     limit.
+
+        :returns: The time at which the call may be made.
+        """
+
+        now = time.time()
+
+        if self.state_path is None:
+            state = {}
+        elif not self.spacing:
+            # Nothing to reserve; just pick up the resets seen by
+            # other runs
+            state = _read_json(self.state_path, {}).get(self.key, {})
+        else:
+            with self.lock.exclusive():
+                shared = _read_json(self.state_path, {})
+                state = shared.get(self.key, {})
+                slot = self._slot(now, state, wait)
+                shared[self.key] = {
+                    'not_before': self.not_before,
+                    'last': slot,
+                }
+                _write_json(self.state_path, shared)
+            self.last = slot
+            return slot
+
+        slot = self._slot(now, state, wait)
+        self.last = slot
+        return slot
+
+    def _slot(self, now, state, wait):
+        """
+        Compute the time slot for a call.
+
+        :param now: The current time, in seconds since the epoch.
+        :param state: The shared schedule for the credentials.
+        :param wait: If ``False``, raise ``ApiRateLimited`` rather than
+                     returning a slot beyond the reset of a rate
+                     limit.
+
+        :returns: The time at which the call may be made.
+        """
+
+        self.not_before = max(self.not_before, state.get('not_before', 0.0))
+        if self.not_before > now and not wait:
+            raise ApiRateLimited(self.not_before)
+
+        slot = max(now, self.not_before)
+        for last in (self.last, state.get('last')):
+            if last is not None:
+                slot = max(slot, last + self.spacing)
+
+        return slot
+
+    def block(self, delay):
+        """
+        Block further calls, from this and other runs, for a period.
+
+        :param delay: The number of seconds to block calls for.
+        """
+
+        self.not_before = max(self.not_before, time.time() + delay)
+
+        if self.state_path is None:
+            return
+
+        with self.lock.exclusive():
+            shared = _read_json(self.state_path, {})
+            state = shared.setdefault(self.key, {})
+            state['not_before'] = max(self.not_before,
+                                      state.get('not_before', 0.0))
+            _write_json(self.state_path, shared)
+
+    def _call(self, wait, recorder, name, func, args, kwargs):
+        """
+        Make a Github API call according to the schedule.
+
+        :param wait: If ``False``, the call is not retried, and
+                     ``ApiRateLimited`` is raised if calls are blocked
+                     by a rate limit.
+        :param recorder: A ``Recorder`` with which to record the call.
+        :param name: A name for the call, e.g., "get_repo".
+        :param func: The callable making the call.
+        :param args: Positional arguments for ``func``.
+        :param kwargs: Keyword arguments for ``func``.
+
+        :returns: The return value of ``func``.
+        """
+
+        deadline = time.time() + self.max_wait
+        while True:
+            slot = self._reserve(wait)
+            if slot > deadline:
+                raise ApiRateLimited(slot)
+
+            # Wait for our slot
+            delay = slot - time.time()
+            if delay > 0:
+                start = time.time()
+                time.sleep(delay)
+                recorder.record('sleep', start=start,
+                                duration=time.time() - start, name=name)
+
+            try:
+                return _api_call(recorder, name, func, *args, **kwargs)
+            except github.GithubException as e:
+                delay = _retry_delay(e, time.time())
+                if delay is None:
+                    raise
+                self.block(max(delay, 1))
+                if not wait:
+                    raise ApiRateLimited(self.not_before)
+
+    def call(self, recorder, name, func, *args, **kwargs):
+        """
+        Make a Github API call, waiting for any rate limit to reset.
+        If the rate limit will not reset within ``max_wait`` seconds,
+        ``ApiRateLimited`` is raised.
+
+        :param recorder: A ``Recorder`` with which to record the call.
+        :param name: A name for the call, e.g., "get_repo".
+        :param func: The callable making the call.
+        :param args: Positional arguments for ``func``.
+        :param kwargs: Keyword arguments for ``func``.
+
+        :returns: The return value of ``func``.
+        """
+
+        return self._call(True, recorder, name, func, args, kwargs)
+
+    def try_call(self, recorder, name, func, *args, **kwargs):
+        """
+        Make a Github API call, unless the API is rate limiting calls,
+        in which case ``ApiRateLimited`` is raised.  The call still
+        respects the minimum spacing between calls.
+
+        :param recorder: A ``Recorder`` with which to record the call.
+        :param name: A name for the call, e.g., "get_repo".
+        :param func: The callable making the call.
+        :param args: Positional arguments for ``func``.
+        :param kwargs: Keyword arguments for ``func``.
+
+        :returns: The return value of ``func``.
+        """
+
+        return self._call(False, recorder, name, func, args, kwargs)
+
+
+def _read_tokens(path):
+    """
+    Read a file listing Github API tokens.  Each non-blank line of the
+    file that does not begin with "#" is a token.
+
+    :param path: The name of the file to read.
+
+    :returns: A list of the tokens.
+    """
+
+    with open(path) as f:
+        return [line.strip() for line in f
+                if line.strip() and not line.strip().startswith('#')]
+
+
+class TokenPool(object):
+    """
+    A pool of Github API tokens.  Each run uses the token with the most
+    calls remaining in its rate limit, as last observed by any run;
+    tokens with the same number of calls remaining are used in turn.
+    The observed rate limits are kept in a state file shared by all
+    runs.
+    """
+
+    # The rate limit assumed for tokens which have not been used, or
+    # whose rate limit has since reset
+    LIMIT = 5000
+
+    def __init__(self, tokens, state_path):
+        """
+        Initialize a ``TokenPool`` object.
+
+        :param tokens: A list of the Github API tokens in the pool.
+        :param state_path: The name of the file in which the rate
+                           limits of the tokens are recorded.
+        """
+
+        self.tokens = tokens
+        self.state_path = state_path
+        self.lock = FileLock(state_path + '.lock')
+        self.token = None
+
+    @staticmethod
+    def fingerprint(token):
+        """
+        Compute a fingerprint identifying a token, so that the token
+        itself need not be recorded.
+
+        :param token: The token.
+
+        :returns: The fingerprint of the token.
+        """
+
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()[:16]
+
+    def select(self):
+        """
+        Select the token to use for the run.
+
+        :returns: The selected token.
+        """
+
+        now = time.time()
+        with self.lock.exclusive():
+            state = _read_json(self.state_path, {})
+
+            def quota(token):
+                entry = state.get(self.fingerprint(token), {})
+                if entry.get('reset', 0) <= now:
+                    remaining = self.LIMIT
+                else:
+                    remaining = entry.get('remaining', self.LIMIT)
+                return (remaining, -entry.get('used', 0))
+
+            self.token = max(self.tokens, key=quota)
+
+            entry = state.setdefault(self.fingerprint(self.token), {})
+            entry['used'] = now
+            _write_json(self.state_path, state)
+
+        return self.token
+
+    def update(self, remaining, reset):
+        """
+        Record the rate limit of the selected token.
+
+        :param remaining: The number of calls remaining in the rate
+                          limit.
+        :param reset: The time, in seconds since the epoch, at which
+                      the rate limit resets.
+        """
+
+        with self.lock.exclusive():
+            state = _read_json(self.state_path, {})
+            entry = state.setdefault(self.fingerprint(self.token), {})
+            entry.update(remaining=remaining, reset=reset)
+            _write_json(self.state_path, state)
+
+
+@contextlib.contextmanager
+def _setenv(ctxt, name, value):
+    """
+    A context manager which temporarily sets a variable in the
+    environment.
+
+    :param ctxt: The context object.
+    :param name: The name of the environment variable.
+    :param value: The value to set.  If ``None``, the environment is
+                  left unchanged.
+    """
+
+    if value is None:
+        yield
+        return
+
+    saved = ctxt.environment.get(name)
+    ctxt.environment[name] = value
+    try:
+        yield
+    finally:
+        if saved is None:
+            del ctxt.environment[name]
+        else:
+            ctxt.environment[name] = saved
+
+
+@contextlib.contextmanager
+def _chdir(ctxt, path):
+    """
+    A context manager which temporarily changes the working directory
+    of the environment.
+
+    :param ctxt: The context object.
+    :param path: The directory to change to.
+    """
+
+    saved_cwd = ctxt.environment.cwd
+    ctxt.environment.cwd = path
+    try:
+        yield
+    finally:
+        ctxt.environment.cwd = saved_cwd
+
+
+def _git(ctxt, *args, **kwargs):
+    """
+    Invoke a "git" subcommand.
+
+    :param ctxt: The context object.
+    :param args: Positional arguments, specified as strings; the first
+                 must be a "git" subcommand, and remaining arguments
+                 will be passed to that subcommand.
+    :param ssh_retries: A keyword-only parameter specifying the number
+                        of retries to attempt.  If the command fails
+                        due to an SSH error, the command will be
+                        retried up to this many times.  This does not
+                        impact failures due to other connection
+                        errors.  Defaults to ``1``.
+    :param do_raise: A keyword-only parameter specifying whether to
+                     raise exceptions in the event of command
+                     failures.  If ``False``, no exception will be
+                     raised.  Defaults to ``True``.
+    :param ghe: A keyword-only parameter specifying the
+                ``GithubExtension`` instance on whose behalf the
+                command is run.  If provided, its git configuration
+                profile is applied to the command, and the command is
+                recorded by its ``Recorder``.
+    :param recorder: A keyword-only parameter specifying the
+                     ``Recorder`` by which the command is recorded.
+                     Defaults to the ``Recorder`` of ``ghe``.
+
+    :returns: The contents of standard output.
+    """
+
+    # Extract keyword-only parameters
+    ssh_retries = kwargs.get('ssh_retries', 1)
+    do_raise = kwargs.get('do_raise', True)
+    ghe = kwargs.get('ghe')
+    recorder = kwargs.get('recorder')
+    if recorder is None and ghe is not None:
+        recorder = ghe.recorder
+    tracer = recorder.tracer if recorder is not None else None
+
+    # Construct the full command
+    cmd = ['git']
+    if ghe is not None:
+        for key, value in ghe.git_config:
+            cmd.extend(['-c', '%s=%s' % (key, value)])
+    cmd.extend(args)
+
+    # Construct the command text for debugging and error output
+    cmd_text = ' '.join(six.moves.shlex_quote(c) for c in cmd)
+
+    # Loop the requisite number of times, with appropriate sleeps
+    sleep_time = 1
+    num_tries = 0
+    while num_tries < ssh_retries:
+        num_tries += 1
+        if num_tries > 1:
+            # Second or subsequent try; sleep with exponential backoff
+            start = time.time()
+            time.sleep(sleep_time)
+            if recorder is not None:
+                recorder.record('sleep', start=start,
+                                duration=time.time() - start,
+                                subcommand=args[0], attempt=num_tries)
+            sleep_time <<= 1
+
+            ctxt.emit('Retry %d of %d: retrying command "%s"' %
+                      (num_tries, ssh_retries, cmd_text), debug=True)
+        else:
+            ctxt.emit('Executing command "%s"' % cmd_text, debug=True)
+
+        # Run the command, passing along the trace context
+        span_id = None
+        traceparent = None
+        if tracer is not None:
+            span_id = tracer.new_span_id()
+            traceparent = tracer.traceparent(span_id)
+        start = time.time()
+        with _setenv(ctxt, 'TRACEPARENT', traceparent):
+            child = ctxt.environment.call(
+                cmd, close_fds=True, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+            stdout, stderr = child.communicate()
+        duration = time.time() - start
+        ctxt.emit('Command result: return code %d, stdout %r, stderr %r' %
+                  (child.returncode, stdout, stderr), debug=True)
+
+        # Do we need to retry?
+        retry = bool(child.returncode and
+                     (SSH_ERROR in stdout or SSH_ERROR in stderr))
+        if recorder is not None:
+            recorder.record(
+                'git', start=start, duration=duration, subcommand=args[0],
+                args=list(args), cwd=ctxt.environment.cwd,
+                attempt=num_tries, returncode=child.returncode,
+                stdout_bytes=len(stdout), stderr_bytes=len(stderr),
+                outcome=('retry' if retry and num_tries < ssh_retries else
+                         'error' if child.returncode else 'ok'),
+                span_id=span_id,
+            )
+        if retry:
+            ctxt.emit('Retrying command after a sleep of %d seconds' %
+                      sleep_time, debug=True)
+            continue
+
+        # We have executed it!
+        break
+    else:
+        ctxt.emit('Too many tries, exiting instead', debug=True)
+
+    if do_raise and child.returncode:
+        # Include stdout
+        text = stdout.strip()
+        if text:
+            msg = ('Git command "%s" returned %d: %s' %
+                   (cmd_text, child.returncode, text))
+        else:
+            msg = ('Git command "%s" returned %d' %
+                   (cmd_text, child.returncode))
+
+        # Raise the exception
+        result = timid.StepResult(state=timid.ERROR, msg=msg,
+                                  returncode=child.returncode)
+        raise GitException(msg, result)
+
+    # Return the standard output
+    return stdout
+
+
+class Mirror(object):
+    """
+    A bare mirror of a repository, cached across runs.  Workspaces are
+    cloned from and updated against the mirror, so that only the
+    mirror needs to fetch from the network.  Automatic garbage
+    collection is disabled in the mirror; instead, the mirror is
+    maintained outside of the critical path of any run by
+    ``maintain()``, which holds the same lock as fetches.
+    """
+
+    # Name of the file in the mirror recording the time of the last
+    # maintenance
+    stamp_file = 'timid-maintenance.json'
+
+    def __init__(self, path, url, interval=86400, max_packs=20,
+                 timeline=None):
+        """
+        Initialize a ``Mirror`` object.
+
+        :param path: The directory containing the mirror.
+        :param url: The upstream repository URL.
+        :param interval: The interval, in seconds, between scheduled
+                         maintenance runs.
+        :param max_packs: The maximum number of pack files before
+                          the mirror is fully repacked.
+        :param timeline: The name of a file to which the git commands
+                         of background maintenance are appended, as
+                         by ``TimelineSink``.  Optional.
+        """
+
+        self.path = path
+        self.url = url
+        self.interval = interval
+        self.max_packs = max_packs
+        self.timeline = timeline
+        self.lock = FileLock('%s.lock' % path)
+
+    def update(self, ctxt, recorder=None):
+        """
+        Create the mirror or bring it up to date with the upstream
+        repository.  The git configuration profile of the workspace is
+        not applied, as the mirror is shared and long-lived.
+
+        :param ctxt: The context object.
+        :param recorder: An optional ``Recorder`` by which the git
+                         commands are recorded.
+        """
+
+        with self.lock.exclusive():
+            if not os.path.isdir(self.path):
+                ctxt.emit('Creating mirror of %s in %s' %
+                          (self.url, self.path))
+                _git(ctxt, 'clone', '--mirror', '--config', 'gc.auto=0',
+                     '--config', 'maintenance.auto=false',
+                     self.url, self.path, ssh_retries=5, recorder=recorder)
+                return
+
+            ctxt.emit('Updating mirror %s' % self.path, level=2)
+            with _chdir(ctxt, self.path):
+                _git(ctxt, 'remote', 'set-url', 'origin', self.url,
+                     recorder=recorder)
+                _git(ctxt, 'fetch', '--prune', 'origin', ssh_retries=5,
+                     recorder=recorder)
+
+    def pack_count(self):
+        """
+        Count the pack files in the mirror.
+
+        :returns: The number of pack files.
+        """
+
+        try:
+            names = os.listdir(os.path.join(self.path, 'objects', 'pack'))
+        except OSError:
+            return 0
+
+        return len([n for n in names if n.endswith('.pack')])
+
+    def needs_maintenance(self):
+        """
+        Determine whether the mirror is due for maintenance, either
+        because the maintenance interval has elapsed or because too
+        many packs have accumulated.
+
+        :returns: A ``True`` value if maintenance should be run.
+        """
+
+        if not os.path.isdir(self.path):
+            return False
+
+        stamp = _read_json(os.path.join(self.path, self.stamp_file), {})
+        return (time.time() - stamp.get('time', 0) >= self.interval or
+                self.pack_count() > self.max_packs)
+
+    def maintain(self, ctxt, recorder=None):
+        """
+        Perform maintenance on the mirror: prefetch from upstream,
+        repack with bitmaps if too many packs have accumulated, and
+        write the multi-pack-index and commit-graph.  If the mirror
+        is locked, maintenance is skipped.
+
+        :param ctxt: The context object.
+        :param recorder: An optional ``Recorder`` by which the git
+                         commands are recorded.
+
+        :returns: A ``True`` value if maintenance was performed.
+        """
+
+        if not self.lock.acquire(blocking=False):
+            ctxt.emit('Mirror %s is busy; skipping maintenance' % self.path)
+            return False
+
+        try:
+            ctxt.emit('Maintaining mirror %s' % self.path)
+            with _chdir(ctxt, self.path):
+                _git(ctxt, 'fetch', '--prune', 'origin', ssh_retries=5,
+                     recorder=recorder)
+                if self.pack_count() > self.max_packs:
+                    _git(ctxt, 'repack', '-a', '-d', '-b',
+                         recorder=recorder)
+                _git(ctxt, 'multi-pack-index', 'write', recorder=recorder)
+                _git(ctxt, 'commit-graph', 'write', '--reachable',
+                     recorder=recorder)
+
+            _write_json(os.path.join(self.path, self.stamp_file),
+                        {'time': time.time()})
+        finally:
+            self.lock.release()
+
+        return True
+
+    def spawn_maintenance(self, ctxt):
+        """
+        Start a detached process to perform maintenance on the mirror.
+        The process runs independently of this one, so maintenance
+        does not delay the completion of the run.
+
+        :param ctxt: The context object.
+        """
+
+        ctxt.emit('Starting background maintenance of mirror %s' %
+                  self.path, debug=True)
+
+        cmd = [
+            sys.executable, '-c',
+            'import sys, timid_github; sys.exit(timid_github.maintain_main())',
+            '--interval', str(self.interval),
+            '--packs', str(self.max_packs),
+        ]
+        if self.timeline:
+            cmd.extend(['--timeline', self.timeline])
+        cmd.append(self.path)
+        kwargs = {}
+        if hasattr(os, 'setsid'):
+            kwargs['preexec_fn'] = os.setsid
+
+        with open(os.devnull, 'r+b') as devnull:
+            ctxt.environment.call(
+                cmd, close_fds=True, stdin=devnull, stdout=devnull,
+                stderr=devnull, **kwargs)
+
+
+def maintain_main(argv=None):
+    """
+    Entry point for the "timid-github-maintain" command, which
+    performs maintenance on repository mirrors.  This may be run on a
+    schedule, e.g., from cron; it is also started in the background
+    by ``GithubExtension`` when a mirror is due for maintenance.
+
+    :param argv: The command line arguments.  Defaults to
+                 ``sys.argv[1:]``.
+
+    :returns: The exit code.
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Perform maintenance on timid-github repository '
+        'mirrors.',
+    )
+    parser.add_argument(
+        'mirrors',
+        nargs='+',
+        help='The mirror directories to maintain.',
+    )
+    parser.add_argument(
+        '--interval',
+        default=86400,
+        type=int,
+        help='The interval, in seconds, between maintenance runs.  '
+        'Default: %(default)s',
+    )
+    parser.add_argument(
+        '--packs',
+        default=20,
+        type=int,
+        help='The number of pack files above which the mirror is fully '
+        'repacked.  Default: %(default)s',
+    )
+    parser.add_argument(
+        '--force',
+        default=False,
+        action='store_true',
+        help='Perform maintenance even if it is not due.',
+    )
+    parser.add_argument(
+        '--timeline',
+        help='The name of a file to which a performance timeline of the '
+        'git commands is appended, as with "--github-timeline".',
+    )
+    args = parser.parse_args(argv)
+
+    ctxt = context.Context()
+    recorder = None
+    if args.timeline:
+        recorder = Recorder([TimelineSink(args.timeline)])
+    errors = 0
+    try:
+        for path in args.mirrors:
+            mirror = Mirror(os.path.abspath(path), None, args.interval,
+                            args.packs)
+            if not (args.force or mirror.needs_maintenance()):
+                continue
+
+            try:
+                mirror.maintain(ctxt, recorder)
+            except GitException as e:
+                ctxt.emit('Failed to maintain mirror %s: %s' % (path, e))
+                errors += 1
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+    return 1 if errors else 0
+
+
+def _parse_size(text):
+    """
+    Parse a size, optionally suffixed with "K", "M", "G", or "T".
+    Used as an ``argparse`` type.
+
+    :param text: The text to parse, e.g., "500M".
+
+    :returns: The size in bytes.
+    """
+
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+    text = text.strip().upper().rstrip('B')
+    multiplier = 1
+    if text and text[-1] in units:
+        multiplier = units[text[-1]]
+        text = text[:-1]
+
+    try:
+        return int(float(text) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid size "%s"' % text)
+
+
+def _disk_usage(path):
+    """
+    Compute the disk space consumed by a directory tree.  Files with
+    multiple hard links within the tree are counted only once.
+
+    :param path: The directory to measure.
+
+    :returns: The size in bytes.
+    """
+
+    total = 0
+    seen = set()
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            total += st.st_size
+
+    return total
+
+
+class WorkspaceRegistry(object):
+    """
+    A registry of the workspaces and mirrors used by runs, recording
+    when each was last used and how much space it consumes.  The
+    registry is used to evict the least recently used entries when a
+    disk budget or free space watermark is crossed.  Each entry has
+    an associated lock, which running jobs hold in shared mode; an
+    entry is only evicted if its lock can be acquired exclusively.
+    """
+
+    def __init__(self, cache_dir, budget=None, min_free=None):
+        """
+        Initialize a ``WorkspaceRegistry`` object.
+
+        :param cache_dir: The cache directory containing the
+                          registry.
+        :param budget: The maximum total size, in bytes, of all the
+                       registered entries.  If ``None``, the size is
+                       not limited.
+        :param min_free: The minimum free space, in bytes, to
+                         maintain on the filesystem containing the
+                         workspace.  If ``None``, free space is not
+                         checked.
+        """
+
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, 'workspaces.json')
+        self.lock = FileLock('%s.lock' % self.path)
+        self.budget = budget
+        self.min_free = min_free
+
+        # The entries in use by this run, and the locks we hold on
+        # them
+        self.held = {}
+
+    def lock_path(self, path):
+        """
+        Compute the name of the lock file for a workspace.
+
+        :param path: The workspace directory.
+
+        :returns: The name of the lock file.
+        """
+
+        digest = hashlib.sha1(path.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, 'locks', '%s.lock' % digest)
+
+    def acquire(self, path, kind='workspace'):
+        """
+        Register an entry as in use by this run, holding its lock in
+        shared mode until ``release()`` is called.
+
+        :param path: The directory of the workspace or mirror.
+        :param kind: The kind of entry; either "workspace" or
+                     "mirror".
+        """
+
+        if path in self.held:
+            return
+
+        # The lock file is removed when its entry is evicted; if that
+        # happened while we waited for the lock, lock the new file
+        while True:
+            lock = FileLock(self.lock_path(path))
+            lock.acquire(shared=True)
+            try:
+                if os.fstat(lock.fd).st_ino == os.stat(lock.path).st_ino:
+                    break
+            except OSError:
+                pass
+            lock.release()
+        self.held[path] = (kind, lock)
+
+        with self.lock.exclusive():
+            entries = _read_json(self.path, {})
+            entry = entries.setdefault(path, {'size': 0})
+            entry.update(kind=kind, lock=lock.path, last_used=time.time())
+            _write_json(self.path, entries)
+
+    def release(self):
+        """
+        Release the locks on all entries in use by this run.
+        """
+
+        for _kind, lock in self.held.values():
+            lock.release()
+        self.held = {}
+
+    def update_sizes(self):
+        """
+        Measure the entries in use by this run and record their sizes.
+        """
+
+        sizes = dict((path, _disk_usage(path)) for path in self.held)
+
+        with self.lock.exclusive():
+            entries = _read_json(self.path, {})
+            for path, size in sizes.items():
+                if path in entries:
+                    entries[path].update(size=size, last_used=time.time())
+            _write_json(self.path, entries)
+
+    def _free_space(self, path):
+        """
+        Determine the free space on a filesystem.
+
+        :param path: A path on the filesystem.
+
+        :returns: The free space, in bytes.
+        """
+
+        st = os.statvfs(path)
+        return st.f_bavail * st.f_frsize
+
+    def evict(self, ctxt, free_path=None):
+        """
+        Evict least recently used entries until the total size is
+        within the budget and the free space is above the watermark.
+        Entries locked by running jobs are never evicted.
+
+        :param ctxt: The context object.
+        :param free_path: A path on the filesystem whose free space
+                          should be checked.  Defaults to the cache
+                          directory.
+
+        :returns: A list of the evicted directories.
+        """
+
+        if self.budget is None and self.min_free is None:
+            return []
+
+        evicted = []
+        with self.lock.exclusive():
+            entries = _read_json(self.path, {})
+
+            # Forget about entries that no longer exist
+            for path in list(entries):
+                if not os.path.isdir(path):
+                    del entries[path]
+
+            total = sum(e['size'] for e in entries.values())
+            free = None
+            if self.min_free is not None:
+                free = self._free_space(free_path or self.cache_dir)
+
+            for path in sorted(entries, key=lambda p: entries[p]['last_used']):
+                over_budget = self.budget is not None and total > self.budget
+                low_space = free is not None and free < self.min_free
+                if not (over_budget or low_space):
+                    break
+
+                if path in self.held:
+                    continue
+
+                # Only evict entries no running job is using
+                lock = FileLock(entries[path]['lock'])
+                if not lock.acquire(blocking=False):
+                    ctxt.emit('Not evicting %s %s: in use' %
+                              (entries[path]['kind'], path), debug=True)
+                    continue
+
+                # A mirror may also be fetched into by a run which has
+                # yet to register it; hold its fetch lock, too
+                fetch_lock = None
+                if entries[path]['kind'] == 'mirror':
+                    fetch_lock = Mirror(path, None).lock
+                    if not fetch_lock.acquire(blocking=False):
+                        lock.release()
+                        ctxt.emit('Not evicting mirror %s: being updated' %
+                                  path, debug=True)
+                        continue
+
+                try:
+                    ctxt.emit('Evicting %s %s (%d bytes)' %
+                              (entries[path]['kind'], path,
+                               entries[path]['size']), level=2)
+                    shutil.rmtree(path, ignore_errors=True)
+
+                    # Remove the lock file while it is still held; a
+                    # run waiting for it will lock a new one
+                    try:
+                        os.unlink(lock.path)
+                    except OSError:
+                        pass
+                finally:
+                    if fetch_lock is not None:
+                        fetch_lock.release()
+                    lock.release()
+
+                total -= entries[path]['size']
+                if free is not None:
+                    free += entries[path]['size']
+                del entries[path]
+                evicted.append(path)
+
+            _write_json(self.path, entries)
+
+        return evicted
+
+
+class CloneAction(timid.Action):
+    """
+    A Timid action that will clone the target repository.  The
+    repository will be cloned into the working directory.  This action
+    cannot appear in the test description, as it is implicitly added
+    by the ``GithubExtension`` extension.
+    """
+
+    schema = None
+
+    def __init__(self, ctxt, ghe):
+        """
+        Initialize a ``CloneAction`` instance.
+
+        :param ghe: An instance of ``GithubExtension``.
+        """
+
+        # Initialize the superclass
+        super(CloneAction, self).__init__(ctxt, '__clone__', None, None)
+
+        # Store the github extension instance
+        self.ghe = ghe
+
+    def validate_conf(self, name, config, step_addr):
+        """
+        Validate configuration.  This action does not take a
+        configuration, so the ``validate_conf()`` method is overridden
+        to inhibit validation.
+
+        :param name: The name of the action or modifier.
+        :param config: The actual configuration.
+        :param step_addr: The address of the step in the test
+                          configuration.
+        """
+
+        pass  # pragma: no cover
+
+    @profiled('clone')
+    @exc_to_result
+    def __call__(self, ctxt):
+        """
+        Invoke the action.  This method will clone the repository into the
+        correct directory, then switch to that directory.
+
+        :param ctxt: The context object.
+
+        :returns: A ``StepResult`` object.
+        """
+
+        mirror = self.ghe.mirror
+        if mirror is None:
+            return self._workspace(ctxt)
+
+        # Mark the mirror as in use, so it will not be evicted; its
+        # in-use lock is separate from the fetch lock, so that other
+        # runs may still update it
+        if self.ghe.workspaces is not None:
+            self.ghe.workspaces.acquire(mirror.path, 'mirror')
+
+        # Bring the mirror up to date, then prepare the workspace from
+        # it; the shared lock keeps maintenance from repacking the
+        # mirror while we read from it
+        mirror.update(ctxt, self.ghe.recorder)
+        with mirror.lock.shared():
+            return self._workspace(ctxt)
+
+    def _origin(self):
+        """
+        Determine the URL the workspace should be cloned from and updated
+        against.
+
+        :returns: The path to the mirror, if one is in use; otherwise,
+                  the repository URL.
+        """
+
+        if self.ghe.mirror is not None:
+            return self.ghe.mirror.path
+        return self.ghe.repo_url
+
+    def _workspace(self, ctxt):
+        """
+        Clone the repository into the correct directory, or update an
+        existing clone, then switch to that directory.
+
+        :param ctxt: The context object.
+
+        :returns: A ``StepResult`` object.
+        """
+
+        # First step, see if the repository exists
+        work_dir = ctxt.environment.cwd
+        repo_dir = os.path.join(work_dir, self.ghe.repo_name)
+
+        # Mark the workspace as in use, so it will not be evicted
+        if self.ghe.workspaces is not None:
+            self.ghe.workspaces.acquire(repo_dir)
+
+        try:
+            dir_data = os.lstat(repo_dir)
+        except OSError as e:
+            # Re-raise the error if it's not ENOENT
+            if e.errno != errno.ENOENT:
+                msg = 'Unable to stat repo directory %s' % repo_dir
+                return timid.StepResult(msg=msg, exc_info=sys.exc_info())
+
+            # OK, safe to clone from scratch
+            return self._clone(work_dir, repo_dir, ctxt)
+
+        # Hmmm, the file exists; is it a directory?
+        if not stat.S_ISDIR(dir_data.st_mode):
+            # OK, we control the workdir, so delete the extraneous
+            # file and clone from scratch
+            ctxt.emit('Deleting file shadowing repository directory %s' %
+                      repo_dir, level=2)
+            os.remove(repo_dir)
+            return self._clone(work_dir, repo_dir, ctxt)
+
+        # It's a directory; is it a repository?
+        if os.path.isdir(os.path.join(repo_dir, '.git')):
+            # Try updating the base branch
+            try:
+                ctxt.environment.cwd = repo_dir
+                self.ghe.recorder.record('workspace', path='update')
+                return self._update(ctxt)
+            except Exception:
+                # Failed to update, so back out of the directory
+                # temporarily
+                ctxt.emit('Failed to update existing repository in '
+                          'directory %s; starting from scratch' % repo_dir)
+                ctxt.environment.cwd = work_dir
+
+        # Not a repository, or couldn't update; blow it away and try
+        # cloning from scratch
+        ctxt.emit('Deleting directory tree shadowing repository directory %s' %
+                  repo_dir, level=2)
+        shutil.rmtree(repo_dir)
+        return self._clone(work_dir, repo_dir, ctxt)
+
+    def _clone(self, work_dir, target_dir, ctxt):
+        """
+        Clones the base repository into the specified target directory.
+
+        :param work_dir: The current working directory.  This is used
+                         to restore the environment working directory
+                         in the event that the later call to
+                         ``self._update()`` fails.
+        :param target_dir: The directory into which the repository
+                           should be checked out.
+        :param ctxt: The context object.
+        """
+
+        self.ghe.recorder.record('workspace', path='clone')
+
+        # Begin by cloning the repository
+        origin = self._origin()
+        ctxt.emit('Cloning repository from %s into directory %s' %
+                  (origin, target_dir))
+        _git(ctxt, 'clone', origin, target_dir, ssh_retries=5, ghe=self.ghe)
+
+        # Change to the target directory and fetch any changes
+        try:
+            ctxt.environment.cwd = target_dir
+            return self._update(ctxt)
+        except Exception:
+            exc_info = sys.exc_info()
+
+            # Reset the directory
+            ctxt.environment.cwd = work_dir
+
+            # Re-raise the exception
+            six.reraise(*exc_info)
+
+    def _update(self, ctxt):
+        """
+        Updates the repository, assumed to be the current working
+        directory, from the specified base repository.
+
+        :param ctxt: The context object.
+
+        :returns: A ``timid.StepResult`` object.
+        """
+
+        ctxt.emit('Updating repository from upstream data')
+
+        # Ensure the remote is set properly
+        _git(ctxt, 'remote', 'set-url', 'origin', self._origin(),
+             ghe=self.ghe)
+
+        # Do some initial resets
+        ctxt.emit('Cleaning up repository...', level=2)
+        _git(ctxt, 'rebase', '--abort', do_raise=False, ghe=self.ghe)
+        _git(ctxt, 'checkout', '-f', self.ghe.repo_branch, ghe=self.ghe)
+        _git(ctxt, 'reset', '--hard', 'origin/%s' % self.ghe.repo_branch,
+             ghe=self.ghe)
+        _git(ctxt, 'clean', '-fdx', ghe=self.ghe)
+
+        # And check out the designated branch
+        ctxt.emit('Checking out most recent version of branch %s' %
+                  self.ghe.repo_branch, level=2)
+        _git(ctxt, 'fetch', 'origin', self.ghe.repo_branch, ssh_retries=5,
+             ghe=self.ghe)
+        _git(ctxt, 'checkout', self.ghe.repo_branch, ghe=self.ghe)
+
+        return timid.StepResult(state=timid.SUCCESS)
+
+
+class MergeAction(timid.Action):
+    """
+    A Timid action that will prepare a repository by creating and
+    checking out a topic branch and merging the pull request into that
+    branch.  This action cannot appear in the test description, as it
+    is implicitly added by the ``GithubExtension`` extension.  In a
+    merge queue, several pull requests are merged in turn.
+    """
+
+    schema = None
+
+    def __init__(self, ctxt, ghe, pulls=None):
+        """
+        Initialize a ``MergeAction`` instance.
+
+        :param ghe: An instance of ``GithubExtension``.
+        :param pulls: An optional list of ``GithubExtension``
+                      instances for the pull requests to merge, in
+                      order.  Defaults to the pull request of
+                      ``ghe``.
+        """
+
+        # Initialize the superclass
+        super(MergeAction, self).__init__(ctxt, '__merge__', None, None)
+
+        # Store the github extension instance
+        self.ghe = ghe
+        self.pulls = pulls or [ghe]
+
+    def validate_conf(self, name, config, step_addr):
+        """
+        Validate configuration.  This action does not take a
+        configuration, so the ``validate_conf()`` method is overridden
+        to inhibit validation.
+
+        :param name: The name of the action or modifier.
+        :param config: The actual configuration.
+        :param step_addr: The address of the step in the test
+                          configuration.
+        """
+
+        pass  # pragma: no cover
+
+    @profiled('merge')
+    @exc_to_result
+    def __call__(self, ctxt):
+        """
+        Invoke the action.  This method will create the appropriate branch
+        and merge the pull request into it.
+
+        :param ctxt: The context object.
+
+        :returns: A ``StepResult`` object.
+        """
+
+        for pull_ghe in self.pulls:
+            self._merge(ctxt, pull_ghe)
+
+        return timid.StepResult(state=timid.SUCCESS)
+
+    def _merge(self, ctxt, pull_ghe):
+        """
+        Merge a pull request into the base branch.
+
+        :param ctxt: The context object.
+        :param pull_ghe: The ``GithubExtension`` instance for the pull
+                         request.
+        """
+
+        # Compute a branch name
+        local_branch = ('%s-%s' %
+                        (pull_ghe.pull.user.login, pull_ghe.change_branch))
+
+        ctxt.emit('Cloning pull request from %s branch %s '
+                  'into local branch %s' %
+                  (pull_ghe.pull.user.login, pull_ghe.change_branch,
+                   local_branch))
+
+        # Make sure the branch doesn't already exist; a single "git
+        # branch -D" is cheaper than asking whether it does first
+        _git(ctxt, 'branch', '-D', local_branch, do_raise=False,
+             ghe=self.ghe)
+
+        # Create the branch; the pull must merge, as the base branch
+        # may already contain other pull requests of a merge queue
+        _git(ctxt, 'checkout', '-b', local_branch, self.ghe.repo_branch,
+             ghe=self.ghe)
+        _git(ctxt, 'pull', '--no-rebase', pull_ghe.change_url,
+             pull_ghe.change_branch, ghe=self.ghe)
+
+        # Merge the change
+        ctxt.emit('Merging the change into branch %s' % self.ghe.repo_branch)
+        _git(ctxt, 'checkout', self.ghe.repo_branch, ghe=self.ghe)
+        _git(ctxt, 'merge', local_branch, ghe=self.ghe)
+
+
+# Git configuration profiles.  Each profile is a list of configuration
+# settings which are passed to every "git" command run on the
+# workspace.  The "ephemeral" profile trades durability for speed,
+# which is appropriate for the throwaway workspaces created by
+# ``CloneAction``.
+GIT_PROFILES = {
+    'default': [],
+    'ephemeral': [
+        ('core.fsync', 'none'),
+        ('checkout.workers', '0'),
+        ('core.preloadIndex', 'true'),
+        ('core.untrackedCache', 'true'),
+        ('protocol.version', '2'),
+    ],
+}
+
+
+# A mapping of URL string to the attribute of the repository object
+# containing the desired URL.
+URL_ATTR = {
+    'ssh': 'ssh_url',
+    'git': 'git_url',
+    'https': 'clone_url',
+}
+
+
+def _select_url(repo_url, repo_obj):
+    """
+    Select the appropriate repository URL.
+
+    :param repo_url: The URL to select.  May be "ssh", "git", or
+                     "https" to select the appropriate URL from the
+                     ``repo_obj``, or may be a verbatim repository
+                     URL.
+    :param repo_obj: An instance of ``github.Repository.Repository``.
+
+    :returns: The appropriate repository URL.
+    """
+
+    # If it's one of the defined ones, return the appropriate
+    # attribute
+    if repo_url in URL_ATTR:
+        return getattr(repo_obj, URL_ATTR[repo_url])
+
+    # Verbatim URL; return it unchanged
+    return repo_url
+
+
+def _probe_url(ctxt, url, children, recorder=None):
+    """
+    Measure how long it takes to query a single ref from a repository
+    URL.  This is used to determine which access method is the fastest
+    from this host.
+
+    :param ctxt: The context object.
+    :param url: The repository URL to probe.
+    :param children: A list to which the child process will be
+                     appended, so that it may be killed if it takes
+                     too long.
+    :param recorder: An optional ``Recorder`` by which the probe is
+                     recorded as a "git" event.
+
+    :returns: The elapsed time in seconds, or ``None`` if the
+              repository could not be reached.
+    """
+
+    args = ['ls-remote', url, 'HEAD']
+    start = time.time()
+    try:
+        child = ctxt.environment.call(
+            ['git'] + args, close_fds=True,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+    except OSError:
+        return None
+    children.append(child)
+
+    stdout, stderr = child.communicate()
+    duration = time.time() - start
+    if recorder is not None:
+        recorder.record(
+            'git', start=start, duration=duration, subcommand=args[0],
+            args=args, cwd=ctxt.environment.cwd, attempt=1,
+            returncode=child.returncode, stdout_bytes=len(stdout or ''),
+            stderr_bytes=len(stderr or ''),
+            outcome='error' if child.returncode else 'ok',
+        )
+    if child.returncode:
+        return None
+
+    return duration
+
+
+def _auto_protocol(ctxt, repo_obj, cache_dir, ttl, timeout, recorder=None):
+    """
+    Select the fastest reachable access method for a repository.  All
+    the methods in ``URL_ATTR`` are probed concurrently, and the
+    fastest one which succeeded is chosen.  The choice is cached per
+    host, so that later runs need not repeat the probe.
+
+    :param ctxt: The context object.
+    :param repo_obj: An instance of ``github.Repository.Repository``.
+    :param cache_dir: The directory containing the protocol cache.
+    :param ttl: The time, in seconds, for which a cached choice
+                remains valid.
+    :param timeout: The maximum time, in seconds, to wait for the
+                    probes to complete.
+    :param recorder: An optional ``Recorder`` by which the probes are
+                     recorded.
+
+    :returns: One of the keys of ``URL_ATTR``.
+    """
+
+    host = six.moves.urllib.parse.urlparse(repo_obj.clone_url).hostname
+    cache_file = os.path.join(cache_dir, 'protocols.json')
+
+    # Consult the cache first
+    cache = _read_json(cache_file, {})
+    entry = cache.get(host)
+    if entry and time.time() - entry['time'] < ttl:
+        ctxt.emit('Using cached access method "%s" for host %s' %
+                  (entry['protocol'], host), level=2)
+        return entry['protocol']
+
+    # Probe all the access methods concurrently
+    timings = {}
+    children = []
+
+    def probe(method):
+        url = getattr(repo_obj, URL_ATTR[method])
+        timings[method] = _probe_url(ctxt, url, children, recorder)
+
+    threads = []
+    for method in sorted(URL_ATTR):
+        thread = threading.Thread(target=probe, args=(method,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    deadline = time.time() + timeout
+    for thread in threads:
+        thread.join(max(deadline - time.time(), 0))
+
+    # Kill any stragglers
+    for child in children:
+        if child.returncode is None:
+            try:
+                child.kill()
+            except OSError:
+                pass
+
+    reachable = dict((m, t) for m, t in timings.items() if t is not None)
+    ctxt.emit('Access method probe results for host %s: %s' %
+              (host, ', '.join('%s=%s' % (m, 'failed' if t is None else
+                                          '%.3fs' % t)
+                               for m, t in sorted(timings.items()))),
+              debug=True)
+    if not reachable:
+        ctxt.emit('No access method reachable for host %s; using "https"' %
+                  host)
+        return 'https'
+
+    method = min(reachable, key=reachable.get)
+    ctxt.emit('Selected access method "%s" for host %s' % (method, host),
+              level=2)
+
+    # Update the cache, re-reading it to pick up any concurrent
+    # updates
+    cache = _read_json(cache_file, {})
+    cache[host] = {
+        'protocol': method,
+        'time': time.time(),
+    }
+    try:
+        _write_json(cache_file, cache)
+    except (IOError, OSError) as e:
+        ctxt.emit('Unable to update protocol cache %s: %s' % (cache_file, e),
+                  debug=True)
+
+    return method
+
+
+# The number of seconds before expiry at which a cached Github App
+# installation token is replaced
+APP_TOKEN_MARGIN = 600
+
+
+def _app_token(ctxt, cache_file, app_id, key_file, installation, api):
+    """
+    Obtain an installation token for a Github App.  Tokens are cached,
+    in a file only the user can read, until shortly before they
+    expire, so that most runs need not exchange a new one.
+
+    :param ctxt: The context object.
+    :param cache_file: The name of the token cache file.
+    :param app_id: The ID of the Github App.
+    :param key_file: The name of the file containing the private key
+                     of the Github App.
+    :param installation: The ID of the installation of the Github
+                         App.
+    :param api: The URL of the Github API.
+
+    :returns: The installation token.
+    """
+
+    key = '%s/%s@%s' % (app_id, installation, api)
+    with FileLock(cache_file + '.lock').exclusive():
+        # Consult the cache first
+        cache = _read_json(cache_file, {})
+        entry = cache.get(key)
+        if entry and entry['expires'] - time.time() > APP_TOKEN_MARGIN:
+            ctxt.emit('Using cached installation token for Github App %s' %
+                      app_id, debug=True)
+            return entry['token']
+
+        # Exchange the private key for a new token
+        ctxt.emit('Requesting installation token for Github App %s' %
+                  app_id, level=2)
+        with open(key_file) as f:
+            private_key = f.read()
+        integration = github.GithubIntegration(app_id, private_key,
+                                               base_url=api)
+        auth = integration.get_access_token(installation)
+
+        cache[key] = {
+            'token': auth.token,
+            'expires': calendar.timegm(auth.expires_at.utctimetuple()),
+        }
+        try:
+            _write_json(cache_file, cache, stat.S_IRUSR | stat.S_IWUSR)
+        except (IOError, OSError) as e:
+            ctxt.emit('Unable to update token cache %s: %s' %
+                      (cache_file, e), debug=True)
+
+    return auth.token
+
+
+# The maximum length of a status description accepted by Github
+STATUS_TEXT_MAX = 140
+
+
+def _append_text(text, suffix):
+    """
+    Append a suffix to a status description, truncating the
+    description so that the result fits within ``STATUS_TEXT_MAX``
+    characters.
+
+    :param text: The status description.  May be ``None``.
+    :param suffix: The suffix to append.  If empty, ``text`` is
+                   returned unchanged.
+
+    :returns: The status description with the suffix appended.
+    """
+
+    if not suffix:
+        return text
+
+    text = text or ''
+    room = STATUS_TEXT_MAX - len(suffix)
+    if len(text) > room:
+        text = text[:max(room - 3, 0)] + '...'
+
+    return (text + suffix)[:STATUS_TEXT_MAX]
+
+
+def _pull_specs(value):
+    """
+    Split the value of the ``--github-pull`` option into pull request
+    designations.  A value beginning with "@" names a file listing
+    one designation per line; blank lines and lines beginning with
+    "#" are ignored.  Otherwise, a JSON object is a single
+    designation, and anything else is split on commas and whitespace.
+
+    :param value: The value of the ``--github-pull`` option.
+
+    :returns: A list of pull request designations.
+    """
+
+    if value.startswith('@'):
+        with open(os.path.expanduser(value[1:])) as f:
+            lines = [line.strip() for line in f]
+        return [line for line in lines if line and not line.startswith('#')]
+
+    try:
+        json.loads(value)
+    except ValueError:
+        return value.replace(',', ' ').split()
+
+    return [value]
+
+
+def _resolve_pull(gh, scheduler, recorder, spec):
+    """
+    Look up a pull request.
+
+    :param gh: A ``github.Github`` object.
+    :param scheduler: The ``ApiScheduler`` to make API calls through.
+    :param recorder: The ``Recorder`` to record API calls with.
+    :param spec: The pull request designation.  This may be the
+                 repository name and pull request number (e.g.,
+                 "repo#1" or "org/repo#1"), or a JSON object
+                 describing the pull request.
+
+    :returns: A ``github.PullRequest.PullRequest`` object.
+    """
+
+    try:
+        # Try JSON first
+        pull_raw = json.loads(spec)
+    except ValueError:
+        # Raw string
+        repo, _sep, number = spec.partition('#')
+
+        # Interpret the number
+        if not number or not number.isdigit():
+            sys.exit('Invalid pull request number "%s"' % number)
+        number = int(number)
+
+        # Interpret the repo
+        if '/' not in repo:
+            user = scheduler.call(recorder, 'get_user', gh.get_user)
+            login = scheduler.call(recorder, 'get_user.login',
+                                   getattr, user, 'login')
+            repo = '%s/%s' % (login, repo)
+
+        # Look up the pull request
+        try:
+            repo = scheduler.call(recorder, 'get_repo', gh.get_repo, repo)
+            return scheduler.call(recorder, 'get_pull', repo.get_pull,
+                                  number)
+        except Exception:
+            # No such pull request, I guess
+            sys.exit('Unable to resolve pull request "%s"' % spec)
+
+    # OK, we have raw JSON data; wrap it in a PullRequest
+    return gh.create_from_raw_data(github.PullRequest.PullRequest, pull_raw)
+
+
+class StatusPoster(object):
+    """
+    Post status updates from a background thread, so that the steps
+    need not wait for the Github API.  Only the most recent status
+    submitted is posted; a status still waiting when a newer one is
+    submitted is dropped.
+    """
+
+    def __init__(self, post):
+        """
+        Initialize a ``StatusPoster`` object.
+
+        :param post: A callable to post a status.  It is called with
+                     the positional arguments passed to ``submit()``.
+        """
+
+        self.post = post
+        self.cond = threading.Condition()
+        self.waiting = None
+        self.busy = False
+        self.stopped = False
+        self.thread = None
+
+    def submit(self, *args):
+        """
+        Submit a status to be posted.  The worker thread is started
+        with the first status.
+
+        :param args: The positional arguments for the ``post``
+                     callable.
+        """
+
+        with self.cond:
+            self.waiting = args
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify_all()
+
+    def _run(self):
+        """
+        The body of the worker thread.
+        """
+
+        while True:
+            with self.cond:
+                while self.waiting is None and not self.stopped:
+                    self.cond.wait()
+                if self.waiting is None:
+                    return
+                args, self.waiting = self.waiting, None
+                self.busy = True
+
+            try:
+                self.post(*args)
+            except Exception as e:
+                sys.stderr.write('Unable to post status: %s\n' % e)
+            finally:
+                with self.cond:
+                    self.busy = False
+                    self.cond.notify_all()
+
+    def flush(self):
+        """
+        Wait until any status submitted has been posted.
+        """
+
+        with self.cond:
+            while self.waiting is not None or self.busy:
+                self.cond.wait()
+
+    def stop(self):
+        """
+        Post any status submitted, then stop the worker thread.
+        """
+
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+            thread = self.thread
+
+        if thread is not None:
+            thread.join()
+        self.thread = None
+
+
+class RunQueue(object):
+    """
+    A persistent queue of the runs waiting to be tested, shared by all
+    the processes on this host.  Runs are keyed by the base repository
+    and number of the pull request, e.g., "org/repo#1"; queueing a new
+    head commit drops any run of the same pull request still waiting,
+    as its result no longer matters.  The latest head commit of each
+    pull request is also recorded, so a run in progress can find that
+    it has been superseded and stop early.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize a ``RunQueue`` object.
+
+        :param path: The name of the state file.  A lock file is kept
+                     alongside it.
+        """
+
+        self.path = path
+        self.lock_path = '%s.lock' % path
+
+        # The heads last read by superseded(), and the time the state
+        # file was modified when they were read
+        self._mtime = None
+        self._heads = {}
+
+    @contextlib.contextmanager
+    def _state(self):
+        """
+        A context manager which holds the lock and yields the state,
+        which is written back on exit.  A new ``FileLock`` is used
+        each time, so the queue may be shared between threads.
+        """
+
+        lock = FileLock(self.lock_path)
+        with lock.exclusive():
+            state = _read_json(self.path) or {}
+            state.setdefault('pending', [])
+            state.setdefault('heads', {})
+            yield state
+            _write_json(self.path, state)
+
+    def push(self, pull, sha, payload=None):
+        """
+        Queue a run of a pull request, dropping any run of the same
+        pull request still waiting.
+
+        :param pull: The pull request, e.g., "org/repo#1".
+        :param sha: The head commit SHA.
+        :param payload: Optional data to hand to the run, e.g., the
+                        pull request object from a webhook, encoded
+                        as JSON.
+
+        :returns: A list of the head commit SHAs of the dropped runs.
+        """
+
+        with self._state() as state:
+            dropped = [job[1] for job in state['pending'] if job[0] == pull]
+            state['pending'] = [job for job in state['pending']
+                                if job[0] != pull]
+            state['pending'].append([pull, sha, payload])
+            state['heads'][pull] = sha
+
+        return dropped
+
+    def cancel(self, pull):
+        """
+        Drop any run of a pull request still waiting, e.g., because
+        the pull request was closed, and forget its head commit.
+
+        :param pull: The pull request, e.g., "org/repo#1".
+
+        :returns: A list of the head commit SHAs of the dropped runs.
+        """
+
+        with self._state() as state:
+            dropped = [job[1] for job in state['pending'] if job[0] == pull]
+            state['pending'] = [job for job in state['pending']
+                                if job[0] != pull]
+            state['heads'].pop(pull, None)
+
+        return dropped
+
+    def pop(self):
+        """
+        Take the oldest run from the queue.
+
+        :returns: A tuple of the pull request, the head commit SHA,
+                  and the payload, or ``None`` if the queue is empty.
+        """
+
+        with self._state() as state:
+            if not state['pending']:
+                return None
+            return tuple(state['pending'].pop(0))
+
+    def __len__(self):
+        """
+        Return the number of runs waiting.
+
+        :returns: The number of runs waiting.
+        """
+
+        return len((_read_json(self.path) or {}).get('pending', []))
+
+    def done(self, pull, sha):
+        """
+        Record that a run has finished.  The head commit of the pull
+        request is forgotten, unless a newer one has been queued.
+
+        :param pull: The pull request, e.g., "org/repo#1".
+        :param sha: The head commit SHA tested.
+        """
+
+        with self._state() as state:
+            if state['heads'].get(pull) == sha:
+                del state['heads'][pull]
+
+    def superseded(self, pull, sha):
+        """
+        Determine whether a newer head commit of a pull request has
+        been queued.  This is called before every step, so the state
+        file is only read again if it has been modified.
+
+        :param pull: The pull request, e.g., "org/repo#1".
+        :param sha: The head commit SHA being tested.
+
+        :returns: The newer head commit SHA, or ``None``.
+        """
+
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return None
+        if mtime != self._mtime:
+            self._heads = (_read_json(self.path) or {}).get('heads', {})
+            self._mtime = mtime
+
+        head = self._heads.get(pull)
+        return head if head and head != sha else None
+
+
+# Github handles kept for reuse by later runs in the same process,
+# keyed by the API key of the credentials, and the passwords looked
+# up from the keyring or prompted for, keyed by API URL and user
+# name; ``None`` disables reuse.  Enabled by the webhook workers,
+# which run many tests in one process.
+_github_clients = None
+_github_passwords = None
+
+
+class GithubExtension(timid.Extension):
+    """
+    A Timid extension that provides integration with Github.  This
+    will allow a pull request to be tested directly by Timid.  Testing
+    includes making status updates to the pull request for each step
+    in the testing procedure, with a final "success" or "failure"
+    status at the conclusion of testing, with an optional override for
+    "success" status.
+    """
+
+    priority = 50
+
+    @classmethod
+    def prepare(cls, parser):
+        """
+        Called to prepare the extension.  The extension is prepared during
+        argument parser preparation.  An extension implementing this
+        method is able to add command line arguments specific for that
+        extension.  Note that this is a class method; the extension
+        will not be instantiated prior to calling this method, nor
+        should this method attempt to initialize the extension.
+
+        :param parser: The argument parser, an instance of
+                       ``argparse.ArgumentParser``.
+        """
+
+        # Begin by grouping the extension arguments
+        group = parser.add_argument_group(
+            'Github Integration', 'Options for integrating with Github.',
+        )
+
+        # Authentication options
+        group.add_argument(
+            '--github-api',
+            default=os.environ.get('TIMID_GITHUB_API',
+                                   'https://api.github.com'),
+            help='Designate the Github API for the instance of Github to '
+            'search for the pull request.  Default is drawn from the '
+            '"TIMID_GITHUB_API" environment variable.  Default: %(default)s',
+        )
+        group.add_argument(
+            '--github-user',
+            default=os.environ.get('TIMID_GITHUB_USER', getpass.getuser()),
+            help='Designate the username to use to authenticate to the '
+            'Github API.  Default is drawn from the "TIMID_GITHUB_USER" '
+            'environment variable.  Default: %(default)s',
+        )
+        group.add_argument(
+            '--github-pass',
+            default=os.environ.get('TIMID_GITHUB_PASS'),
+            help='Designate the password to use to authenticate to the '
+            'Github API.  If not provided, and not available from the '
+            'keyring, will be prompted for.',
+        )
+        group.add_argument(
+            '--github-keyring-set',
+            default=False,
+            action='store_true',
+            help='Enable setting the password in the keyring.  The entry '
+            'will be keyed by the Github API URL and by the username.',
+        )
+        group.add_argument(
+            '--github-token-pool',
+            default=os.environ.get('TIMID_GITHUB_TOKEN_POOL'),
+            help='Designate a file listing Github API tokens, one per line.  '
+            'Each run uses the token with the most calls remaining in its '
+            'rate limit, as last seen by any run on this host, in place of '
+            'the username and password.  Default is drawn from the '
+            '"TIMID_GITHUB_TOKEN_POOL" environment variable.',
+        )
+        group.add_argument(
+            '--github-app-id',
+            default=os.environ.get('TIMID_GITHUB_APP_ID'),
+            help='Designate the ID of a Github App to authenticate as, in '
+            'place of the username and password.  Installation tokens are '
+            'cached in the cache directory until shortly before they '
+            'expire.  Default is drawn from the "TIMID_GITHUB_APP_ID" '
+            'environment variable.',
+        )
+        group.add_argument(
+            '--github-app-key',
+            default=os.environ.get('TIMID_GITHUB_APP_KEY'),
+            help='Designate the file containing the private key of the '
+            'Github App.  Default is drawn from the "TIMID_GITHUB_APP_KEY" '
+            'environment variable.',
+        )
+        group.add_argument(
+            '--github-app-installation',
+            type=int,
+            default=os.environ.get('TIMID_GITHUB_APP_INSTALLATION'),
+            help='Designate the ID of the installation of the Github App.  '
+            'Default is drawn from the "TIMID_GITHUB_APP_INSTALLATION" '
+            'environment variable.',
+        )
+
+        # The pull request to test
+        group.add_argument(
+            '--github-pull',
+            help='Designate the pull request to test.  This may be the '
+            'repository name and pull request number (e.g., "repo#1" or '
+            '"org/repo#1"), or a JSON object describing the pull request '
+            '(deprecated usage).  Several pull requests, separated by '
+            'commas or spaces, or "@" and the name of a file listing one '
+            'per line, are tested in turn, reusing the Github session and '
+            'mirror.  This is the only option that enables the Github '
+            'extension.',
+        )
+        group.add_argument(
+            '--github-batch-jobs',
+            type=int,
+            default=1,
+            help='The number of pull requests to test at once, when '
+            '--github-pull designates several.  Each is tested in its own '
+            'subdirectory of the working directory.  Default: '
+            '%(default)s.',
+        )
+        group.add_argument(
+            '--github-merge-queue',
+            action='store_true',
+            default=False,
+            help='Test the pull requests designated by --github-pull '
+            'together, merged onto the base branch in the order given, '
+            'running the steps once.  If the steps fail, the pull requests '
+            'are bisected to find those at fault.  The pull requests must '
+            'share a base repository and branch.',
+        )
+
+        # The repository to pull from
+        group.add_argument(
+            '--github-repo',
+            default='git',
+            help='Designate the repository URL to clone from.  This may '
+            'be the full URL to the repository, or it may be one of the '
+            'tokens "ssh", "git", or "https", designating to use the '
+            'specified access method from the repository specified in the '
+            'Github pull request.  The token "auto" selects the fastest '
+            'reachable access method.  Default: %(default)s.',
+        )
+
+        # The repository to pull from
+        group.add_argument(
+            '--github-change-repo',
+            help='Designate the repository URL to merge the pull request '
+            'from.  This may be the full URL to the repository, or it may '
+            'be one of the tokens "ssh", "git", or "https", designating to '
+            'use the specified access method from the repository specified '
+            'in the Github pull request.  Defaults to the same method as '
+            'selected for --github-repo.',
+        )
+
+        # Local state options
+        group.add_argument(
+            '--github-cache-dir',
+            default=os.environ.get('TIMID_GITHUB_CACHE',
+                                   os.path.join('~', '.cache',
+                                                'timid-github')),
+            help='Designate a directory in which to cache state between '
+            'runs.  Default is drawn from the "TIMID_GITHUB_CACHE" '
+            'environment variable.  Default: %(default)s',
+        )
+        group.add_argument(
+            '--github-auto-ttl',
+            default=3600,
+            type=int,
+            help='The time, in seconds, for which the access method '
+            'selected by "auto" is cached for a host.  Default: '
+            '%(default)s',
+        )
+        group.add_argument(
+            '--github-auto-timeout',
+            default=10.0,
+            type=float,
+            help='The maximum time, in seconds, to wait while probing '
+            'access methods for "auto".  Default: %(default)s',
+        )
+
+        # Workspace options
+        group.add_argument(
+            '--github-git-profile',
+            default=os.environ.get('TIMID_GITHUB_GIT_PROFILE', 'default'),
+            choices=sorted(GIT_PROFILES),
+            help='Designate the git configuration profile to apply to '
+            'the workspace.  The "ephemeral" profile disables fsync, '
+            'enables parallel checkout, index preloading and the untracked '
+            'cache, and uses git protocol version 2.  Default is drawn from '
+            'the "TIMID_GITHUB_GIT_PROFILE" environment variable.  '
+            'Default: %(default)s',
+        )
+
+        group.add_argument(
+            '--github-mirror',
+            default=False,
+            action='store_true',
+            help='Maintain a mirror of the base repository in the cache '
+            'directory, and clone and update the workspace from it.  The '
+            'mirror is maintained in the background.',
+        )
+        group.add_argument(
+            '--github-maintenance-interval',
+            default=86400,
+            type=int,
+            help='The interval, in seconds, between maintenance runs on '
+            'the mirror.  Default: %(default)s',
+        )
+        group.add_argument(
+            '--github-maintenance-packs',
+            default=20,
+            type=int,
+            help='The number of pack files in the mirror which triggers '
+            'maintenance, regardless of the interval.  Default: '
+            '%(default)s',
+        )
+
+        group.add_argument(
+            '--github-disk-budget',
+            type=_parse_size,
+            help='The maximum total disk space to be consumed by workspaces '
+            'and mirrors.  When exceeded, the least recently used ones not '
+            'in use by a running job are deleted.  May be suffixed with '
+            '"K", "M", "G", or "T".',
+        )
+        group.add_argument(
+            '--github-min-free',
+            type=_parse_size,
+            help='The minimum free disk space to maintain on the filesystem '
+            'containing the workspace.  When free space falls below this, '
+            'the least recently used workspaces and mirrors not in use by a '
+            'running job are deleted.  May be suffixed with "K", "M", "G", '
+            'or "T".',
+        )
+
+        group.add_argument(
+            '--github-api-budget',
+            type=int,
+            help='The number of Github API calls a run may make before '
+            'pending status updates are skipped.  Failure and final '
+            'statuses are always sent.',
+        )
+        group.add_argument(
+            '--github-api-hourly-budget',
+            type=int,
+            help='The number of Github API calls all runs on this host, '
+            'using the same credentials, may make in a clock hour before '
+            'pending status updates are skipped.  Failure and final '
+            'statuses are always sent.',
+        )
+        group.add_argument(
+            '--github-api-reserve',
+            type=int,
+            default=50,
+            help='The number of calls remaining in the Github API rate '
+            'limit below which pending status updates are skipped.  '
+            'Default: %(default)s.',
+        )
+        group.add_argument(
+            '--github-api-spacing',
+            type=float,
+            default=0.0,
+            help='The minimum number of seconds between Github API calls.  '
+            'The spacing applies across all runs on this host using the '
+            'same credentials.  Default: %(default)s.',
+        )
+        group.add_argument(
+            '--github-api-max-wait',
+            type=int,
+            default=300,
+            help='The maximum number of seconds to wait for the Github API '
+            'rate limit to reset.  Pending status updates are queued '
+            'rather than waiting.  Default: %(default)s.',
+        )
+        group.add_argument(
+            '--github-summary-top',
+            type=int,
+            default=5,
+            help='The number of slowest git commands to include in the '
+            'summary of the run emitted at the end of testing.  The summary '
+            'is emitted at verbosity level 2.  Default: %(default)s.',
+        )
+        group.add_argument(
+            '--github-summary-file',
+            help='The name of a file to which a summary of the time spent in '
+            'each phase of the run is written, as JSON.',
+        )
+        group.add_argument(
+            '--github-summary-status',
+            action='store_true',
+            default=False,
+            help='Append a brief summary of the time spent in each phase of '
+            'the run to the final status description.',
+        )
+        group.add_argument(
+            '--github-metrics-dir',
+            default=os.environ.get('TIMID_GITHUB_METRICS_DIR'),
+            help='The node exporter textfile collector directory to which '
+            'Prometheus metrics describing the runs are written.  Default '
+            'is drawn from the "TIMID_GITHUB_METRICS_DIR" environment '
+            'variable.',
+        )
+        group.add_argument(
+            '--github-history',
+            help='The name of a SQLite database to which the timings of '
+            'the run are recorded, keyed by repository, base branch, and '
+            'host.  Use "timid-github-history" to report on it.',
+        )
+        group.add_argument(
+            '--github-trace',
+            help='The name of a file to which trace spans describing the '
+            'run, its steps, and the git commands and Github API calls they '
+            'make are appended, as OTLP JSON.  The trace context is passed '
+            'to git through the "TRACEPARENT" environment variable, and a '
+            '"TRACEPARENT" set in the environment of timid is used as the '
+            'parent of the run.',
+        )
+        group.add_argument(
+            '--github-timeline',
+            help='The name of a file to which a performance timeline is '
+            'appended.  Each git command, retry, and Github API call is '
+            'recorded as a line of JSON describing its start time, '
+            'duration, size, and outcome.',
+        )
+
+        # Some control options
+        group.add_argument(
+            '--github-status-url',
+            help='A URL to include in status updates made on the pull '
+            'request.  Optional.',
+        )
+        group.add_argument(
+            '--github-status-interval',
+            type=float,
+            default=0.0,
+            help='The minimum number of seconds between pending status '
+            'updates.  Steps starting sooner after the last update do not '
+            'update the status; the final status is always set.  A run '
+            'thus makes at most one pending update per interval, however '
+            'many steps it has.  Default: %(default)s, updating the status '
+            'at every step.',
+        )
+        group.add_argument(
+            '--github-status-async',
+            action='store_true',
+            default=False,
+            help='Post pending status updates from a background thread, '
+            'so that steps do not wait for the Github API.',
+        )
+        group.add_argument(
+            '--github-queue',
+            default=os.environ.get('TIMID_GITHUB_QUEUE'),
+            help='The state file of the queue of runs kept by '
+            '"timid-github-watch" or "timid-github-webhook".  If a newer '
+            'head commit of the pull request is queued while testing, the '
+            'remaining steps are skipped and the commit tested is given a '
+            '"superseded" status.  Default is drawn from the '
+            '"TIMID_GITHUB_QUEUE" environment variable, which those '
+            'commands set.',
+        )
+
+        # Override options
+        group.add_argument(
+            '--github-override',
+            help='DEPRECATED.  Accepts a JSON object describing the status '
+            'to use in place of a successful status resulting from the test. '
+            'The JSON object should be a dictionary containing the "status" '
+            'key designating the final status (replaced by '
+            '"--github-override-status").  Optionally, the "text" key '
+            '(replaced by "--github-override-text") designates the status '
+            'text, and the "url" key (replaced by "--github-override-url") '
+            'designates the status URL.',
+        )
+        group.add_argument(
+            '--github-override-status',
+            choices=['pending', 'error', 'failure'],
+            help='Specifies an alternate status to use if tests complete '
+            'successfully.  Must be "pending", "error", or "failure".  If '
+            'used with "--github-override", this option takes precedence.',
+        )
+        group.add_argument(
+            '--github-override-text',
+            help='Specifies status text to include with the override '
+            'status specified by "--github-override-status".  If used with '
+            '"--github-override", this option takes precedence.',
+        )
+        group.add_argument(
+            '--github-override-url',
+            help='Specifies a status URL to include with the override '
+            'status specified by "--github-override-status".  If used with '
+            '"--github-override", this option takes precedence.',
+        )
+
+    @classmethod
+    @profiled('activate')
+    def activate(cls, ctxt, args):
+        """
+        Called to determine whether to activate the extension.  This call
+        is made after processing command line arguments, and must
+        return either ``None`` or an initialized instance of the
+        extension.  Note that this is a class method.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param args: An instance of ``argparse.Namespace`` containing
+                     the result of processing command line arguments.
+
+        :returns: An instance of the extension class if the extension
+                  has been activated, ``None`` if it has not.  If this
+                  method returns ``None``, no further extension
+                  methods will be called.
+        """
+
+        # If no pull request was specified, do nothing
+        if not args.github_pull:
+            return None
+
+        ctxt.emit('Github plugin activated')
+
+        # Determine the pull requests to test
+        try:
+            specs = _pull_specs(args.github_pull)
+        except (IOError, OSError) as e:
+            sys.exit('Unable to read pull requests from %s: %s' %
+                     (args.github_pull[1:], e))
+        if not specs:
+            sys.exit('No pull requests found in "%s"' % args.github_pull)
+
+        # Ensure we have a password, or obtain a token
+        pool = None
+        token = False
+        login = args.github_user
+        api_key = '%s@%s' % (args.github_user, args.github_api)
+        if args.github_app_id:
+            if args.github_token_pool:
+                sys.exit('A Github App and a token pool may not both be used')
+            if not args.github_app_key or args.github_app_installation is None:
+                sys.exit('A Github App requires a private key and an '
+                         'installation ID')
+            try:
+                passwd = _app_token(
+                    ctxt, os.path.join(
+                        os.path.expanduser(args.github_cache_dir),
+                        'app-tokens.json'),
+                    args.github_app_id,
+                    os.path.expanduser(args.github_app_key),
+                    args.github_app_installation, args.github_api)
+            except (IOError, OSError, github.GithubException) as e:
+                sys.exit('Unable to obtain a token for Github App %s: %s' %
+                         (args.github_app_id, e))
+            token = True
+            login = 'x-access-token'
+            api_key = 'app-%s-%s@%s' % (args.github_app_id,
+                                        args.github_app_installation,
+                                        args.github_api)
+        elif args.github_token_pool:
+            token_file = os.path.expanduser(args.github_token_pool)
+            try:
+                tokens = _read_tokens(token_file)
+            except (IOError, OSError) as e:
+                sys.exit('Unable to read tokens from %s: %s' %
+                         (token_file, e))
+            if not tokens:
+                sys.exit('No tokens found in %s' % token_file)
+            pool = TokenPool(tokens, os.path.join(
+                os.path.expanduser(args.github_cache_dir),
+                'token-pool.json'))
+            passwd = pool.select()
+            token = True
+            api_key = 'token-%s@%s' % (pool.fingerprint(passwd),
+                                       args.github_api)
+            ctxt.emit('Using token %s from the pool' %
+                      pool.fingerprint(passwd), level=2)
+        else:
+            service = 'timid-github!%s' % args.github_api
+            passwd_key = (args.github_api, args.github_user)
+            passwd = args.github_pass
+            if passwd is None and not args.github_keyring_set:
+                # Try a password a previous run looked up, then the
+                # keyring
+                if _github_passwords is not None:
+                    passwd = _github_passwords.get(passwd_key)
+                if passwd is None:
+                    passwd = keyring.get_password(service, args.github_user)
+            if passwd is None:
+                # OK, try prompting for it
+                passwd = getpass.getpass('[%s] Password for "%s"> ' %
+                                         (args.github_api, args.github_user))
+
+            # Are we supposed to set it?
+            if args.github_keyring_set:
+                ctxt.emit('Saving password in keyring as requested')
+                keyring.set_password(service, args.github_user, passwd)
+
+            if _github_passwords is not None:
+                _github_passwords[passwd_key] = passwd
+
+        # Set up the performance timeline
+        summary = RunSummary(args.github_summary_top,
+                             args.github_summary_file,
+                             args.github_summary_status)
+        tracer = None
+        if args.github_trace:
+            tracer = TraceSink(os.path.expanduser(args.github_trace),
+                               ctxt.environment.get('TRACEPARENT'))
+        hourly_state = None
+        if args.github_api_hourly_budget is not None:
+            hourly_state = os.path.join(
+                os.path.expanduser(args.github_cache_dir), 'api-usage.json')
+        budget = ApiBudget(args.github_api_budget,
+                           args.github_api_hourly_budget,
+                           args.github_api_reserve, hourly_state, api_key)
+        scheduler = ApiScheduler(
+            args.github_api_spacing, args.github_api_max_wait,
+            os.path.join(os.path.expanduser(args.github_cache_dir),
+                         'api-schedule.json'), api_key)
+        # The HTTP requests are always observed, as the budget tracks
+        # the rate limit from their headers
+        recorder = Recorder([summary, budget], tracer)
+        recorder.observe_http()
+        if args.github_timeline:
+            recorder.add_sink(TimelineSink(args.github_timeline))
+        if args.github_metrics_dir:
+            recorder.add_sink(MetricsSink(
+                os.path.expanduser(args.github_metrics_dir)))
+        history = None
+        if args.github_history:
+            history = RunHistory(os.path.expanduser(args.github_history))
+
+        # Now we have authentication information, get a Github handle;
+        # a warm webhook worker reuses the handle, and its connections,
+        # from its earlier runs.  Only a fingerprint of the secret is
+        # kept with it, to notice a renewed installation token.
+        fingerprint = TokenPool.fingerprint(passwd)
+        gh = None
+        if _github_clients is not None:
+            gh, cached = _github_clients.get(api_key, (None, None))
+            if cached != fingerprint:
+                gh = None
+        if gh is None:
+            if token:
+                gh = github.Github(passwd, None, base_url=args.github_api)
+            else:
+                gh = github.Github(args.github_user, passwd,
+                                   base_url=args.github_api)
+            if _github_clients is not None:
+                _github_clients[api_key] = (gh, fingerprint)
+
+        # Set up the final status information
+        final_status = {
+            'status': 'success',
+            'text': 'Tests passed!',
+            'url': args.github_status_url,
+        }
+
+        # Handle the --github-override option
+        if args.github_override:
+            try:
+                override_raw = json.loads(args.github_override)
+                for key in final_status:
+                    if key in override_raw:
+                        final_status[key] = override_raw[key]
+            except ValueError:
+                pass
+
+        # Now we process the other override options
+        if args.github_override_status:
+            final_status['status'] = args.github_override_status
+        if args.github_override_text:
+            final_status['text'] = args.github_override_text
+        if args.github_override_url:
+            final_status['url'] = args.github_override_url
+
+        # Set up the queue, to detect runs which are superseded
+        queue = None
+        if args.github_queue:
+            queue = RunQueue(os.path.expanduser(args.github_queue))
+
+        # Set up an extension for each pull request
+        cache_dir = os.path.expanduser(args.github_cache_dir)
+        pulls = []
+        for spec in specs:
+            pull = _resolve_pull(gh, scheduler, recorder, spec)
+
+            ctxt.emit('Testing pull request %s#%d' %
+                      (pull.base.repo.full_name, pull.number))
+
+            # Need the repository name
+            repo_name = pull.base.repo.name
+
+            # Also need the branches
+            repo_branch = pull.base.ref
+            change_branch = pull.head.ref
+
+            # Select the correct repository URL
+            repo_method = args.github_repo
+            if repo_method == 'auto':
+                repo_method = _auto_protocol(
+                    ctxt, pull.base.repo, cache_dir, args.github_auto_ttl,
+                    args.github_auto_timeout, recorder)
+            repo_url = _select_url(repo_method, pull.base.repo)
+            ctxt.emit('Base repository %s' % repo_url, level=2)
+
+            # Select the correct change repository URL.  If not
+            # independently specified, default to the same as the
+            # repo_url.  Note: the URLs could legally be the same, as
+            # a PR could be made from one branch to another of the
+            # same repository.
+            change_method = args.github_change_repo or args.github_repo
+            if change_method == 'auto':
+                change_method = _auto_protocol(
+                    ctxt, pull.head.repo, cache_dir, args.github_auto_ttl,
+                    args.github_auto_timeout, recorder)
+            change_url = _select_url(change_method, pull.head.repo)
+            ctxt.emit('PR repository %s' % change_url, level=2)
+
+            # Set up the mirror of the base repository.  Each pull
+            # request gets its own Mirror object, as the locks they
+            # hold may not be shared between threads; pull requests
+            # against the same repository share the mirror itself.
+            mirror = None
+            if args.github_mirror:
+                host = six.moves.urllib.parse.urlparse(
+                    pull.base.repo.clone_url).hostname
+                mirror = Mirror(
+                    os.path.join(cache_dir, 'mirrors', host,
+                                 '%s.git' % pull.base.repo.full_name),
+                    repo_url, args.github_maintenance_interval,
+                    args.github_maintenance_packs, args.github_timeline)
+                ctxt.emit('Using mirror %s' % mirror.path, level=2)
+
+            # Set up the workspace registry, used to evict old
+            # workspaces
+            workspaces = None
+            if (args.github_disk_budget is not None or
+                    args.github_min_free is not None):
+                workspaces = WorkspaceRegistry(
+                    cache_dir, args.github_disk_budget, args.github_min_free)
+
+            # With the pull, we need the commit at its head; looking it
+            # up directly avoids listing every commit of the pull
+            # request
+            last_commit = scheduler.call(recorder, 'get_commit',
+                                         pull.base.repo.get_commit,
+                                         pull.head.sha)
+
+            # Describe the run in the trace
+            if tracer is not None and len(specs) == 1:
+                tracer.attributes.update({
+                    'github.pull': '%s#%d' % (pull.base.repo.full_name,
+                                              pull.number),
+                    'github.repo': pull.base.repo.full_name,
+                    'github.base_branch': repo_branch,
+                    'github.commit_sha': last_commit.sha,
+                })
+
+            # Variables for the use of any callers
+            variables = {
+                'github_api': args.github_api,
+                'github_api_username': login,
+                'github_api_password': passwd,
+                'github_repo_name': repo_name,
+                'github_pull': '%s#%d' % (pull.base.repo.full_name,
+                                          pull.number),
+                'github_base_repo': repo_url,
+                'github_base_branch': repo_branch,
+                'github_change_repo': change_url,
+                'github_change_branch': change_branch,
+                'github_success_status': final_status['status'],
+                'github_success_text': final_status['text'],
+                'github_success_url': final_status['url'],
+                'github_status_url': args.github_status_url,
+            }
+
+            ext = cls(gh, pull, last_commit, args.github_status_url,
+                      final_status, repo_name, repo_url, repo_branch,
+                      change_url, change_branch,
+                      git_config=GIT_PROFILES[args.github_git_profile],
+                      mirror=mirror, workspaces=workspaces,
+                      recorder=recorder, summary=summary, history=history,
+                      budget=budget, scheduler=scheduler, pool=pool,
+                      status_interval=args.github_status_interval,
+                      status_async=args.github_status_async, queue=queue)
+            pulls.append((ext, variables))
+
+        ctxt.variables.declare_sensitive('github_api_password')
+
+        # With several pull requests, test them in a batch, or
+        # together in a merge queue
+        if len(pulls) > 1:
+            if not args.github_merge_queue:
+                return BatchExtension(pulls, args.github_batch_jobs,
+                                      args.check)
+            bases = set((ext.pull.base.repo.full_name, ext.repo_branch)
+                        for ext, _variables in pulls)
+            if len(bases) > 1:
+                sys.exit('Pull requests in a merge queue must share a base '
+                         'repository and branch')
+            return MergeQueueExtension(pulls, args.check)
+
+        # Set some variables in the context for the use of any callers
+        ext, variables = pulls[0]
+        ctxt.variables.update(variables)
+
+        # We are all set
+        return ext
+
+    def __init__(self, gh, pull, last_commit, status_url, final_status,
+                 repo_name, repo_url, repo_branch, change_url, change_branch,
+                 git_config=None, mirror=None, workspaces=None,
+                 recorder=None, summary=None, history=None, budget=None,
+                 scheduler=None, pool=None, status_interval=0.0,
+                 status_async=False, queue=None):
+        """
+        Initialize the ``GithubExtension`` instance.
+
+        :param gh: A ``github.Github`` object representing a handle
+                   for interacting with the Github API.
+        :param pull: A ``github.PullRequest.PullRequest`` object
+                     describing the pull request being tested.
+        :param last_commit: A ``github.Commit.Commit`` object
+                            identifying the last commit contained in
+                            the pull request.  This is used for
+                            updating the pull request status.
+        :param status_url: An optional status URL to include in the
+                           status updates.  If none is provided, use
+                           ``None``.
+        :param final_status: A dictionary of three keys: "status",
+                             "text", and "url".  This is used to set
+                             the final status of the pull request
+                             should tests pass.
+        :param repo_name: The bare name of the repository, excluding
+                          the organization or user name.
+        :param repo_url: The repository URL to clone from.
+        :param repo_branch: The branch of the repository into which to
+                            merge the pull request.
+        :param change_url: The repository URL of the repository
+                           containing the pull request.
+        :param change_branch: The branch of the change repository from
+                              which to merge the pull request.
+        :param git_config: An optional list of git configuration
+                           settings, as tuples of key and value, to
+                           apply to all git commands run on the
+                           workspace.
+        :param mirror: An optional ``Mirror`` object describing a
+                       mirror of the base repository from which the
+                       workspace should be cloned.
+        :param workspaces: An optional ``WorkspaceRegistry`` object,
+                           used to record the workspaces used by this
+                           run and to evict old ones.
+        :param recorder: An optional ``Recorder`` object, used to
+                         record git commands and Github API calls.
+        :param summary: An optional ``RunSummary`` object, which
+                        should be a sink of ``recorder``.  It is used
+                        to report where the time of the run was
+                        spent.
+        :param history: An optional ``RunHistory`` object, to which
+                        the timings reported by ``summary`` are
+                        recorded.
+        :param budget: An optional ``ApiBudget`` object, which should
+                       be a sink of ``recorder``.  When the budget
+                       runs low, pending status updates are skipped.
+        :param scheduler: An optional ``ApiScheduler`` object, through
+                          which status updates are made.
+        :param pool: An optional ``TokenPool`` object, from which the
+                     token used by ``gh`` was selected.  The rate
+                     limit of the token is recorded at the end of the
+                     run.
+        :param status_interval: The minimum number of seconds between
+                                pending status updates.
+        :param status_async: If ``True``, pending status updates are
+                             posted from a background thread.
+        :param queue: An optional ``RunQueue`` object.  If a newer
+                      head commit of the pull request is queued, the
+                      remaining steps are skipped.
+        """
+
+        # Save the important data
+        self.gh = gh
+        self.pull = pull
+        self.last_commit = last_commit
+        self.status_url = status_url
+        self.final_status = final_status
+        self.repo_name = repo_name
+        self.repo_url = repo_url
+        self.repo_branch = repo_branch
+        self.change_url = change_url
+        self.change_branch = change_branch
+        self.git_config = git_config or []
+        self.mirror = mirror
+        self.workspaces = workspaces
+        self.recorder = recorder or Recorder()
+        self.summary = summary
+        self.history = history
+        self.budget = budget
+        self.scheduler = scheduler or ApiScheduler()
+        self.pool = pool
+        self.status_interval = status_interval
+        self.poster = StatusPoster(self._set_status) if status_async else None
+        self.queue = queue
+
+        # Remember what the last status was, whether any status
+        # updates were skipped to save API calls, and any status
+        # waiting for the rate limit to reset
+        self.last_status = None
+        self.last_post = None
+        self.degraded = False
+        self.queued_status = None
+
+        # Remember when the current step started, and its trace span
+        self.step_start = None
+        self.step_span = None
+
+        # The head commit which superseded the one being tested, if
+        # any
+        self.superseded = None
+
+    def _budget_low(self):
+        """
+        A helper method to determine whether the API budget is running
+        low.  The remaining rate limit is that reported by the headers
+        of the last API response, as observed by the recorder; the
+        Github API is never consulted.
+
+        :returns: A description of why the budget is low, or ``None``
+                  if it is not.
+        """
+
+        if self.budget is None:
+            return None
+
+        return self.budget.low()
+
+    def _set_status(self, ctxt, status, text=None, url=None, wait=False):
+        """
+        A helper method to set the status of a pull request.  If the
+        Github API is rate limiting calls, the status is queued, and
+        replaces any status already queued.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param status: The desired status.  Should be one of the
+                       values "pending", "success", "failure", or
+                       "error".
+        :param text: An optional textual description of the status.
+        :param url: An optional URL for the status.
+        :param wait: If ``True``, wait for any rate limit to reset
+                     before setting the status.
+        """
+
+        new_status = {
+            'status': status,
+            'text': text,
+            'url': url,
+        }
+
+        # Don't repeat a status the pull request already has
+        if new_status == self.last_status:
+            ctxt.emit('Status unchanged; not updating', debug=True)
+            self.recorder.record('status', state=status, outcome='suppressed')
+            self.queued_status = None
+            return
+
+        # Set the status
+        call = self.scheduler.call if wait else self.scheduler.try_call
+        try:
+            call(
+                self.recorder, 'create_status',
+                self.last_commit.create_status,
+                status,
+                url or github.GithubObject.NotSet,
+                text or github.GithubObject.NotSet,
+            )
+        except ApiRateLimited as e:
+            if wait:
+                ctxt.emit('Unable to change status to "%s": %s' %
+                          (status, e))
+            else:
+                ctxt.emit('Queueing status "%s": %s' % (status, e),
+                          debug=True)
+            self.recorder.record('status', state=status, outcome='queued')
+            self.queued_status = new_status
+            return
+
+        ctxt.emit('Changing status to "%s" (text "%s"%s%s)' %
+                  (status, text, ', url ' if url else '', url or ''),
+                  debug=True)
+
+        self.recorder.record('status', state=status, outcome='sent')
+
+        # Remember it so we only make calls we need to
+        self.last_status = new_status
+        self.last_post = time.time()
+        self.queued_status = None
+
+    def read_steps(self, ctxt, steps):
+        """
+        Called after reading steps, prior to adding them to the list of
+        test steps.  This allows an extension to alter the list (in
+        place).
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param steps: A list of ``timid.steps.Step`` instances.
+        """
+
+        # Get our file name
+        fname = inspect.getsourcefile(self.__class__)
+
+        # Prepend our steps to the list of steps read
+        ctxt.emit('Prepending clone and merge steps', debug=True)
+        steps[0:0] = [
+            # First step will be to clone the repository
+            timid.Step(timid.StepAddress(fname, 0),
+                       CloneAction(ctxt, self),
+                       name='Cloning repository',
+                       description='Clone the Github repository'),
+
+            # Second step will be to merge the pull request
+            timid.Step(timid.StepAddress(fname, 1),
+                       MergeAction(ctxt, self),
+                       name='Merging pull request',
+                       description='Merge the Github pull request'),
+        ]
+
+    @profiled('pre_step')
+    def pre_step(self, ctxt, step, idx):
+        """
+        Called prior to executing a step.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param step: An instance of ``timid.steps.Step`` describing
+                     the step to be executed.
+        :param idx: The index of the step in the list of steps.
+
+        :returns: A ``True`` value if the step is to be skipped.  Any
+                  ``False`` value (including ``None``) will result in
+                  the step being executed as normal.
+        """
+
+        # Skip the remaining steps once a newer head commit of the
+        # pull request has been queued
+        if self.superseded:
+            return True
+        if self.queue is not None:
+            newer = self.queue.superseded(
+                '%s#%d' % (self.pull.base.repo.full_name, self.pull.number),
+                self.last_commit.sha)
+            if newer:
+                ctxt.emit('Superseded by %s; skipping remaining steps' %
+                          newer)
+                self.superseded = newer
+                if self.poster is not None:
+                    self.poster.flush()
+                self._set_status(ctxt, 'error', 'Superseded by %s' %
+                                 newer[:7], self.status_url)
+                return True
+
+        now = time.time()
+
+        # Update the pull request status, unless the last update was
+        # too recent or the API budget is running low; the throttle
+        # is checked first, as it is the cheapest
+        if (self.status_interval and self.last_post is not None and
+                now - self.last_post < self.status_interval):
+            # Hold on to the status, so finalize() knows a step was
+            # still pending
+            self.queued_status = {
+                'status': 'pending',
+                'text': step.name,
+                'url': self.status_url,
+            }
+            self.recorder.record('status', state='pending',
+                                 outcome='throttled')
+        else:
+            reason = self._budget_low()
+            if reason:
+                if not self.degraded:
+                    ctxt.emit('Skipping pending status updates: %s' %
+                              reason)
+                self.degraded = True
+                self.recorder.record('status', state='pending',
+                                     outcome='suppressed')
+            elif self.poster is not None:
+                self.poster.submit(ctxt, 'pending', step.name,
+                                   self.status_url)
+            else:
+                self._set_status(ctxt, 'pending', step.name,
+                                 self.status_url)
+            now = time.time()
+
+        # Open the span of the step, the parent of the events recorded
+        # while it runs; a step skipped by another extension never
+        # closed its span
+        if self.step_span is not None:
+            self.recorder.pop_span(self.step_span)
+        self.step_start = now
+        self.step_span = self.recorder.push_span()
+
+        return None
+
+    @profiled('post_step')
+    def post_step(self, ctxt, step, idx, result):
+        """
+        Called after executing a step.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param step: An instance of ``timid.steps.Step`` describing
+                     the step that was executed.
+        :param idx: The index of the step in the list of steps.
+        :param result: An instance of ``timid.steps.StepResult``
+                       describing the result of executing the step.
+                       May be altered by the extension, e.g., to set
+                       the ``ignore`` attribute.
+        """
+
+        # Record how long the step took
+        if self.step_start is not None:
+            if isinstance(step.action, CloneAction):
+                phase = 'clone'
+            elif isinstance(step.action, MergeAction):
+                phase = 'merge'
+            else:
+                phase = 'steps'
+            self.recorder.pop_span(self.step_span)
+            self.recorder.record(
+                'step', start=self.step_start,
+                duration=time.time() - self.step_start, name=step.name,
+                index=idx, phase=phase, state=result.state,
+                span_id=self.step_span,
+            )
+            self.step_start = None
+            self.step_span = None
+
+        if not result:
+            # The step failed; compute a status update
+            msg = result.msg
+            if result.state == timid.FAILURE:
+                status = 'failure'
+                if not msg:
+                    msg = 'Failed: %s' % step.name
+            else:
+                status = 'error'
+                if not msg:
+                    if result.state != timid.ERROR:
+                        msg = ('Unknown timid state "%s" during step: %s' %
+                               (result.state, step.name))
+                    else:
+                        msg = 'Error: %s' % step.name
+
+            # Update the status, after any pending status still being
+            # posted
+            if self.poster is not None:
+                self.poster.flush()
+            self._set_status(ctxt, status, msg, self.status_url)
+
+    @profiled('finalize')
+    def finalize(self, ctxt, result):
+        """
+        Called at the end of processing.  This call allows the extension
+        to emit any additional data, such as timing information, prior
+        to ``timid``'s exit.  The extension may also alter the return
+        value.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param result: The return value of the basic ``timid`` call,
+                       or an ``Exception`` instance if an exception
+                       was raised.  Without the extension, this would
+                       be passed directly to ``sys.exit()``.
+
+        :returns: Should return ``result`` unless the extension wishes
+                  to change the return value.
+        """
+
+        suffix = self._report_run(ctxt, result)
+        self._finish_status(ctxt, result, suffix)
+        self._release_api(ctxt)
+        self._release_workspace(ctxt)
+
+        # Close the performance timeline and write the metrics
+        try:
+            self.recorder.close()
+        except (IOError, OSError) as e:
+            ctxt.emit('Unable to write performance data: %s' % e)
+
+        return result
+
+    def _report_run(self, ctxt, result, name=None):
+        """
+        A helper method to report where the time of the run went, and
+        to record the run in the history.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param result: The result of the run, as passed to
+                       ``finalize()``.
+        :param name: The name of the run in the history.  Defaults to
+                     the name of the pull request.
+
+        :returns: The suffix to append to the final status
+                  description; may be empty.
+        """
+
+        suffix = ''
+        if self.summary is not None:
+            self.summary.report(ctxt)
+            if self.summary.in_status:
+                suffix = ' ' + self.summary.brief()
+
+            if self.history is not None:
+                if result is None:
+                    outcome = 'success'
+                elif isinstance(result, Exception):
+                    outcome = 'error'
+                else:
+                    outcome = 'failure'
+
+                try:
+                    self.history.add(
+                        self.pull.base.repo.full_name, self.repo_branch,
+                        socket.gethostname(), name or '%s#%d' %
+                        (self.pull.base.repo.full_name, self.pull.number),
+                        outcome, self.summary.as_dict())
+                except (sqlite3.Error, OSError) as e:
+                    ctxt.emit('Unable to record run history in %s: %s' %
+                              (self.history.path, e))
+
+        return suffix
+
+    def _finish_status(self, ctxt, result, suffix=''):
+        """
+        A helper method to set the final status of the pull request.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param result: The result of the run, as passed to
+                       ``finalize()``.
+        :param suffix: A suffix to append to the status description.
+        """
+
+        # Wait for any pending status still being posted
+        if self.poster is not None:
+            self.poster.stop()
+
+        # A superseded run keeps its "superseded" status
+        if self.superseded:
+            if self.queued_status is not None:
+                self._set_status(ctxt, wait=True, **self.queued_status)
+            return
+
+        # If result is None, update the status to success
+        if result is None:
+            final_status = dict(self.final_status)
+            if suffix:
+                final_status['text'] = _append_text(final_status['text'],
+                                                    suffix)
+            self._set_status(ctxt, wait=True, **final_status)
+        elif isinstance(result, Exception):
+            # An exception occurred while running timid; log it as an
+            # error status
+            self._set_status(ctxt, 'error', _append_text(
+                'Exception while running timid: %s' % result, suffix),
+                self.status_url, wait=True)
+        else:
+            current = self.queued_status or self.last_status
+            if ((current and current['status'] == 'pending') or
+                    (current is None and self.degraded)):
+                # A test failed and we haven't reported it; do so
+                self._set_status(ctxt, 'failure', _append_text(
+                    'Testing failed: %s' % result, suffix),
+                    self.status_url, wait=True)
+
+        # Send any status still waiting for the rate limit to reset
+        if self.queued_status is not None:
+            self._set_status(ctxt, wait=True, **self.queued_status)
+
+    def _release_api(self, ctxt):
+        """
+        A helper method to record the use made of the Github API.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        """
+
+        # Report the API calls made
+        if self.budget is not None:
+            try:
+                self.budget.flush()
+            except (IOError, OSError) as e:
+                ctxt.emit('Unable to record API usage in %s: %s' %
+                          (self.budget.state_path, e))
+            self.budget.report(ctxt)
+
+        # Record the rate limit of the token, for the use of later
+        # runs, as last reported by the Github API
+        if (self.pool is not None and self.budget is not None and
+                self.budget.rate_remaining is not None):
+            try:
+                self.pool.update(self.budget.rate_remaining,
+                                 self.budget.rate_reset)
+            except (IOError, OSError) as e:
+                ctxt.emit('Unable to record token usage in %s: %s' %
+                          (self.pool.state_path, e))
+
+    def _release_workspace(self, ctxt):
+        """
+        A helper method to maintain the mirror and release the
+        workspace once testing is done.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        """
+
+        # Schedule maintenance of the mirror, if it is due
+        if self.mirror is not None and self.mirror.needs_maintenance():
+            self.mirror.spawn_maintenance(ctxt)
+
+        # Record the space used by this run and evict old workspaces
+        if self.workspaces is not None:
+            try:
+                self.workspaces.update_sizes()
+                self.workspaces.evict(ctxt, ctxt.environment.cwd)
+            finally:
+                self.workspaces.release()
+
+
+class BatchExtension(timid.Extension):
+    """
+    Test several pull requests in one process.  This is returned by
+    ``GithubExtension.activate()`` in place of a ``GithubExtension``
+    when ``--github-pull`` designates more than one pull request.
+    ``timid`` itself then runs no steps: ``finalize()`` runs the steps
+    once for each pull request, each in a subdirectory of the working
+    directory and with its own context, reporting the status to that
+    pull request.  The Github client, API scheduler and budget, the
+    performance timeline and the mirrors are shared by all the pull
+    requests.  Other extensions are not called for the steps run by
+    the batch.
+    """
+
+    priority = GithubExtension.priority
+
+    def __init__(self, pulls, jobs=1, check=False):
+        """
+        Initialize the ``BatchExtension`` instance.
+
+        :param pulls: A list of tuples of a ``GithubExtension`` for a
+                      pull request and a dictionary of the variables
+                      to set in its context.
+        :param jobs: The number of pull requests to test at once.
+        :param check: If ``True``, ``timid`` is only checking the
+                      syntax of the test steps, so they are not run.
+        """
+
+        self.pulls = pulls
+        self.jobs = jobs
+        self.check = check
+        self.steps = []
+
+    def read_steps(self, ctxt, steps):
+        """
+        Called after reading steps, prior to adding them to the list of
+        test steps.  The steps are saved for ``finalize()``, and
+        removed from the list.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param steps: A list of ``timid.steps.Step`` instances.
+        """
+
+        self.steps = list(steps)
+        del steps[:]
+
+    def _context(self, ctxt, ext, variables, work_name=None):
+        """
+        A helper method to build the context for testing a pull
+        request.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param ext: The ``GithubExtension`` for the pull request.
+        :param variables: The variables to set in the context.
+        :param work_name: The name of the subdirectory of the working
+                          directory to test in.  Defaults to one named
+                          for the pull request.
+
+        :returns: An instance of ``timid.context.Context``.
+        """
+
+        work_dir = os.path.join(
+            ctxt.environment.cwd, work_name or '%s-%d' % (
+                ext.pull.base.repo.full_name.replace('/', '-'),
+                ext.pull.number))
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+
+        pull_ctxt = context.Context(ctxt.verbose, ctxt.debug, work_dir)
+        pull_ctxt.environment.update(ctxt.environment)
+        for key in ctxt.environment.sensitive:
+            pull_ctxt.environment.declare_sensitive(key)
+        pull_ctxt.environment.cwd = work_dir
+        pull_ctxt.variables = ctxt.variables.copy()
+        pull_ctxt.variables.update(variables)
+
+        return pull_ctxt
+
+    def _run_pull(self, ctxt, ext, variables):
+        """
+        A helper method to test a pull request.  The steps are run as
+        ``timid`` would run them, calling the hooks of ``ext``, and the
+        final status is set.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param ext: The ``GithubExtension`` for the pull request.
+        :param variables: The variables to set in its context.
+
+        :returns: The result of the run: ``None`` if the pull request
+                  passed, a message if a step failed, or an
+                  ``Exception`` instance if an exception was raised.
+        """
+
+        pull_ctxt = ctxt
+        try:
+            pull_ctxt = self._context(ctxt, ext, variables)
+            steps = list(self.steps)
+            ext.read_steps(pull_ctxt, steps)
+            result, _idx = self._run_steps(
+                pull_ctxt, variables['github_pull'], steps, ext)
+        except Exception as e:
+            result = e
+
+        ext._finish_status(pull_ctxt, result)
+        ext._release_workspace(pull_ctxt)
+
+        return result
+
+    def _run_steps(self, ctxt, name, steps, ext=None):
+        """
+        A helper method to run the steps as ``timid`` would run them,
+        stopping at the first failure.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param name: The name to prefix the messages with.
+        :param steps: A list of ``timid.steps.Step`` instances.
+        :param ext: An optional ``GithubExtension``, whose hooks are
+                    called for each step.
+
+        :returns: A tuple of the result, ``None`` if all the steps
+                  passed or a message if a step failed, and the index
+                  of the step which failed, or ``None``.
+        """
+
+        for idx, step in enumerate(steps):
+            ctxt.emit('[%s] [Step %d]: %s . . .' % (name, idx, step.name))
+
+            if ext is not None and ext.pre_step(ctxt, step, idx):
+                ctxt.emit('[%s] [Step %d]: `- Step %s' %
+                          (name, idx, timid.states[timid.SKIPPED]))
+                continue
+
+            step_result = step(ctxt)
+            if ext is not None:
+                ext.post_step(ctxt, step, idx, step_result)
+
+            ctxt.emit('[%s] [Step %d]: `- Step %s%s' %
+                      (name, idx, timid.states[step_result.state],
+                       ' (ignored)' if step_result.ignore else ''))
+
+            if not step_result:
+                result = 'Test step failure'
+                if step_result.msg:
+                    result += ': %s' % step_result.msg
+                return result, idx
+
+        return None, None
+
+    def _test(self, ctxt):
+        """
+        A helper method to test the pull requests, each on its own,
+        handing them out to the workers in order.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+
+        :returns: A list of the results for the pull requests, as
+                  returned by ``_run_pull()``.
+        """
+
+        results = [None] * len(self.pulls)
+        work = six.moves.queue.Queue()
+        for item in enumerate(self.pulls):
+            work.put(item)
+
+        def worker():
+            while True:
+                try:
+                    idx, (ext, variables) = work.get_nowait()
+                except six.moves.queue.Empty:
+                    return
+                results[idx] = self._run_pull(ctxt, ext, variables)
+
+        if self.jobs > 1:
+            threads = [threading.Thread(target=worker)
+                       for _idx in range(min(self.jobs, len(self.pulls)))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            worker()
+
+        return results
+
+    @profiled('batch')
+    def finalize(self, ctxt, result):
+        """
+        Called at the end of processing.  The steps are run for each
+        pull request, unless ``timid`` failed or was only checking
+        the steps.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param result: The return value of the basic ``timid`` call,
+                       or an ``Exception`` instance if an exception
+                       was raised.
+
+        :returns: ``None`` if all the pull requests passed, a message
+                  naming those which failed, or ``result`` if
+                  ``timid`` failed.
+        """
+
+        names = [variables['github_pull'] for _ext, variables in self.pulls]
+
+        if result is None and not self.check:
+            results = self._test(ctxt)
+            failed = [name for name, res in zip(names, results)
+                      if res is not None]
+            if failed:
+                result = 'Testing failed for %d of %d pull requests: %s' % (
+                    len(failed), len(names), ', '.join(failed))
+        else:
+            for ext, _variables in self.pulls:
+                ext._finish_status(ctxt, result)
+                ext._release_workspace(ctxt)
+
+        # The shared parts are released once, through the first
+        # extension
+        lead = self.pulls[0][0]
+        lead._report_run(ctxt, result, ', '.join(names))
+        lead._release_api(ctxt)
+        try:
+            lead.recorder.close()
+        except (IOError, OSError) as e:
+            ctxt.emit('Unable to write performance data: %s' % e)
+
+        return result
+
+
+class MergeQueueExtension(BatchExtension):
+    """
+    Test several pull requests together, as a merge queue would.  This
+    is returned by ``GithubExtension.activate()`` in place of a
+    ``BatchExtension`` when ``--github-merge-queue`` is given.  All
+    the pull requests are merged onto the base branch and the steps
+    are run once; if they pass, every pull request is given the
+    success status.  If a step after the clone fails, the pull
+    requests are split in two and each half is tested, the second on
+    top of those of the first which passed, until the failing pull
+    requests are found.  Each pull request is given its final status
+    as soon as it is known.
+    """
+
+    def __init__(self, pulls, check=False):
+        """
+        Initialize the ``MergeQueueExtension`` instance.
+
+        :param pulls: A list of tuples of a ``GithubExtension`` for a
+                      pull request and a dictionary of the variables
+                      to set in its context, in queue order.  The
+                      pull requests must share a base repository and
+                      branch.
+        :param check: If ``True``, ``timid`` is only checking the
+                      syntax of the test steps, so they are not run.
+        """
+
+        super(MergeQueueExtension, self).__init__(pulls, check=check)
+
+        # Count the test runs made
+        self.runs = 0
+
+    def _run_group(self, ctxt, group, base):
+        """
+        A helper method to test a group of pull requests together.
+        The workspace is shared by all the groups.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param group: A list of the indexes of the pull requests to
+                      test, in queue order.
+        :param base: A list of the indexes of the pull requests which
+                     passed, to be merged before the group.  Their
+                     statuses are left alone.
+
+        :returns: A tuple of the result, ``None`` if the steps passed,
+                  a message if a step failed, or an ``Exception``
+                  instance if an exception was raised, and a flag
+                  which is ``True`` if the failure may be due to one
+                  of the pull requests, rather than to the clone.
+        """
+
+        merged = base + group
+        lead, variables = self.pulls[merged[0]]
+        exts = [self.pulls[idx][0] for idx in merged]
+        names = ', '.join(self.pulls[idx][1]['github_pull']
+                          for idx in merged)
+
+        ctxt.emit('Testing %d pull requests together: %s' %
+                  (len(merged), names))
+        for idx in group:
+            ext = self.pulls[idx][0]
+            ext._set_status(ctxt, 'pending',
+                            'Testing in a batch of %d' % len(merged),
+                            ext.status_url)
+
+        result = None
+        culprit = False
+        group_ctxt = ctxt
+        try:
+            group_ctxt = self._context(
+                ctxt, lead, dict(variables, github_pull=names),
+                '%s-merge-queue' %
+                lead.pull.base.repo.full_name.replace('/', '-'))
+
+            fname = inspect.getsourcefile(GithubExtension)
+            steps = [
+                timid.Step(timid.StepAddress(fname, 0),
+                           CloneAction(group_ctxt, lead),
+                           name='Cloning repository',
+                           description='Clone the Github repository'),
+                timid.Step(timid.StepAddress(fname, 1),
+                           MergeAction(group_ctxt, lead, exts),
+                           name='Merging pull requests',
+                           description='Merge the Github pull requests'),
+            ] + self.steps
+
+            result, idx = self._run_steps(group_ctxt, 'merge queue', steps)
+            culprit = idx is not None and idx > 0
+        except Exception as e:
+            result = e
+
+        lead._release_workspace(group_ctxt)
+
+        return result, culprit
+
+    def _bisect(self, ctxt, group, base, results):
+        """
+        A helper method to test a group of pull requests on top of
+        those already known to pass, splitting the group on failure.
+
+        :param ctxt: An instance of ``timid.context.Context``.
+        :param group: A list of the indexes of the pull requests to
+                      test, in queue order.
+        :param base: A list of the indexes of the pull requests which
+                     passed, to be merged before the group.
+        :param results: A list of the results for the pull requests,
+                        which is updated for those in the group.
+
+        :returns: A list of the indexes of the pull requests of the
+                  group which passed.
+        """
+
+        self.runs += 1
+        result, culprit = self._run_group(ctxt, group, base)
+
+        if result is None or len(group) == 1 or not culprit:
+            for idx in group:
+                results[idx] = result
+                self.pulls[idx][0]._finish_status(ctxt, result)
+            return list(group) if result is None else []
+
+        ctxt.emit('Testing of %d pull requests failed; bisecting' %
+                  len(group))
+        mid = len(group) // 2
+        passed = self._bisect(ctxt, group[:mid], base, results)
+        return passed + self._bisect(ctxt, group[mid:], base + passed,
+                                     results)
+
+    def _test(self, ctxt):
+        """
+        A helper method to test the pull requests together, bisecting
+        on failure.
 
         :param ctxt: An instance of ``timid.context.Context``.
-        :param args: An instance of ``argparse.Namespace`` containing
-                     the result of processing command line arguments.
 
-        :returns: An instance of the extension class if the extension
-                  has been activated, ``None`` if it has not.  If this
-                  method returns ``None``, no further extension
-                  methods will be called.
+        :returns: A list of the results for the pull requests.
         """
 
-        # If no pull request was specified, do nothing
-        if not args.github_pull:
-            return None
+        results = [None] * len(self.pulls)
+        self._bisect(ctxt, list(range(len(self.pulls))), [], results)
 
-        ctxt.emit('Github plugin activated')
+        ctxt.emit('Tested %d pull requests in %d runs' %
+                  (len(self.pulls), self.runs))
 
-        # Ensure we have a password
-        service = 'timid-github!%s' % args.github_api
-        passwd = args.github_pass
-        if passwd is None and not args.github_keyring_set:
-            # Try getting it from the keyring
-            passwd = keyring.get_password(service, args.github_user)
-        if passwd is None:
-            # OK, try prompting for it
-            passwd = getpass.getpass('[%s] Password for "%s"> ' %
-                                     (args.github_api, args.github_user))
-
-        # Are we supposed to set it?
-        if args.github_keyring_set:
-            ctxt.emit('Saving password in keyring as requested')
-            keyring.set_password(service, args.github_user, passwd)
-
-        # Now we have authentication information, get a Github handle
-        gh = github.Github(args.github_user, passwd, args.github_api)
-
-        # Next, interpret the pull request designation
-        try:
-            # Try JSON first
-            pull_raw = json.loads(args.github_pull)
-        except ValueError:
-            # Raw string
-            repo, _sep, number = args.github_pull.partition('#')
+        return results
 
-            # Interpret the number
-            if not number or not number.isdigit():
-                sys.exit('Invalid pull request number "%s"' % number)
-            number = int(number)
 
-            # Interpret the repo
-            if '/' not in repo:
-                user = gh.get_user()
-                repo = '%s/%s' % (user.login, repo)
+def _next_link(header):
+    """
+    Find the URL of the next page in a "Link" header.
 
-            # Look up the pull request
-            try:
-                repo = gh.get_repo(repo)
-                pull = repo.get_pull(number)
-            except Exception:
-                # No such pull request, I guess
-                sys.exit('Unable to resolve pull request "%s"' %
-                         args.github_pull)
-        else:
-            # OK, we have raw JSON data; wrap it in a PullRequest
-            pull = gh.create_from_raw_data(
-                github.PullRequest.PullRequest, pull_raw)
+    :param header: The value of the "Link" header.  May be ``None``.
 
-        ctxt.emit('Testing pull request %s#%d' %
-                  (pull.base.repo.full_name, pull.number))
+    :returns: The URL of the next page, or ``None`` if there is none.
+    """
 
-        # Need the repository name
-        repo_name = pull.base.repo.name
+    for link in (header or '').split(','):
+        url, _sep, params = link.partition(';')
+        if 'rel="next"' in params.replace(' ', ''):
+            return url.strip().strip('<>')
 
-        # Also need the branches
-        repo_branch = pull.base.ref
-        change_branch = pull.head.ref
+    return None
 
-        # Select the correct repository URL
-        repo_url = _select_url(args.github_repo, pull.base.repo)
-        ctxt.emit('Base repository %s' % repo_url, level=2)
 
-        # Select the correct change repository URL.  If not
-        # independently specified, default to the same as the
-        # repo_url.  Note: the URLs could legally be the same, as a PR
-        # could be made from one branch to another of the same
-        # repository.
-        change_url = _select_url(args.github_change_repo or args.github_repo,
-                                 pull.head.repo)
-        ctxt.emit('PR repository %s' % change_url, level=2)
+class PullWatcher(object):
+    """
+    Watch the open pull requests of a set of repositories for new head
+    commits.  The pull requests are listed with conditional requests:
+    the "ETag" of each page is saved, and sent back in an
+    "If-None-Match" header, so that a page which has not changed
+    yields a "304 Not Modified" response, which does not count
+    against the rate limit.  The ETags, and the head commit last seen
+    for each pull request, are kept in a state file, so they survive
+    restarts.
+    """
 
-        # With the pull, we need to select an appropriate commit
-        last_commit = list(pull.get_commits())[-1]
+    def __init__(self, api, repos, state_path, auth=None, timeout=30.0):
+        """
+        Initialize a ``PullWatcher`` object.
+
+        :param api: The URL of the Github API.
+        :param repos: A list of the full names of the repositories to
+                      watch, e.g., "org/repo".
+        :param state_path: The name of the state file.
+        :param auth: An optional value for the "Authorization" header.
+        :param timeout: The timeout for each request, in seconds.
+        """
 
-        # Set up the final status information
-        final_status = {
-            'status': 'success',
-            'text': 'Tests passed!',
-            'url': args.github_status_url,
-        }
+        self.api = api.rstrip('/')
+        self.repos = repos
+        self.state_path = state_path
+        self.auth = auth
+        self.timeout = timeout
 
-        # Handle the --github-override option
-        if args.github_override:
-            try:
-                override_raw = json.loads(args.github_override)
-                for key in final_status:
-                    if key in override_raw:
-                        final_status[key] = override_raw[key]
-            except ValueError:
-                pass
+        state = _read_json(state_path) or {}
+        self.pages = state.get('pages', {})
+        self.heads = state.get('heads', {})
 
-        # Now we process the other override options
-        if args.github_override_status:
-            final_status['status'] = args.github_override_status
-        if args.github_override_text:
-            final_status['text'] = args.github_override_text
-        if args.github_override_url:
-            final_status['url'] = args.github_override_url
+        # Count the requests made, and how many were not modified
+        self.requests = 0
+        self.not_modified = 0
 
-        # Set some variables in the context for the use of any callers
-        ctxt.variables.declare_sensitive('github_api_password')
-        ctxt.variables.update({
-            'github_api': args.github_api,
-            'github_api_username': args.github_user,
-            'github_api_password': passwd,
-            'github_repo_name': repo_name,
-            'github_pull': '%s#%d' % (pull.base.repo.full_name, pull.number),
-            'github_base_repo': repo_url,
-            'github_base_branch': repo_branch,
-            'github_change_repo': change_url,
-            'github_change_branch': change_branch,
-            'github_success_status': final_status['status'],
-            'github_success_text': final_status['text'],
-            'github_success_url': final_status['url'],
-            'github_status_url': args.github_status_url,
-        })
+    def _page(self, url):
+        """
+        Retrieve a page of pull requests, unless it has not changed.
 
-        # We are all set; initialize the extension
-        return cls(gh, pull, last_commit, args.github_status_url, final_status,
-                   repo_name, repo_url, repo_branch, change_url, change_branch)
+        :param url: The URL of the page.
 
-    def __init__(self, gh, pull, last_commit, status_url, final_status,
-                 repo_name, repo_url, repo_branch, change_url, change_branch):
+        :returns: A tuple of a list of the pull requests on the page,
+                  each a list of the number and head commit SHA, and
+                  the URL of the next page, or ``None``.
         """
-        Initialize the ``GithubExtension`` instance.
 
-        :param gh: A ``github.Github`` object representing a handle
-                   for interacting with the Github API.
-        :param pull: A ``github.PullRequest.PullRequest`` object
-                     describing the pull request being tested.
-        :param last_commit: A ``github.Commit.Commit`` object
-                            identifying the last commit contained in
-                            the pull request.  This is used for
-                            updating the pull request status.
-        :param status_url: An optional status URL to include in the
-                           status updates.  If none is provided, use
-                           ``None``.
-        :param final_status: A dictionary of three keys: "status",
-                             "text", and "url".  This is used to set
-                             the final status of the pull request
-                             should tests pass.
-        :param repo_name: The bare name of the repository, excluding
-                          the organization or user name.
-        :param repo_url: The repository URL to clone from.
-        :param repo_branch: The branch of the repository into which to
-                            merge the pull request.
-        :param change_url: The repository URL of the repository
-                           containing the pull request.
-        :param change_branch: The branch of the change repository from
-                              which to merge the pull request.
-        """
+        headers = {
+            'Accept': 'application/vnd.github.v3+json',
+            'User-Agent': 'timid-github',
+        }
+        if self.auth:
+            headers['Authorization'] = self.auth
+        cached = self.pages.get(url)
+        if cached:
+            headers['If-None-Match'] = cached['etag']
 
-        # Save the important data
-        self.gh = gh
-        self.pull = pull
-        self.last_commit = last_commit
-        self.status_url = status_url
-        self.final_status = final_status
-        self.repo_name = repo_name
-        self.repo_url = repo_url
-        self.repo_branch = repo_branch
-        self.change_url = change_url
-        self.change_branch = change_branch
+        self.requests += 1
+        try:
+            resp = six.moves.urllib.request.urlopen(
+                six.moves.urllib.request.Request(url, headers=headers),
+                timeout=self.timeout)
+        except six.moves.urllib.error.HTTPError as e:
+            if e.code == 304 and cached:
+                self.not_modified += 1
+                return cached['pulls'], cached['next']
+            raise
 
-        # Remember what the last status was
-        self.last_status = None
+        try:
+            body = resp.read()
+            etag = resp.info().get('ETag')
+            next_url = _next_link(resp.info().get('Link'))
+        finally:
+            resp.close()
+
+        pulls = [[pull['number'], pull['head']['sha']]
+                 for pull in json.loads(body.decode('utf-8'))]
+        if etag:
+            self.pages[url] = {'etag': etag, 'pulls': pulls, 'next': next_url}
+        else:
+            self.pages.pop(url, None)
+
+        return pulls, next_url
 
-    def _set_status(self, ctxt, status, text=None, url=None):
+    def poll(self, ctxt):
         """
-        A helper method to set the status of a pull request.
+        Poll the repositories for pull requests with new head commits.
+        A repository which cannot be listed is skipped until the next
+        poll.
 
         :param ctxt: An instance of ``timid.context.Context``.
-        :param status: The desired status.  Should be one of the
-                       values "pending", "success", "failure", or
-                       "error".
-        :param text: An optional textual description of the status.
-        :param url: An optional URL for the status.
+
+        :returns: A list of tuples of the pull request, e.g.,
+                  "org/repo#1", and its new head commit SHA.
         """
 
-        # Set the status
-        self.last_commit.create_status(
-            status,
-            url or github.GithubObject.NotSet,
-            text or github.GithubObject.NotSet,
-        )
+        updates = []
+        for repo in self.repos:
+            heads = {}
+            url = '%s/repos/%s/pulls?state=open&per_page=100' % (
+                self.api, repo)
+            try:
+                while url:
+                    pulls, url = self._page(url)
+                    for number, sha in pulls:
+                        heads['%s#%d' % (repo, number)] = sha
+            except (IOError, OSError, ValueError, KeyError) as e:
+                ctxt.emit('Unable to list pull requests of %s: %s' %
+                          (repo, e))
+                continue
+
+            # Forget the pull requests which have been closed
+            prefix = '%s#' % repo
+            for pull in [p for p in self.heads if p.startswith(prefix)]:
+                if pull not in heads:
+                    del self.heads[pull]
+
+            for pull in sorted(heads):
+                if self.heads.get(pull) != heads[pull]:
+                    updates.append((pull, heads[pull]))
+                    self.heads[pull] = heads[pull]
 
-        ctxt.emit('Changing status to "%s" (text "%s"%s%s)' %
-                  (status, text, ', url ' if url else '', url or ''),
-                  debug=True)
+        try:
+            _write_json(self.state_path, {
+                'pages': self.pages,
+                'heads': self.heads,
+            })
+        except (IOError, OSError) as e:
+            ctxt.emit('Unable to save watch state in %s: %s' %
+                      (self.state_path, e))
 
-        # Remember it so we only make calls we need to
-        self.last_status = {
-            'status': status,
-            'text': text,
-            'url': url,
-        }
+        return updates
 
-    def read_steps(self, ctxt, steps):
-        """
-        Called after reading steps, prior to adding them to the list of
-        test steps.  This allows an extension to alter the list (in
-        place).
 
-        :param ctxt: An instance of ``timid.context.Context``.
-        :param steps: A list of ``timid.steps.Step`` instances.
-        """
+def _auth_header(user, secret):
+    """
+    Compute the "Authorization" header for a request to the Github
+    API.
 
-        # Get our file name
-        fname = inspect.getsourcefile(self.__class__)
+    :param user: The username, or ``None`` if ``secret`` is a token.
+    :param secret: The password or token.  May be ``None``.
 
-        # Prepend our steps to the list of steps read
-        ctxt.emit('Prepending clone and merge steps', debug=True)
-        steps[0:0] = [
-            # First step will be to clone the repository
-            timid.Step(timid.StepAddress(fname, 0),
-                       CloneAction(ctxt, self),
-                       name='Cloning repository',
-                       description='Clone the Github repository'),
+    :returns: The value of the header, or ``None`` if there are no
+              credentials.
+    """
 
-            # Second step will be to merge the pull request
-            timid.Step(timid.StepAddress(fname, 1),
-                       MergeAction(ctxt, self),
-                       name='Merging pull request',
-                       description='Merge the Github pull request'),
-        ]
+    if not secret:
+        return None
+    if not user:
+        return 'token %s' % secret
 
-    def pre_step(self, ctxt, step, idx):
-        """
-        Called prior to executing a step.
+    encoded = binascii.b2a_base64(
+        ('%s:%s' % (user, secret)).encode('utf-8')).strip()
+    return 'Basic %s' % encoded.decode('ascii')
 
-        :param ctxt: An instance of ``timid.context.Context``.
-        :param step: An instance of ``timid.steps.Step`` describing
-                     the step to be executed.
-        :param idx: The index of the step in the list of steps.
 
-        :returns: A ``True`` value if the step is to be skipped.  Any
-                  ``False`` value (including ``None``) will result in
-                  the step being executed as normal.
-        """
+def _start_command(ctxt, command, pull, sha, env=None):
+    """
+    Start the command for a pull request.  The strings "{pull}" and
+    "{sha}" in the arguments are replaced by the pull request and its
+    head commit SHA.
+
+    :param ctxt: An instance of ``timid.context.Context``.
+    :param command: The command, as a list of arguments.
+    :param pull: The pull request, e.g., "org/repo#1".
+    :param sha: The head commit SHA.
+    :param env: An optional environment for the command.
+
+    :returns: A ``subprocess.Popen`` object, or ``None`` if the
+              command could not be started.
+    """
 
-        # Update the pull request status
-        self._set_status(ctxt, 'pending', step.name, self.status_url)
+    args = [arg.replace('{pull}', pull).replace('{sha}', sha)
+            for arg in command]
+    ctxt.emit('Testing %s at %s' % (pull, sha))
 
+    try:
+        return subprocess.Popen(args, env=env)
+    except OSError as e:
+        ctxt.emit('Unable to run "%s": %s' % (args[0], e))
         return None
 
-    def post_step(self, ctxt, step, idx, result):
-        """
-        Called after executing a step.
 
-        :param ctxt: An instance of ``timid.context.Context``.
-        :param step: An instance of ``timid.steps.Step`` describing
-                     the step that was executed.
-        :param idx: The index of the step in the list of steps.
-        :param result: An instance of ``timid.steps.StepResult``
-                       describing the result of executing the step.
-                       May be altered by the extension, e.g., to set
-                       the ``ignore`` attribute.
-        """
+def _queue_updates(ctxt, queue, updates):
+    """
+    Queue runs for the new head commits of pull requests, dropping
+    the runs they supersede.
 
-        if not result:
-            # The step failed; compute a status update
-            msg = result.msg
-            if result.state == timid.FAILURE:
-                status = 'failure'
-                if not msg:
-                    msg = 'Failed: %s' % step.name
+    :param ctxt: An instance of ``timid.context.Context``.
+    :param queue: A ``RunQueue`` object.
+    :param updates: A list of tuples of the pull request, the head
+                    commit SHA, and the payload for the run.
+    """
+
+    for pull, sha, payload in updates:
+        for old in queue.push(pull, sha, payload):
+            ctxt.emit('Dropping superseded run of %s at %s' % (pull, old))
+
+
+def watch_main(argv=None):
+    """
+    Entry point for the "timid-github-watch" command, which watches
+    the open pull requests of a set of repositories, and runs a
+    command, typically ``timid``, for each new head commit.  Pull
+    requests are listed with conditional requests, so a poll which
+    finds nothing new costs nothing against the rate limit.  The
+    commands are run one at a time from a ``RunQueue``, and polling
+    continues while a command runs, so a run waiting, or in progress,
+    is superseded by a newer head commit.
+
+    :param argv: The command line arguments.  Defaults to
+                 ``sys.argv[1:]``.
+
+    :returns: The exit code.
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Watch Github pull requests and test each new head '
+        'commit.',
+        epilog='The command follows "--"; the strings "{pull}" and '
+        '"{sha}" in it are replaced by the pull request and its head '
+        'commit, e.g., "-- timid --github-pull {pull} test.yaml".',
+    )
+    parser.add_argument(
+        'repos',
+        nargs='+',
+        help='The repositories to watch, e.g., "org/repo".',
+    )
+    parser.add_argument(
+        '--api',
+        default=os.environ.get('TIMID_GITHUB_API', 'https://api.github.com'),
+        help='The Github API to use.  Default is drawn from the '
+        '"TIMID_GITHUB_API" environment variable.  Default: %(default)s',
+    )
+    parser.add_argument(
+        '--user',
+        default=os.environ.get('TIMID_GITHUB_USER'),
+        help='The username to authenticate with; the password is drawn '
+        'from the keyring, as for "--github-user".  Default is drawn from '
+        'the "TIMID_GITHUB_USER" environment variable.',
+    )
+    parser.add_argument(
+        '--token',
+        default=os.environ.get('TIMID_GITHUB_TOKEN'),
+        help='A token to authenticate with, in place of a username.  '
+        'Default is drawn from the "TIMID_GITHUB_TOKEN" environment '
+        'variable.',
+    )
+    parser.add_argument(
+        '--interval',
+        default=10.0,
+        type=float,
+        help='The number of seconds between polls.  Default: %(default)s',
+    )
+    parser.add_argument(
+        '--state',
+        default=os.path.join(
+            os.environ.get('TIMID_GITHUB_CACHE',
+                           os.path.join('~', '.cache', 'timid-github')),
+            'watch.json'),
+        help='The file in which to keep the ETags and the head commits '
+        'seen.  Default: %(default)s',
+    )
+    parser.add_argument(
+        '--queue',
+        default=os.path.join(
+            os.environ.get('TIMID_GITHUB_CACHE',
+                           os.path.join('~', '.cache', 'timid-github')),
+            'queue.json'),
+        help='The file in which to keep the queue of runs.  It is passed '
+        'to the command in the "TIMID_GITHUB_QUEUE" environment '
+        'variable.  Default: %(default)s',
+    )
+    parser.add_argument(
+        '--ignore-existing',
+        default=False,
+        action='store_true',
+        help='On the first poll, only record the open pull requests, '
+        'rather than testing them all.',
+    )
+    parser.add_argument(
+        '--once',
+        default=False,
+        action='store_true',
+        help='Poll once, run the queued commands, then exit.',
+    )
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    command = []
+    if '--' in argv:
+        idx = argv.index('--')
+        argv, command = argv[:idx], argv[idx + 1:]
+    args = parser.parse_args(argv)
+    if not command:
+        parser.error('A command must be given after "--"')
+
+    ctxt = context.Context()
+
+    secret = args.token
+    user = None if args.token else args.user
+    if user:
+        secret = keyring.get_password('timid-github!%s' % args.api, user)
+
+    state_path = os.path.expanduser(args.state)
+    ignore = args.ignore_existing and not os.path.exists(state_path)
+    watcher = PullWatcher(args.api, args.repos, state_path,
+                          _auth_header(user, secret))
+    queue_path = os.path.expanduser(args.queue)
+    queue = RunQueue(queue_path)
+    env = dict(os.environ, TIMID_GITHUB_QUEUE=queue_path)
+
+    errors = 0
+    running = None
+    while True:
+        updates = watcher.poll(ctxt)
+        ctxt.emit('Polled %d repositories: %d requests, %d not modified, '
+                  '%d new head commits' %
+                  (len(args.repos), watcher.requests, watcher.not_modified,
+                   len(updates)), level=2)
+        watcher.requests = watcher.not_modified = 0
+
+        if ignore:
+            ignore = False
+        else:
+            _queue_updates(ctxt, queue,
+                           [(pull, sha, None) for pull, sha in updates])
+
+        # Reap the run in progress, and start the next; with --once,
+        # wait for each run in turn
+        while True:
+            if running is not None:
+                pull, sha, proc = running
+                result = proc.wait() if args.once else proc.poll()
+                if result is None:
+                    break
+                running = None
+                queue.done(pull, sha)
+                if result:
+                    ctxt.emit('Testing %s at %s failed with exit code %d' %
+                              (pull, sha, result))
+                    errors += 1
+
+            job = queue.pop()
+            if job is None:
+                break
+            pull, sha, _payload = job
+            proc = _start_command(ctxt, command, pull, sha, env)
+            if proc is None:
+                queue.done(pull, sha)
+                errors += 1
             else:
-                status = 'error'
-                if not msg:
-                    if result.state != timid.ERROR:
-                        msg = ('Unknown timid state "%s" during step: %s' %
-                               (result.state, step.name))
-                    else:
-                        msg = 'Error: %s' % step.name
+                running = (pull, sha, proc)
 
-            # Update the status
-            self._set_status(ctxt, status, msg, self.status_url)
+        if args.once:
+            return 1 if errors else 0
 
-    def finalize(self, ctxt, result):
+        time.sleep(args.interval)
+
+
+# The pull request actions which change what should be tested
+WEBHOOK_ACTIONS = frozenset(['opened', 'reopened', 'synchronize'])
+
+# The largest webhook payload Github sends
+WEBHOOK_MAX_BODY = 25 << 20
+
+
+def _verify_signature(secret, body, header):
+    """
+    Verify the signature of a webhook delivery.
+
+    :param secret: The webhook secret, as bytes.
+    :param body: The body of the delivery, as bytes.
+    :param header: The value of the "X-Hub-Signature-256" header.
+                   May be ``None``.
+
+    :returns: ``True`` if the signature is valid.
+    """
+
+    if not header or not header.startswith('sha256='):
+        return False
+
+    expected = 'sha256=%s' % hmac.new(secret, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected.encode('ascii'),
+                               header.strip().encode('ascii', 'replace'))
+
+
+class WebhookHandler(six.moves.BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Handle a webhook delivery.  The signature is verified, and a
+    ``pull_request`` event which changes the head of the pull request
+    is handed to the server's ``dispatch()`` method, while one which
+    closes the pull request is handed to its ``cancel()`` method;
+    other events are acknowledged and ignored.
+    """
+
+    def log_message(self, format, *args):
+        self.server.ctxt.emit('%s - %s' % (self.address_string(),
+                                           format % args), level=2)
+
+    def _respond(self, code, msg):
+        payload = ('%s\n' % msg).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        # Check the length before reading; a negative length would
+        # read until the client closes the connection
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            return self._respond(400, 'Invalid Content-Length')
+        if length < 0:
+            return self._respond(400, 'Invalid Content-Length')
+        elif length > WEBHOOK_MAX_BODY:
+            return self._respond(413, 'Payload too large')
+        body = self.rfile.read(length)
+
+        if not _verify_signature(self.server.secret, body,
+                                 self.headers.get('X-Hub-Signature-256')):
+            return self._respond(401, 'Invalid signature')
+
+        event = self.headers.get('X-GitHub-Event')
+        if event == 'ping':
+            return self._respond(200, 'pong')
+        elif event != 'pull_request':
+            return self._respond(200, 'Ignored event "%s"' % event)
+
+        try:
+            payload = json.loads(body.decode('utf-8'))
+            action = payload['action']
+            raw = payload['pull_request']
+            pull = '%s#%d' % (raw['base']['repo']['full_name'],
+                              raw['number'])
+            sha = raw['head']['sha']
+        except (ValueError, KeyError, TypeError) as e:
+            return self._respond(400, 'Invalid payload: %s' % e)
+
+        if action == 'closed':
+            self.server.cancel(pull)
+            return self._respond(200, 'Cancelled %s' % pull)
+        elif action not in WEBHOOK_ACTIONS:
+            return self._respond(200, 'Ignored action "%s"' % action)
+
+        self.server.dispatch(pull, sha, json.dumps(raw))
+        self._respond(202, 'Queued %s at %s' % (pull, sha))
+
+
+class WebhookServer(six.moves.socketserver.ThreadingMixIn,
+                    six.moves.BaseHTTPServer.HTTPServer):
+    """
+    An HTTP server receiving webhook deliveries, queueing the pull
+    requests to test for the workers.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, secret, jobs, ctxt, queue):
+        """
+        Initialize a ``WebhookServer`` object.
+
+        :param address: A tuple of the host and port to listen on.
+        :param secret: The webhook secret, as bytes.
+        :param jobs: The queue on which to wake a worker for each
+                     run queued.
+        :param ctxt: An instance of ``timid.context.Context``, used
+                     for logging.
+        :param queue: The ``RunQueue`` object on which to queue the
+                      runs.
         """
-        Called at the end of processing.  This call allows the extension
-        to emit any additional data, such as timing information, prior
-        to ``timid``'s exit.  The extension may also alter the return
-        value.
 
-        :param ctxt: An instance of ``timid.context.Context``.
-        :param result: The return value of the basic ``timid`` call,
-                       or an ``Exception`` instance if an exception
-                       was raised.  Without the extension, this would
-                       be passed directly to ``sys.exit()``.
+        six.moves.BaseHTTPServer.HTTPServer.__init__(
+            self, address, WebhookHandler)
 
-        :returns: Should return ``result`` unless the extension wishes
-                  to change the return value.
+        self.secret = secret
+        self.jobs = jobs
+        self.ctxt = ctxt
+        self.queue = queue
+
+    def dispatch(self, pull, sha, raw):
         """
+        Queue a pull request to be tested.
 
-        # If result is None, update the status to success
-        if result is None:
-            self._set_status(ctxt, **self.final_status)
-        elif isinstance(result, Exception):
-            # An exception occurred while running timid; log it as an
-            # error status
-            self._set_status(ctxt, 'error',
-                             'Exception while running timid: %s' % result,
-                             self.status_url)
-        elif self.last_status and self.last_status['status'] == 'pending':
-            # A test failed and we haven't reported it; do so
-            self._set_status(ctxt, 'failure', 'Testing failed: %s' % result,
-                             self.status_url)
+        :param pull: The pull request, e.g., "org/repo#1".
+        :param sha: The head commit SHA.
+        :param raw: The pull request object from the payload, encoded
+                    as JSON.
+        """
 
-        return result
+        self.ctxt.emit('Queueing %s at %s' % (pull, sha))
+        _queue_updates(self.ctxt, self.queue, [(pull, sha, raw)])
+        self.jobs.put(True)
+
+    def cancel(self, pull):
+        """
+        Drop the runs of a closed pull request still waiting.
+
+        :param pull: The pull request, e.g., "org/repo#1".
+        """
+
+        for old in self.queue.cancel(pull):
+            self.ctxt.emit('Dropping run of closed %s at %s' % (pull, old))
+
+
+def _webhook_worker(jobs, args, queue_path):
+    """
+    The body of a webhook worker process.  The worker is warmed up
+    before the first delivery arrives: ``timid``, PyGithub and keyring
+    are imported, and Github handles and passwords are kept from one
+    run to the next.  Each pull request is then tested by running ``timid``
+    in-process, passing the pull request from the payload to
+    ``--github-pull``, so it need not be looked up again.
+
+    :param jobs: The queue on which the worker is woken to take a run
+                 from the ``RunQueue``.  A ``None`` stops the worker.
+    :param args: The arguments for ``timid``.  The strings "{pull}"
+                 and "{sha}" in them are replaced by the pull request
+                 and its head commit SHA.
+    :param queue_path: The name of the state file of the
+                       ``RunQueue``.  It is passed to ``timid`` in
+                       the "TIMID_GITHUB_QUEUE" environment variable,
+                       so superseded runs stop early.
+    """
+
+    global _github_clients
+    global _github_passwords
+
+    # Import everything a run needs now, rather than on the first
+    # delivery, and keep the Github handles and passwords
+    from timid import main as timid_main
+    github.load()
+    keyring.load()
+    _github_clients = {}
+    _github_passwords = {}
+
+    os.environ['TIMID_GITHUB_QUEUE'] = queue_path
+    queue = RunQueue(queue_path)
+
+    while True:
+        if jobs.get() is None:
+            return
+
+        # The run may have been dropped as superseded
+        job = queue.pop()
+        if job is None:
+            continue
+
+        pull, sha, raw = job
+        argv = ['--github-pull', raw] + [
+            arg.replace('{pull}', pull).replace('{sha}', sha)
+            for arg in args]
+        try:
+            result = timid_main.timid.console(argv=argv)
+        except SystemExit as e:
+            result = e.code
+        except Exception as e:
+            result = e
+        queue.done(pull, sha)
+
+        if result:
+            sys.stderr.write('Testing %s at %s failed: %s\n' %
+                             (pull, sha, result))
+
+
+def webhook_main(argv=None):
+    """
+    Entry point for the "timid-github-webhook" command, a daemon which
+    receives ``pull_request`` webhooks and tests each new head commit
+    in a pool of warm worker processes.  Runs are queued in a
+    ``RunQueue``, so a run waiting, or in progress, is superseded by a
+    newer head commit.
+
+    :param argv: The command line arguments.  Defaults to
+                 ``sys.argv[1:]``.
+
+    :returns: The exit code.
+    """
+
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(
+        description='Receive Github pull request webhooks and test each '
+        'new head commit.',
+        epilog='The arguments for timid follow "--"; the strings "{pull}" '
+        'and "{sha}" in them are replaced by the pull request and its '
+        'head commit, e.g., "-- test.yaml /work/{sha}".',
+    )
+    parser.add_argument(
+        '--host',
+        default='127.0.0.1',
+        help='The address to listen on.  Default: %(default)s',
+    )
+    parser.add_argument(
+        '--port',
+        default=8080,
+        type=int,
+        help='The port to listen on.  Default: %(default)s',
+    )
+    parser.add_argument(
+        '--secret',
+        default=os.environ.get('TIMID_GITHUB_WEBHOOK_SECRET'),
+        help='The webhook secret.  Default is drawn from the '
+        '"TIMID_GITHUB_WEBHOOK_SECRET" environment variable.',
+    )
+    parser.add_argument(
+        '--workers',
+        default=2,
+        type=int,
+        help='The number of worker processes.  Default: %(default)s',
+    )
+    parser.add_argument(
+        '--queue',
+        default=os.path.join(
+            os.environ.get('TIMID_GITHUB_CACHE',
+                           os.path.join('~', '.cache', 'timid-github')),
+            'queue.json'),
+        help='The file in which to keep the queue of runs.  Runs left '
+        'in it by an earlier daemon are resumed.  Default: %(default)s',
+    )
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    timid_args = []
+    if '--' in argv:
+        idx = argv.index('--')
+        argv, timid_args = argv[:idx], argv[idx + 1:]
+    args = parser.parse_args(argv)
+    if not timid_args:
+        parser.error('The arguments for timid must be given after "--"')
+    if not args.secret:
+        parser.error('A webhook secret is required')
+
+    ctxt = context.Context()
+    queue_path = os.path.expanduser(args.queue)
+    queue = RunQueue(queue_path)
+    jobs = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_webhook_worker,
+                                       args=(jobs, timid_args, queue_path))
+               for _idx in range(args.workers)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    # Resume the runs left in the queue
+    for _idx in range(len(queue)):
+        jobs.put(True)
+
+    server = WebhookServer((args.host, args.port),
+                           args.secret.encode('utf-8'), jobs, ctxt, queue)
+    ctxt.emit('Listening for webhooks on %s:%d' % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for _worker in workers:
+            jobs.put(None)
+        for worker in workers:
+            worker.join()
+
+    return 0